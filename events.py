@@ -0,0 +1,140 @@
+"""Event bus domain di dalam proses.
+
+Handler mem-publish event setelah perubahan di-commit (sale selesai, stok
+bertambah/berkurang, pengaturan, metode pembayaran, katalog). Turunan state
+(cache snapshot toko, counter metrik, log audit, notifikasi) cukup subscribe ke
+event yang relevan, sehingga handler baru tidak perlu tahu cache mana yang harus
+di-invalidate.
+
+Subscriber sinkron dijalankan langsung di thread pemanggil publish(), berurutan
+sesuai urutan subscribe; dipakai untuk state yang harus konsisten seketika
+(mis. invalidasi cache sebelum handler membaca ulang). Subscriber async
+dijalankan satu per satu di satu thread latar sesuai urutan publish; dipakai
+untuk efek samping yang boleh tertunda (log, kirim pesan). Error subscriber
+hanya dicatat dan tidak menggagalkan publisher.
+"""
+import logging
+import queue
+import threading
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Any, Callable, DefaultDict, Dict, List, Optional, Tuple, Type
+
+
+@dataclass(frozen=True)
+class SaleCompleted:
+    sale_id: int
+    buyer_id: int
+    product_id: int
+    account_ids: Tuple[int, ...]
+    source: str # 'admin' (approve manual) atau 'reconcile' (mutasi otomatis)
+
+
+@dataclass(frozen=True)
+class SaleRejected:
+    sale_id: int
+    buyer_id: int
+    admin_id: int
+
+
+@dataclass(frozen=True)
+class StockAdded:
+    product_id: int
+    account_ids: Tuple[int, ...]
+
+
+@dataclass(frozen=True)
+class StockRemoved:
+    account_id: int
+
+
+@dataclass(frozen=True)
+class SettingChanged:
+    key: str
+    value: str
+
+
+@dataclass(frozen=True)
+class PaymentMethodChanged:
+    action: str # 'saved', 'toggled', 'deleted'
+    method_id: Optional[int] = None # Diisi untuk toggle/hapus (dari tombol)
+    method: Optional[str] = None # Diisi saat disimpan dari input admin
+
+
+@dataclass(frozen=True)
+class ProductChanged:
+    product_id: int
+    action: str # 'added', 'price', 'toggled'
+
+
+Subscriber = Callable[[Any], None]
+
+
+class EventBus:
+    def __init__(self, logger: Optional[logging.Logger] = None, queue_size: int = 10000):
+        self.logger = logger or logging.getLogger(__name__) # Bot memberi loggernya sendiri agar error tercatat di log yang sama
+        self._sync: DefaultDict[type, List[Subscriber]] = defaultdict(list)
+        self._async: DefaultDict[type, List[Subscriber]] = defaultdict(list)
+        self._queue: 'queue.Queue[Optional[Tuple[Subscriber, Any]]]' = queue.Queue(maxsize=queue_size)
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self.published: DefaultDict[str, int] = defaultdict(int)
+        self.errors = 0
+        self.dropped = 0
+
+    def subscribe(self, event_types: Tuple[Type[Any], ...], subscriber: Subscriber, run_async: bool = False) -> None:
+        with self._lock:
+            for event_type in event_types:
+                (self._async if run_async else self._sync)[event_type].append(subscriber)
+            if run_async and self._thread is None:
+                self._thread = threading.Thread(target=self._run_async, name='event-bus', daemon=True)
+                self._thread.start()
+
+    def publish(self, event: Any) -> None:
+        """Dipanggil setelah commit. Subscriber sinkron selesai sebelum publish() kembali."""
+        event_type = type(event)
+        with self._lock:
+            self.published[event_type.__name__] += 1
+            sync_subscribers = list(self._sync.get(event_type, ()))
+            async_subscribers = list(self._async.get(event_type, ()))
+        for subscriber in sync_subscribers:
+            self._deliver(subscriber, event)
+        for subscriber in async_subscribers:
+            try:
+                self._queue.put_nowait((subscriber, event))
+            except queue.Full: # Efek samping async boleh hilang; publisher tidak boleh ikut tertahan
+                self.dropped += 1
+                self.logger.warning(f"Antrean event penuh, {event_type.__name__} untuk {subscriber.__name__} dibuang.")
+
+    def pending_count(self) -> int:
+        return self._queue.qsize()
+
+    def close(self, timeout: float = 5.0) -> None:
+        """Menjalankan sisa antrean async (dipanggil saat shutdown)."""
+        if self._thread is None:
+            return
+        try:
+            self._queue.put(None, timeout=timeout)
+        except queue.Full:
+            return
+        self._thread.join(timeout)
+        if not self._thread.is_alive():
+            self._thread = None
+
+    def _deliver(self, subscriber: Subscriber, event: Any) -> None:
+        try:
+            subscriber(event)
+        except Exception as e:
+            self.errors += 1
+            self.logger.error(f"Subscriber {getattr(subscriber, '__name__', subscriber)} gagal menangani {type(event).__name__}: {e}", exc_info=True)
+
+    def _run_async(self) -> None:
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            self._deliver(*item)
+
+    def counts(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self.published)
@@ -0,0 +1,207 @@
+"""Server HTTP kecil untuk memantau proses worker bot.
+
+Endpoint:
+    /healthz  liveness: loop polling masih memanggil getUpdates dalam batas waktu
+    /readyz   readiness: database bisa dibuka dan versi skema sesuai
+    /metrics  metrik dalam format teks Prometheus
+    /status   metrik yang sama dalam JSON
+
+/healthz dan /metrics hanya membaca counter di memori; /readyz membuka satu
+koneksi SQLite dengan timeout pendek, sehingga aman di-scrape tiap beberapa detik.
+
+Bisa dicoba lokal tanpa bot (readiness terhadap file DB saja):
+
+    python health_server.py --db store_enhanced.db --port 8080
+    curl -i localhost:8080/readyz
+"""
+import argparse
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Deque, Dict, Optional, Tuple
+
+LAG_SAMPLES = 100 # Jumlah lag update terakhir yang disimpan untuk nilai maksimum
+READY_DB_TIMEOUT_SEC = 1.0
+
+
+class HealthState:
+    """Counter aktivitas polling dan update; diperbarui dari thread polling, dibaca dari thread HTTP."""
+
+    def __init__(self, max_poll_gap_sec: float = 120.0):
+        self.max_poll_gap_sec = max_poll_gap_sec
+        self.started_at = time.time()
+        self.last_poll_at: Optional[float] = None
+        self.last_update_at: Optional[float] = None
+        self.updates_total = 0
+        self.db_locked_errors = 0
+        self._lags: Deque[float] = deque(maxlen=LAG_SAMPLES)
+        self._lock = threading.Lock()
+
+    def mark_poll(self, update_count: int) -> None:
+        """Dipanggil tiap hasil getUpdates (juga yang kosong)."""
+        now = time.time()
+        with self._lock:
+            self.last_poll_at = now
+            if update_count:
+                self.last_update_at = now
+                self.updates_total += update_count
+
+    def record_lag(self, message_date: int) -> None:
+        """Lag pemrosesan: waktu sekarang dikurangi tanggal pesan dari Telegram."""
+        with self._lock:
+            self._lags.append(max(0.0, time.time() - message_date))
+
+    def mark_db_locked(self) -> None:
+        with self._lock:
+            self.db_locked_errors += 1
+
+    def is_alive(self) -> Tuple[bool, str]:
+        now = time.time()
+        with self._lock:
+            last_poll = self.last_poll_at
+        if last_poll is None:
+            if now - self.started_at <= self.max_poll_gap_sec:
+                return True, "menunggu polling pertama"
+            return False, f"belum ada polling sejak {now - self.started_at:.0f} detik"
+        gap = now - last_poll
+        if gap > self.max_poll_gap_sec:
+            return False, f"polling terakhir {gap:.0f} detik lalu"
+        return True, "ok"
+
+    def metrics(self) -> Dict[str, float]:
+        now = time.time()
+        with self._lock:
+            lags = list(self._lags)
+            return {
+                'uptime_seconds': now - self.started_at,
+                'last_poll_age_seconds': now - self.last_poll_at if self.last_poll_at else -1,
+                'last_update_age_seconds': now - self.last_update_at if self.last_update_at else -1,
+                'updates_total': self.updates_total,
+                'update_lag_seconds': lags[-1] if lags else 0,
+                'update_lag_max_seconds': max(lags) if lags else 0,
+                'db_locked_errors_total': self.db_locked_errors,
+            }
+
+
+class DbLockCounter(logging.Handler):
+    """Menghitung log error 'database is locked' (lock wait yang melewati busy timeout) ke HealthState."""
+
+    def __init__(self, state: HealthState):
+        super().__init__(level=logging.WARNING)
+        self.state = state
+
+    def emit(self, record: logging.LogRecord) -> None:
+        if 'database is locked' in record.getMessage():
+            self.state.mark_db_locked()
+
+
+def check_database(db_path: str, schema_version: Optional[int] = None) -> Tuple[bool, str]:
+    """Readiness: DB bisa dibaca dan PRAGMA user_version sama dengan versi skema yang diharapkan."""
+    try:
+        conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True, timeout=READY_DB_TIMEOUT_SEC)
+        try:
+            version = conn.execute('PRAGMA user_version').fetchone()[0]
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        return False, f"database tidak bisa dibuka: {e}"
+    if schema_version is not None and version != schema_version:
+        return False, f"versi skema {version}, diharapkan {schema_version}"
+    return True, f"ok (skema {version})"
+
+
+class HealthServer:
+    """ThreadingHTTPServer di thread daemon. `extra_metrics` menambah metrik (mis. kedalaman antrean) saat scrape."""
+
+    def __init__(self, state: HealthState, db_path: str, schema_version: Optional[int] = None,
+                 extra_metrics: Optional[Callable[[], Dict[str, float]]] = None,
+                 host: str = '0.0.0.0', port: int = 8080):
+        self.state = state
+        self.db_path = db_path
+        self.schema_version = schema_version
+        self.extra_metrics = extra_metrics
+        self.address = (host, port)
+        self._server: Optional[ThreadingHTTPServer] = None
+        self._thread: Optional[threading.Thread] = None
+
+    def collect_metrics(self) -> Dict[str, float]:
+        metrics = self.state.metrics()
+        if self.extra_metrics:
+            metrics.update(self.extra_metrics())
+        return metrics
+
+    def handle(self, path: str) -> Tuple[int, str, str]:
+        """Mengembalikan (status HTTP, content type, body) untuk path."""
+        if path == '/healthz':
+            alive, detail = self.state.is_alive()
+            return (200 if alive else 503), 'text/plain; charset=utf-8', detail + '\n'
+        if path == '/readyz':
+            ready, detail = check_database(self.db_path, self.schema_version)
+            return (200 if ready else 503), 'text/plain; charset=utf-8', detail + '\n'
+        if path == '/metrics':
+            lines = [f"bot_{name} {value:g}" for name, value in self.collect_metrics().items()]
+            return 200, 'text/plain; version=0.0.4', '\n'.join(lines) + '\n'
+        if path == '/status':
+            alive, live_detail = self.state.is_alive()
+            body = {'alive': alive, 'detail': live_detail, 'metrics': self.collect_metrics()}
+            return 200, 'application/json', json.dumps(body)
+        return 404, 'text/plain; charset=utf-8', 'not found\n'
+
+    def start(self) -> None:
+        health = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self) -> None:
+                status, content_type, body = health.handle(self.path.split('?', 1)[0])
+                data = body.encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format: str, *args) -> None: # Scrape rutin tidak perlu masuk log
+                pass
+
+        self._server = ThreadingHTTPServer(self.address, Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, name='health-server', daemon=True)
+        self._thread.start()
+
+    @property
+    def port(self) -> int:
+        return self._server.server_address[1] if self._server else self.address[1]
+
+    def stop(self) -> None:
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Menjalankan health server saja (tanpa bot) untuk uji lokal.")
+    parser.add_argument('--db', default='store_enhanced.db', help="File database toko")
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--schema-version', type=int, default=None, help="Versi skema yang diharapkan (PRAGMA user_version)")
+    args = parser.parse_args()
+
+    state = HealthState()
+    state.mark_poll(0) # Tanpa bot tidak ada polling; anggap hidup
+    server = HealthServer(state, args.db, args.schema_version, host='127.0.0.1', port=args.port)
+    server.start()
+    print(f"Health server di http://127.0.0.1:{server.port} (/healthz /readyz /metrics /status). Ctrl+C untuk berhenti.")
+    try:
+        while True:
+            time.sleep(60)
+            state.mark_poll(0)
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
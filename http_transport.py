@@ -0,0 +1,137 @@
+"""Transport HTTP ke Bot API Telegram dengan satu pool koneksi keep-alive.
+
+Dipasang sebagai `telebot.apihelper.CUSTOM_REQUEST_SENDER`. Semua thread (worker
+update, notifikasi admin, broadcast, laporan, event bus) berbagi satu
+`requests.Session` dengan pool koneksi sebesar jumlah thread tersebut, sehingga
+fan-out approve/broadcast memakai ulang koneksi TLS yang sudah terbuka.
+
+Timeout connect/read diatur per method API (mis. sendMessage pendek, sendDocument
+panjang); getUpdates dan pemanggilan dengan `timeout=` eksplisit tetap memakai
+timeout dari telebot. Error koneksi diulang dengan backoff eksponensial
+ber-jitter, tetapi method yang mengubah sesuatu (sendMessage, forwardMessage, ...)
+hanya diulang jika koneksi belum pernah tersambung (connect gagal/timeout). Koneksi
+yang diputus setelah request terkirim ("Connection aborted") atau read timeout
+tidak diulang karena request mungkin sudah diproses Telegram (pesan ganda).
+
+    transport = TelegramTransport(pool_size=8, method_timeouts=parse_method_timeouts('sendDocument=5:120'))
+    telebot.apihelper.CUSTOM_REQUEST_SENDER = transport
+"""
+import logging
+import random
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import ConnectTimeoutError, NewConnectionError
+
+Timeout = Tuple[float, float] # (connect, read) detik
+DEFAULT_METHOD_TIMEOUTS: Dict[str, Timeout] = {
+    'sendMessage': (3.05, 10), 'editMessageText': (3.05, 10), 'editMessageReplyMarkup': (3.05, 10),
+    'forwardMessage': (3.05, 10), 'answerCallbackQuery': (3.05, 5), 'answerInlineQuery': (3.05, 10),
+    'deleteMessage': (3.05, 10), 'pinChatMessage': (3.05, 10), 'getMe': (3.05, 10), 'getFile': (3.05, 15),
+    'sendPhoto': (5, 60), 'sendDocument': (5, 60), 'sendMediaGroup': (5, 60),
+}
+UNTUNED_METHODS = ('getUpdates',) # Timeout read dihitung telebot dari long_polling_timeout
+READ_ONLY_PREFIX = 'get' # getMe, getFile, getUpdates, ...: aman diulang walau request sudah terkirim
+
+logger = logging.getLogger(__name__)
+
+
+def connection_not_established(error: requests.exceptions.ConnectionError) -> bool:
+    """True jika request pasti belum sampai ke Telegram (DNS/connect gagal atau connect timeout)."""
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    reason = getattr(error.args[0], 'reason', None) if error.args else None # urllib3 MaxRetryError
+    return isinstance(reason, (NewConnectionError, ConnectTimeoutError))
+
+
+def parse_method_timeouts(spec: str) -> Dict[str, Timeout]:
+    """'sendMessage=3:10,sendDocument=5:120' -> {'sendMessage': (3.0, 10.0), ...}; ValueError jika format salah."""
+    timeouts: Dict[str, Timeout] = {}
+    for item in filter(None, (part.strip() for part in spec.split(','))):
+        method, _, values = item.partition('=')
+        connect, _, read = values.partition(':')
+        if not method or not connect or not read:
+            raise ValueError(f"Format timeout '{item}' harus method=connect:read")
+        timeouts[method.strip()] = (float(connect), float(read))
+    return timeouts
+
+
+class TelegramTransport:
+    def __init__(self, pool_size: int = 10, method_timeouts: Optional[Dict[str, Timeout]] = None,
+                 max_retries: int = 2, backoff_base: float = 0.25, backoff_max: float = 3.0,
+                 default_timeout: Timeout = (15, 30)):
+        self.method_timeouts = dict(DEFAULT_METHOD_TIMEOUTS, **(method_timeouts or {}))
+        # Timeout bawaan telebot (CONNECT_TIMEOUT, READ_TIMEOUT); nilai lain berarti `timeout=` eksplisit dari pemanggil
+        self.default_timeout = tuple(default_timeout)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        # Satu host (api.telegram.org): satu pool berisi pool_size koneksi; tanpa pool_block agar lonjakan tidak antre
+        self.adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(1, pool_size), max_retries=0)
+        self.session = requests.Session()
+        self.session.mount('https://', self.adapter)
+        self.session.mount('http://', self.adapter)
+        self._lock = threading.Lock()
+        self.counts: Dict[str, int] = {'requests': 0, 'retries': 0, 'connection_errors': 0}
+        # Counter pool urllib3 ikut hilang saat pool dibuang (ganti host/proxy, close); simpan dulu agar metrik tetap naik
+        self._retired = {'connections_opened': 0, 'pooled_requests': 0}
+        pools = self.adapter.poolmanager.pools
+        self._dispose_pool = pools.dispose_func
+        pools.dispose_func = self._retire_pool
+
+    def timeout_for(self, api_method: str, default: Timeout) -> Timeout:
+        if api_method in UNTUNED_METHODS or tuple(default) != self.default_timeout:
+            return default
+        return self.method_timeouts.get(api_method, default)
+
+    def __call__(self, method: str, url: str, params: Optional[Dict[str, Any]] = None, files: Optional[Dict[str, Any]] = None,
+                 timeout: Timeout = (15, 30), proxies: Optional[Dict[str, str]] = None) -> requests.Response:
+        """Tanda tangan sama dengan CUSTOM_REQUEST_SENDER telebot."""
+        api_method = url.rsplit('/', 1)[-1]
+        request_timeout = self.timeout_for(api_method, timeout)
+        attempt = 0
+        while True:
+            with self._lock:
+                self.counts['requests'] += 1
+            try:
+                return self.session.request(method, url, params=params, files=files, timeout=request_timeout, proxies=proxies)
+            except requests.exceptions.ConnectionError as e:
+                with self._lock:
+                    self.counts['connection_errors'] += 1
+                # File stream sudah terbaca sebagian; ulangi hanya request tanpa file
+                if attempt >= self.max_retries or files:
+                    raise
+                if not api_method.startswith(READ_ONLY_PREFIX) and not connection_not_established(e):
+                    raise
+                attempt += 1
+                delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt)) # Full jitter
+                # URL berisi token bot; cukup jenis error
+                logger.warning(f"Koneksi ke Telegram ({api_method}) gagal: {type(e).__name__}. Ulangi ke-{attempt} dalam {delay:.2f} detik.")
+                with self._lock:
+                    self.counts['retries'] += 1
+                time.sleep(delay)
+
+    def _retire_pool(self, pool: Any) -> None:
+        with self._lock:
+            self._retired['connections_opened'] += pool.num_connections
+            self._retired['pooled_requests'] += pool.num_requests
+        if self._dispose_pool:
+            self._dispose_pool(pool)
+
+    def connection_stats(self) -> Dict[str, int]:
+        """Koneksi baru vs request HTTP di pool urllib3; selisihnya adalah request yang memakai ulang koneksi."""
+        with self._lock:
+            opened, sent = self._retired['connections_opened'], self._retired['pooled_requests']
+        pools = self.adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is not None:
+                opened += pool.num_connections
+                sent += pool.num_requests
+        return {'connections_opened': opened, 'pooled_requests': sent, 'reused_requests': max(0, sent - opened)}
+
+    def close(self) -> None:
+        self.session.close()
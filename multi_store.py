@@ -0,0 +1,270 @@
+"""Runtime multi-toko: menjalankan beberapa token bot dalam satu proses.
+
+Setiap toko dimuat dari telegram_bot.py apa adanya (runpy, namespace sendiri)
+dengan environment dari file konfigurasi, sehingga database, pengaturan,
+snapshot stok, rate limiter, dan antrean notifikasinya tetap terpisah. Yang
+dibagi: interpreter, satu worker pool untuk semua handler, dan sesi HTTP
+apihelper. Tiap toko hanya memakai satu thread long polling.
+
+    python multi_store.py stores.json --workers 4
+
+Isi stores.json: list konfigurasi, kunci sama dengan variabel .env bot:
+
+    [
+      {"STORE_KEY": "toko_a", "BOT_TOKEN": "...", "ADMIN_ID": "123", "BOT_USERNAME": "tokoa_bot",
+       "OWNER_USERNAME": "...", "ADMIN_USERNAME": "...", "STORE_NAME": "Toko A", "DB_PATH": "data/toko_a.db"},
+      ...
+    ]
+
+DB_PATH (dan ARCHIVE_DB_PATH) wajib berbeda untuk tiap toko. Metrik per toko
+(update, CPU handler & polling, tambahan memori saat dimuat) serta perkiraan
+penghematan dibanding satu proses per toko ditulis ke log secara berkala.
+"""
+import argparse
+import json
+import logging
+import os
+import re
+import runpy
+import signal
+import sys
+import threading
+import time
+from dataclasses import dataclass, field
+from functools import wraps
+from typing import Any, Dict, List, Optional
+
+import dotenv # noqa: F401 - dependensi bot diimpor sebelum baseline RSS diukur
+import telebot
+from telebot.util import ThreadPool
+
+import events # noqa: F401
+import health_server # noqa: F401
+import http_transport # noqa: F401
+import reconcile # noqa: F401
+import report_executor # noqa: F401
+import stock_spool # noqa: F401
+import storage # noqa: F401
+import traffic_capture # noqa: F401
+import update_profiler # noqa: F401
+
+BOT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'telegram_bot.py')
+LONG_POLLING_TIMEOUT = 30 # Sama dengan infinity_polling di telegram_bot.py
+REQUEST_TIMEOUT = 60
+REQUIRED_KEYS = ('BOT_TOKEN', 'ADMIN_ID', 'BOT_USERNAME', 'OWNER_USERNAME', 'ADMIN_USERNAME', 'STORE_NAME', 'DB_PATH')
+
+logger = logging.getLogger('multi_store')
+
+
+def current_rss() -> int:
+    """RSS proses saat ini dalam byte (Linux /proc; fallback ke puncak RSS)."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def format_mb(size: float) -> str:
+    return f"{size / (1024 * 1024):.1f} MB"
+
+
+@dataclass
+class StoreRuntime:
+    key: str
+    namespace: Dict[str, Any]
+    load_rss: int # Tambahan RSS saat toko dimuat
+    updates: int = 0
+    handler_cpu: float = 0.0
+    poll_cpu: float = 0.0
+    poll_errors: int = 0
+    thread: Optional[threading.Thread] = None
+    _lock: threading.Lock = field(default_factory=threading.Lock)
+
+    @property
+    def bot(self) -> telebot.TeleBot:
+        return self.namespace['bot']
+
+    @property
+    def lifecycle(self) -> Any:
+        return self.namespace['lifecycle']
+
+    @property
+    def logger(self) -> logging.Logger:
+        return self.namespace['logger']
+
+    def add_handler_cpu(self, seconds: float) -> None:
+        with self._lock:
+            self.handler_cpu += seconds
+
+
+class MultiStoreRuntime:
+    def __init__(self, configs: List[Dict[str, str]], workers: int = 4):
+        self.configs = configs
+        self.workers = workers
+        self.stores: List[StoreRuntime] = []
+        self.pool: Optional[ThreadPool] = None
+        self.stop_event = threading.Event()
+        self.baseline_rss = current_rss() # Interpreter + telebot/requests: biaya yang dibayar tiap proses terpisah
+        self.started_at = time.monotonic()
+
+    def load_all(self) -> None:
+        for config in self.configs:
+            store = self._load_store(config)
+            if self.pool is None:
+                self.pool = ThreadPool(store.bot, num_threads=self.workers)
+            own_pool, store.bot.worker_pool = store.bot.worker_pool, self.pool
+            if own_pool: own_pool.close()
+            self._meter_handlers(store)
+            self.stores.append(store)
+            logger.info(f"Toko '{store.key}' dimuat (+{format_mb(store.load_rss)}).")
+
+    def _load_store(self, config: Dict[str, str]) -> StoreRuntime:
+        missing = [key for key in REQUIRED_KEYS if not config.get(key)]
+        if missing:
+            raise ValueError(f"Konfigurasi toko {config.get('STORE_NAME', '?')} tidak lengkap: {', '.join(missing)}")
+        key = config.get('STORE_KEY') or re.sub(r'\W+', '_', config['STORE_NAME']).strip('_').lower()
+        if any(store.key == key for store in self.stores):
+            raise ValueError(f"STORE_KEY '{key}' dipakai lebih dari satu toko.")
+        config.setdefault('ARCHIVE_DB_PATH', os.path.splitext(config['DB_PATH'])[0] + '_archive.db')
+
+        saved_env = dict(os.environ)
+        rss_before = current_rss()
+        try:
+            os.environ.update({name: str(value) for name, value in config.items()})
+            namespace = runpy.run_path(BOT_PATH, run_name=f"store.{key}")
+        finally: # Environment toko ini (termasuk yang diisi load_dotenv) tidak boleh bocor ke toko berikutnya
+            os.environ.clear()
+            os.environ.update(saved_env)
+        if 'lifecycle' not in namespace: # telegram_bot.py menangkap error startup sendiri dan hanya mencatatnya
+            raise RuntimeError(f"Toko '{key}' gagal dimuat, lihat log di atas.")
+        return StoreRuntime(key, namespace, max(0, current_rss() - rss_before))
+
+    def _meter_handlers(self, store: StoreRuntime) -> None:
+        """Mencatat waktu CPU handler per toko; task tetap melewati pembungkus profiler & lifecycle bot."""
+        exec_task = store.bot._exec_task
+
+        def metered_exec_task(task, *args, **kwargs):
+            @wraps(task)
+            def metered_task(*task_args, **task_kwargs):
+                start = time.thread_time()
+                try:
+                    return task(*task_args, **task_kwargs)
+                finally:
+                    store.add_handler_cpu(time.thread_time() - start)
+            return exec_task(metered_task, *args, **kwargs)
+        store.bot._exec_task = metered_exec_task
+
+    def _poll(self, store: StoreRuntime) -> None:
+        bot, lifecycle = store.bot, store.lifecycle
+        backoff = 0.25
+        while not lifecycle.stopping.is_set():
+            cpu_start = time.thread_time()
+            try:
+                updates = bot.get_updates(offset=bot.last_update_id + 1, timeout=REQUEST_TIMEOUT,
+                                          long_polling_timeout=LONG_POLLING_TIMEOUT)
+                bot.process_new_updates(updates)
+                store.updates += len(updates)
+                backoff = 0.25
+            except Exception as e:
+                store.poll_errors += 1
+                store.logger.error(f"Polling toko '{store.key}' gagal: {e}")
+                lifecycle.stopping.wait(backoff)
+                backoff = min(backoff * 2, 60)
+            finally:
+                store.poll_cpu += time.thread_time() - cpu_start
+            if self.pool.exception_event.is_set(): # Error handler di worker bersama
+                store.logger.error(f"Error handler: {self.pool.exception_info!r}")
+                self.pool.clear_exceptions()
+
+    def start(self) -> None:
+        for store in self.stores:
+            store.namespace['resume_broadcast_job']()
+            store.thread = threading.Thread(target=self._poll, args=(store,), name=f"poll-{store.key}", daemon=True)
+            store.thread.start()
+        logger.info(f"{len(self.stores)} toko berjalan dengan {self.workers} worker bersama.")
+
+    def request_stop(self, signum: Optional[int] = None, frame: Any = None) -> None:
+        if self.stop_event.is_set():
+            return
+        self.stop_event.set()
+        for store in self.stores:
+            store.lifecycle.request_stop(signum, frame) # Tiap toko menguras task dan flush state-nya sendiri
+
+    def shutdown(self) -> None:
+        for store in self.stores:
+            store.lifecycle.shutdown() # Menunggu shutdown yang sudah dimulai request_stop
+        if self.pool:
+            self.pool.close()
+        logger.info("Metrik akhir:\n" + self.format_metrics())
+
+    def metrics(self) -> Dict[str, Any]:
+        rss = current_rss()
+        standalone_rss = sum(self.baseline_rss + store.load_rss for store in self.stores)
+        return {
+            'uptime_sec': time.monotonic() - self.started_at,
+            'rss': rss,
+            'baseline_rss': self.baseline_rss,
+            'standalone_rss_estimate': standalone_rss,
+            'memory_saved_estimate': standalone_rss - rss,
+            'process_cpu': time.process_time(),
+            'threads': threading.active_count(),
+            'stores': [{
+                'key': store.key, 'updates': store.updates, 'handler_cpu': store.handler_cpu,
+                'poll_cpu': store.poll_cpu, 'poll_errors': store.poll_errors, 'load_rss': store.load_rss,
+            } for store in self.stores],
+        }
+
+    def format_metrics(self) -> str:
+        m = self.metrics()
+        lines = [f"{'Toko':<16} {'Update':>8} {'CPU handler':>12} {'CPU polling':>12} {'Error':>6} {'Memori':>10}"]
+        for s in m['stores']:
+            lines.append(f"{s['key']:<16} {s['updates']:>8} {s['handler_cpu']:>11.2f}s {s['poll_cpu']:>11.2f}s "
+                         f"{s['poll_errors']:>6} {format_mb(s['load_rss']):>10}")
+        store_cpu = sum(s['handler_cpu'] + s['poll_cpu'] for s in m['stores'])
+        lines.append(f"RSS proses {format_mb(m['rss'])} vs perkiraan {len(m['stores'])} proses terpisah "
+                     f"{format_mb(m['standalone_rss_estimate'])} (hemat ~{format_mb(m['memory_saved_estimate'])}; "
+                     f"interpreter dasar {format_mb(m['baseline_rss'])} per proses).")
+        lines.append(f"CPU proses {m['process_cpu']:.2f}s (toko {store_cpu:.2f}s, sisanya overhead bersama), "
+                     f"{m['threads']} thread untuk {len(m['stores'])} toko.")
+        return '\n'.join(lines)
+
+    def run(self, metrics_interval: float) -> None:
+        self.start()
+        while not self.stop_event.wait(metrics_interval):
+            logger.info("Metrik multi-toko:\n" + self.format_metrics())
+        self.shutdown()
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Menjalankan beberapa toko (token bot) dalam satu proses.")
+    parser.add_argument('config', help="File JSON berisi list konfigurasi toko")
+    parser.add_argument('--workers', type=int, default=4, help="Jumlah worker handler bersama")
+    parser.add_argument('--metrics-interval', type=float, default=600, help="Interval log metrik (detik)")
+    args = parser.parse_args()
+
+    with open(args.config, encoding='utf-8') as f:
+        configs = json.load(f)
+    if not isinstance(configs, list) or not configs:
+        print("File konfigurasi harus berisi list toko.")
+        return 1
+    db_paths = [os.path.abspath(config.get('DB_PATH', '')) for config in configs]
+    if len(set(db_paths)) != len(db_paths):
+        print("DB_PATH tiap toko harus berbeda.")
+        return 1
+
+    runtime = MultiStoreRuntime(configs, args.workers)
+    try:
+        runtime.load_all()
+    except (ValueError, RuntimeError) as e:
+        logger.critical(f"Gagal memuat toko: {e}")
+        return 1
+    signal.signal(signal.SIGTERM, runtime.request_stop)
+    signal.signal(signal.SIGINT, runtime.request_stop)
+    runtime.run(args.metrics_interval)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,185 @@
+"""Mesin rekonsiliasi pembayaran dari file mutasi bank/e-wallet (CSV).
+
+Setiap sale pending memiliki nominal unik (harga + kode unik) di kolom
+`sales.expected_amount`. Baris mutasi dicocokkan ke sale lewat index hash
+nominal -> sale, lalu disaring dengan jendela waktu di sekitar waktu sale dibuat.
+
+Modul ini tidak bergantung pada bot Telegram sehingga bisa diuji lokal:
+
+    python reconcile.py samples/statement_sample.csv --db store_enhanced.db
+"""
+import argparse
+import csv
+import io
+import re
+import sqlite3
+import sys
+from collections import defaultdict
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+
+DATE_FORMATS: Tuple[str, ...] = (
+    '%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M', '%Y-%m-%d',
+    '%d/%m/%Y %H:%M:%S', '%d/%m/%Y %H:%M', '%d/%m/%Y',
+    '%d-%m-%Y %H:%M:%S', '%d-%m-%Y %H:%M', '%d-%m-%Y',
+    '%d/%m/%y %H:%M', '%d/%m/%y',
+)
+# Nama kolom yang dikenali (huruf kecil) pada header CSV ekspor bank/e-wallet
+DATE_COLUMNS = ('tanggal', 'tgl', 'date', 'waktu', 'time', 'datetime', 'tanggal transaksi', 'transaction date')
+AMOUNT_COLUMNS = ('kredit', 'credit', 'cr', 'nominal', 'jumlah', 'amount', 'mutasi', 'uang masuk')
+DESCRIPTION_COLUMNS = ('keterangan', 'deskripsi', 'description', 'catatan', 'remark', 'berita')
+TYPE_COLUMNS = ('tipe', 'type', 'jenis', 'db/cr', 'd/k')
+DEBIT_MARKERS = ('db', 'd', 'debit', 'keluar', 'out')
+
+
+@dataclass
+class StatementLine:
+    line_no: int
+    date: datetime
+    amount: int
+    description: str = ''
+
+
+@dataclass
+class PendingSale:
+    sale_id: int
+    expected_amount: int
+    created: datetime
+
+
+@dataclass
+class ReconcileResult:
+    matched: List[Tuple[StatementLine, PendingSale]] = field(default_factory=list)
+    unmatched: List[StatementLine] = field(default_factory=list)
+    ambiguous: List[Tuple[StatementLine, List[PendingSale]]] = field(default_factory=list)
+
+
+def parse_amount(raw: str) -> Optional[int]:
+    """Membaca nominal rupiah dari format umum: '50.123', '50,123.00', 'Rp 50.123,00', '50123'."""
+    text = (raw or '').strip().upper().replace('RP', '').replace('IDR', '').replace(' ', '')
+    if not text:
+        return None
+    negative = text.startswith('-') or text.startswith('(')
+    text = text.strip('-()+')
+    text = re.sub(r'(CR|DB)$', '', text)
+    # Buang bagian desimal 1-2 digit ('50.123,00', '50,123.00'); pemisah ribuan selalu diikuti 3 digit
+    decimal_match = re.match(r'^([\d.,]*?)[.,](\d{1,2})$', text)
+    if decimal_match:
+        text = decimal_match.group(1)
+    digits = re.sub(r'[.,]', '', text)
+    if not digits.isdigit():
+        return None
+    value = int(digits)
+    return -value if negative else value
+
+
+def parse_date(raw: str) -> Optional[datetime]:
+    text = (raw or '').strip()
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(text, fmt)
+        except ValueError:
+            continue
+    return None
+
+
+def _find_column(header: List[str], candidates: Iterable[str]) -> Optional[int]:
+    normalized = [h.strip().lower() for h in header]
+    for candidate in candidates:
+        if candidate in normalized:
+            return normalized.index(candidate)
+    return None
+
+
+def parse_statement(text: str) -> Tuple[List[StatementLine], List[int]]:
+    """Membaca CSV mutasi, mengembalikan (baris uang masuk, nomor baris yang dilewati)."""
+    try:
+        dialect = csv.Sniffer().sniff(text[:2048], delimiters=',;\t|')
+    except csv.Error:
+        dialect = csv.excel
+    rows = list(csv.reader(io.StringIO(text), dialect))
+    if not rows:
+        return [], []
+
+    header = rows[0]
+    date_col = _find_column(header, DATE_COLUMNS)
+    amount_col = _find_column(header, AMOUNT_COLUMNS)
+    if date_col is None or amount_col is None:
+        raise ValueError("Header CSV harus memiliki kolom tanggal dan nominal (mis. 'tanggal,keterangan,nominal').")
+    desc_col = _find_column(header, DESCRIPTION_COLUMNS)
+    type_col = _find_column(header, TYPE_COLUMNS)
+
+    lines: List[StatementLine] = []
+    skipped: List[int] = []
+    for line_no, row in enumerate(rows[1:], start=2):
+        if not any(cell.strip() for cell in row):
+            continue
+        try:
+            date = parse_date(row[date_col])
+            amount = parse_amount(row[amount_col])
+            is_debit = type_col is not None and row[type_col].strip().lower() in DEBIT_MARKERS
+        except IndexError:
+            date, amount, is_debit = None, None, False
+        if date is None or amount is None or amount <= 0 or is_debit:
+            skipped.append(line_no)
+            continue
+        description = row[desc_col].strip() if desc_col is not None and desc_col < len(row) else ''
+        lines.append(StatementLine(line_no, date, amount, description))
+    return lines, skipped
+
+
+def match_statement(lines: List[StatementLine], pending: List[PendingSale],
+                    window: timedelta = timedelta(hours=24)) -> ReconcileResult:
+    """Mencocokkan baris mutasi ke sale pending berdasarkan nominal (hash index) dan jendela waktu."""
+    by_amount: Dict[int, List[PendingSale]] = defaultdict(list)
+    for sale in pending:
+        by_amount[sale.expected_amount].append(sale)
+
+    result = ReconcileResult()
+    for line in sorted(lines, key=lambda l: l.date):
+        candidates = [sale for sale in by_amount.get(line.amount, ()) if abs(line.date - sale.created) <= window]
+        if not candidates:
+            result.unmatched.append(line)
+        elif len(candidates) > 1:
+            result.ambiguous.append((line, candidates)) # Nominal sama di jendela yang sama: verifikasi manual
+        else:
+            sale = candidates[0]
+            by_amount[line.amount].remove(sale) # Satu sale hanya boleh dipakai satu baris mutasi
+            result.matched.append((line, sale))
+    return result
+
+
+def load_pending_sales(conn: sqlite3.Connection) -> List[PendingSale]:
+    """Mengambil sale pending yang memiliki nominal unik."""
+    rows = conn.execute("""SELECT id, expected_amount, created_date FROM sales
+                           WHERE status = 'pending' AND expected_amount IS NOT NULL""").fetchall()
+    return [PendingSale(sale_id, expected_amount, datetime.strptime(created, '%Y-%m-%d %H:%M:%S'))
+            for sale_id, expected_amount, created in rows]
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Uji rekonsiliasi mutasi terhadap sale pending (dry run, tanpa menulis DB).")
+    parser.add_argument('statement', help="File CSV mutasi")
+    parser.add_argument('--db', default='store_enhanced.db', help="File database toko")
+    parser.add_argument('--window-hours', type=float, default=24, help="Jendela waktu pencocokan (jam)")
+    args = parser.parse_args(argv)
+
+    with open(args.statement, encoding='utf-8-sig') as f:
+        lines, skipped = parse_statement(f.read())
+    with sqlite3.connect(args.db) as conn:
+        pending = load_pending_sales(conn)
+    result = match_statement(lines, pending, timedelta(hours=args.window_hours))
+
+    print(f"Baris uang masuk: {len(lines)} (dilewati: {len(skipped)}), sale pending: {len(pending)}")
+    for line, sale in result.matched:
+        print(f"  COCOK   baris {line.line_no}: {line.amount} -> Sale ID {sale.sale_id}")
+    for line, candidates in result.ambiguous:
+        print(f"  AMBIGU  baris {line.line_no}: {line.amount} -> Sale ID {', '.join(str(s.sale_id) for s in candidates)}")
+    for line in result.unmatched:
+        print(f"  TIDAK   baris {line.line_no}: {line.amount} {line.description}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
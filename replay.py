@@ -0,0 +1,356 @@
+"""Replay rekaman trafik (TRAFFIC_CAPTURE_DIR) ke handler bot asli.
+
+Update dari rekaman traffic_capture.py diumpankan ke telegram_bot.py (dimuat
+tanpa polling, dengan API Telegram palsu lokal) terhadap salinan database, pada
+kecepatan asli atau dipercepat. Waktu eksekusi tiap handler diukur; dengan
+--runs > 1 atau --baseline, selisih waktu antar-run ditampilkan sehingga regresi
+performa bisa direproduksi dan dibandingkan.
+
+    python replay.py captures/ --db store_enhanced.db --speed 10 --runs 2
+    python replay.py captures/ --db store_enhanced.db --speed 0 --output hasil.json
+    python replay.py captures/ --db store_enhanced.db --baseline hasil.json
+
+--speed 1 = jeda antar-batch sama dengan aslinya, 10 = sepuluh kali lebih cepat,
+0 = tanpa jeda. Database sumber tidak pernah diubah: setiap run memakai salinan
+baru (backup API SQLite) dengan high-water mark update direset dan seed random
+yang sama. Jika --salt sama dengan TRAFFIC_CAPTURE_SALT saat merekam, ID user di
+salinan database ikut dipseudonimkan sehingga riwayat pembeli cocok dengan
+update di rekaman; tanpa --salt, user di rekaman tampil sebagai user baru.
+Admin dikenali dari metadata rekaman. Unduhan file (bukti bayar, CSV mutasi)
+mengembalikan isi kosong.
+"""
+import argparse
+import contextlib
+import io
+import itertools
+import json
+import logging
+import os
+import random
+import runpy
+import shutil
+import sqlite3
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from functools import wraps
+from typing import Any, Dict, List, Optional, Tuple
+
+import telebot
+from telebot import apihelper
+
+import traffic_capture
+
+BOT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'telegram_bot.py')
+BOT_RUN_NAME = 'replay_bot'
+FALLBACK_ADMIN_ID = 1 # Jika rekaman tidak punya metadata admin
+# (tabel, kolom ID user, kolom username yang mengikuti ID di baris yang sama)
+PSEUDONYM_COLUMNS: List[Tuple[str, Tuple[str, ...], Tuple[Tuple[str, str], ...]]] = [
+    ('customers', ('telegram_id',), (('username', 'telegram_id'), ('last_username', 'telegram_id'))),
+    ('customer_products', ('telegram_id',), ()),
+    ('admins', ('telegram_id',), ()),
+    ('sales', ('buyer_id', 'claimed_by'), (('buyer_username', 'buyer_id'),)),
+    ('accounts', ('sold_to_id',), (('sold_to_username', 'sold_to_id'),)),
+]
+
+
+class FakeResponse:
+    status_code = 200
+    reason = 'OK'
+
+    def __init__(self, payload: dict):
+        self._payload = payload
+        self.text = json.dumps(payload)
+
+    def json(self) -> dict:
+        return self._payload
+
+
+class FakeTelegramApi:
+    """Pengganti apihelper.CUSTOM_REQUEST_SENDER: jawaban sukses minimal, latensi tetap opsional, hitungan per method."""
+
+    def __init__(self, latency_ms: float = 0.0):
+        self.latency = latency_ms / 1000
+        self.calls: Dict[str, int] = defaultdict(int)
+        self._message_ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def __call__(self, method: str, url: str, params: Optional[dict] = None, files: Any = None,
+                 timeout: Any = None, proxies: Any = None) -> FakeResponse:
+        name = url.rsplit('/', 1)[-1]
+        params = params or {}
+        with self._lock:
+            self.calls[name] += 1
+            message_id = next(self._message_ids)
+        if self.latency:
+            time.sleep(self.latency)
+        chat = {'id': int(params.get('chat_id') or 1), 'type': 'private'}
+        if name == 'getMe':
+            result: Any = {'id': 1, 'is_bot': True, 'first_name': 'Replay', 'username': 'replaybot'}
+        elif name == 'getFile':
+            result = {'file_id': params.get('file_id', 'x'), 'file_unique_id': 'x', 'file_size': 0, 'file_path': 'replay/file'}
+        elif name == 'sendMediaGroup':
+            result = [{'message_id': message_id, 'date': int(time.time()), 'chat': chat}]
+        elif name.startswith(('send', 'edit', 'forward', 'copy')):
+            result = {'message_id': message_id, 'date': int(time.time()), 'chat': chat, 'text': str(params.get('text') or '')}
+        else:
+            result = True
+        return FakeResponse({'ok': True, 'result': result})
+
+
+class ErrorCounter(logging.Handler):
+    def __init__(self) -> None:
+        super().__init__(logging.ERROR)
+        self.count = 0
+
+    def emit(self, record: logging.LogRecord) -> None:
+        self.count += 1
+
+
+def load_capture(path: str, limit: Optional[int]) -> Tuple[Dict[str, Any], List[Tuple[float, List[Dict[str, Any]]]]]:
+    """Membaca rekaman lalu mengelompokkan update dengan waktu terima yang sama (satu hasil getUpdates) jadi batch."""
+    meta: Dict[str, Any] = {}
+    batches: List[Tuple[float, List[Dict[str, Any]]]] = []
+    records = traffic_capture.read_capture(traffic_capture.capture_files(path))
+    for file_meta, received_at, update in itertools.islice(records, limit):
+        meta = meta or file_meta
+        if batches and batches[-1][0] == received_at:
+            batches[-1][1].append(update)
+        else:
+            batches.append((received_at, [update]))
+    return meta, batches
+
+
+def copy_database(source: str, target: str) -> None:
+    """Salinan konsisten lewat backup API (aman walau bot produksi sedang menulis)."""
+    with contextlib.closing(sqlite3.connect(f"file:{source}?mode=ro", uri=True)) as src, \
+            contextlib.closing(sqlite3.connect(target)) as dst:
+        src.backup(dst)
+
+
+def pseudonymize_database(path: str, anonymizer: traffic_capture.Anonymizer) -> None:
+    """Mengganti ID user (dan username di baris yang sama) dengan pseudonim rekaman."""
+    with contextlib.closing(sqlite3.connect(path)) as conn:
+        conn.create_function('pseudo_id', 1, anonymizer.user_id, deterministic=True)
+        conn.create_function('pseudo_name', 1, anonymizer.username, deterministic=True)
+        tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        with conn:
+            for table, id_cols, name_cols in PSEUDONYM_COLUMNS:
+                if table not in tables:
+                    continue
+                existing = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+                assignments = [f"{col} = CASE WHEN {col} IS NULL THEN NULL ELSE pseudo_name({id_col}) END"
+                               for col, id_col in name_cols if col in existing]
+                assignments += [f"{col} = pseudo_id({col})" for col in id_cols if col in existing]
+                if assignments:
+                    conn.execute(f"UPDATE {table} SET {', '.join(assignments)}")
+
+
+def prepare_workdir(args: argparse.Namespace, meta: Dict[str, Any]) -> Tuple[str, str, str]:
+    workdir = tempfile.mkdtemp(prefix='replay_')
+    db_path, archive_path = os.path.join(workdir, 'replay.db'), os.path.join(workdir, 'replay_archive.db')
+    anonymizer = traffic_capture.Anonymizer(args.salt) if args.salt else None
+    if args.db:
+        copy_database(args.db, db_path)
+        if anonymizer: pseudonymize_database(db_path, anonymizer)
+        with contextlib.closing(sqlite3.connect(db_path)) as conn, conn:
+            conn.execute("DELETE FROM settings WHERE key IN ('last_update_id', 'broadcast_job')") # Update rekaman tidak dianggap duplikat
+            if not anonymizer and meta.get('roster'): # Roster rekaman (pseudonim) agar admin lain tetap dikenali
+                conn.executemany("""INSERT INTO admins (telegram_id, role, active) VALUES (?, ?, 1)
+                                    ON CONFLICT(telegram_id) DO UPDATE SET role = excluded.role, active = 1""",
+                                 [(int(member), role) for member, role in meta['roster'].items()])
+    archive_source = args.archive_db or (os.path.splitext(args.db)[0] + '_archive.db' if args.db else '')
+    if archive_source and os.path.exists(archive_source):
+        copy_database(archive_source, archive_path)
+        if anonymizer: pseudonymize_database(archive_path, anonymizer)
+    return workdir, db_path, archive_path
+
+
+def run_once(args: argparse.Namespace, meta: Dict[str, Any], batches: List[Tuple[float, List[Dict[str, Any]]]],
+             run_index: int) -> Dict[str, Any]:
+    workdir, db_path, archive_path = prepare_workdir(args, meta)
+    api = FakeTelegramApi(args.api_latency_ms)
+    apihelper.CUSTOM_REQUEST_SENDER = api
+    apihelper.download_file = lambda token, file_path: b''
+    os.environ.update({
+        'BOT_TOKEN': '1:replay', 'ADMIN_ID': str(meta.get('admin_id') or FALLBACK_ADMIN_ID),
+        'DB_PATH': db_path, 'ARCHIVE_DB_PATH': archive_path, 'TRAFFIC_CAPTURE_DIR': '', 'HEALTH_PORT': '0',
+    })
+    for key in ('BOT_USERNAME', 'OWNER_USERNAME', 'ADMIN_USERNAME'):
+        os.environ.setdefault(key, 'replay')
+    os.environ.setdefault('STORE_NAME', meta.get('store') or 'Replay Store')
+    if not args.keep_rate_limit: # Replay dipercepat akan terkena rate limit yang tidak terjadi di produksi
+        os.environ['RATE_LIMIT_BURST'] = '1000000'
+
+    errors = ErrorCounter()
+    bot_logger = logging.getLogger(BOT_RUN_NAME)
+    bot_logger.handlers = [errors]
+    bot_logger.setLevel(logging.INFO if args.verbose else logging.ERROR)
+    bot_logger.propagate = args.verbose # Tanpa --verbose log bot hanya dihitung
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            namespace = runpy.run_path(BOT_PATH, run_name=BOT_RUN_NAME)
+        if 'lifecycle' not in namespace:
+            raise RuntimeError("telegram_bot.py gagal dimuat; jalankan dengan --verbose untuk melihat log.")
+        if args.salt:
+            namespace['rebuild_search_indexes']() # Rowid customers berubah karena pseudonim
+        bot: telebot.TeleBot = namespace['bot']
+        if args.workers and bot.worker_pool:
+            bot.worker_pool.close()
+            bot.worker_pool = telebot.util.ThreadPool(bot, num_threads=args.workers)
+
+        durations: Dict[str, List[float]] = defaultdict(list)
+        durations_lock = threading.Lock()
+
+        def timed(func):
+            @wraps(func)
+            def timed_func(*func_args, **func_kwargs):
+                start = time.perf_counter()
+                try:
+                    return func(*func_args, **func_kwargs)
+                finally:
+                    with durations_lock:
+                        durations[func.__name__].append(time.perf_counter() - start)
+            return timed_func
+
+        # Handler terdaftar diukur per fungsi; next step handler dijalankan langsung lewat _exec_task
+        for handler_list in (bot.message_handlers, bot.callback_query_handlers, bot.inline_handlers):
+            for handler in handler_list:
+                handler['function'] = timed(handler['function'])
+        exec_task = bot._exec_task
+
+        def timed_exec_task(task, *task_args, **task_kwargs):
+            if getattr(task, '__name__', '') != '_run_middlewares_and_handler':
+                task = timed(task)
+            return exec_task(task, *task_args, **task_kwargs)
+        bot._exec_task = timed_exec_task
+
+        random.seed(args.seed)
+        dispatch_lags: List[float] = []
+        first_at = batches[0][0] if batches else 0.0
+        started = time.perf_counter()
+        for received_at, raw_updates in batches:
+            if args.speed > 0:
+                target = started + (received_at - first_at) / args.speed
+                delay = target - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                dispatch_lags.append(max(0.0, -delay))
+            bot.process_new_updates([telebot.types.Update.de_json(json.loads(json.dumps(raw))) for raw in raw_updates])
+        namespace['lifecycle'].shutdown() # Menunggu handler yang masih berjalan, flush buffer
+        elapsed = time.perf_counter() - started
+        if bot.worker_pool:
+            bot.worker_pool.close()
+    finally:
+        os.chdir(cwd)
+        if not args.keep_workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    handlers = {name: summarize(values) for name, values in durations.items()}
+    return {
+        'run': run_index, 'elapsed': elapsed, 'updates': sum(len(batch) for _, batch in batches),
+        'errors': errors.count, 'api_calls': dict(api.calls), 'handlers': handlers,
+        'dispatch_lag_p95_ms': percentile(dispatch_lags, 0.95) * 1000,
+        'workdir': workdir if args.keep_workdir else None,
+    }
+
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct))]
+
+
+def summarize(values: List[float]) -> Dict[str, float]:
+    return {
+        'count': len(values), 'total_ms': sum(values) * 1000, 'mean_ms': statistics.fmean(values) * 1000,
+        'p50_ms': statistics.median(values) * 1000, 'p95_ms': percentile(values, 0.95) * 1000, 'max_ms': max(values) * 1000,
+    }
+
+
+def format_delta(current: float, reference: float) -> str:
+    if reference <= 0:
+        return '-'
+    return f"{(current - reference) / reference:+.0%}"
+
+
+def print_report(runs: List[Dict[str, Any]], baseline: Optional[Dict[str, Any]]) -> None:
+    reference = baseline or (runs[0] if len(runs) > 1 else None)
+    for run in runs:
+        label = f"Run {run['run']}"
+        print(f"\n{label}: {run['updates']} update dalam {run['elapsed']:.2f} detik, error log {run['errors']}, "
+              f"panggilan API {sum(run['api_calls'].values())}, lag dispatch p95 {run['dispatch_lag_p95_ms']:.1f} ms")
+        header = f"{'handler':<36} {'jumlah':>6} {'p50_ms':>8} {'p95_ms':>8} {'max_ms':>8} {'total_ms':>9}"
+        if reference is not None and run is not reference:
+            header += f" {'Δp50':>6} {'Δp95':>6} {'Δtotal':>7}"
+        print(header)
+        print('-' * len(header))
+        for name, stats in sorted(run['handlers'].items(), key=lambda item: item[1]['total_ms'], reverse=True):
+            line = (f"{name[:36]:<36} {stats['count']:>6} {stats['p50_ms']:>8.1f} {stats['p95_ms']:>8.1f} "
+                    f"{stats['max_ms']:>8.1f} {stats['total_ms']:>9.1f}")
+            if reference is not None and run is not reference:
+                ref = reference['handlers'].get(name)
+                if ref:
+                    line += (f" {format_delta(stats['p50_ms'], ref['p50_ms']):>6} {format_delta(stats['p95_ms'], ref['p95_ms']):>6}"
+                             f" {format_delta(stats['total_ms'], ref['total_ms']):>7}")
+                else:
+                    line += f" {'baru':>6}"
+            print(line)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Replay rekaman update ke handler bot dengan API Telegram palsu.")
+    parser.add_argument('capture', help="File .jsonl.gz atau direktori TRAFFIC_CAPTURE_DIR")
+    parser.add_argument('--db', help="Database sumber yang disalin untuk tiap run (kosong = database baru)")
+    parser.add_argument('--archive-db', help="Database arsip sumber (default: <db>_archive.db jika ada)")
+    parser.add_argument('--speed', type=float, default=1.0, help="Kelipatan kecepatan; 1 = asli, 0 = tanpa jeda")
+    parser.add_argument('--runs', type=int, default=1, help="Jumlah run untuk dibandingkan")
+    parser.add_argument('--limit', type=int, default=None, help="Hanya N update pertama")
+    parser.add_argument('--salt', default='', help="TRAFFIC_CAPTURE_SALT saat merekam, untuk memseudonimkan salinan DB")
+    parser.add_argument('--workers', type=int, default=0, help="Jumlah worker handler (0 = default bot)")
+    parser.add_argument('--api-latency-ms', type=float, default=0.0, help="Latensi tiap panggilan API palsu")
+    parser.add_argument('--keep-rate-limit', action='store_true', help="Jangan nonaktifkan rate limit per user")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help="Simpan hasil ke file JSON (untuk --baseline berikutnya)")
+    parser.add_argument('--baseline', help="File JSON hasil sebelumnya sebagai pembanding")
+    parser.add_argument('--keep-workdir', action='store_true', help="Jangan hapus salinan database setelah run")
+    parser.add_argument('--verbose', action='store_true', help="Tampilkan log bot")
+    args = parser.parse_args(argv)
+    if args.verbose:
+        logging.basicConfig(level=logging.INFO)
+
+    meta, batches = load_capture(args.capture, args.limit)
+    if not batches:
+        print(f"Tidak ada update di rekaman {args.capture}.")
+        return 1
+    if args.db and not os.path.exists(args.db):
+        print(f"Database {args.db} tidak ditemukan.")
+        return 1
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)['runs'][-1]
+        baseline['run'] = 'baseline'
+
+    span = batches[-1][0] - batches[0][0]
+    print(f"{sum(len(batch) for _, batch in batches)} update dalam {len(batches)} batch, rentang asli {span:.1f} detik, "
+          f"kecepatan {'tanpa jeda' if args.speed <= 0 else f'{args.speed:g}x'}.", file=sys.stderr)
+    runs = []
+    for run_index in range(1, args.runs + 1):
+        runs.append(run_once(args, meta, batches, run_index))
+        print(f"Run {run_index} selesai dalam {runs[-1]['elapsed']:.2f} detik.", file=sys.stderr)
+    print_report(runs, baseline)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({'capture': args.capture, 'speed': args.speed, 'runs': runs}, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
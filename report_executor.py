@@ -0,0 +1,182 @@
+"""Executor laporan admin di luar thread update.
+
+Laporan berat (statistik, daftar akun, detail stok, laporan penjualan) dijalankan
+di pool thread kecil. Tiap job membuka koneksi SQLite read-only sendiri
+(`mode=ro` + `PRAGMA query_only`) dan membaca semua query-nya dalam satu transaksi,
+sehingga pada database WAL laporan melihat satu snapshot konsisten tanpa menahan
+penulis (submit bukti bayar, approve). Tiap job punya batas waktu; job yang
+melewatinya atau dibatalkan admin dihentikan lewat progress handler SQLite
+(query yang sedang berjalan) dan `ReportJob.check()` (loop format di Python).
+
+    executor = ReportExecutor(lambda: connect_readonly('store.db'), workers=2)
+    executor.submit((chat_id, 'stats'), 'stats', 30, build, on_done)
+"""
+import itertools
+import logging
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, Optional, Tuple
+
+PROGRESS_HANDLER_STEPS = 1000 # Instruksi VM SQLite di antara pengecekan batal/batas waktu
+READONLY_BUSY_TIMEOUT_SEC = 5.0
+
+logger = logging.getLogger(__name__)
+
+
+class ReportCancelled(Exception):
+    """Job dibatalkan admin atau saat shutdown."""
+
+
+class ReportTimeout(ReportCancelled):
+    """Job melewati batas waktunya."""
+
+
+class ReportJob:
+    def __init__(self, job_id: int, key: Tuple[Any, ...], name: str, timeout: float):
+        self.id = job_id
+        self.key = key
+        self.name = name
+        self.timeout = timeout
+        self.submitted_at = time.monotonic()
+        self.deadline = self.submitted_at + timeout
+        self._cancelled = threading.Event()
+
+    def cancel(self) -> None:
+        self._cancelled.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    def should_abort(self) -> bool:
+        """Progress handler SQLite: nilai benar menghentikan query dengan OperationalError 'interrupted'."""
+        return self._cancelled.is_set() or time.monotonic() > self.deadline
+
+    def check(self) -> None:
+        """Dipanggil builder di sela loop Python; melempar ReportCancelled/ReportTimeout bila harus berhenti."""
+        if self._cancelled.is_set():
+            raise ReportCancelled(self.name)
+        if time.monotonic() > self.deadline:
+            raise ReportTimeout(self.name)
+
+
+def connect_readonly(db_path: str, archive_path: Optional[str] = None,
+                     archive_tables: Iterable[str] = ()) -> sqlite3.Connection:
+    """Koneksi read-only dengan transaksi baca terbuka (snapshot diambil saat query pertama).
+
+    Jika `archive_path` ada, database arsip di-attach read-only dan view TEMP `<tabel>_all`
+    dibuat dari kolom yang ada di kedua tabel; tanpa arsip view hanya berisi tabel utama.
+    """
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True, timeout=READONLY_BUSY_TIMEOUT_SEC)
+    try:
+        has_archive = bool(archive_path) and os.path.exists(archive_path)
+        if has_archive:
+            conn.execute("ATTACH DATABASE ? AS archive", (f"file:{archive_path}?mode=ro",))
+        for table in archive_tables:
+            main_cols = [row[1] for row in conn.execute(f"PRAGMA main.table_info({table})")]
+            archive_cols = {row[1] for row in conn.execute(f"PRAGMA archive.table_info({table})")} if has_archive else set()
+            if archive_cols:
+                cols = ', '.join(col for col in main_cols if col in archive_cols)
+                select_sql = f"SELECT {cols} FROM main.{table} UNION ALL SELECT {cols} FROM archive.{table}"
+            else:
+                select_sql = f"SELECT * FROM main.{table}"
+            conn.execute(f"CREATE TEMP VIEW {table}_all AS {select_sql}")
+        conn.execute('PRAGMA query_only = ON')
+        conn.execute('BEGIN')
+    except sqlite3.Error:
+        conn.close()
+        raise
+    return conn
+
+
+# on_done(job, status, payload): status 'done' (payload = hasil builder), 'timeout', 'cancelled', atau 'error' (payload = exception)
+DoneCallback = Callable[[ReportJob, str, Any], None]
+Builder = Callable[[sqlite3.Connection, ReportJob], Any]
+
+
+class ReportExecutor:
+    """Pool thread laporan. Satu job aktif per key (mis. (chat_id, nama laporan))."""
+
+    def __init__(self, connect: Callable[[], sqlite3.Connection], workers: int = 2,
+                 wrap_task: Callable[[Callable[..., Any]], Callable[..., Any]] = lambda task: task):
+        self.connect = connect
+        self.wrap_task = wrap_task # Mis. lifecycle.track agar shutdown menunggu laporan yang berjalan
+        self._pool = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix='report')
+        self._active: Dict[Tuple[Any, ...], ReportJob] = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self.counts: Dict[str, int] = {'done': 0, 'timeout': 0, 'cancelled': 0, 'error': 0}
+
+    def is_running(self, key: Tuple[Any, ...]) -> bool:
+        with self._lock:
+            return key in self._active
+
+    def running_count(self) -> int:
+        with self._lock:
+            return len(self._active)
+
+    def submit(self, key: Tuple[Any, ...], name: str, timeout: float, build: Builder,
+               on_done: DoneCallback) -> Optional[ReportJob]:
+        """Mengantrekan job; None jika job dengan key yang sama masih berjalan."""
+        with self._lock:
+            if key in self._active:
+                return None
+            job = ReportJob(next(self._ids), key, name, timeout)
+            self._active[key] = job
+        try:
+            self._pool.submit(self.wrap_task(self._run), job, build, on_done)
+        except RuntimeError: # Pool sudah ditutup (shutdown)
+            with self._lock:
+                self._active.pop(key, None)
+            raise
+        return job
+
+    def cancel(self, key: Tuple[Any, ...]) -> bool:
+        with self._lock:
+            job = self._active.get(key)
+        if job:
+            job.cancel()
+        return job is not None
+
+    def cancel_all(self) -> int:
+        with self._lock:
+            jobs = list(self._active.values())
+        for job in jobs:
+            job.cancel()
+        return len(jobs)
+
+    def shutdown(self, wait: bool = True) -> None:
+        self.cancel_all()
+        self._pool.shutdown(wait=wait)
+
+    def _run(self, job: ReportJob, build: Builder, on_done: DoneCallback) -> None:
+        status, payload = 'done', None
+        try:
+            job.check() # Bisa sudah dibatalkan/kedaluwarsa selagi antre
+            conn = self.connect()
+            try:
+                conn.set_progress_handler(job.should_abort, PROGRESS_HANDLER_STEPS)
+                payload = build(conn, job)
+            finally:
+                conn.close()
+            job.check()
+        except ReportCancelled:
+            status = 'cancelled' if job.cancelled else 'timeout'
+        except sqlite3.OperationalError as e:
+            if job.should_abort(): # Query dihentikan progress handler
+                status = 'cancelled' if job.cancelled else 'timeout'
+            else:
+                status, payload = 'error', e
+        except Exception as e:
+            status, payload = 'error', e
+        finally:
+            with self._lock:
+                self._active.pop(job.key, None)
+                self.counts[status] += 1
+        try:
+            on_done(job, status, payload)
+        except Exception as e:
+            logger.error(f"Callback laporan '{job.name}' gagal: {e}", exc_info=True)
@@ -0,0 +1,186 @@
+"""Impor stok akun dari direktori spool.
+
+File teks (`.txt`/`.csv`) yang diletakkan di STOCK_SPOOL_DIR dibaca berkala. Format
+per baris sama dengan input admin di bot:
+
+    # produk: 2
+    email@contoh.com|password
+    email2@contoh.com|password|catatan
+
+Baris kosong dan baris diawali `#` diabaikan; direktif `# produk: <id>` memilih
+produk tujuan (tanpa direktif: produk utama). File dibaca utuh dulu; jika ada baris
+yang tidak valid, tidak ada akun yang diimpor dan file dipindah ke `failed/`
+beserta `<nama>.errors.txt`. File valid diimpor per batch (satu transaksi per
+batch) lalu dipindah ke `processed/`. Email yang sudah ada dilewati, sehingga file
+yang sempat diimpor sebagian (proses mati di tengah) aman diproses ulang.
+
+File hanya diambil setelah tidak berubah selama `settle_sec`, agar file yang
+masih disalin tidak terbaca setengah. Cara paling aman: tulis ke nama lain lalu
+rename ke direktori spool.
+"""
+import logging
+import os
+import re
+import threading
+import time
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Callable, List, Optional, Tuple
+
+AccountRow = Tuple[str, str, str] # (email, password, notes)
+SPOOL_SUFFIXES = ('.txt', '.csv')
+PROCESSED_DIR = 'processed'
+FAILED_DIR = 'failed'
+PRODUCT_DIRECTIVE = re.compile(r'#\s*(?:produk|product)\s*:\s*(\d+)\s*$', re.IGNORECASE)
+
+logger = logging.getLogger(__name__)
+
+
+def is_valid_account(email: str, password: str) -> bool:
+    """Validasi sederhana yang sama untuk input admin dan file spool."""
+    return '@' in email and '.' in email.split('@')[-1] and bool(password)
+
+
+@dataclass
+class ParsedStockFile:
+    product_id: int
+    rows: List[AccountRow] = field(default_factory=list)
+    errors: List[str] = field(default_factory=list)
+
+
+def parse_stock_lines(lines: List[str], default_product_id: int) -> ParsedStockFile:
+    parsed = ParsedStockFile(default_product_id)
+    for line_no, raw in enumerate(lines, start=1):
+        line = raw.strip()
+        if not line:
+            continue
+        if line.startswith('#'):
+            directive = PRODUCT_DIRECTIVE.match(line)
+            if directive:
+                if parsed.rows:
+                    parsed.errors.append(f"baris {line_no}: direktif produk harus sebelum baris akun")
+                parsed.product_id = int(directive.group(1))
+            continue
+        parts = line.split('|')
+        if not (2 <= len(parts) <= 3):
+            parsed.errors.append(f"baris {line_no}: format harus email|password atau email|password|catatan")
+            continue
+        email, password = parts[0].strip(), parts[1].strip()
+        if not is_valid_account(email, password):
+            parsed.errors.append(f"baris {line_no}: email atau password tidak valid")
+            continue
+        parsed.rows.append((email, password, parts[2].strip() if len(parts) == 3 else ''))
+    return parsed
+
+
+@dataclass
+class IngestResult:
+    file_name: str
+    status: str # 'processed' atau 'failed'
+    product_id: int
+    imported: int = 0
+    duplicates: List[str] = field(default_factory=list)
+    errors: List[str] = field(default_factory=list)
+
+
+# import_rows(product_id, rows) -> (ID akun baru, email yang sudah ada); ValueError = tolak file (mis. produk tidak ada)
+ImportRows = Callable[[int, List[AccountRow]], Tuple[List[int], List[str]]]
+
+
+class SpoolIngestor:
+    """Thread pemindai direktori spool; hasil tiap file dilaporkan lewat `on_result`."""
+
+    def __init__(self, directory: str, import_rows: ImportRows, on_result: Callable[[IngestResult], None],
+                 default_product_id: int = 1, batch_size: int = 500, poll_sec: float = 5.0, settle_sec: float = 2.0):
+        self.directory = directory
+        self.import_rows = import_rows
+        self.on_result = on_result
+        self.default_product_id = default_product_id
+        self.batch_size = max(1, batch_size)
+        self.poll_sec = poll_sec
+        self.settle_sec = settle_sec
+        self.counts = {'processed': 0, 'failed': 0, 'accounts': 0}
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        for sub_dir in (PROCESSED_DIR, FAILED_DIR):
+            os.makedirs(os.path.join(directory, sub_dir), exist_ok=True)
+
+    def pending_files(self) -> List[str]:
+        """File spool yang siap diambil (tidak berubah selama settle_sec), urut nama."""
+        now = time.time()
+        ready = []
+        for name in sorted(os.listdir(self.directory)):
+            path = os.path.join(self.directory, name)
+            if not name.lower().endswith(SPOOL_SUFFIXES) or not os.path.isfile(path):
+                continue
+            if now - os.path.getmtime(path) >= self.settle_sec:
+                ready.append(path)
+        return ready
+
+    def scan_once(self) -> List[IngestResult]:
+        results = []
+        for path in self.pending_files():
+            if self._stopped.is_set():
+                break
+            result = self.ingest_file(path)
+            results.append(result)
+            try:
+                self.on_result(result)
+            except Exception as e:
+                logger.error(f"Callback hasil impor spool '{result.file_name}' gagal: {e}", exc_info=True)
+        return results
+
+    def ingest_file(self, path: str) -> IngestResult:
+        name = os.path.basename(path)
+        try:
+            with open(path, encoding='utf-8-sig', errors='replace') as f:
+                parsed = parse_stock_lines(f.readlines(), self.default_product_id)
+        except OSError as e:
+            parsed = ParsedStockFile(self.default_product_id, errors=[f"file tidak bisa dibaca: {e}"])
+        result = IngestResult(name, 'failed', parsed.product_id, errors=list(parsed.errors))
+        if not parsed.errors:
+            if not parsed.rows:
+                result.errors.append("tidak ada baris akun")
+            try:
+                for start in range(0, len(parsed.rows), self.batch_size):
+                    new_ids, duplicates = self.import_rows(parsed.product_id, parsed.rows[start:start + self.batch_size])
+                    result.imported += len(new_ids)
+                    result.duplicates.extend(duplicates)
+            except Exception as e: # ValueError (ditolak) atau error database; batch yang sudah masuk tetap tersimpan
+                if not isinstance(e, ValueError):
+                    logger.error(f"Impor spool '{name}' gagal: {e}", exc_info=True)
+                result.errors.append(str(e))
+            if not result.errors:
+                result.status = 'processed'
+        self.counts[result.status] += 1
+        self.counts['accounts'] += result.imported
+        self._move(path, result)
+        return result
+
+    def _move(self, path: str, result: IngestResult) -> None:
+        target_dir = os.path.join(self.directory, PROCESSED_DIR if result.status == 'processed' else FAILED_DIR)
+        target = os.path.join(target_dir, f"{datetime.now():%Y%m%d-%H%M%S}_{result.file_name}") # Nama file sama bisa dikirim ulang
+        try:
+            os.replace(path, target)
+            if result.errors:
+                with open(f"{target}.errors.txt", 'w', encoding='utf-8') as f:
+                    f.write('\n'.join(result.errors) + '\n')
+        except OSError as e: # File tertinggal di spool akan diproses lagi; email duplikat dilewati
+            logger.error(f"Gagal memindahkan file spool '{result.file_name}': {e}")
+
+    def _run(self) -> None:
+        while not self._stopped.is_set():
+            try:
+                self.scan_once()
+            except OSError as e:
+                logger.error(f"Gagal membaca direktori spool {self.directory}: {e}")
+            self._stopped.wait(self.poll_sec)
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, name='stock-spool', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Menghentikan pemindai; file yang sedang diimpor diselesaikan dulu."""
+        self._stopped.set()
+        if self._thread: self._thread.join(timeout=10)
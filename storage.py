@@ -0,0 +1,1291 @@
+"""Repository penyimpanan toko: pengaturan, katalog & akun, penjualan & antrean verifikasi, roster admin, customer, metode pembayaran.
+
+Handler bot hanya memakai interface `StoreRepository`. Ada dua implementasi:
+
+    SqliteRepository   SQL yang sama dengan sebelumnya, terhadap file database bot
+    MemoryRepository   dict dan list terurut (bisect) di memori, tanpa I/O disk
+
+Repository tidak mengirim pesan. Operasi yang bisa ditolak aturan bisnis (stok
+habis, sale diklaim admin lain, bukti ganda) mengembalikan status yang
+diterjemahkan handler menjadi balasan; error database tetap dilempar sebagai
+sqlite3.Error. Skema SQLite dibuat dan dimigrasi oleh init_db di telegram_bot.py.
+
+Di luar repository, telegram_bot.py hanya membuka database untuk init_db,
+pemeliharaan (pengarsipan, hitung ulang statistik customer, index pencarian),
+laporan admin (worker report_executor dengan koneksi read-only sendiri),
+pencarian admin, dan checkpoint WAL saat shutdown. MemoryRepository
+hanya untuk benchmark (`python stress_test.py --backends sqlite,memory`
+memasangnya sebagai `repo` bot); bot sendiri selalu memakai SQLite karena
+bagian tadi masih membaca file database. Data MemoryRepository hilang saat
+proses berhenti dan tidak punya arsip.
+"""
+import bisect
+import itertools
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Set, Tuple
+
+import reconcile
+
+AccountDetail = Tuple[int, str, str, Optional[str]] # (id, email, password, notes)
+PaymentMethodInfo = Tuple[str, str, str] # (method, number, holder_name)
+Stamp = Tuple[str, int] # (tanggal TEXT waktu lokal, epoch detik), sama dengan now_stamp() di bot
+
+
+class ProductInfo(NamedTuple):
+    id: int
+    name: str
+    description: Optional[str]
+    price: int
+    active: bool
+    stock: int
+
+
+class SaleRecord(NamedTuple):
+    id: int
+    buyer_id: int
+    buyer_username: Optional[str]
+    status: str
+    amount: str
+    quantity: int
+    product_id: int
+    account_id: Optional[int]
+    claimed_by: Optional[int]
+    claimed_until: Optional[int]
+
+
+class NewSale(NamedTuple):
+    buyer_id: int
+    buyer_username: str
+    product_id: int
+    quantity: int
+    unique_code: Optional[int]
+    payment_proof: str
+    payment_proof_unique_id: Optional[str]
+    created: Stamp
+
+
+class SubmitResult(NamedTuple):
+    status: str # 'created', 'duplicate', 'inactive', 'out_of_stock'
+    sale_id: Optional[int] = None
+    sale_status: Optional[str] = None # Status sale lama untuk 'duplicate'
+    product_name: str = ''
+    amount: str = ''
+    notify_admin_id: Optional[int] = None
+
+
+class ApproveResult(NamedTuple):
+    status: str # 'approved', 'not_found', 'not_pending', 'claimed', 'out_of_stock', 'account_missing', 'account_sold', 'conflict'
+    sale: Optional[SaleRecord] = None
+    accounts: List[AccountDetail] = []
+    available: int = 0 # Akun tersedia saat 'out_of_stock'
+
+
+class RejectResult(NamedTuple):
+    status: str # 'cancelled', 'not_found', 'not_pending', 'claimed', 'conflict'
+    sale: Optional[SaleRecord] = None
+
+
+class ClaimResult(NamedTuple):
+    status: str # 'claimed' (berhasil), 'not_found', 'not_pending', 'taken' (diklaim admin lain)
+    sale: Optional[SaleRecord] = None
+
+
+class QueuedSale(NamedTuple):
+    """Sale pending seperti yang ditampilkan ke staf (antrean, daftar pending, klaim berikutnya)."""
+    id: int
+    buyer_id: int
+    buyer_username: Optional[str]
+    quantity: int
+    amount: str
+    payment_proof: Optional[str]
+    created_ts: Optional[int]
+    claimed_by: Optional[int]
+    claimed_until: Optional[int]
+    product_id: int
+
+
+class PendingSummary(NamedTuple):
+    count: int
+    total_amount: float
+    newest: List[QueuedSale] # Terbaru dulu
+    claims: Dict[int, int] # admin_id -> jumlah klaim yang lease-nya masih berlaku
+
+
+class ReconcileApproval(NamedTuple):
+    sale_id: int
+    buyer_id: int
+    accounts: List[AccountDetail]
+    product_id: int
+
+
+class HistoryEntry(NamedTuple):
+    id: int
+    amount: str
+    quantity: int
+    status: str
+    created_ts: Optional[int]
+    product_id: int
+
+
+class PaymentMethodRecord(NamedTuple):
+    id: int
+    method: str
+    number: str
+    holder_name: str
+    active: bool
+
+
+class AdminInfo(NamedTuple):
+    telegram_id: int
+    role: str
+    assigned_count: int
+    active_claims: int
+
+
+class CustomerActivity(NamedTuple):
+    telegram_id: int
+    username: Optional[str]
+    seen: Stamp
+    register: bool # True = /start (buat customer bila belum ada), False = aktivitas biasa
+
+
+def claimed_by_other(sale: SaleRecord, admin_id: int, now_ts: int, owner_id: Optional[int] = None) -> bool:
+    """Sale sedang diklaim admin lain yang lease-nya belum habis; pemilik toko (owner_id) tidak pernah terhalang."""
+    if admin_id == owner_id:
+        return False
+    return sale.claimed_by is not None and sale.claimed_by != admin_id and (sale.claimed_until or 0) >= now_ts
+
+
+def segment_where(segment: Dict[str, Any]) -> Tuple[str, List[Any]]:
+    """Kondisi WHERE atas customers untuk segmen broadcast; kondisinya sama persis dengan index parsial segmen di init_db."""
+    key = segment.get('key', 'semua')
+    if key == 'pembeli':
+        return "is_blocked = 0 AND purchase_count > 0", []
+    if key == 'bukan_pembeli':
+        return "is_blocked = 0 AND purchase_count = 0", []
+    if key == 'belum_selesai':
+        return "is_blocked = 0 AND purchase_count = 0 AND order_count > 0", []
+    if 'since_ts' in segment:
+        return "is_blocked = 0 AND last_seen_ts >= ?", [segment['since_ts']]
+    if 'product_id' in segment:
+        return "is_blocked = 0 AND telegram_id IN (SELECT telegram_id FROM customer_products WHERE product_id = ?)", [segment['product_id']]
+    return "is_blocked = 0", []
+
+
+def reconcile_note(line: reconcile.StatementLine) -> str:
+    return f"Auto-rekonsiliasi: mutasi baris {line.line_no} ({line.date:%Y-%m-%d %H:%M}) {line.description}".strip()
+
+
+class StoreRepository(ABC):
+    """Interface penyimpanan yang dipakai handler; semua method aman dipanggil dari banyak thread."""
+
+    # --- Pengaturan ---
+    @abstractmethod
+    def get_setting(self, key: str) -> Optional[str]: ...
+
+    @abstractmethod
+    def set_setting(self, key: str, value: str) -> None: ...
+
+    # --- Katalog & akun ---
+    @abstractmethod
+    def load_catalog(self) -> List[ProductInfo]:
+        """Semua produk (aktif & nonaktif) urut sort_order, beserta jumlah akun belum terjual."""
+
+    @abstractmethod
+    def add_product(self, name: str, price: int, description: Optional[str], created: Stamp) -> Optional[int]:
+        """ID produk baru, None jika nama sudah dipakai."""
+
+    @abstractmethod
+    def set_product_price(self, product_id: int, price: int) -> bool: ...
+
+    @abstractmethod
+    def toggle_product(self, product_id: int) -> bool: ...
+
+    @abstractmethod
+    def add_account(self, product_id: int, email: str, password: str, notes: str, added: Stamp) -> Optional[int]:
+        """ID akun baru, None jika email sudah ada."""
+
+    @abstractmethod
+    def add_accounts(self, product_id: int, rows: List[Tuple[str, str, str]], added: Stamp) -> Tuple[List[int], List[str]]:
+        """Impor (email, password, notes) dalam satu transaksi: (ID akun baru, email yang sudah ada dan dilewati)."""
+
+    @abstractmethod
+    def get_account(self, account_id: int) -> Optional[Tuple[str, bool]]:
+        """(email, sudah terjual) atau None."""
+
+    @abstractmethod
+    def delete_account(self, account_id: int) -> Optional[str]:
+        """Email akun yang dihapus, None jika tidak ada. Sale yang memakainya kehilangan referensi akun (ON DELETE SET NULL)."""
+
+    # --- Metode pembayaran ---
+    @abstractmethod
+    def active_payment_methods(self) -> List[PaymentMethodInfo]: ...
+
+    @abstractmethod
+    def list_payment_methods(self) -> List[PaymentMethodRecord]:
+        """Semua metode (aktif & nonaktif) urut nama."""
+
+    @abstractmethod
+    def save_payment_method(self, method: str, number: str, holder_name: str) -> None:
+        """Menambah metode, atau mengganti metode dengan nama sama, dalam keadaan aktif."""
+
+    @abstractmethod
+    def toggle_payment_method(self, method_id: int) -> bool: ...
+
+    @abstractmethod
+    def delete_payment_method(self, method_id: int) -> bool: ...
+
+    # --- Penjualan ---
+    @abstractmethod
+    def pending_expected_amounts(self, low: int, high: int) -> Set[int]:
+        """Nominal expected_amount sale pending dalam rentang [low, high] (dicocokkan rekonsiliasi mutasi)."""
+
+    @abstractmethod
+    def find_sale_by_proof(self, buyer_id: int, proof_unique_id: Optional[str]) -> Optional[Tuple[int, str]]:
+        """(id, status) sale buyer ini yang memakai bukti pembayaran yang sama."""
+
+    @abstractmethod
+    def submit_sale(self, sale: NewSale) -> SubmitResult:
+        """Mencatat sale pending setelah cek bukti ganda, produk aktif, dan stok, lalu memilih admin tujuan notifikasi.
+
+        Sale baru belum diklaim siapa pun; klaim dibuat saat admin mengambilnya (claim_sale / klaim berikutnya).
+        """
+
+    @abstractmethod
+    def claim_sale(self, sale_id: int, admin_id: int, now_ts: int, lease_sec: int) -> ClaimResult:
+        """Mengklaim (atau memperpanjang klaim) satu sale pending untuk admin_id selama lease_sec."""
+
+    @abstractmethod
+    def approve_sale(self, sale_id: int, admin_id: int, now: Stamp) -> ApproveResult:
+        """Mengalokasikan akun terlama produk sale, menandainya terjual, dan menyelesaikan sale secara atomik."""
+
+    @abstractmethod
+    def reject_sale(self, sale_id: int, admin_id: int, reason: str, now: Stamp) -> RejectResult: ...
+
+    @abstractmethod
+    def claim_next_sale(self, admin_id: int, after_id: int, now_ts: int, lease_sec: int) -> Optional[QueuedSale]:
+        """Mengklaim sale pending berikutnya secara atomik: id > after_id dulu, lalu dari awal.
+
+        Klaim atas after_id (sale yang dilewati) dilepas dan sale itu tidak diklaim ulang saat kembali dari awal. Sale yang diklaim
+        admin lain dan lease-nya masih berlaku tidak ikut terpilih, sehingga dua admin tidak pernah memegang sale yang sama.
+        """
+
+    @abstractmethod
+    def pending_sales(self) -> List[QueuedSale]:
+        """Semua sale pending, terlama dulu."""
+
+    @abstractmethod
+    def pending_summary(self, preview_size: int, now_ts: int) -> PendingSummary: ...
+
+    @abstractmethod
+    def reconcile_statement(self, lines: List[reconcile.StatementLine], window: timedelta, payment_method: Optional[str],
+                            now: Stamp) -> Tuple[reconcile.ReconcileResult, List[ReconcileApproval], List[int]]:
+        """Mencocokkan mutasi dengan sale pending dan menyetujui semua yang cocok dalam satu transaksi.
+
+        Mengembalikan (hasil pencocokan, sale yang disetujui, sale cocok tapi stok kurang yang tetap pending).
+        """
+
+    @abstractmethod
+    def purchase_history(self, buyer_id: int, before_sale_id: Optional[int], limit: int) -> List[HistoryEntry]:
+        """Sale buyer (termasuk arsip), terbaru dulu; keyset (created_ts, id) sebelum before_sale_id."""
+
+    @abstractmethod
+    def buyer_sale(self, buyer_id: int, sale_id: int) -> Optional[HistoryEntry]:
+        """Sale milik buyer ini (termasuk arsip), None jika bukan miliknya."""
+
+    @abstractmethod
+    def sale_accounts(self, sale_ids: List[int]) -> Dict[int, List[AccountDetail]]:
+        """Akun yang terkirim per sale (sale_items, fallback ke sales.account_id untuk data lama)."""
+
+    # --- Roster admin ---
+    @abstractmethod
+    def load_roster(self) -> Dict[int, str]:
+        """telegram_id -> peran ('admin' / 'verifier') untuk anggota aktif."""
+
+    @abstractmethod
+    def list_admins(self, now_ts: int) -> List[AdminInfo]: ...
+
+    @abstractmethod
+    def add_admin(self, telegram_id: int, role: str, added: Stamp) -> None:
+        """Menambah atau mengaktifkan ulang anggota; jatah round-robin dimulai dari beban terkecil."""
+
+    @abstractmethod
+    def remove_admin(self, telegram_id: int) -> Optional[int]:
+        """Menonaktifkan anggota dan melepas klaimnya: jumlah klaim yang dilepas, None jika tidak ada di roster aktif."""
+
+    # --- Customer ---
+    @abstractmethod
+    def record_customers(self, entries: List[CustomerActivity]) -> None:
+        """Registrasi dan aktivitas terakhir customer dalam satu transaksi."""
+
+    @abstractmethod
+    def count_customers(self, segment: Dict[str, Any]) -> int:
+        """Jumlah penerima segmen broadcast (lihat segment_where)."""
+
+    @abstractmethod
+    def customer_ids(self, segment: Dict[str, Any], after_id: int, limit: int) -> List[int]:
+        """Satu halaman telegram_id penerima segmen, urut naik setelah after_id (keyset)."""
+
+    @abstractmethod
+    def block_customers(self, telegram_ids: List[int]) -> None: ...
+
+
+# --- SQLite ---
+def allocate_accounts(c: sqlite3.Cursor, quantity: int, product_id: int) -> List[AccountDetail]:
+    """Mengambil akun tersedia terlama dari satu produk sebanyak quantity (panggil di dalam transaksi)."""
+    c.execute("""SELECT id, email, password, notes FROM accounts WHERE product_id = ? AND sold = 0
+                 ORDER BY added_ts ASC, id ASC LIMIT ?""", (product_id, quantity))
+    return c.fetchall()
+
+
+def mark_accounts_sold(c: sqlite3.Cursor, sale_id: int, accounts: List[AccountDetail],
+                       buyer_id: int, buyer_username: Optional[str], now_str: str, now_ts: int) -> bool:
+    """Menandai akun terjual dan mencatat item pesanan. False jika ada akun yang sudah terjual proses lain."""
+    account_ids = [acc[0] for acc in accounts]
+    placeholders = ','.join('?' * len(account_ids))
+    c.execute(f'''UPDATE accounts
+                  SET sold = 1, sold_to_username = ?, sold_to_id = ?, sold_date = ?, sold_ts = ?
+                  WHERE id IN ({placeholders}) AND sold = 0''', # Kunci: AND sold = 0
+              (buyer_username, buyer_id, now_str, now_ts, *account_ids))
+    if c.rowcount != len(account_ids):
+        return False
+    c.executemany("INSERT INTO sale_items (sale_id, account_id) VALUES (?, ?)", [(sale_id, acc_id) for acc_id in account_ids])
+    return True
+
+
+class SqliteRepository(StoreRepository):
+    SALE_COLUMNS = "id, buyer_id, buyer_username, status, amount, COALESCE(quantity, 1), product_id, account_id, claimed_by, claimed_until"
+    QUEUED_COLUMNS = "id, buyer_id, buyer_username, COALESCE(quantity, 1), amount, payment_proof, created_ts, claimed_by, claimed_until, product_id"
+    HISTORY_COLUMNS = "id, amount, COALESCE(quantity, 1), status, created_ts, product_id"
+
+    def __init__(self, db_path: str, owner_id: int, default_product_id: int = 1,
+                 connect_archive: Optional[Callable[[], sqlite3.Connection]] = None):
+        self.db_path = db_path
+        self.owner_id = owner_id # ADMIN_ID: penerima notifikasi jika tabel admins kosong, tidak terhalang klaim admin lain
+        self.default_product_id = default_product_id # Untuk baris lama tanpa product_id
+        # Koneksi dengan view gabungan arsip `<tabel>_all` untuk riwayat pembelian; tanpa ini hanya tabel utama yang dibaca
+        self.connect_archive = connect_archive
+
+    def _queued_sale(self, row: tuple) -> QueuedSale:
+        sale = QueuedSale(*row)
+        return sale._replace(product_id=sale.product_id or self.default_product_id)
+
+    def _history_entry(self, row: tuple) -> HistoryEntry:
+        entry = HistoryEntry(*row)
+        return entry._replace(product_id=entry.product_id or self.default_product_id)
+
+    def _history_connection(self) -> Tuple[sqlite3.Connection, str]:
+        """(koneksi, akhiran nama tabel): '_all' untuk view gabungan arsip, '' untuk tabel utama saja."""
+        if self.connect_archive:
+            return self.connect_archive(), '_all'
+        return sqlite3.connect(self.db_path), ''
+
+    def _sale_record(self, row: tuple) -> SaleRecord:
+        record = SaleRecord(*row)
+        return record._replace(product_id=record.product_id or self.default_product_id)
+
+    def get_setting(self, key: str) -> Optional[str]:
+        with sqlite3.connect(self.db_path) as conn:
+            row = conn.execute('SELECT value FROM settings WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else None
+
+    def set_setting(self, key: str, value: str) -> None:
+        with sqlite3.connect(self.db_path) as conn:
+            conn.execute('INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)', (key, value))
+            conn.commit()
+
+    def load_catalog(self) -> List[ProductInfo]:
+        with sqlite3.connect(self.db_path) as conn:
+            # Kolom stock dijaga trigger di tabel accounts (lihat init_db), tanpa COUNT per produk
+            rows = conn.execute('''SELECT id, name, description, price, active, stock
+                                   FROM products ORDER BY sort_order, id''').fetchall()
+        return [ProductInfo(pid, name, description, price, bool(active), stock)
+                for pid, name, description, price, active, stock in rows]
+
+    def add_product(self, name: str, price: int, description: Optional[str], created: Stamp) -> Optional[int]:
+        try:
+            with sqlite3.connect(self.db_path) as conn:
+                c = conn.cursor()
+                c.execute('''INSERT INTO products (name, description, price, sort_order, created_date, created_ts)
+                             VALUES (?, ?, ?, (SELECT COALESCE(MAX(sort_order), 0) + 1 FROM products), ?, ?)''',
+                          (name, description, price, *created))
+                conn.commit()
+                return c.lastrowid
+        except sqlite3.IntegrityError: # Nama produk UNIQUE
+            return None
+
+    def set_product_price(self, product_id: int, price: int) -> bool:
+        with sqlite3.connect(self.db_path) as conn:
+            c = conn.execute("UPDATE products SET price = ? WHERE id = ?", (price, product_id))
+            conn.commit()
+        return c.rowcount > 0
+
+    def toggle_product(self, product_id: int) -> bool:
+        with sqlite3.connect(self.db_path) as conn:
+            c = conn.execute("UPDATE products SET active = NOT active WHERE id = ?", (product_id,))
+            conn.commit()
+        return c.rowcount > 0
+
+    def add_account(self, product_id: int, email: str, password: str, notes: str, added: Stamp) -> Optional[int]:
+        try:
+            with sqlite3.connect(self.db_path) as conn:
+                c = conn.cursor()
+                c.execute('INSERT INTO accounts (email, password, notes, date_added, added_ts, product_id) VALUES (?, ?, ?, ?, ?, ?)',
+                          (email, password, notes, *added, product_id))
+                conn.commit()
+                return c.lastrowid
+        except sqlite3.IntegrityError: # Email UNIQUE
+            return None
+
+    def add_accounts(self, product_id: int, rows: List[Tuple[str, str, str]], added: Stamp) -> Tuple[List[int], List[str]]:
+        new_ids: List[int] = []
+        duplicates: List[str] = []
+        with sqlite3.connect(self.db_path) as conn:
+            c = conn.cursor()
+            for email, password, notes in rows:
+                c.execute('''INSERT INTO accounts (email, password, notes, date_added, added_ts, product_id) VALUES (?, ?, ?, ?, ?, ?)
+                             ON CONFLICT(email) DO NOTHING''', (email, password, notes, *added, product_id))
+                if c.rowcount > 0:
+                    new_ids.append(c.lastrowid)
+                else:
+                    duplicates.append(email)
+            conn.commit()
+        return new_ids, duplicates
+
+    def get_account(self, account_id: int) -> Optional[Tuple[str, bool]]:
+        with sqlite3.connect(self.db_path) as conn:
+            row = conn.execute("SELECT email, sold FROM accounts WHERE id = ?", (account_id,)).fetchone()
+        return (row[0], bool(row[1])) if row else None
+
+    def delete_account(self, account_id: int) -> Optional[str]:
+        with sqlite3.connect(self.db_path) as conn:
+            row = conn.execute("DELETE FROM accounts WHERE id = ? RETURNING email", (account_id,)).fetchone()
+            conn.commit()
+        return row[0] if row else None
+
+    def active_payment_methods(self) -> List[PaymentMethodInfo]:
+        with sqlite3.connect(self.db_path) as conn:
+            return conn.execute('SELECT method, number, holder_name FROM payment_methods WHERE active = 1 ORDER BY method').fetchall()
+
+    def list_payment_methods(self) -> List[PaymentMethodRecord]:
+        with sqlite3.connect(self.db_path) as conn:
+            rows = conn.execute("SELECT id, method, number, holder_name, active FROM payment_methods ORDER BY method").fetchall()
+        return [PaymentMethodRecord(method_id, method, number, holder, bool(active)) for method_id, method, number, holder, active in rows]
+
+    def save_payment_method(self, method: str, number: str, holder_name: str) -> None:
+        with sqlite3.connect(self.db_path) as conn:
+            # INSERT OR REPLACE akan update jika method sudah ada, atau insert baru
+            conn.execute('''INSERT OR REPLACE INTO payment_methods (method, number, holder_name, active)
+                            VALUES (?, ?, ?, 1)''', (method, number, holder_name))
+            conn.commit()
+
+    def toggle_payment_method(self, method_id: int) -> bool:
+        with sqlite3.connect(self.db_path) as conn:
+            c = conn.execute("UPDATE payment_methods SET active = NOT active WHERE id = ?", (method_id,))
+            conn.commit()
+        return c.rowcount > 0
+
+    def delete_payment_method(self, method_id: int) -> bool:
+        with sqlite3.connect(self.db_path) as conn:
+            c = conn.execute("DELETE FROM payment_methods WHERE id = ?", (method_id,))
+            conn.commit()
+        return c.rowcount > 0
+
+    def pending_expected_amounts(self, low: int, high: int) -> Set[int]:
+        with sqlite3.connect(self.db_path) as conn:
+            # Memakai indeks parsial idx_sales_pending_amount
+            rows = conn.execute("SELECT expected_amount FROM sales WHERE status = 'pending' AND expected_amount BETWEEN ? AND ?",
+                                (low, high)).fetchall()
+        return {row[0] for row in rows}
+
+    def _find_sale_by_proof(self, c: sqlite3.Cursor, buyer_id: int, proof_unique_id: Optional[str]) -> Optional[Tuple[int, str]]:
+        if not proof_unique_id:
+            return None
+        c.execute("SELECT id, status FROM sales WHERE buyer_id = ? AND payment_proof_unique_id = ?", (buyer_id, proof_unique_id))
+        return c.fetchone()
+
+    def find_sale_by_proof(self, buyer_id: int, proof_unique_id: Optional[str]) -> Optional[Tuple[int, str]]:
+        with sqlite3.connect(self.db_path) as conn:
+            return self._find_sale_by_proof(conn.cursor(), buyer_id, proof_unique_id)
+
+    def _pick_notify_admin(self, c: sqlite3.Cursor) -> int:
+        """Admin aktif berikutnya secara round-robin (yang paling sedikit menerima pembayaran)."""
+        c.execute('''UPDATE admins SET assigned_count = assigned_count + 1
+                     WHERE telegram_id = (SELECT telegram_id FROM admins WHERE active = 1
+                                          ORDER BY assigned_count, telegram_id LIMIT 1)
+                     RETURNING telegram_id''')
+        row = c.fetchone()
+        return row[0] if row else self.owner_id
+
+    def submit_sale(self, sale: NewSale) -> SubmitResult:
+        with sqlite3.connect(self.db_path) as conn:
+            c = conn.cursor()
+            existing_sale = self._find_sale_by_proof(c, sale.buyer_id, sale.payment_proof_unique_id)
+            if existing_sale:
+                return SubmitResult('duplicate', *existing_sale)
+
+            c.execute('SELECT name, price, active FROM products WHERE id = ?', (sale.product_id,))
+            product_row = c.fetchone()
+            if not product_row or not product_row[2]:
+                return SubmitResult('inactive')
+            product_name, product_price, _ = product_row
+            expected_amount = product_price * sale.quantity + (sale.unique_code or 0)
+
+            c.execute('SELECT COUNT(*) FROM accounts WHERE product_id = ? AND sold = 0', (sale.product_id,)) # Cek stok terakhir
+            if c.fetchone()[0] < sale.quantity:
+                return SubmitResult('out_of_stock', product_name=product_name)
+
+            notify_admin_id = self._pick_notify_admin(c)
+            created_date, created_ts = sale.created
+            try:
+                c.execute('''INSERT INTO sales
+                             (buyer_id, buyer_username, product_id, amount, quantity, unique_code, expected_amount, payment_proof, payment_proof_unique_id, status, created_date, created_ts, account_id)
+                             VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, 'pending', ?, ?, NULL)''',
+                          (sale.buyer_id, sale.buyer_username, sale.product_id, str(expected_amount), sale.quantity, sale.unique_code,
+                           expected_amount if sale.unique_code else None, # Tanpa kode unik, nominal tidak bisa direkonsiliasi otomatis
+                           sale.payment_proof, sale.payment_proof_unique_id, created_date, created_ts))
+            except sqlite3.IntegrityError: # Kiriman ganda yang lolos cek di atas secara bersamaan
+                conn.rollback()
+                existing_sale = self._find_sale_by_proof(c, sale.buyer_id, sale.payment_proof_unique_id)
+                if not existing_sale: raise
+                return SubmitResult('duplicate', *existing_sale)
+            conn.commit()
+            return SubmitResult('created', c.lastrowid, 'pending', product_name, str(expected_amount), notify_admin_id)
+
+    def claim_sale(self, sale_id: int, admin_id: int, now_ts: int, lease_sec: int) -> ClaimResult:
+        with sqlite3.connect(self.db_path) as conn:
+            row = conn.execute(f"""UPDATE sales SET claimed_by = ?, claimed_until = ?
+                                   WHERE id = ? AND status = 'pending'
+                                     AND (? OR claimed_by = ? OR COALESCE(claimed_until, 0) < ?) -- Pemilik boleh mengambil alih
+                                   RETURNING {self.SALE_COLUMNS}""",
+                               (admin_id, now_ts + lease_sec, sale_id, admin_id == self.owner_id, admin_id, now_ts)).fetchone()
+            if row:
+                conn.commit()
+                return ClaimResult('claimed', self._sale_record(row))
+            row = conn.execute(f"SELECT {self.SALE_COLUMNS} FROM sales WHERE id = ?", (sale_id,)).fetchone()
+        if not row:
+            return ClaimResult('not_found')
+        sale = self._sale_record(row)
+        return ClaimResult('not_pending' if sale.status != 'pending' else 'taken', sale)
+
+    def approve_sale(self, sale_id: int, admin_id: int, now: Stamp) -> ApproveResult:
+        conn = sqlite3.connect(self.db_path, isolation_level=None) # Transaksi dikelola manual
+        try:
+            conn.execute('PRAGMA foreign_keys = ON;')
+            c = conn.cursor()
+            # Kunci tulis diambil di awal agar alokasi stok tidak balapan
+            c.execute('BEGIN IMMEDIATE')
+            row = c.execute(f"SELECT {self.SALE_COLUMNS} FROM sales WHERE id = ?", (sale_id,)).fetchone()
+            if not row:
+                conn.rollback()
+                return ApproveResult('not_found')
+            sale = self._sale_record(row)
+            if sale.status != 'pending':
+                conn.rollback()
+                return ApproveResult('not_pending', sale)
+            if claimed_by_other(sale, admin_id, now[1], self.owner_id):
+                conn.rollback()
+                return ApproveResult('claimed', sale)
+
+            accounts: List[AccountDetail]
+            if sale.account_id is None: # Akun belum ter-assign, ambil N akun tersedia sekaligus
+                accounts = allocate_accounts(c, sale.quantity, sale.product_id)
+                if len(accounts) < sale.quantity:
+                    conn.rollback()
+                    return ApproveResult('out_of_stock', sale, available=len(accounts))
+            else: # Akun sudah ter-assign (data lama), fetch detailnya
+                c.execute("SELECT email, password, notes, sold FROM accounts WHERE id = ?", (sale.account_id,))
+                account_data = c.fetchone()
+                if not account_data:
+                    c.execute("UPDATE sales SET status = 'failed', admin_notes = ? WHERE id = ?",
+                              (f"Gagal approve: Akun ID {sale.account_id} tidak ditemukan saat approval.", sale_id))
+                    conn.commit() # Status 'failed' tetap disimpan
+                    return ApproveResult('account_missing', sale)
+                acc_email, acc_pass, acc_notes, acc_already_sold = account_data
+                accounts = [(sale.account_id, acc_email, acc_pass, acc_notes)]
+                if acc_already_sold == 1:
+                    conn.rollback()
+                    return ApproveResult('account_sold', sale, accounts)
+
+            now_str, now_ts = now
+            if not mark_accounts_sold(c, sale_id, accounts, sale.buyer_id, sale.buyer_username, now_str, now_ts):
+                conn.rollback()
+                return ApproveResult('conflict', sale)
+            c.execute("UPDATE sales SET account_id = ?, status = 'completed', completed_date = ?, completed_ts = ? WHERE id = ?",
+                      (accounts[0][0], now_str, now_ts, sale_id))
+            conn.commit()
+            return ApproveResult('approved', sale._replace(status='completed'), accounts)
+        except sqlite3.Error:
+            if conn.in_transaction: conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+    def reject_sale(self, sale_id: int, admin_id: int, reason: str, now: Stamp) -> RejectResult:
+        with sqlite3.connect(self.db_path) as conn:
+            c = conn.cursor()
+            row = c.execute(f"SELECT {self.SALE_COLUMNS} FROM sales WHERE id = ?", (sale_id,)).fetchone()
+            if not row:
+                return RejectResult('not_found')
+            sale = self._sale_record(row)
+            if sale.status != 'pending':
+                return RejectResult('not_pending', sale)
+            if claimed_by_other(sale, admin_id, now[1], self.owner_id):
+                return RejectResult('claimed', sale)
+            c.execute("UPDATE sales SET status = 'cancelled', completed_date = ?, completed_ts = ?, admin_notes = ? WHERE id = ? AND status = 'pending'",
+                      (*now, reason, sale_id))
+            if c.rowcount == 0: # Diproses admin lain di antara SELECT dan UPDATE
+                conn.rollback()
+                return RejectResult('conflict', sale)
+            conn.commit()
+        return RejectResult('cancelled', sale._replace(status='cancelled'))
+
+    def claim_next_sale(self, admin_id: int, after_id: int, now_ts: int, lease_sec: int) -> Optional[QueuedSale]:
+        claim_sql = f'''UPDATE sales SET claimed_by = ?, claimed_until = ?
+                        WHERE id = (SELECT id FROM sales WHERE status = 'pending' AND id > ? AND id != ?
+                                      AND (claimed_by = ? OR COALESCE(claimed_until, 0) < ?)
+                                    ORDER BY id LIMIT 1)
+                        RETURNING {self.QUEUED_COLUMNS}'''
+        with sqlite3.connect(self.db_path) as conn:
+            if after_id:
+                conn.execute("UPDATE sales SET claimed_by = NULL, claimed_until = NULL WHERE id = ? AND claimed_by = ? AND status = 'pending'",
+                             (after_id, admin_id))
+            for start_id in ((after_id, 0) if after_id else (0,)):
+                rows = conn.execute(claim_sql, (admin_id, now_ts + lease_sec, start_id, after_id, admin_id, now_ts)).fetchall()
+                if rows:
+                    return self._queued_sale(rows[0])
+        return None
+
+    def pending_sales(self) -> List[QueuedSale]:
+        with sqlite3.connect(self.db_path) as conn:
+            rows = conn.execute(f"SELECT {self.QUEUED_COLUMNS} FROM sales WHERE status = 'pending' ORDER BY created_ts ASC").fetchall()
+        return [self._queued_sale(row) for row in rows]
+
+    def pending_summary(self, preview_size: int, now_ts: int) -> PendingSummary:
+        with sqlite3.connect(self.db_path) as conn:
+            c = conn.cursor()
+            c.execute("""SELECT COUNT(*), SUM(CAST(REPLACE(REPLACE(amount, '.', ''), ',', '') AS REAL))
+                         FROM sales WHERE status = 'pending'""")
+            total_pending, total_amount = c.fetchone()
+            c.execute(f"SELECT {self.QUEUED_COLUMNS} FROM sales WHERE status = 'pending' ORDER BY id DESC LIMIT ?", (preview_size,))
+            newest = [self._queued_sale(row) for row in c.fetchall()]
+            c.execute("""SELECT claimed_by, COUNT(*) FROM sales WHERE status = 'pending' AND claimed_until >= ?
+                         GROUP BY claimed_by""", (now_ts,))
+            claims = dict(c.fetchall())
+        return PendingSummary(total_pending, total_amount or 0, newest, claims)
+
+    def reconcile_statement(self, lines: List[reconcile.StatementLine], window: timedelta, payment_method: Optional[str],
+                            now: Stamp) -> Tuple[reconcile.ReconcileResult, List[ReconcileApproval], List[int]]:
+        approved: List[ReconcileApproval] = []
+        short_stock: List[int] = []
+        conn = sqlite3.connect(self.db_path, isolation_level=None)
+        try:
+            conn.execute('PRAGMA foreign_keys = ON;')
+            c = conn.cursor()
+            c.execute('BEGIN IMMEDIATE') # Sale pending dibaca & disetujui di bawah kunci tulis yang sama
+            result = reconcile.match_statement(lines, reconcile.load_pending_sales(conn), window)
+            now_str, now_ts = now
+            for line, sale in result.matched:
+                c.execute("SELECT buyer_id, buyer_username, quantity, product_id FROM sales WHERE id = ? AND status = 'pending'", (sale.sale_id,))
+                buyer_id, buyer_username, quantity, product_id = c.fetchone()
+                product_id = product_id or self.default_product_id
+                accounts = allocate_accounts(c, quantity or 1, product_id)
+                if len(accounts) < (quantity or 1):
+                    short_stock.append(sale.sale_id) # Pembayaran cocok tapi stok kurang: tetap pending
+                    continue
+                if not mark_accounts_sold(c, sale.sale_id, accounts, buyer_id, buyer_username, now_str, now_ts):
+                    raise sqlite3.IntegrityError(f"Akun untuk Sale ID {sale.sale_id} sudah terjual di tengah transaksi.")
+                c.execute("""UPDATE sales SET account_id = ?, status = 'completed', completed_date = ?, completed_ts = ?,
+                                    payment_method = COALESCE(?, payment_method), admin_notes = ?
+                             WHERE id = ?""",
+                          (accounts[0][0], now_str, now_ts, payment_method, reconcile_note(line), sale.sale_id))
+                approved.append(ReconcileApproval(sale.sale_id, buyer_id, accounts, product_id))
+            conn.commit()
+        except Exception:
+            if conn.in_transaction: conn.rollback()
+            raise
+        finally:
+            conn.close()
+        return result, approved, short_stock
+
+    def purchase_history(self, buyer_id: int, before_sale_id: Optional[int], limit: int) -> List[HistoryEntry]:
+        conn, suffix = self._history_connection()
+        with conn:
+            keyset_sql, keyset_params = "", ()
+            if before_sale_id is not None:
+                keyset_sql = f"AND (created_ts, id) < (SELECT created_ts, id FROM sales{suffix} WHERE id = ? AND buyer_id = ?)"
+                keyset_params = (before_sale_id, buyer_id)
+            rows = conn.execute(f"""
+                SELECT {self.HISTORY_COLUMNS} FROM sales{suffix}
+                WHERE buyer_id = ? {keyset_sql}
+                ORDER BY created_ts DESC, id DESC LIMIT ?
+            """, (buyer_id, *keyset_params, limit)).fetchall()
+        return [self._history_entry(row) for row in rows]
+
+    def buyer_sale(self, buyer_id: int, sale_id: int) -> Optional[HistoryEntry]:
+        conn, suffix = self._history_connection()
+        with conn:
+            row = conn.execute(f"SELECT {self.HISTORY_COLUMNS} FROM sales{suffix} WHERE id = ? AND buyer_id = ?", (sale_id, buyer_id)).fetchone()
+        return self._history_entry(row) if row else None
+
+    def sale_accounts(self, sale_ids: List[int]) -> Dict[int, List[AccountDetail]]:
+        if not sale_ids:
+            return {}
+        placeholders = ','.join('?' * len(sale_ids))
+        conn, suffix = self._history_connection()
+        with conn:
+            rows = conn.execute(f"""
+                SELECT i.sale_id, a.id, a.email, a.password, a.notes
+                FROM sale_items{suffix} i JOIN accounts{suffix} a ON a.id = i.account_id
+                WHERE i.sale_id IN ({placeholders})
+                UNION ALL
+                SELECT s.id, a.id, a.email, a.password, a.notes
+                FROM sales{suffix} s JOIN accounts{suffix} a ON a.id = s.account_id
+                WHERE s.id IN ({placeholders}) AND NOT EXISTS (SELECT 1 FROM sale_items{suffix} i WHERE i.sale_id = s.id)
+                ORDER BY 1, 2
+            """, (*sale_ids, *sale_ids)).fetchall()
+        accounts_by_sale: Dict[int, List[AccountDetail]] = {}
+        for sale_id, acc_id, email, password, notes in rows:
+            accounts_by_sale.setdefault(sale_id, []).append((acc_id, email, password, notes))
+        return accounts_by_sale
+
+    def load_roster(self) -> Dict[int, str]:
+        with sqlite3.connect(self.db_path) as conn:
+            return dict(conn.execute('SELECT telegram_id, role FROM admins WHERE active = 1').fetchall())
+
+    def list_admins(self, now_ts: int) -> List[AdminInfo]:
+        with sqlite3.connect(self.db_path) as conn:
+            rows = conn.execute('''SELECT a.telegram_id, a.role, a.assigned_count,
+                                          (SELECT COUNT(*) FROM sales s WHERE s.status = 'pending'
+                                             AND s.claimed_by = a.telegram_id AND s.claimed_until >= ?)
+                                   FROM admins a WHERE a.active = 1 ORDER BY a.role, a.telegram_id''', (now_ts,)).fetchall()
+        return [AdminInfo(*row) for row in rows]
+
+    def add_admin(self, telegram_id: int, role: str, added: Stamp) -> None:
+        with sqlite3.connect(self.db_path) as conn:
+            # Mulai dari beban terkecil agar admin baru tidak menerima semua notifikasi sekaligus (round-robin)
+            conn.execute('''INSERT INTO admins (telegram_id, role, active, assigned_count, added_date, added_ts)
+                            VALUES (?, ?, 1, (SELECT COALESCE(MIN(assigned_count), 0) FROM admins WHERE active = 1), ?, ?)
+                            ON CONFLICT(telegram_id) DO UPDATE SET role = excluded.role, active = 1,
+                                assigned_count = excluded.assigned_count''', (telegram_id, role, *added))
+            conn.commit()
+
+    def remove_admin(self, telegram_id: int) -> Optional[int]:
+        with sqlite3.connect(self.db_path) as conn:
+            removed = conn.execute('UPDATE admins SET active = 0 WHERE telegram_id = ? AND active = 1', (telegram_id,)).rowcount
+            if not removed:
+                return None
+            released = conn.execute("UPDATE sales SET claimed_by = NULL, claimed_until = NULL WHERE claimed_by = ? AND status = 'pending'",
+                                    (telegram_id,)).rowcount
+            conn.commit()
+        return released
+
+    def record_customers(self, entries: List[CustomerActivity]) -> None:
+        registrations = [(e.telegram_id, e.username, *e.seen, *e.seen, e.username) for e in entries if e.register]
+        activities = [(*e.seen, e.username, e.telegram_id) for e in entries if not e.register]
+        with sqlite3.connect(self.db_path) as conn:
+            conn.executemany('''INSERT INTO customers (telegram_id, username, join_date, join_ts, last_seen, last_seen_ts, last_username)
+                                VALUES (?, ?, ?, ?, ?, ?, ?)
+                                ON CONFLICT(telegram_id) DO UPDATE SET
+                                    last_seen = excluded.last_seen, last_seen_ts = excluded.last_seen_ts,
+                                    last_username = excluded.last_username''', registrations)
+            conn.executemany("UPDATE customers SET last_seen = ?, last_seen_ts = ?, last_username = ? WHERE telegram_id = ?", activities)
+            conn.commit()
+
+    def count_customers(self, segment: Dict[str, Any]) -> int:
+        where_sql, params = segment_where(segment)
+        with sqlite3.connect(self.db_path) as conn:
+            return conn.execute(f"SELECT COUNT(*) FROM customers WHERE {where_sql}", params).fetchone()[0]
+
+    def customer_ids(self, segment: Dict[str, Any], after_id: int, limit: int) -> List[int]:
+        where_sql, params = segment_where(segment)
+        with sqlite3.connect(self.db_path) as conn:
+            return [row[0] for row in conn.execute(
+                f"SELECT telegram_id FROM customers WHERE {where_sql} AND telegram_id > ? ORDER BY telegram_id LIMIT ?",
+                (*params, after_id, limit))]
+
+    def block_customers(self, telegram_ids: List[int]) -> None:
+        with sqlite3.connect(self.db_path) as conn:
+            conn.executemany("UPDATE customers SET is_blocked = 1 WHERE telegram_id = ?", [(telegram_id,) for telegram_id in telegram_ids])
+            conn.commit()
+
+
+# --- Memori ---
+@dataclass
+class MemoryProduct:
+    id: int
+    name: str
+    description: Optional[str]
+    price: int
+    sort_order: int
+    created: Stamp
+    active: bool = True
+
+
+@dataclass
+class MemoryAccount:
+    id: int
+    product_id: int
+    email: str
+    password: str
+    notes: Optional[str]
+    added: Stamp
+    sold: bool = False
+    sold_to_id: Optional[int] = None
+    sold_to_username: Optional[str] = None
+    sold_at: Optional[Stamp] = None
+
+    @property
+    def detail(self) -> AccountDetail:
+        return self.id, self.email, self.password, self.notes
+
+
+@dataclass
+class MemorySale:
+    id: int
+    buyer_id: int
+    buyer_username: Optional[str]
+    product_id: int
+    amount: str
+    quantity: int
+    unique_code: Optional[int]
+    payment_proof: str
+    payment_proof_unique_id: Optional[str]
+    created: Stamp
+    claimed_by: Optional[int] = None
+    claimed_until: Optional[int] = None
+    status: str = 'pending'
+    account_id: Optional[int] = None
+    completed: Optional[Stamp] = None
+    admin_notes: Optional[str] = None
+    payment_method: Optional[str] = None
+
+    def record(self) -> SaleRecord:
+        return SaleRecord(self.id, self.buyer_id, self.buyer_username, self.status, self.amount, self.quantity,
+                          self.product_id, self.account_id, self.claimed_by, self.claimed_until)
+
+    def queued(self) -> QueuedSale:
+        return QueuedSale(self.id, self.buyer_id, self.buyer_username, self.quantity, self.amount, self.payment_proof,
+                          self.created[1], self.claimed_by, self.claimed_until, self.product_id)
+
+    def history(self) -> HistoryEntry:
+        return HistoryEntry(self.id, self.amount, self.quantity, self.status, self.created[1], self.product_id)
+
+
+@dataclass
+class MemoryCustomer:
+    telegram_id: int
+    username: Optional[str]
+    joined: Stamp
+    last_seen: Optional[Stamp] = None
+    last_username: Optional[str] = None
+    order_count: int = 0
+    purchase_count: int = 0
+    last_purchase_ts: Optional[int] = None
+    blocked: bool = False
+    product_ids: Set[int] = field(default_factory=set) # Seperti customer_products
+
+    def in_segment(self, segment: Dict[str, Any]) -> bool:
+        """Padanan segment_where untuk satu customer."""
+        if self.blocked:
+            return False
+        key = segment.get('key', 'semua')
+        if key == 'pembeli':
+            return self.purchase_count > 0
+        if key == 'bukan_pembeli':
+            return self.purchase_count == 0
+        if key == 'belum_selesai':
+            return self.purchase_count == 0 and self.order_count > 0
+        if 'since_ts' in segment:
+            return self.last_seen is not None and self.last_seen[1] >= segment['since_ts']
+        if 'product_id' in segment:
+            return segment['product_id'] in self.product_ids
+        return True
+
+
+class MemoryRepository(StoreRepository):
+    """Semua data di dict; akun belum terjual per produk disimpan di list terurut (added_ts, id) seperti index parsial SQLite.
+
+    Satu lock untuk semua operasi, setara kunci tulis database tunggal. Atribut dict boleh dibaca langsung
+    (mis. oleh stress_test.py untuk memeriksa invariant) selama tidak ada operasi lain yang berjalan.
+    """
+
+    def __init__(self, admin_ids: List[int], owner_id: Optional[int] = None):
+        self.owner_id = owner_id
+        self.settings: Dict[str, str] = {}
+        self.products: Dict[int, MemoryProduct] = {}
+        self.accounts: Dict[int, MemoryAccount] = {}
+        self.sales: Dict[int, MemorySale] = {}
+        self.sale_items: Dict[int, List[int]] = {} # sale_id -> account_id
+        self.customers: Dict[int, MemoryCustomer] = {}
+        self.payment_methods: Dict[int, PaymentMethodRecord] = {}
+        self.admin_roles: Dict[int, str] = {admin_id: 'admin' for admin_id in admin_ids} # Roster aktif
+        self.admin_assignments: Dict[int, int] = {admin_id: 0 for admin_id in admin_ids} # Round-robin, termasuk anggota nonaktif
+        self._unsold: Dict[int, List[Tuple[int, int]]] = {} # product_id -> [(added_ts, account_id)] terurut
+        self._emails: Set[str] = set()
+        self._product_names: Set[str] = set()
+        self._sale_by_proof: Dict[Tuple[int, str], int] = {}
+        self._pending_amounts: Dict[int, int] = {} # sale_id -> expected_amount untuk sale pending berkode unik
+        self._product_ids = itertools.count(1)
+        self._account_ids = itertools.count(1)
+        self._sale_ids = itertools.count(1)
+        self._payment_method_ids = itertools.count(1)
+        self._lock = threading.RLock()
+
+    def get_setting(self, key: str) -> Optional[str]:
+        return self.settings.get(key)
+
+    def set_setting(self, key: str, value: str) -> None:
+        with self._lock:
+            self.settings[key] = value
+
+    def load_catalog(self) -> List[ProductInfo]:
+        with self._lock:
+            products = sorted(self.products.values(), key=lambda p: (p.sort_order, p.id))
+            return [ProductInfo(p.id, p.name, p.description, p.price, p.active, len(self._unsold.get(p.id, ())))
+                    for p in products]
+
+    def add_product(self, name: str, price: int, description: Optional[str], created: Stamp) -> Optional[int]:
+        with self._lock:
+            if name in self._product_names:
+                return None
+            product_id = next(self._product_ids)
+            sort_order = max((p.sort_order for p in self.products.values()), default=0) + 1
+            self.products[product_id] = MemoryProduct(product_id, name, description, price, sort_order, created)
+            self._product_names.add(name)
+            return product_id
+
+    def set_product_price(self, product_id: int, price: int) -> bool:
+        with self._lock:
+            product = self.products.get(product_id)
+            if product: product.price = price
+            return product is not None
+
+    def toggle_product(self, product_id: int) -> bool:
+        with self._lock:
+            product = self.products.get(product_id)
+            if product: product.active = not product.active
+            return product is not None
+
+    def add_account(self, product_id: int, email: str, password: str, notes: str, added: Stamp) -> Optional[int]:
+        with self._lock:
+            if email in self._emails:
+                return None
+            account_id = next(self._account_ids)
+            self.accounts[account_id] = MemoryAccount(account_id, product_id, email, password, notes, added)
+            self._emails.add(email)
+            bisect.insort(self._unsold.setdefault(product_id, []), (added[1], account_id))
+            return account_id
+
+    def add_accounts(self, product_id: int, rows: List[Tuple[str, str, str]], added: Stamp) -> Tuple[List[int], List[str]]:
+        new_ids: List[int] = []
+        duplicates: List[str] = []
+        with self._lock:
+            for email, password, notes in rows:
+                account_id = self.add_account(product_id, email, password, notes, added)
+                if account_id is None:
+                    duplicates.append(email)
+                else:
+                    new_ids.append(account_id)
+        return new_ids, duplicates
+
+    def get_account(self, account_id: int) -> Optional[Tuple[str, bool]]:
+        with self._lock:
+            account = self.accounts.get(account_id)
+            return (account.email, account.sold) if account else None
+
+    def delete_account(self, account_id: int) -> Optional[str]:
+        with self._lock:
+            account = self.accounts.pop(account_id, None)
+            if account is None:
+                return None
+            self._emails.discard(account.email)
+            if not account.sold:
+                unsold = self._unsold.get(account.product_id, [])
+                del unsold[bisect.bisect_left(unsold, (account.added[1], account.id))]
+            for sale in self.sales.values(): # ON DELETE SET NULL
+                if sale.account_id == account_id:
+                    sale.account_id = None
+            for sale_id, account_ids in self.sale_items.items():
+                if account_id in account_ids:
+                    self.sale_items[sale_id] = [other for other in account_ids if other != account_id]
+            return account.email
+
+    def active_payment_methods(self) -> List[PaymentMethodInfo]:
+        return [(m.method, m.number, m.holder_name) for m in self.list_payment_methods() if m.active]
+
+    def list_payment_methods(self) -> List[PaymentMethodRecord]:
+        with self._lock:
+            return sorted(self.payment_methods.values(), key=lambda m: m.method)
+
+    def save_payment_method(self, method: str, number: str, holder_name: str) -> None:
+        with self._lock:
+            for existing in [m for m in self.payment_methods.values() if m.method == method]: # Seperti INSERT OR REPLACE
+                del self.payment_methods[existing.id]
+            method_id = next(self._payment_method_ids)
+            self.payment_methods[method_id] = PaymentMethodRecord(method_id, method, number, holder_name, True)
+
+    def toggle_payment_method(self, method_id: int) -> bool:
+        with self._lock:
+            existing = self.payment_methods.get(method_id)
+            if existing: self.payment_methods[method_id] = existing._replace(active=not existing.active)
+            return existing is not None
+
+    def delete_payment_method(self, method_id: int) -> bool:
+        with self._lock:
+            return self.payment_methods.pop(method_id, None) is not None
+
+    def pending_expected_amounts(self, low: int, high: int) -> Set[int]:
+        with self._lock:
+            return {amount for amount in self._pending_amounts.values() if low <= amount <= high}
+
+    def find_sale_by_proof(self, buyer_id: int, proof_unique_id: Optional[str]) -> Optional[Tuple[int, str]]:
+        if not proof_unique_id:
+            return None
+        with self._lock:
+            sale_id = self._sale_by_proof.get((buyer_id, proof_unique_id))
+            return (sale_id, self.sales[sale_id].status) if sale_id is not None else None
+
+    def _pick_notify_admin(self) -> Optional[int]:
+        if not self.admin_roles:
+            return self.owner_id
+        admin_id = min(self.admin_roles, key=lambda a: (self.admin_assignments[a], a))
+        self.admin_assignments[admin_id] += 1
+        return admin_id
+
+    def submit_sale(self, sale: NewSale) -> SubmitResult:
+        with self._lock:
+            existing_sale = self.find_sale_by_proof(sale.buyer_id, sale.payment_proof_unique_id)
+            if existing_sale:
+                return SubmitResult('duplicate', *existing_sale)
+            product = self.products.get(sale.product_id)
+            if not product or not product.active:
+                return SubmitResult('inactive')
+            if len(self._unsold.get(sale.product_id, ())) < sale.quantity:
+                return SubmitResult('out_of_stock', product_name=product.name)
+
+            expected_amount = product.price * sale.quantity + (sale.unique_code or 0)
+            notify_admin_id = self._pick_notify_admin()
+            sale_id = next(self._sale_ids)
+            self.sales[sale_id] = MemorySale(sale_id, sale.buyer_id, sale.buyer_username, sale.product_id, str(expected_amount),
+                                             sale.quantity, sale.unique_code, sale.payment_proof, sale.payment_proof_unique_id,
+                                             sale.created)
+            if sale.payment_proof_unique_id:
+                self._sale_by_proof[(sale.buyer_id, sale.payment_proof_unique_id)] = sale_id
+            if sale.unique_code is not None:
+                self._pending_amounts[sale_id] = expected_amount
+            self._customer_for(sale.buyer_id, sale.buyer_username, sale.created).order_count += 1
+            return SubmitResult('created', sale_id, 'pending', product.name, str(expected_amount), notify_admin_id)
+
+    def claim_sale(self, sale_id: int, admin_id: int, now_ts: int, lease_sec: int) -> ClaimResult:
+        with self._lock:
+            sale = self.sales.get(sale_id)
+            if not sale:
+                return ClaimResult('not_found')
+            if sale.status != 'pending':
+                return ClaimResult('not_pending', sale.record())
+            if claimed_by_other(sale.record(), admin_id, now_ts, self.owner_id):
+                return ClaimResult('taken', sale.record())
+            sale.claimed_by, sale.claimed_until = admin_id, now_ts + lease_sec
+            return ClaimResult('claimed', sale.record())
+
+    def approve_sale(self, sale_id: int, admin_id: int, now: Stamp) -> ApproveResult:
+        with self._lock:
+            sale = self.sales.get(sale_id)
+            if not sale:
+                return ApproveResult('not_found')
+            record = sale.record()
+            if sale.status != 'pending':
+                return ApproveResult('not_pending', record)
+            if claimed_by_other(record, admin_id, now[1], self.owner_id):
+                return ApproveResult('claimed', record)
+
+            if sale.account_id is None:
+                unsold = self._unsold.get(sale.product_id, [])
+                if len(unsold) < sale.quantity:
+                    return ApproveResult('out_of_stock', record, available=len(unsold))
+                account_ids = [account_id for _, account_id in unsold[:sale.quantity]]
+                del unsold[:sale.quantity]
+            else:
+                account = self.accounts.get(sale.account_id)
+                if not account:
+                    sale.status = 'failed'
+                    sale.admin_notes = f"Gagal approve: Akun ID {sale.account_id} tidak ditemukan saat approval."
+                    self._pending_amounts.pop(sale_id, None)
+                    return ApproveResult('account_missing', record)
+                if account.sold:
+                    return ApproveResult('account_sold', record, [account.detail])
+                account_ids = [account.id]
+                unsold = self._unsold.get(account.product_id, [])
+                del unsold[bisect.bisect_left(unsold, (account.added[1], account.id))]
+
+            return ApproveResult('approved', sale.record(), self._complete_sale(sale, account_ids, now))
+
+    def _complete_sale(self, sale: MemorySale, account_ids: List[int], now: Stamp) -> List[AccountDetail]:
+        """Menandai akun (sudah dikeluarkan dari _unsold) terjual dan sale selesai, seperti mark_accounts_sold + trigger customer."""
+        for account_id in account_ids:
+            account = self.accounts[account_id]
+            account.sold, account.sold_to_id, account.sold_to_username, account.sold_at = True, sale.buyer_id, sale.buyer_username, now
+        self.sale_items[sale.id] = account_ids
+        sale.status, sale.account_id, sale.completed = 'completed', account_ids[0], now
+        self._pending_amounts.pop(sale.id, None)
+        customer = self._customer_for(sale.buyer_id, sale.buyer_username, sale.created)
+        customer.purchase_count += 1
+        customer.last_purchase_ts = max(customer.last_purchase_ts or 0, now[1])
+        customer.product_ids.add(sale.product_id)
+        return [self.accounts[account_id].detail for account_id in account_ids]
+
+    def reject_sale(self, sale_id: int, admin_id: int, reason: str, now: Stamp) -> RejectResult:
+        with self._lock:
+            sale = self.sales.get(sale_id)
+            if not sale:
+                return RejectResult('not_found')
+            record = sale.record()
+            if sale.status != 'pending':
+                return RejectResult('not_pending', record)
+            if claimed_by_other(record, admin_id, now[1], self.owner_id):
+                return RejectResult('claimed', record)
+            sale.status, sale.completed, sale.admin_notes = 'cancelled', now, reason
+            self._pending_amounts.pop(sale_id, None)
+            return RejectResult('cancelled', sale.record())
+
+    def claim_next_sale(self, admin_id: int, after_id: int, now_ts: int, lease_sec: int) -> Optional[QueuedSale]:
+        with self._lock:
+            skipped = self.sales.get(after_id)
+            if skipped and skipped.status == 'pending' and skipped.claimed_by == admin_id:
+                skipped.claimed_by = skipped.claimed_until = None
+            pending = sorted(sale_id for sale_id, sale in self.sales.items()
+                             if sale.status == 'pending' and sale_id != after_id
+                             and (sale.claimed_by == admin_id or (sale.claimed_until or 0) < now_ts))
+            sale_id = next((sale_id for sale_id in pending if sale_id > after_id), pending[0] if pending else None)
+            if sale_id is None:
+                return None
+            sale = self.sales[sale_id]
+            sale.claimed_by, sale.claimed_until = admin_id, now_ts + lease_sec
+            return sale.queued()
+
+    def pending_sales(self) -> List[QueuedSale]:
+        with self._lock:
+            return [sale.queued() for sale in sorted(self.sales.values(), key=lambda s: s.created[1]) if sale.status == 'pending']
+
+    def pending_summary(self, preview_size: int, now_ts: int) -> PendingSummary:
+        with self._lock:
+            pending = [sale for sale in self.sales.values() if sale.status == 'pending']
+            claims: Dict[int, int] = {}
+            for sale in pending:
+                if sale.claimed_by is not None and (sale.claimed_until or 0) >= now_ts:
+                    claims[sale.claimed_by] = claims.get(sale.claimed_by, 0) + 1
+            newest = [sale.queued() for sale in sorted(pending, key=lambda s: s.id, reverse=True)[:preview_size]]
+            total_amount = sum(float(sale.amount.replace('.', '').replace(',', '')) for sale in pending)
+            return PendingSummary(len(pending), total_amount, newest, claims)
+
+    def reconcile_statement(self, lines: List[reconcile.StatementLine], window: timedelta, payment_method: Optional[str],
+                            now: Stamp) -> Tuple[reconcile.ReconcileResult, List[ReconcileApproval], List[int]]:
+        approved: List[ReconcileApproval] = []
+        short_stock: List[int] = []
+        with self._lock:
+            pending = [reconcile.PendingSale(sale_id, amount, datetime.strptime(self.sales[sale_id].created[0], '%Y-%m-%d %H:%M:%S'))
+                       for sale_id, amount in self._pending_amounts.items()]
+            result = reconcile.match_statement(lines, pending, window)
+            for line, matched in result.matched:
+                sale = self.sales[matched.sale_id]
+                unsold = self._unsold.get(sale.product_id, [])
+                if len(unsold) < sale.quantity:
+                    short_stock.append(sale.id) # Pembayaran cocok tapi stok kurang: tetap pending
+                    continue
+                account_ids = [account_id for _, account_id in unsold[:sale.quantity]]
+                del unsold[:sale.quantity]
+                accounts = self._complete_sale(sale, account_ids, now)
+                sale.payment_method = payment_method or sale.payment_method
+                sale.admin_notes = reconcile_note(line)
+                approved.append(ReconcileApproval(sale.id, sale.buyer_id, accounts, sale.product_id))
+        return result, approved, short_stock
+
+    def purchase_history(self, buyer_id: int, before_sale_id: Optional[int], limit: int) -> List[HistoryEntry]:
+        with self._lock:
+            sales = sorted((sale for sale in self.sales.values() if sale.buyer_id == buyer_id),
+                           key=lambda s: (s.created[1], s.id), reverse=True)
+            if before_sale_id is not None:
+                before = self.sales.get(before_sale_id)
+                if before is None or before.buyer_id != buyer_id:
+                    return [] # Sama dengan subquery keyset tanpa baris di SQLite
+                sales = [sale for sale in sales if (sale.created[1], sale.id) < (before.created[1], before.id)]
+            return [sale.history() for sale in sales[:limit]]
+
+    def buyer_sale(self, buyer_id: int, sale_id: int) -> Optional[HistoryEntry]:
+        with self._lock:
+            sale = self.sales.get(sale_id)
+            return sale.history() if sale and sale.buyer_id == buyer_id else None
+
+    def sale_accounts(self, sale_ids: List[int]) -> Dict[int, List[AccountDetail]]:
+        with self._lock:
+            accounts_by_sale: Dict[int, List[AccountDetail]] = {}
+            for sale_id in sale_ids:
+                sale = self.sales.get(sale_id)
+                account_ids = self.sale_items.get(sale_id) or ([sale.account_id] if sale and sale.account_id is not None else [])
+                details = [self.accounts[account_id].detail for account_id in sorted(account_ids) if account_id in self.accounts]
+                if details:
+                    accounts_by_sale[sale_id] = details
+            return accounts_by_sale
+
+    def load_roster(self) -> Dict[int, str]:
+        with self._lock:
+            return dict(self.admin_roles)
+
+    def list_admins(self, now_ts: int) -> List[AdminInfo]:
+        with self._lock:
+            claims = self.pending_summary(0, now_ts).claims
+            return [AdminInfo(admin_id, role, self.admin_assignments[admin_id], claims.get(admin_id, 0))
+                    for admin_id, role in sorted(self.admin_roles.items(), key=lambda item: (item[1], item[0]))]
+
+    def add_admin(self, telegram_id: int, role: str, added: Stamp) -> None:
+        with self._lock:
+            self.admin_assignments[telegram_id] = min((self.admin_assignments[a] for a in self.admin_roles), default=0)
+            self.admin_roles[telegram_id] = role
+
+    def remove_admin(self, telegram_id: int) -> Optional[int]:
+        with self._lock:
+            if self.admin_roles.pop(telegram_id, None) is None:
+                return None
+            released = 0
+            for sale in self.sales.values():
+                if sale.status == 'pending' and sale.claimed_by == telegram_id:
+                    sale.claimed_by = sale.claimed_until = None
+                    released += 1
+            return released
+
+    def _customer_for(self, telegram_id: int, username: Optional[str], joined: Stamp) -> MemoryCustomer:
+        """Seperti trigger customer_stats_*: pembeli yang belum di-flush buffer aktivitas dibuatkan barisnya."""
+        customer = self.customers.get(telegram_id)
+        if customer is None:
+            customer = self.customers[telegram_id] = MemoryCustomer(telegram_id, username, joined, last_username=username)
+        return customer
+
+    def record_customers(self, entries: List[CustomerActivity]) -> None:
+        with self._lock:
+            for entry in entries:
+                customer = self.customers.get(entry.telegram_id)
+                if customer is None:
+                    if not entry.register:
+                        continue # Sama dengan UPDATE tanpa baris di SQLite
+                    customer = self.customers[entry.telegram_id] = MemoryCustomer(entry.telegram_id, entry.username, entry.seen)
+                customer.last_seen, customer.last_username = entry.seen, entry.username
+
+    def count_customers(self, segment: Dict[str, Any]) -> int:
+        with self._lock:
+            return sum(1 for customer in self.customers.values() if customer.in_segment(segment))
+
+    def customer_ids(self, segment: Dict[str, Any], after_id: int, limit: int) -> List[int]:
+        with self._lock:
+            return sorted(telegram_id for telegram_id, customer in self.customers.items()
+                          if telegram_id > after_id and customer.in_segment(segment))[:limit]
+
+    def block_customers(self, telegram_ids: List[int]) -> None:
+        with self._lock:
+            for telegram_id in telegram_ids:
+                if telegram_id in self.customers:
+                    self.customers[telegram_id].blocked = True
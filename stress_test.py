@@ -0,0 +1,466 @@
+"""Stress test & benchmark konkurensi untuk submit bukti bayar dan /approve.
+
+Skrip ini memuat telegram_bot.py apa adanya (tanpa polling) dengan transport
+Telegram palsu, lalu memanggil handler asli `process_payment_proof_submission`
+dan `approve_payment_command` dari banyak thread atau proses terhadap file
+SQLite sementara. Setiap sale di-approve dua kali secara bersamaan untuk
+memancing balapan alokasi stok. Setelah selesai, invariant database diperiksa:
+
+  - tidak ada akun yang terjual dua kali,
+  - tidak ada sale completed tanpa akun (jumlah akun = quantity),
+  - jumlah akun terjual = total quantity sale completed,
+  - sale pending/cancelled tidak memegang akun.
+
+Hasil (approve/detik, error "database is locked", latensi) dilaporkan per
+kombinasi journal_mode dan busy_timeout. Dengan --backends sqlite,memory skenario
+yang sama juga dijalankan sekali terhadap MemoryRepository (dipasang sebagai `repo`
+bot setelah dimuat, mode thread saja), sehingga selisih latensinya menunjukkan
+biaya database:
+
+    python stress_test.py --buyers 200 --workers 8 --journal-modes delete,wal --busy-timeouts 0,100,5000
+    python stress_test.py --kind process --workers 4
+    python stress_test.py --backends sqlite,memory --journal-modes wal --busy-timeouts 5000
+
+Exit code 1 jika ada invariant yang dilanggar, worker mati, atau tidak semua bukti bayar terkirim.
+"""
+import argparse
+import contextlib
+import io
+import itertools
+import json
+import logging
+import multiprocessing
+import os
+import queue
+import random
+import runpy
+import sqlite3
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+import telebot
+from telebot import apihelper
+
+import storage
+
+BOT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'telegram_bot.py')
+BOT_RUN_NAME = 'stress_bot'
+ADMIN_ID = 999000
+DEFAULT_PRODUCT_ID = 1 # Produk hasil migrasi init_db; stok uji masuk ke produk ini
+DB_NAME = 'store_enhanced.db' # Relatif terhadap direktori kerja, sama seperti bot
+STOP = None # Sentinel antrean approve
+
+_message_ids = itertools.count(1)
+_counter_lock = threading.Lock()
+api_counters: Dict[str, int] = {'calls': 0, 'db_error_replies': 0}
+rejected_chats: Set[int] = set() # Pembeli yang menerima balasan penolakan (❌) dari bot
+_busy_timeout_sec = 5.0
+HARNESS_BUSY_TIMEOUT_SEC = 30.0 # Query milik harness sendiri (bukan handler bot) tidak ikut diukur
+_original_connect = sqlite3.connect
+
+
+# --- Transport Telegram palsu ---
+def fake_request_sender(method: str, url: str, params: Optional[dict] = None, files: Any = None,
+                        timeout: Any = None, proxies: Any = None) -> Any:
+    name = url.rsplit('/', 1)[-1]
+    params = params or {}
+    text = str(params.get('text') or '')
+    with _counter_lock:
+        api_counters['calls'] += 1
+        if 'kesalahan database' in text.lower():
+            api_counters['db_error_replies'] += 1
+        if text.startswith('❌') and params.get('chat_id') not in (None, ADMIN_ID, str(ADMIN_ID)):
+            rejected_chats.add(int(params['chat_id']))
+    if name == 'getMe':
+        result: Any = {'id': 1, 'is_bot': True, 'first_name': 'Stress', 'username': 'stressbot'}
+    elif name == 'sendMediaGroup':
+        result = [{'message_id': next(_message_ids), 'date': 0, 'chat': {'id': ADMIN_ID, 'type': 'private'}}]
+    elif name in ('sendMessage', 'sendPhoto', 'sendDocument', 'forwardMessage', 'editMessageText'):
+        result = {'message_id': next(_message_ids), 'date': 0, 'text': text,
+                  'chat': {'id': int(params.get('chat_id', ADMIN_ID)), 'type': 'private'}}
+    else:
+        result = True
+    return FakeResponse({'ok': True, 'result': result})
+
+
+class FakeResponse:
+    status_code = 200
+    reason = 'OK'
+
+    def __init__(self, payload: dict):
+        self._payload = payload
+        self.text = json.dumps(payload)
+
+    def json(self) -> dict:
+        return self._payload
+
+
+def connect_with_busy_timeout(*args: Any, **kwargs: Any) -> sqlite3.Connection:
+    """sqlite3.connect dengan busy_timeout konfigurasi benchmark (dipasang hanya di proses stress test)."""
+    kwargs.setdefault('timeout', _busy_timeout_sec)
+    return _original_connect(*args, **kwargs)
+
+
+class LockedErrorCounter(logging.Handler):
+    """Menghitung log error bot yang disebabkan 'database is locked'."""
+
+    def __init__(self) -> None:
+        super().__init__(logging.ERROR)
+        self.count = 0
+
+    def emit(self, record: logging.LogRecord) -> None:
+        text = record.getMessage() + (str(record.exc_info[1]) if record.exc_info else '')
+        if 'locked' in text:
+            with _counter_lock:
+                self.count += 1
+
+
+def load_bot(workdir: str, backend: str = 'sqlite') -> Tuple[Dict[str, Any], LockedErrorCounter]:
+    """Memuat telegram_bot.py di workdir dengan transport palsu; polling tidak dijalankan."""
+    os.chdir(workdir)
+    os.environ.update({
+        'BOT_TOKEN': '1:stress', 'ADMIN_ID': str(ADMIN_ID), 'BOT_USERNAME': 'stressbot', 'OWNER_USERNAME': 'owner',
+        'STORE_NAME': 'Stress Store', 'ADMIN_USERNAME': 'admin', 'RATE_LIMIT_BURST': '1000000',
+    })
+    apihelper.CUSTOM_REQUEST_SENDER = fake_request_sender
+    sqlite3.connect = connect_with_busy_timeout
+    locked_counter = LockedErrorCounter()
+    bot_logger = logging.getLogger(BOT_RUN_NAME)
+    bot_logger.handlers = [locked_counter] # Log bot tidak ditampilkan; hanya dihitung
+    bot_logger.setLevel(logging.ERROR)
+    bot_logger.propagate = False
+    with contextlib.redirect_stdout(io.StringIO()):
+        namespace = runpy.run_path(BOT_PATH, run_name=BOT_RUN_NAME)
+    namespace['customer_buffer'].stop()
+    if backend == 'memory':
+        install_memory_repository(namespace)
+    return namespace, locked_counter
+
+
+def install_memory_repository(namespace: Dict[str, Any]) -> None:
+    """Mengganti repository bot dengan MemoryRepository berisi pengaturan default dan produk pertama seperti init_db.
+
+    Handler membaca `repo` dari globals modul saat dipanggil, jadi penggantian ini berlaku untuk jalur submit/approve.
+    Jalur yang masih memakai SQLite langsung (laporan, pencarian admin) tidak dipakai benchmark ini. run_path
+    mengembalikan salinan globals, jadi yang diganti adalah globals asli milik fungsi bot.
+    """
+    memory_repo = storage.MemoryRepository([ADMIN_ID], owner_id=ADMIN_ID)
+    for key, value in namespace['DEFAULT_SETTINGS'].items():
+        memory_repo.set_setting(key, value)
+    memory_repo.add_product(namespace['DEFAULT_PRODUCT_NAME'], int(namespace['DEFAULT_SETTINGS']['price']), None,
+                            namespace['now_stamp']())
+    namespace['repo'] = namespace['approve_sale'].__globals__['repo'] = memory_repo
+    namespace['store_snapshot'].invalidate()
+
+
+def make_message(user_id: int, text: Optional[str] = None, photo_id: Optional[str] = None) -> telebot.types.Message:
+    data: Dict[str, Any] = {
+        'message_id': next(_message_ids), 'date': int(time.time()),
+        'chat': {'id': user_id, 'type': 'private'},
+        'from': {'id': user_id, 'is_bot': False, 'first_name': 'U', 'username': f'u{user_id}'},
+    }
+    if text is not None:
+        data['text'] = text
+    if photo_id is not None:
+        data['photo'] = [{'file_id': photo_id, 'file_unique_id': f'uniq_{photo_id}', 'width': 1, 'height': 1}]
+    return telebot.types.Message.de_json(data)
+
+
+# --- Peran worker ---
+# attempted/found/rejected/lost: jumlah submit, sale yang ditemukan, ditolak bot dengan balasan ❌, dan hilang tanpa
+# sale maupun balasan; errors: exception yang mematikan worker
+WorkerOutcome = Dict[str, Any]
+
+
+def new_outcome() -> WorkerOutcome:
+    return {'attempted': 0, 'found': 0, 'rejected': 0, 'lost': 0, 'errors': []}
+
+
+def sale_lookup(namespace: Dict[str, Any], backend: str) -> Callable[[int, str], Optional[Tuple[int, str]]]:
+    """Pencarian sale milik harness: untuk SQLite memakai koneksi sendiri dengan timeout panjang,
+    agar busy_timeout yang sedang diukur tidak mematikan worker di luar handler bot."""
+    if backend == 'memory':
+        return namespace['repo'].find_sale_by_proof
+
+    def find_sale(buyer_id: int, proof_unique_id: str) -> Optional[Tuple[int, str]]:
+        with contextlib.closing(_original_connect(DB_NAME, timeout=HARNESS_BUSY_TIMEOUT_SEC)) as conn:
+            return conn.execute("SELECT id, status FROM sales WHERE buyer_id = ? AND payment_proof_unique_id = ?",
+                                (buyer_id, proof_unique_id)).fetchone()
+    return find_sale
+
+
+def submit_worker(namespace: Dict[str, Any], backend: str, buyers: List[Tuple[int, int]], sale_queue: Any,
+                  latencies: List[float], outcome: WorkerOutcome) -> None:
+    """Mengirim bukti bayar untuk setiap (buyer_id, quantity), lalu mengantrekan sale-nya dua kali untuk di-approve."""
+    submit, find_sale = namespace['process_payment_proof_submission'], sale_lookup(namespace, backend)
+    try:
+        for buyer_id, quantity in buyers:
+            photo_id = f'proof_{buyer_id}'
+            start = time.perf_counter()
+            submit(make_message(buyer_id, photo_id=photo_id), quantity, None)
+            latencies.append(time.perf_counter() - start)
+            outcome['attempted'] += 1
+            found = find_sale(buyer_id, f'uniq_{photo_id}')
+            if found:
+                outcome['found'] += 1
+                sale_queue.put(found[0])
+                sale_queue.put(found[0]) # Approve ganda dari worker berbeda
+            elif buyer_id in rejected_chats: # Stok habis atau error database, dan pembeli sudah diberi tahu
+                outcome['rejected'] += 1
+            else:
+                outcome['lost'] += 1
+    except Exception as e:
+        outcome['errors'].append(f"submit: {type(e).__name__}: {e}")
+
+
+def approve_worker(namespace: Dict[str, Any], sale_queue: Any, latencies: List[float], outcome: WorkerOutcome) -> None:
+    approve = namespace['approve_payment_command']
+    while True:
+        sale_id = sale_queue.get()
+        if sale_id is STOP:
+            return
+        start = time.perf_counter()
+        try:
+            approve(make_message(ADMIN_ID, text=f'/approve {sale_id}'))
+        except Exception as e: # Tetap mengosongkan antrean agar submitter & STOP tidak macet
+            outcome['errors'].append(f"approve sale {sale_id}: {type(e).__name__}: {e}")
+        latencies.append(time.perf_counter() - start)
+
+
+def process_worker(role: str, workdir: str, busy_timeout_sec: float, payload: Any, sale_queue: Any,
+                   result_queue: Any, barrier: Any) -> None:
+    """Entry point mode proses: memuat bot sendiri lalu menjalankan satu peran."""
+    global _busy_timeout_sec
+    namespace, locked_counter = load_bot(workdir)
+    _busy_timeout_sec = busy_timeout_sec
+    latencies: List[float] = []
+    outcome = new_outcome()
+    barrier.wait()
+    if role == 'submit':
+        submit_worker(namespace, 'sqlite', payload, sale_queue, latencies, outcome)
+    else:
+        approve_worker(namespace, sale_queue, latencies, outcome)
+    result_queue.put((role, latencies, locked_counter.count, api_counters['db_error_replies'], outcome))
+
+
+# --- Skenario ---
+def seed_store(repo: Any, stock: int, max_quantity: int) -> None:
+    """Stok dan pengaturan uji lewat repository, sama untuk backend SQLite maupun memori."""
+    for i in range(stock):
+        repo.add_account(DEFAULT_PRODUCT_ID, f'stress{i}@example.com', 'pw', '', ('2024-01-01 00:00:00', 1704067200 + i))
+    repo.set_setting('max_purchase', str(max_quantity))
+    repo.set_setting('admin_notify_mode', 'individual')
+
+
+def prepare_database(workdir: str, journal_mode: str, stock: int, max_quantity: int) -> None:
+    global _busy_timeout_sec
+    _busy_timeout_sec = 30.0
+    os.environ['DB_JOURNAL_MODE'] = journal_mode # init_db memasang journal_mode ini (juga di proses worker)
+    namespace, _ = load_bot(workdir) # init_db membuat skema di workdir
+    seed_store(namespace['repo'], stock, max_quantity)
+
+
+# (status, quantity, buyer_id) per sale, (sale_id, account_id) per item, (sold, sold_to_id) per akun
+StoreState = Tuple[Dict[int, Tuple[str, int, int]], List[Tuple[int, int]], Dict[int, Tuple[bool, Optional[int]]]]
+
+
+def collect_sqlite_state() -> StoreState:
+    with _original_connect(DB_NAME) as conn:
+        sales = {row[0]: (row[1], row[2], row[3])
+                 for row in conn.execute("SELECT id, status, COALESCE(quantity, 1), buyer_id FROM sales")}
+        items = conn.execute("SELECT sale_id, account_id FROM sale_items WHERE account_id IS NOT NULL").fetchall()
+        accounts = {row[0]: (bool(row[1]), row[2]) for row in conn.execute("SELECT id, sold, sold_to_id FROM accounts")}
+    return sales, items, accounts
+
+
+def collect_memory_state(repo: Any) -> StoreState:
+    sales = {sale.id: (sale.status, sale.quantity, sale.buyer_id) for sale in repo.sales.values()}
+    items = [(sale_id, account_id) for sale_id, account_ids in repo.sale_items.items() for account_id in account_ids]
+    accounts = {account.id: (account.sold, account.sold_to_id) for account in repo.accounts.values()}
+    return sales, items, accounts
+
+
+def check_invariants(state: StoreState) -> List[str]:
+    sales, items, accounts = state
+    violations: List[str] = []
+    sale_counts = Counter(account_id for _, account_id in items)
+    double_sold = [(account_id, count) for account_id, count in sale_counts.items() if count > 1]
+    if double_sold:
+        violations.append(f"Akun terjual lebih dari sekali: {double_sold[:10]}")
+    item_counts = Counter(sale_id for sale_id, _ in items)
+    incomplete = [(sale_id, quantity, item_counts[sale_id]) for sale_id, (status, quantity, _) in sales.items()
+                  if status == 'completed' and item_counts[sale_id] != quantity]
+    if incomplete:
+        violations.append(f"Sale completed dengan jumlah akun salah (id, quantity, akun): {incomplete[:10]}")
+    sold_accounts = sum(1 for sold, _ in accounts.values() if sold)
+    completed_quantity = sum(quantity for status, quantity, _ in sales.values() if status == 'completed')
+    if sold_accounts != completed_quantity:
+        violations.append(f"Akun terjual ({sold_accounts}) != total quantity sale completed ({completed_quantity})")
+    wrong_buyer = [account_id for sale_id, account_id in items
+                   if account_id not in accounts or sale_id not in sales
+                   or not accounts[account_id][0] or accounts[account_id][1] != sales[sale_id][2]]
+    if wrong_buyer:
+        violations.append(f"Akun tidak cocok dengan pembelinya: {wrong_buyer[:10]}")
+    orphan_items = sum(1 for sale_id, _ in items if sales.get(sale_id, ('',))[0] != 'completed')
+    if orphan_items:
+        violations.append(f"{orphan_items} item akun menempel di sale yang tidak completed")
+    return violations
+
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct))]
+
+
+def run_scenario(args: argparse.Namespace, backend: str, journal_mode: str, busy_timeout_ms: int) -> Dict[str, Any]:
+    """Backend 'memory' selalu memakai thread: data hanya hidup di proses yang memuat bot."""
+    global _busy_timeout_sec
+    workdir = tempfile.mkdtemp(prefix='stress_')
+    if backend == 'sqlite':
+        prepare_database(workdir, journal_mode, args.stock, args.max_quantity)
+
+    rng = random.Random(args.seed)
+    buyers = [(100000 + i, rng.randint(1, args.max_quantity)) for i in range(args.buyers)]
+    submitters = max(1, args.workers // 2)
+    approvers = max(1, args.workers - submitters)
+    chunks = [buyers[i::submitters] for i in range(submitters)]
+    submit_latencies: List[float] = []
+    approve_latencies: List[float] = []
+    locked_errors = 0
+    db_error_replies = 0
+    outcomes: List[WorkerOutcome] = []
+
+    start = time.perf_counter()
+    if args.kind == 'thread' or backend == 'memory':
+        namespace, locked_counter = load_bot(workdir, backend)
+        if backend == 'memory':
+            seed_store(namespace['repo'], args.stock, args.max_quantity)
+        api_counters['db_error_replies'] = 0
+        rejected_chats.clear()
+        _busy_timeout_sec = busy_timeout_ms / 1000
+        sale_queue: Any = queue.Queue()
+        start = time.perf_counter()
+        outcomes = [new_outcome() for _ in range(submitters + approvers)]
+        submit_threads = [threading.Thread(target=submit_worker, args=(namespace, backend, chunk, sale_queue, submit_latencies, outcome))
+                          for chunk, outcome in zip(chunks, outcomes)]
+        approve_threads = [threading.Thread(target=approve_worker, args=(namespace, sale_queue, approve_latencies, outcome))
+                           for outcome in outcomes[submitters:]]
+        for t in submit_threads + approve_threads: t.start()
+        for t in submit_threads: t.join()
+        for _ in approve_threads: sale_queue.put(STOP)
+        for t in approve_threads: t.join()
+        locked_errors, db_error_replies = locked_counter.count, api_counters['db_error_replies']
+    else:
+        ctx = multiprocessing.get_context('spawn')
+        sale_queue = ctx.Queue()
+        result_queue = ctx.Queue()
+        barrier = ctx.Barrier(submitters + approvers + 1)
+        processes = [ctx.Process(target=process_worker, args=('submit', workdir, busy_timeout_ms / 1000, chunk, sale_queue, result_queue, barrier))
+                     for chunk in chunks]
+        processes += [ctx.Process(target=process_worker, args=('approve', workdir, busy_timeout_ms / 1000, None, sale_queue, result_queue, barrier))
+                      for _ in range(approvers)]
+        for p in processes: p.start()
+        barrier.wait() # Semua proses sudah memuat bot; mulai hitung waktu dari sini
+        start = time.perf_counter()
+        for _ in range(submitters):
+            role, latencies, locked, db_errors, outcome = result_queue.get()
+            submit_latencies += latencies; locked_errors += locked; db_error_replies += db_errors; outcomes.append(outcome)
+        for _ in range(approvers): sale_queue.put(STOP)
+        for _ in range(approvers):
+            role, latencies, locked, db_errors, outcome = result_queue.get()
+            approve_latencies += latencies; locked_errors += locked; db_error_replies += db_errors; outcomes.append(outcome)
+        for p in processes: p.join()
+    elapsed = time.perf_counter() - start
+
+    os.chdir(workdir)
+    state = collect_memory_state(namespace['repo']) if backend == 'memory' else collect_sqlite_state()
+    submitted = len(state[0])
+    completed = sum(1 for status, _, _ in state[0].values() if status == 'completed')
+    violations = check_invariants(state)
+    attempted = sum(outcome['attempted'] for outcome in outcomes)
+    found = sum(outcome['found'] for outcome in outcomes)
+    rejected = sum(outcome['rejected'] for outcome in outcomes)
+    lost = sum(outcome['lost'] for outcome in outcomes)
+    worker_errors = [error for outcome in outcomes for error in outcome['errors']]
+    if worker_errors:
+        violations.append(f"{len(worker_errors)} worker gagal: {worker_errors[:5]}")
+    if attempted != len(buyers):
+        violations.append(f"Hanya {attempted} dari {len(buyers)} bukti bayar yang dikirim")
+    if lost:
+        violations.append(f"{lost} bukti bayar tidak menjadi sale dan tidak dibalas penolakan")
+    if submitted != found:
+        violations.append(f"Sale di database ({submitted}) != submit yang ditemukan harness ({found})")
+    return {
+        'backend': backend, 'journal_mode': journal_mode if backend == 'sqlite' else '-',
+        'busy_timeout_ms': busy_timeout_ms if backend == 'sqlite' else 0, 'elapsed': elapsed,
+        'submitted': submitted, 'rejected': rejected, 'completed': completed, 'approvals_per_sec': completed / elapsed if elapsed else 0.0,
+        'approve_calls': len(approve_latencies), 'locked_errors': locked_errors, 'db_error_replies': db_error_replies,
+        'locked_rate': locked_errors / max(1, len(approve_latencies) + len(submit_latencies)),
+        'approve_p50_ms': statistics.median(approve_latencies) * 1000 if approve_latencies else 0.0,
+        'approve_p95_ms': percentile(approve_latencies, 0.95) * 1000,
+        'submit_p95_ms': percentile(submit_latencies, 0.95) * 1000,
+        'violations': violations, 'workdir': workdir,
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Stress test konkurensi submit bukti bayar & /approve terhadap SQLite sementara.")
+    parser.add_argument('--kind', choices=('thread', 'process'), default='thread', help="Worker berupa thread atau proses")
+    parser.add_argument('--workers', type=int, default=8, help="Jumlah worker (separuh submit, separuh approve)")
+    parser.add_argument('--buyers', type=int, default=200, help="Jumlah pembeli (satu bukti bayar per pembeli)")
+    parser.add_argument('--stock', type=int, default=250, help="Jumlah akun stok awal (buat lebih kecil dari permintaan untuk memancing stok habis)")
+    parser.add_argument('--max-quantity', type=int, default=3, help="Quantity maksimal per pembelian")
+    parser.add_argument('--journal-modes', default='delete,wal', help="Daftar journal_mode dipisah koma")
+    parser.add_argument('--busy-timeouts', default='0,100,5000', help="Daftar busy_timeout (ms) dipisah koma")
+    parser.add_argument('--backends', default='sqlite', help="Backend storage dipisah koma: sqlite, memory")
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args(argv)
+    backends = [b.strip() for b in args.backends.split(',') if b.strip()]
+    unknown = set(backends) - {'sqlite', 'memory'}
+    if unknown:
+        parser.error(f"Backend tidak dikenal: {', '.join(sorted(unknown))}")
+
+    scenarios = [(backend, journal_mode.strip(), int(busy_timeout_ms)) for backend in backends if backend == 'sqlite'
+                 for journal_mode in args.journal_modes.split(',') for busy_timeout_ms in args.busy_timeouts.split(',')]
+    if 'memory' in backends:
+        scenarios.append(('memory', '-', 0)) # journal_mode/busy_timeout tidak berlaku
+    results = []
+    for backend, journal_mode, busy_timeout_ms in scenarios:
+        result = run_scenario(args, backend, journal_mode, busy_timeout_ms)
+        results.append(result)
+        print(f"[{result['backend']:>6} | {result['journal_mode']:>8} | busy {result['busy_timeout_ms']:>5} ms] "
+              f"{'OK' if not result['violations'] else 'GAGAL'}", file=sys.stderr)
+
+    header = f"{'backend':>7} {'journal':>8} {'busy_ms':>7} {'sale':>5} {'tolak':>5} {'done':>5} {'approve/s':>9} {'locked':>6} {'locked%':>7} {'db_err':>6} {'appr_p50':>8} {'appr_p95':>8} {'subm_p95':>8}  invariant"
+    print(f"\nMode: {args.kind}, worker: {args.workers}, pembeli: {args.buyers}, stok: {args.stock}, quantity maks: {args.max_quantity}\n")
+    print(header)
+    print('-' * len(header))
+    for r in results:
+        print(f"{r['backend']:>7} {r['journal_mode']:>8} {r['busy_timeout_ms']:>7} {r['submitted']:>5} {r['rejected']:>5} {r['completed']:>5} {r['approvals_per_sec']:>9.1f} "
+              f"{r['locked_errors']:>6} {r['locked_rate']:>7.1%} {r['db_error_replies']:>6} {r['approve_p50_ms']:>8.1f} "
+              f"{r['approve_p95_ms']:>8.1f} {r['submit_p95_ms']:>8.1f}  {'OK' if not r['violations'] else 'GAGAL'}")
+    memory = next((r for r in results if r['backend'] == 'memory'), None)
+    if memory:
+        print("\nBiaya database dibanding backend memori (selisih latensi p50 approve / p95 submit):")
+        for r in results:
+            if r['backend'] == 'sqlite':
+                print(f"  {r['journal_mode']:>8}, busy {r['busy_timeout_ms']:>5} ms: "
+                      f"approve +{r['approve_p50_ms'] - memory['approve_p50_ms']:.1f} ms, "
+                      f"submit +{r['submit_p95_ms'] - memory['submit_p95_ms']:.1f} ms")
+    failed = [r for r in results if r['violations']]
+    for r in failed:
+        print(f"\nPelanggaran invariant ({r['backend']}, {r['journal_mode']}, busy {r['busy_timeout_ms']} ms, DB: {r['workdir']}):")
+        for violation in r['violations']:
+            print(f"  - {violation}")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -2,16 +2,36 @@ import telebot
 from telebot.types import (
     InlineKeyboardMarkup, InlineKeyboardButton,
     ReplyKeyboardMarkup, KeyboardButton, Message,
-    CallbackQuery
+    CallbackQuery, InputMediaPhoto, InputMediaDocument,
+    InlineQuery, InlineQueryResultArticle, InputTextMessageContent
 )
+from telebot.formatting import escape_markdown
 import sqlite3
 import os
+import io
 from datetime import datetime, timedelta
 from dotenv import load_dotenv
 import logging
 import sys
-from functools import wraps
-from typing import Optional, List, Tuple, Any, Dict
+import threading
+import atexit
+import json
+import signal
+import time
+from collections import deque
+from functools import wraps, lru_cache
+from typing import Optional, List, Tuple, Any, Dict, NamedTuple, Callable, Iterator, Set
+import random
+
+import events
+import health_server
+import http_transport
+import reconcile
+import report_executor
+import stock_spool
+import storage
+import traffic_capture
+import update_profiler
 
 # Setup logging
 logging.basicConfig(
@@ -26,6 +46,25 @@ logger = logging.getLogger(__name__)
 
 # --- Konstanta ---
 DB_NAME = 'store_enhanced.db'
+ARCHIVE_DB_NAME = 'store_archive.db'
+ARCHIVE_BATCH_SIZE = 500 # Jumlah baris per transaksi saat memindahkan data ke arsip
+ARCHIVE_MIN_AGE_DAYS = 30 # Laporan penjualan membaca 30 hari terakhir dari tabel utama
+ADMIN_QUEUE_PREVIEW_SIZE = 5 # Jumlah sale terbaru yang ditampilkan di pesan antrean admin
+MEDIA_GROUP_MAX = 10 # Batas item per album (sendMediaGroup)
+# Karakter entitas parse_mode 'Markdown' (lama); di dalam *...* backslash tidak berlaku, jadi nama produk tidak boleh memuatnya
+MARKDOWN_SPECIAL_CHARS = '_*`['
+# Kolom epoch INTEGER (detik) dan kolom tanggal TEXT sumbernya, per tabel
+EPOCH_COLUMNS: Dict[str, List[Tuple[str, str]]] = {
+    'accounts': [('added_ts', 'date_added'), ('sold_ts', 'sold_date')],
+    'sales': [('created_ts', 'created_date'), ('completed_ts', 'completed_date')],
+    'customers': [('join_ts', 'join_date'), ('last_seen_ts', 'last_seen')],
+}
+# Index FTS5 (external content): nama index -> (tabel sumber, kolom teks, kolom rowid)
+SEARCH_INDEXES: Dict[str, Tuple[str, Tuple[str, ...], str]] = {
+    'accounts_fts': ('accounts', ('email', 'notes'), 'id'),
+    'sales_fts': ('sales', ('buyer_username', 'admin_notes'), 'id'),
+    'customers_fts': ('customers', ('username', 'last_username'), 'telegram_id'),
+}
 
 class AdminCallbackData:
     # Produk
@@ -36,12 +75,18 @@ class AdminCallbackData:
     CONFIRM_DELETE_ACCOUNT_PREFIX = "adm_confirm_delete_acc_"
     CANCEL_BACK_PRODUCT = "adm_cancel_back_product"
     BACK_TO_PRODUCT = "adm_back_product"
+    CATALOG = "adm_catalog"
+    ADD_PRODUCT = "adm_add_product"
+    ADD_ACCOUNT_TO_PRODUCT_PREFIX = "adm_add_acc_to_" # + ID produk
+    PRODUCT_PRICE_PREFIX = "adm_product_price_" # + ID produk
+    TOGGLE_PRODUCT_PREFIX = "adm_toggle_product_" # + ID produk
 
     # Keuangan
     PAYMENT_METHODS = "adm_payment_methods"
     PRICE_SETTINGS = "adm_price_settings"
     SALES_REPORT = "adm_sales_report"
     PENDING_PAYMENTS_MENU = "adm_pending_payments_menu"
+    RECONCILE_STATEMENT = "adm_reconcile_statement"
     ADD_PAYMENT_METHOD = "adm_add_payment_method"
     TOGGLE_PAYMENT_METHOD_PREFIX = "adm_toggle_pm_"
     DELETE_PAYMENT_METHOD_PREFIX = "adm_delete_pm_"
@@ -51,10 +96,48 @@ class AdminCallbackData:
 
     # Pengaturan
     TOGGLE_MAINTENANCE = "adm_toggle_maintenance"
+    TOGGLE_NOTIFY_MODE = "adm_toggle_notify_mode"
     # PRICE_SETTINGS dan PAYMENT_METHODS bisa diakses dari menu Keuangan & Pengaturan
 
+    # Pencarian
+    SEARCH_PAGE_PREFIX = "adm_search_page_" # + nomor halaman
+
+    # Broadcast
+    BROADCAST_SEGMENT_PREFIX = "adm_bc_seg_" # + kunci segmen (semua, pembeli, aktif_7, produk_2, ...)
+
+    # Laporan
+    REPORT_CANCEL_PREFIX = "adm_report_cancel_" # + nama laporan (stats, accounts, stock, sales)
+
     # Umum
     CANCEL_ACTION = "adm_cancel_action" # General cancel, might remove current message's keyboard
+
+class UserCallbackData:
+    CONFIRM_PURCHASE = "user_confirm_purchase_send_proof"
+    HISTORY_PAGE_PREFIX = "user_hist_" # + ID sale terakhir di halaman sebelumnya (keyset)
+    RESEND_ACCOUNT_PREFIX = "user_resend_" # + ID sale
+    BUY_PRODUCT_PREFIX = "user_buy_" # + ID produk
+
+class StaffCallbackData: # Bisa dipakai semua anggota roster admin (termasuk verifikator)
+    CLAIM_NEXT_PREFIX = "staff_next_" # + ID sale terakhir yang dilihat (0 = dari awal)
+    APPROVE_PREFIX = "staff_approve_" # + ID sale
+    REJECT_PREFIX = "staff_reject_" # + ID sale
+
+ADMIN_ROLES = ('admin', 'verifier') # admin = akses penuh, verifier = hanya verifikasi pembayaran
+HISTORY_PAGE_SIZE = 5
+SEARCH_PAGE_SIZE = 10
+PROCESSED_UPDATES_MAXLEN = 10000 # Ukuran ring update_id yang sudah diproses (di memori)
+UNIQUE_CODE_MAX = 999 # Kode unik pembayaran 1..999 ditambahkan ke total agar bisa dicocokkan dengan mutasi
+DEFAULT_PRODUCT_ID = 1 # Produk hasil migrasi dari toko satu produk; juga dipakai tombol lama tanpa ID produk
+DEFAULT_SETTINGS: Dict[str, str] = {
+    'price': '50000', # Hanya harga awal produk pertama saat migrasi; harga kini disimpan per produk
+    'maintenance_mode': 'off',
+    'min_purchase': '1',
+    'max_purchase': '1',
+    'archive_after_days': '90',
+    'reconcile_window_hours': '24',
+    'admin_notify_mode': 'batch' # 'batch' = antrean live + album bukti, 'individual' = satu notifikasi per pembayaran
+}
+SCHEMA_VERSION = 6 # Disimpan di PRAGMA user_version oleh init_db; naikkan jika skema berubah
 # --- End Konstanta ---
 
 try:
@@ -69,6 +152,54 @@ try:
     ADMIN_USERNAME: Optional[str] = os.getenv('ADMIN_USERNAME')
     PAYMENT_METHODS_STR: str = os.getenv('PAYMENT_METHODS', 'DANA,OVO,GOPAY,BCA,BRI')
     PAYMENT_METHODS: List[str] = PAYMENT_METHODS_STR.split(',') if PAYMENT_METHODS_STR else []
+    # Write-behind customer: flush tiap N ms atau saat M baris terkumpul
+    CUSTOMER_FLUSH_INTERVAL_MS: int = int(os.getenv('CUSTOMER_FLUSH_INTERVAL_MS', '1000'))
+    CUSTOMER_FLUSH_MAX_ROWS: int = int(os.getenv('CUSTOMER_FLUSH_MAX_ROWS', '500'))
+    # Rate limit per user (token bucket): kapasitas burst dan token yang terisi per detik
+    RATE_LIMIT_BURST: float = float(os.getenv('RATE_LIMIT_BURST', '8'))
+    RATE_LIMIT_REFILL_PER_SEC: float = float(os.getenv('RATE_LIMIT_REFILL_PER_SEC', '1'))
+    # Notifikasi admin digabung: pesan antrean diperbarui paling cepat tiap N detik
+    ADMIN_NOTIFY_DEBOUNCE_SEC: float = float(os.getenv('ADMIN_NOTIFY_DEBOUNCE_SEC', '3'))
+    # Profiler update: aktif jika PROFILE_SAMPLE_RATE > 0 (bisa juga lewat /profile on)
+    PROFILE_SAMPLE_RATE: float = float(os.getenv('PROFILE_SAMPLE_RATE', '0'))
+    PROFILE_THRESHOLD_MS: float = float(os.getenv('PROFILE_THRESHOLD_MS', '500'))
+    PROFILE_MAX_CAPTURES: int = int(os.getenv('PROFILE_MAX_CAPTURES', '20'))
+    # Inline query: lama jawaban di-cache Telegram, dan umur maksimal snapshot toko di memori
+    INLINE_CACHE_TIME_SEC: int = int(os.getenv('INLINE_CACHE_TIME_SEC', '30'))
+    STORE_SNAPSHOT_MAX_AGE_SEC: float = float(os.getenv('STORE_SNAPSHOT_MAX_AGE_SEC', '60'))
+    # Health server HTTP (/healthz, /readyz, /metrics, /status); 0 = nonaktif
+    HEALTH_PORT: int = int(os.getenv('HEALTH_PORT', '0'))
+    HEALTH_MAX_POLL_GAP_SEC: float = float(os.getenv('HEALTH_MAX_POLL_GAP_SEC', '120'))
+    # Graceful shutdown: batas waktu menunggu handler yang sedang berjalan setelah SIGTERM
+    SHUTDOWN_DRAIN_SEC: float = float(os.getenv('SHUTDOWN_DRAIN_SEC', '20'))
+    # Laporan admin berat dibuat di pool thread terpisah dengan koneksi read-only; batas waktu dasar per laporan
+    REPORT_WORKERS: int = int(os.getenv('REPORT_WORKERS', '2'))
+    REPORT_TIMEOUT_SEC: float = float(os.getenv('REPORT_TIMEOUT_SEC', '30'))
+    # Journal mode yang dipasang init_db; WAL membuat laporan read-only tidak menahan penulis. Kosong = tidak diubah
+    DB_JOURNAL_MODE: str = os.getenv('DB_JOURNAL_MODE', 'wal').lower()
+    # Rekaman update mentah (pseudonim) untuk replay.py; kosong = nonaktif. Tanpa SALT pseudonim berganti tiap restart
+    TRAFFIC_CAPTURE_DIR: str = os.getenv('TRAFFIC_CAPTURE_DIR', '')
+    TRAFFIC_CAPTURE_SALT: str = os.getenv('TRAFFIC_CAPTURE_SALT', '')
+    TRAFFIC_CAPTURE_MAX_MB: float = float(os.getenv('TRAFFIC_CAPTURE_MAX_MB', '50'))
+    TRAFFIC_CAPTURE_KEEP_FILES: int = int(os.getenv('TRAFFIC_CAPTURE_KEEP_FILES', '20'))
+    # Impor stok dari file di direktori spool (format email|password|catatan); kosong = nonaktif
+    STOCK_SPOOL_DIR: str = os.getenv('STOCK_SPOOL_DIR', '')
+    STOCK_SPOOL_POLL_SEC: float = float(os.getenv('STOCK_SPOOL_POLL_SEC', '5'))
+    STOCK_IMPORT_BATCH_SIZE: int = int(os.getenv('STOCK_IMPORT_BATCH_SIZE', '500'))
+    # Admin diberi tahu sekali saat stok produk aktif turun di bawah batas ini; 0 = nonaktif
+    LOW_STOCK_THRESHOLD: int = int(os.getenv('LOW_STOCK_THRESHOLD', '5'))
+    # Transport HTTP ke Telegram: 'pooled' = satu pool koneksi keep-alive bersama (http_transport.py), 'telebot' = bawaan telebot
+    HTTP_TRANSPORT: str = os.getenv('HTTP_TRANSPORT', 'pooled').lower()
+    HTTP_POOL_SIZE: int = int(os.getenv('HTTP_POOL_SIZE', '0')) # 0 = sesuai jumlah thread yang memanggil API
+    HTTP_MAX_RETRIES: int = int(os.getenv('HTTP_MAX_RETRIES', '2')) # Hanya untuk error koneksi, bukan read timeout
+    HTTP_METHOD_TIMEOUTS: Dict[str, Tuple[float, float]] = http_transport.parse_method_timeouts(os.getenv('HTTP_METHOD_TIMEOUTS', ''))
+    # Lama klaim (lease) sale pending oleh satu admin sebelum bisa diambil admin lain
+    ADMIN_CLAIM_LEASE_SEC: int = int(os.getenv('ADMIN_CLAIM_LEASE_SEC', '600'))
+    # Nama produk pertama saat database lama (satu produk) dimigrasi ke katalog
+    DEFAULT_PRODUCT_NAME: str = os.getenv('DEFAULT_PRODUCT_NAME', 'Blackbox.ai Premium')
+    # Lokasi database; multi_store.py memberi file terpisah untuk tiap toko
+    DB_NAME = os.getenv('DB_PATH', DB_NAME)
+    ARCHIVE_DB_NAME = os.getenv('ARCHIVE_DB_PATH', ARCHIVE_DB_NAME)
 
     if not all([TOKEN, ADMIN_ID_STR, BOT_USERNAME, OWNER_USERNAME, STORE_NAME, ADMIN_USERNAME]):
         raise ValueError("Variabel lingkungan yang wajib ada hilang (TOKEN, ADMIN_ID, BOT_USERNAME, OWNER_USERNAME, STORE_NAME, ADMIN_USERNAME)")
@@ -78,12 +209,30 @@ try:
         ADMIN_ID = int(ADMIN_ID_STR)
     except ValueError:
         raise ValueError("Variabel lingkungan ADMIN_ID harus berupa integer (Telegram User ID).")
+    if DB_JOURNAL_MODE not in ('', 'wal', 'delete', 'truncate', 'persist'):
+        raise ValueError("Variabel lingkungan DB_JOURNAL_MODE harus 'wal', 'delete', 'truncate', 'persist', atau kosong.")
+    if HTTP_TRANSPORT not in ('pooled', 'telebot'):
+        raise ValueError("Variabel lingkungan HTTP_TRANSPORT harus 'pooled' atau 'telebot'.")
+    if any(char in DEFAULT_PRODUCT_NAME for char in MARKDOWN_SPECIAL_CHARS):
+        raise ValueError(f"Variabel lingkungan DEFAULT_PRODUCT_NAME tidak boleh mengandung karakter {' '.join(MARKDOWN_SPECIAL_CHARS)}.")
 
     print(f"=== {STORE_NAME} Bot (Enhanced) ===")
     print("Memulai bot...")
 
     logger.info("Inisialisasi bot...")
     bot = telebot.TeleBot(TOKEN, parse_mode='Markdown') # Set parse_mode global ke Markdown
+    http_sender: Optional[http_transport.TelegramTransport] = None
+    # Sender yang sudah dipasang (skrip uji/replay, atau toko lain di multi_store.py yang berbagi pool) tidak ditimpa
+    if HTTP_TRANSPORT == 'pooled' and telebot.apihelper.CUSTOM_REQUEST_SENDER is None:
+        worker_pool = getattr(bot, 'worker_pool', None)
+        # Worker update + pool laporan + polling, notifikasi admin, broadcast, event bus
+        pool_size = HTTP_POOL_SIZE or (worker_pool.num_threads if worker_pool else 1) + REPORT_WORKERS + 4
+        http_sender = http_transport.TelegramTransport(pool_size, HTTP_METHOD_TIMEOUTS, HTTP_MAX_RETRIES,
+                                                       default_timeout=(telebot.apihelper.CONNECT_TIMEOUT, telebot.apihelper.READ_TIMEOUT))
+        telebot.apihelper.CUSTOM_REQUEST_SENDER = http_sender
+        logger.info(f"Transport HTTP Telegram: pool keep-alive {pool_size} koneksi.")
+    health_state = health_server.HealthState(HEALTH_MAX_POLL_GAP_SEC)
+    logger.addHandler(health_server.DbLockCounter(health_state)) # Hitung error 'database is locked' untuk /metrics
     me = bot.get_me()
     print(f"Nama Bot: {me.first_name}")
     print(f"Username Bot: @{me.username}")
@@ -96,6 +245,9 @@ try:
             with sqlite3.connect(DB_NAME) as conn:
                 c = conn.cursor()
                 c.execute('PRAGMA foreign_keys = ON;')
+                if DB_JOURNAL_MODE:
+                    c.execute(f'PRAGMA journal_mode = {DB_JOURNAL_MODE}')
+                previous_version = c.execute('PRAGMA user_version').fetchone()[0]
 
                 c.execute('''CREATE TABLE IF NOT EXISTS accounts
                              (id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -140,13 +292,7 @@ try:
                              (key TEXT PRIMARY KEY,
                               value TEXT)''')
 
-                default_settings: Dict[str, str] = {
-                    'price': '50000',
-                    'maintenance_mode': 'off',
-                    'min_purchase': '1',
-                    'max_purchase': '1'
-                }
-                for key, value in default_settings.items():
+                for key, value in DEFAULT_SETTINGS.items():
                     c.execute('INSERT OR IGNORE INTO settings (key, value) VALUES (?, ?)', (key, value))
 
                 # Migrasi skema (jika diperlukan)
@@ -160,22 +306,220 @@ try:
                     logger.info("Kolom 'admin_notes' ditambahkan ke tabel 'sales'.")
                 except sqlite3.OperationalError:
                     pass
+                try:
+                    c.execute('ALTER TABLE customers ADD COLUMN last_seen TEXT;')
+                    c.execute('ALTER TABLE customers ADD COLUMN last_username TEXT;')
+                    logger.info("Kolom 'last_seen' dan 'last_username' ditambahkan ke tabel 'customers'.")
+                except sqlite3.OperationalError:
+                    pass
+                try:
+                    c.execute('ALTER TABLE sales ADD COLUMN quantity INTEGER DEFAULT 1;')
+                    logger.info("Kolom 'quantity' ditambahkan ke tabel 'sales'.")
+                except sqlite3.OperationalError:
+                    pass
+                try:
+                    c.execute('ALTER TABLE sales ADD COLUMN payment_proof_unique_id TEXT;')
+                    logger.info("Kolom 'payment_proof_unique_id' ditambahkan ke tabel 'sales'.")
+                except sqlite3.OperationalError:
+                    pass
+                try:
+                    c.execute('ALTER TABLE sales ADD COLUMN unique_code INTEGER;')
+                    c.execute('ALTER TABLE sales ADD COLUMN expected_amount INTEGER;')
+                    logger.info("Kolom 'unique_code' dan 'expected_amount' ditambahkan ke tabel 'sales'.")
+                except sqlite3.OperationalError:
+                    pass
 
+                # Katalog produk; produk pertama dibuat dari harga lama (setting 'price') agar data satu produk tetap valid
+                c.execute('''CREATE TABLE IF NOT EXISTS products
+                             (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                              name TEXT UNIQUE NOT NULL,
+                              description TEXT,
+                              price INTEGER NOT NULL CHECK(price > 0),
+                              active INTEGER DEFAULT 1,
+                              sort_order INTEGER DEFAULT 0,
+                              created_date TEXT,
+                              created_ts INTEGER)''')
+                c.execute('SELECT COUNT(*) FROM products')
+                if c.fetchone()[0] == 0:
+                    c.execute("SELECT value FROM settings WHERE key = 'price'")
+                    legacy_price = ''.join(filter(str.isdigit, c.fetchone()[0] or '')) or DEFAULT_SETTINGS['price']
+                    created_date_str, created_ts = now_stamp()
+                    c.execute('INSERT INTO products (id, name, price, created_date, created_ts) VALUES (?, ?, ?, ?, ?)',
+                              (DEFAULT_PRODUCT_ID, DEFAULT_PRODUCT_NAME, int(legacy_price), created_date_str, created_ts))
+                    logger.info(f"Produk '{DEFAULT_PRODUCT_NAME}' dibuat dari harga lama {legacy_price}.")
+                for table in ('accounts', 'sales'):
+                    try:
+                        # Tanpa REFERENCES: SQLite menolak kolom FK dengan default non-NULL saat foreign_keys aktif.
+                        # Default membuat INSERT lama (skrip/impor tanpa product_id) tetap masuk ke produk utama.
+                        c.execute(f'ALTER TABLE {table} ADD COLUMN product_id INTEGER NOT NULL DEFAULT {DEFAULT_PRODUCT_ID};')
+                        logger.info(f"Kolom 'product_id' ditambahkan ke tabel '{table}'.")
+                    except sqlite3.OperationalError:
+                        pass
+
+                # Item pesanan: satu baris per akun yang terkirim untuk sebuah sale
+                c.execute('''CREATE TABLE IF NOT EXISTS sale_items
+                             (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                              sale_id INTEGER NOT NULL,
+                              account_id INTEGER,
+                              FOREIGN KEY(sale_id) REFERENCES sales(id) ON DELETE CASCADE,
+                              FOREIGN KEY(account_id) REFERENCES accounts(id) ON DELETE SET NULL)''')
+                c.execute('CREATE INDEX IF NOT EXISTS idx_sale_items_sale ON sale_items(sale_id)')
+
+                # Roster admin; ADMIN_ID dari environment selalu admin penuh
+                c.execute('''CREATE TABLE IF NOT EXISTS admins
+                             (telegram_id INTEGER PRIMARY KEY,
+                              role TEXT NOT NULL DEFAULT 'verifier' CHECK(role IN ('admin', 'verifier')),
+                              active INTEGER DEFAULT 1,
+                              assigned_count INTEGER DEFAULT 0, -- Jumlah notifikasi diterima (round-robin)
+                              added_date TEXT,
+                              added_ts INTEGER)''')
+                added_date_str, added_ts = now_stamp()
+                c.execute('''INSERT INTO admins (telegram_id, role, active, added_date, added_ts) VALUES (?, 'admin', 1, ?, ?)
+                             ON CONFLICT(telegram_id) DO UPDATE SET role = 'admin', active = 1''', (ADMIN_ID, added_date_str, added_ts))
+                # Klaim sale pending oleh admin: claimed_until (epoch) = akhir lease
+                try:
+                    c.execute('ALTER TABLE sales ADD COLUMN claimed_by INTEGER;')
+                    c.execute('ALTER TABLE sales ADD COLUMN claimed_until INTEGER;')
+                    logger.info("Kolom 'claimed_by' dan 'claimed_until' ditambahkan ke tabel 'sales'.")
+                except sqlite3.OperationalError:
+                    pass
+
+                # Agregat per customer untuk segmen broadcast, dijaga trigger di tabel sales (lihat bawah)
+                rebuild_stats = False
+                try:
+                    c.execute('ALTER TABLE customers ADD COLUMN order_count INTEGER NOT NULL DEFAULT 0;')
+                    c.execute('ALTER TABLE customers ADD COLUMN purchase_count INTEGER NOT NULL DEFAULT 0;')
+                    c.execute('ALTER TABLE customers ADD COLUMN last_purchase_ts INTEGER;')
+                    rebuild_stats = True
+                    logger.info("Kolom 'order_count', 'purchase_count' dan 'last_purchase_ts' ditambahkan ke tabel 'customers'.")
+                except sqlite3.OperationalError:
+                    pass
+                c.execute('''CREATE TABLE IF NOT EXISTS customer_products
+                             (product_id INTEGER NOT NULL,
+                              telegram_id INTEGER NOT NULL,
+                              purchase_count INTEGER NOT NULL DEFAULT 0,
+                              last_purchase_ts INTEGER,
+                              PRIMARY KEY (product_id, telegram_id)) WITHOUT ROWID''')
+                # Baris customer baru ditulis buffer aktivitas ~1 detik kemudian; trigger membuat barisnya sendiri agar order tidak hilang
+                if 0 < previous_version < 6: # Trigger versi lama hanya UPDATE; ganti dan hitung ulang agregat yang sudah kurang
+                    c.execute('DROP TRIGGER IF EXISTS customer_stats_sale_ai')
+                    c.execute('DROP TRIGGER IF EXISTS customer_stats_sale_completed')
+                    rebuild_stats = True
+                c.execute('''CREATE TRIGGER IF NOT EXISTS customer_stats_sale_ai AFTER INSERT ON sales BEGIN
+                                 INSERT INTO customers (telegram_id, username, join_date, join_ts, last_username, order_count)
+                                 VALUES (new.buyer_id, new.buyer_username, new.created_date, new.created_ts, new.buyer_username, 1)
+                                 ON CONFLICT(telegram_id) DO UPDATE SET order_count = order_count + 1;
+                             END''')
+                c.execute(f'''CREATE TRIGGER IF NOT EXISTS customer_stats_sale_completed AFTER UPDATE OF status ON sales
+                              WHEN new.status = 'completed' AND old.status IS NOT 'completed' BEGIN
+                                  INSERT INTO customers (telegram_id, username, join_date, join_ts, last_username, purchase_count, last_purchase_ts)
+                                  VALUES (new.buyer_id, new.buyer_username, new.created_date, new.created_ts, new.buyer_username, 1, new.completed_ts)
+                                  ON CONFLICT(telegram_id) DO UPDATE SET purchase_count = purchase_count + 1,
+                                      last_purchase_ts = MAX(COALESCE(last_purchase_ts, 0), COALESCE(excluded.last_purchase_ts, 0));
+                                  INSERT INTO customer_products (product_id, telegram_id, purchase_count, last_purchase_ts)
+                                  VALUES (COALESCE(new.product_id, {DEFAULT_PRODUCT_ID}), new.buyer_id, 1, new.completed_ts)
+                                  ON CONFLICT(product_id, telegram_id) DO UPDATE SET purchase_count = purchase_count + 1,
+                                      last_purchase_ts = MAX(COALESCE(last_purchase_ts, 0), COALESCE(excluded.last_purchase_ts, 0));
+                              END''')
+
+                # Stok per produk (akun belum terjual) dijaga trigger, agar katalog & alert stok rendah tidak perlu COUNT
+                try:
+                    c.execute('ALTER TABLE products ADD COLUMN stock INTEGER NOT NULL DEFAULT 0;')
+                    c.execute('''UPDATE products SET stock = (SELECT COUNT(*) FROM accounts a WHERE a.product_id = products.id AND a.sold = 0)''')
+                    logger.info("Kolom 'stock' ditambahkan ke tabel 'products' dan diisi dari tabel 'accounts'.")
+                except sqlite3.OperationalError:
+                    pass
+                c.execute('''CREATE TRIGGER IF NOT EXISTS product_stock_account_ai AFTER INSERT ON accounts WHEN new.sold = 0 BEGIN
+                                 UPDATE products SET stock = stock + 1 WHERE id = new.product_id;
+                             END''')
+                c.execute('''CREATE TRIGGER IF NOT EXISTS product_stock_account_ad AFTER DELETE ON accounts WHEN old.sold = 0 BEGIN
+                                 UPDATE products SET stock = stock - 1 WHERE id = old.product_id;
+                             END''')
+                c.execute('''CREATE TRIGGER IF NOT EXISTS product_stock_account_au AFTER UPDATE OF sold, product_id ON accounts BEGIN
+                                 UPDATE products SET stock = stock - 1 WHERE id = old.product_id AND old.sold = 0;
+                                 UPDATE products SET stock = stock + 1 WHERE id = new.product_id AND new.sold = 0;
+                             END''')
+
+                # Kolom epoch (INTEGER) pendamping kolom tanggal TEXT untuk filter rentang & urutan
+                for table, columns in EPOCH_COLUMNS.items():
+                    for ts_col, _text_col in columns:
+                        try:
+                            c.execute(f'ALTER TABLE {table} ADD COLUMN {ts_col} INTEGER;')
+                            logger.info(f"Kolom '{ts_col}' ditambahkan ke tabel '{table}'.")
+                        except sqlite3.OperationalError:
+                            pass
+                backfill_epoch_columns(conn)
+                c.execute('DROP INDEX IF EXISTS idx_accounts_unsold') # Digantikan index berbasis epoch
+                c.execute('DROP INDEX IF EXISTS idx_sales_buyer_created')
+                c.execute('DROP INDEX IF EXISTS idx_accounts_unsold_ts') # Digantikan index per produk
+                # Stok per produk & urutan alokasi (terlama dulu) hanya atas akun yang belum terjual
+                c.execute('CREATE INDEX IF NOT EXISTS idx_accounts_product_unsold ON accounts(product_id, added_ts, id) WHERE sold = 0')
+                c.execute('CREATE INDEX IF NOT EXISTS idx_accounts_sold_ts ON accounts(sold_ts) WHERE sold = 1')
+                # Riwayat pembelian per user (keyset pagination)
+                c.execute('CREATE INDEX IF NOT EXISTS idx_sales_buyer_created_ts ON sales(buyer_id, created_ts)')
+                # Laporan penjualan (rentang created_ts) dan pendapatan harian (status + rentang completed_ts)
+                c.execute('CREATE INDEX IF NOT EXISTS idx_sales_created_ts ON sales(created_ts)')
+                c.execute('CREATE INDEX IF NOT EXISTS idx_sales_status_completed_ts ON sales(status, completed_ts)')
+                # Satu bukti pembayaran (file_unique_id Telegram) hanya boleh membuat satu sale per buyer
+                c.execute('''CREATE UNIQUE INDEX IF NOT EXISTS idx_sales_buyer_proof ON sales(buyer_id, payment_proof_unique_id)
+                             WHERE payment_proof_unique_id IS NOT NULL''')
+                c.execute("CREATE INDEX IF NOT EXISTS idx_sales_pending_amount ON sales(expected_amount) WHERE status = 'pending'")
+                # Antrean klaim: sale pending berikutnya setelah ID tertentu
+                c.execute("CREATE INDEX IF NOT EXISTS idx_sales_pending_claim ON sales(id, claimed_until) WHERE status = 'pending'")
+                # Segmen broadcast: tiap segmen dilayani index parsial sendiri, urut telegram_id untuk kursor keyset
+                c.execute('CREATE INDEX IF NOT EXISTS idx_customers_buyers ON customers(telegram_id) WHERE is_blocked = 0 AND purchase_count > 0')
+                c.execute('CREATE INDEX IF NOT EXISTS idx_customers_non_buyers ON customers(telegram_id, order_count) WHERE is_blocked = 0 AND purchase_count = 0')
+                c.execute('CREATE INDEX IF NOT EXISTS idx_customers_last_seen ON customers(last_seen_ts, telegram_id) WHERE is_blocked = 0')
+                ensure_search_indexes(conn)
+
+                c.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
                 conn.commit()
+            prepare_archive()
+            if rebuild_stats: # Kolom agregat baru: isi dari riwayat penjualan (termasuk arsip)
+                rebuild_customer_stats()
             print("Database berhasil diinisialisasi!")
         except sqlite3.Error as e:
             logger.critical(f"Gagal inisialisasi database: {e}", exc_info=True)
             print(f"KRITIKAL: Gagal inisialisasi database - {e}")
             sys.exit(1)
 
+    def backfill_epoch_columns(conn: sqlite3.Connection, schema: str = 'main', tables: Optional[List[str]] = None) -> None:
+        """Mengisi kolom epoch yang masih kosong dari kolom tanggal TEXT (waktu lokal)."""
+        for table in tables or list(EPOCH_COLUMNS):
+            for ts_col, text_col in EPOCH_COLUMNS.get(table, []):
+                conn.execute(f"""UPDATE {schema}.{table} SET {ts_col} = CAST(strftime('%s', {text_col}, 'utc') AS INTEGER)
+                                 WHERE {ts_col} IS NULL AND {text_col} IS NOT NULL""")
+
+    def now_stamp() -> Tuple[str, int]:
+        """Waktu sekarang sebagai (teks '%Y-%m-%d %H:%M:%S', epoch detik) untuk pasangan kolom tanggal & *_ts."""
+        now = datetime.now().replace(microsecond=0)
+        return now.strftime('%Y-%m-%d %H:%M:%S'), int(now.timestamp())
+
+    def day_range_ts(day: datetime) -> Tuple[int, int]:
+        """Rentang epoch [awal hari, awal hari berikutnya) untuk tanggal lokal."""
+        start = day.replace(hour=0, minute=0, second=0, microsecond=0)
+        return int(start.timestamp()), int((start + timedelta(days=1)).timestamp())
+
+    @lru_cache(maxsize=4096)
+    def _format_minute(minute: int, fmt: str) -> str:
+        return datetime.fromtimestamp(minute * 60).strftime(fmt)
+
+    def format_ts(ts: Optional[int], fmt: str = '%d %b %y, %H:%M') -> str:
+        """Memformat epoch untuk tampilan. Hasil di-cache per menit (format tanpa detik)."""
+        if ts is None:
+            return 'N/A'
+        return _format_minute(ts // 60, fmt)
+
+    # Laporan, arsip, dan pencarian admin masih membaca SQLite langsung, jadi bot selalu memakai SqliteRepository.
+    # MemoryRepository hanya dipasang stress_test.py (mengganti `repo` setelah bot dimuat).
+    repo: storage.StoreRepository = storage.SqliteRepository(DB_NAME, ADMIN_ID, DEFAULT_PRODUCT_ID,
+                                                             connect_archive=lambda: connect_with_archive()) # Didefinisikan di bawah
+    event_bus = events.EventBus(logger) # Handler publish setelah commit; cache, metrik, dan audit subscribe di bawah
+
     def get_setting(key: str) -> Optional[str]:
         """Mengambil nilai pengaturan dari database."""
         try:
-            with sqlite3.connect(DB_NAME) as conn:
-                c = conn.cursor()
-                c.execute('SELECT value FROM settings WHERE key = ?', (key,))
-                result = c.fetchone()
-            return result[0] if result else None
+            return repo.get_setting(key)
         except sqlite3.Error as e:
             logger.error(f"Error mengambil pengaturan {key}: {e}")
             return None
@@ -183,18 +527,457 @@ try:
     def set_setting(key: str, value: str) -> bool:
         """Menyimpan nilai pengaturan ke database."""
         try:
-            with sqlite3.connect(DB_NAME) as conn:
-                c = conn.cursor()
-                c.execute('INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)', (key, value))
-                conn.commit()
+            repo.set_setting(key, value)
+            event_bus.publish(events.SettingChanged(key, value))
             return True
         except sqlite3.Error as e:
             logger.error(f"Error menyimpan pengaturan {key} ke {value}: {e}")
             return False
 
+    def get_purchase_limits() -> Tuple[int, int]:
+        """Mengambil batas jumlah akun per transaksi (min_purchase, max_purchase)."""
+        try:
+            min_qty = max(1, int(get_setting('min_purchase') or '1'))
+            max_qty = max(min_qty, int(get_setting('max_purchase') or '1'))
+        except ValueError:
+            logger.warning("Pengaturan min_purchase/max_purchase tidak valid, memakai 1 akun per transaksi.")
+            return 1, 1
+        return min_qty, max_qty
+
+    def pick_unique_code(base_amount: int) -> int:
+        """Memilih kode unik sehingga total transfer (base_amount + kode) tidak sama dengan nominal sale pending lain.
+
+        Rekonsiliasi mutasi mencocokkan nominal, bukan kode, jadi kode yang sama untuk harga berbeda aman dipakai ulang.
+        """
+        used_amounts = repo.pending_expected_amounts(base_amount + 1, base_amount + UNIQUE_CODE_MAX)
+        free_codes = [code for code in range(1, UNIQUE_CODE_MAX + 1) if base_amount + code not in used_amounts]
+        # Acak agar dua user yang melihat menu bersamaan jarang mendapat kode sama
+        return random.choice(free_codes) if free_codes else random.randint(1, UNIQUE_CODE_MAX)
+
+    # --- Snapshot Toko (Inline Query) ---
+    PaymentMethodInfo = storage.PaymentMethodInfo
+    ProductInfo = storage.ProductInfo
+
+    class StoreSnapshotData(NamedTuple):
+        generation: int
+        products: List[ProductInfo] # Semua produk (aktif & nonaktif), urut sort_order
+        payment_methods: List[PaymentMethodInfo]
+        maintenance: bool
+
+        @property
+        def catalog(self) -> List[ProductInfo]:
+            """Produk aktif yang ditampilkan ke pembeli."""
+            return [product for product in self.products if product.active]
+
+        @property
+        def stock(self) -> int:
+            return sum(product.stock for product in self.catalog)
+
+        def product(self, product_id: Optional[int]) -> Optional[ProductInfo]:
+            return next((product for product in self.products if product.id == product_id), None)
+
+    class StoreSnapshot:
+        """Katalog (harga, stok, status aktif), metode pembayaran, dan mode maintenance di memori.
+
+        Dibangun ulang setelah invalidate() atau jika kedaluwarsa, sehingga menu katalog tidak perlu COUNT per produk.
+        """
+
+        SETTING_KEYS = ('maintenance_mode',)
+
+        def __init__(self, max_age: float = STORE_SNAPSHOT_MAX_AGE_SEC):
+            self.max_age = max_age # Cadangan untuk perubahan di luar bot (mis. skrip yang menulis DB langsung)
+            self._data: Optional[StoreSnapshotData] = None
+            self._built_at = 0.0
+            self._generation = 0
+            self._lock = threading.Lock()
+            self.rebuild_count = 0
+
+        def invalidate(self) -> None:
+            """Menandai snapshot basi; panggil setelah commit perubahan produk, stok, atau metode pembayaran."""
+            with self._lock:
+                self._generation += 1
+
+        def get(self) -> StoreSnapshotData:
+            """Mengembalikan snapshot terkini, membangun ulang dari DB bila perlu (bisa raise sqlite3.Error)."""
+            with self._lock:
+                data, generation = self._data, self._generation
+                if data is not None and data.generation == generation and time.monotonic() - self._built_at < self.max_age:
+                    return data
+            # Dibangun di luar lock; invalidate() selama membangun membuat hasil ini langsung basi lagi
+            products = repo.load_catalog()
+            methods = repo.active_payment_methods()
+            data = StoreSnapshotData(generation, products, methods, repo.get_setting('maintenance_mode') == 'on')
+            with self._lock:
+                if self._data is None or generation >= self._data.generation:
+                    self._data, self._built_at = data, time.monotonic()
+                self.rebuild_count += 1
+            return data
+
+    store_snapshot = StoreSnapshot()
+
+    # --- Subscriber Event ---
+    AUDITED_SETTING_KEYS = ('maintenance_mode', 'admin_notify_mode') # Diubah admin lewat menu; key lain adalah state internal bot
+
+    def invalidate_store_snapshot(event: Any) -> None:
+        """Sale, stok, katalog, metode pembayaran, dan mode maintenance mengubah isi snapshot toko."""
+        if isinstance(event, events.SettingChanged) and event.key not in StoreSnapshot.SETTING_KEYS:
+            return
+        store_snapshot.invalidate()
+
+    def audit_admin_change(event: Any) -> None:
+        """Jejak perubahan konfigurasi toko di log (async, tidak menahan handler admin)."""
+        if isinstance(event, events.SettingChanged):
+            if event.key in AUDITED_SETTING_KEYS:
+                logger.info(f"Audit: pengaturan '{event.key}' diubah menjadi '{event.value}'.")
+        elif isinstance(event, events.PaymentMethodChanged):
+            logger.info(f"Audit: metode pembayaran {event.method or f'ID {event.method_id}'} {event.action}.")
+        elif isinstance(event, events.ProductChanged):
+            logger.info(f"Audit: produk ID {event.product_id} {event.action}.")
+
+    event_bus.subscribe((events.SaleCompleted, events.StockAdded, events.StockRemoved, events.SettingChanged,
+                         events.PaymentMethodChanged, events.ProductChanged), invalidate_store_snapshot)
+    event_bus.subscribe((events.SettingChanged, events.PaymentMethodChanged, events.ProductChanged),
+                        audit_admin_change, run_async=True)
+
+    # escape_markdown telebot untuk MarkdownV2 menyisakan backslash di '.' dan '-' pada parse_mode 'Markdown' (lama)
+    LEGACY_MARKDOWN_ESCAPES = str.maketrans({char: f"\\{char}" for char in MARKDOWN_SPECIAL_CHARS})
+
+    def escape_md(text: str) -> str:
+        """Teks bebas (nama produk, nama file) agar aman disisipkan ke pesan Markdown, di luar entitas *...* / `...`."""
+        return text.translate(LEGACY_MARKDOWN_ESCAPES)
+
+    def product_label(product_id: Optional[int]) -> str:
+        """Nama produk untuk teks pesan; cadangan umum jika produk tidak ditemukan atau snapshot gagal dibangun."""
+        try:
+            product = store_snapshot.get().product(product_id)
+        except sqlite3.Error as e:
+            logger.error(f"DB Error membaca katalog untuk produk {product_id}: {e}")
+            product = None
+        return product.name if product else "premium"
+
+    # --- Stok Masuk (Spool) & Alert Stok Rendah ---
+    LOW_STOCK_ALERTED_KEY = 'low_stock_alerted' # ID produk yang sudah diberi alert, dipisah koma (bertahan saat restart)
+    class LowStockMonitor:
+        """Alert ke admin sekali saat stok produk aktif turun di bawah batas; aktif lagi setelah stok diisi ulang.
+
+        Membaca kolom products.stock (dijaga trigger) lewat snapshot toko, bukan COUNT berkala.
+        """
+        def __init__(self, threshold: int):
+            self.threshold = threshold
+            self._alerted: Set[int] = set()
+            self._sending: Set[int] = set() # Alert sedang dikirim; baru masuk _alerted setelah terkirim
+            self._lock = threading.Lock()
+            self.alert_count = 0
+
+        def load(self) -> None:
+            raw = get_setting(LOW_STOCK_ALERTED_KEY) or ''
+            with self._lock:
+                self._alerted = {int(part) for part in raw.split(',') if part.strip().isdigit()}
+
+        def check(self, event: Any = None) -> None:
+            """Subscriber event stok/sale/katalog; juga dipanggil sekali saat startup."""
+            if self.threshold <= 0:
+                return
+            try:
+                products = store_snapshot.get().products
+            except sqlite3.Error as e:
+                logger.error(f"DB Error membaca stok untuk alert stok rendah: {e}")
+                return
+            with self._lock:
+                low = [p for p in products if p.active and p.stock < self.threshold and p.id not in self._alerted | self._sending]
+                restocked = {p.id for p in products if p.stock >= self.threshold} & self._alerted
+                if not low and not restocked:
+                    return
+                self._alerted -= restocked
+                self._sending |= {p.id for p in low}
+            sent = set()
+            for product in low:
+                try:
+                    bot.send_message(ADMIN_ID, f"⚠️ *STOK RENDAH:* {escape_md(product.name)} tinggal *{product.stock}* akun (batas {self.threshold}). Segera tambah stok!")
+                    sent.add(product.id)
+                    self.alert_count += 1
+                except Exception as e: # API atau koneksi; tidak dicatat, dicoba lagi pada event stok berikutnya
+                    logger.error(f"Gagal mengirim alert stok rendah produk {product.id} ke admin: {e}")
+            with self._lock:
+                self._sending -= {p.id for p in low}
+                self._alerted |= sent
+                alerted = ','.join(str(product_id) for product_id in sorted(self._alerted))
+            if sent or restocked:
+                set_setting(LOW_STOCK_ALERTED_KEY, alerted)
+
+    low_stock_monitor = LowStockMonitor(LOW_STOCK_THRESHOLD)
+    event_bus.subscribe((events.SaleCompleted, events.StockAdded, events.StockRemoved, events.ProductChanged),
+                        low_stock_monitor.check, run_async=True)
+
+    def import_spool_accounts(product_id: int, rows: List[stock_spool.AccountRow]) -> Tuple[List[int], List[str]]:
+        """Satu batch file spool; produk harus sudah ada di katalog."""
+        if store_snapshot.get().product(product_id) is None:
+            raise ValueError(f"Produk ID {product_id} tidak ditemukan")
+        new_ids, duplicates = repo.add_accounts(product_id, rows, now_stamp())
+        if new_ids:
+            event_bus.publish(events.StockAdded(product_id, tuple(new_ids)))
+        return new_ids, duplicates
+
+    def report_spool_result(result: stock_spool.IngestResult) -> None:
+        """Ringkasan impor file spool untuk admin."""
+        if result.status == 'processed':
+            logger.info(f"Spool '{result.file_name}': {result.imported} akun diimpor ke produk {result.product_id}, {len(result.duplicates)} duplikat dilewati.")
+            text = (f"📥 *Impor stok* {escape_md(result.file_name)} selesai.\n"
+                    f"{result.imported} akun ditambahkan ke {escape_md(product_label(result.product_id))}"
+                    + (f", {len(result.duplicates)} email sudah ada dilewati." if result.duplicates else "."))
+        else:
+            logger.warning(f"Spool '{result.file_name}' gagal: {'; '.join(result.errors[:5])}")
+            errors = '\n'.join(result.errors[:10]) + (f"\n... dan {len(result.errors) - 10} lainnya" if len(result.errors) > 10 else "")
+            text = (f"❌ *Impor stok* {escape_md(result.file_name)} gagal ({result.imported} akun sempat masuk). "
+                    f"File dipindah ke folder `{stock_spool.FAILED_DIR}`.\n```\n{errors}\n```")
+        try:
+            bot.send_message(ADMIN_ID, text)
+        except telebot.apihelper.ApiTelegramException as e:
+            logger.error(f"Gagal mengirim hasil impor spool '{result.file_name}' ke admin: {e}")
+
+    stock_ingestor: Optional[stock_spool.SpoolIngestor] = None
+    if STOCK_SPOOL_DIR:
+        stock_ingestor = stock_spool.SpoolIngestor(STOCK_SPOOL_DIR, import_spool_accounts, report_spool_result,
+                                                   DEFAULT_PRODUCT_ID, STOCK_IMPORT_BATCH_SIZE, STOCK_SPOOL_POLL_SEC)
+
+    # --- Arsip Data Lama ---
+    ARCHIVED_TABLES: Tuple[str, ...] = ('sales', 'sale_items', 'accounts')
+    ARCHIVE_INDEXES: Dict[str, List[Tuple[str, str]]] = { # Index pencarian yang juga dibutuhkan di tabel arsip
+        'sales': [('idx_sales_buyer_created_ts', 'buyer_id, created_ts')],
+        'sale_items': [('idx_sale_items_sale', 'sale_id')],
+    }
+
+    def sync_archive_table(conn: sqlite3.Connection, table: str) -> List[str]:
+        """Menyamakan struktur tabel arsip dengan tabel utama, mengembalikan daftar kolom."""
+        main_cols = [row[1] for row in conn.execute(f"PRAGMA main.table_info({table})")]
+        archive_cols = [row[1] for row in conn.execute(f"PRAGMA archive.table_info({table})")]
+        if not archive_cols:
+            conn.execute(f"CREATE TABLE archive.{table} AS SELECT * FROM main.{table} WHERE 0")
+            conn.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS archive.idx_{table}_id ON {table}(id)")
+        else:
+            missing_cols = [col for col in main_cols if col not in archive_cols] # Kolom baru hasil migrasi tabel utama
+            for col in missing_cols:
+                conn.execute(f"ALTER TABLE archive.{table} ADD COLUMN {col}")
+            if missing_cols:
+                backfill_epoch_columns(conn, 'archive', [table])
+        for index_name, index_cols in ARCHIVE_INDEXES.get(table, []):
+            conn.execute(f"CREATE INDEX IF NOT EXISTS archive.{index_name} ON {table}({index_cols})")
+        return main_cols
+
+    archive_view_columns: Dict[str, str] = {} # Kolom view `<tabel>_all`, diisi prepare_archive
+
+    def prepare_archive() -> None:
+        """Menyamakan tabel, index dan index pencarian arsip dengan database utama.
+
+        Dijalankan sekali saat startup (setelah migrasi skema) dan saat pengarsipan, bukan di setiap koneksi.
+        """
+        conn = sqlite3.connect(DB_NAME)
+        try:
+            conn.execute("ATTACH DATABASE ? AS archive", (ARCHIVE_DB_NAME,))
+            columns = {table: ', '.join(sync_archive_table(conn, table)) for table in ARCHIVED_TABLES}
+            ensure_search_indexes(conn, 'archive')
+            conn.commit()
+        finally:
+            conn.close()
+        archive_view_columns.update(columns)
+
+    def connect_with_archive(**connect_kwargs: Any) -> sqlite3.Connection:
+        """Membuka koneksi dengan database arsip ter-attach dan view gabungan `<tabel>_all`."""
+        if not archive_view_columns: # Dipanggil sebelum init_db menyiapkan arsip
+            prepare_archive()
+        conn = sqlite3.connect(DB_NAME, **connect_kwargs)
+        conn.execute("ATTACH DATABASE ? AS archive", (ARCHIVE_DB_NAME,))
+        for table, cols in archive_view_columns.items():
+            # View TEMP wajib karena view di database utama tidak boleh merujuk database lain
+            conn.execute(f"""CREATE TEMP VIEW IF NOT EXISTS {table}_all AS
+                             SELECT {cols} FROM main.{table}
+                             UNION ALL
+                             SELECT {cols} FROM archive.{table}""")
+        conn.commit()
+        return conn
+
+    def get_hot_table_sizes(conn: sqlite3.Connection) -> Dict[str, int]:
+        """Menghitung jumlah baris tabel utama yang ikut diarsipkan."""
+        return {table: conn.execute(f"SELECT COUNT(*) FROM main.{table}").fetchone()[0] for table in ARCHIVED_TABLES}
+
+    def move_to_archive(conn: sqlite3.Connection, table: str, where_sql: str, params: List[Any]) -> None:
+        """Menyalin baris yang cocok ke tabel arsip lalu menghapusnya dari tabel utama (arsip sudah disiapkan prepare_archive)."""
+        cols = archive_view_columns[table]
+        conn.execute(f"INSERT OR REPLACE INTO archive.{table} ({cols}) SELECT {cols} FROM main.{table} WHERE {where_sql}", params)
+        conn.execute(f"DELETE FROM main.{table} WHERE {where_sql}", params)
+
+    def archive_old_records(max_age_days: int, batch_size: int = ARCHIVE_BATCH_SIZE) -> Dict[str, Dict[str, int]]:
+        """Memindahkan penjualan selesai/batal dan akun terjual yang lebih tua dari max_age_days ke database arsip."""
+        cutoff = datetime.now() - timedelta(days=max_age_days)
+        cutoff_ts = int(cutoff.timestamp())
+        # Penjualan dipindah dulu agar akun yang masih dirujuk penjualan aktif tidak ikut terarsip
+        selectors: Dict[str, Tuple[str, Tuple[Any, ...]]] = {
+            'sales': ("""SELECT id FROM main.sales
+                         WHERE status IN ('completed', 'cancelled') AND COALESCE(completed_ts, created_ts) < ?
+                         ORDER BY id LIMIT ?""", (cutoff_ts, batch_size)),
+            'accounts': ("""SELECT a.id FROM main.accounts a
+                            WHERE a.sold = 1 AND a.sold_ts < ?
+                              AND NOT EXISTS (SELECT 1 FROM main.sales s WHERE s.account_id = a.id)
+                              AND NOT EXISTS (SELECT 1 FROM main.sale_items i WHERE i.account_id = a.id)
+                            ORDER BY a.id LIMIT ?""", (cutoff_ts, batch_size)),
+        }
+        moved: Dict[str, int] = {table: 0 for table in selectors}
+        prepare_archive()
+        conn = connect_with_archive(isolation_level=None) # Transaksi diatur manual per batch
+        try:
+            before = get_hot_table_sizes(conn)
+            for table, (select_sql, params) in selectors.items():
+                while True:
+                    conn.execute('BEGIN IMMEDIATE')
+                    ids = [row[0] for row in conn.execute(select_sql, params)]
+                    if not ids:
+                        conn.commit()
+                        break
+                    placeholders = ','.join('?' * len(ids))
+                    if table == 'sales': # Item pesanan ikut pindah bersama sale-nya dalam batch yang sama
+                        move_to_archive(conn, 'sale_items', f"sale_id IN ({placeholders})", ids)
+                    move_to_archive(conn, table, f"id IN ({placeholders})", ids)
+                    conn.commit()
+                    moved[table] += len(ids)
+            after = get_hot_table_sizes(conn)
+        except sqlite3.Error:
+            if conn.in_transaction: conn.rollback()
+            raise
+        finally:
+            conn.close()
+        logger.info(f"Arsip selesai (batas {cutoff:%Y-%m-%d %H:%M}): dipindah {moved}, ukuran tabel utama {before} -> {after}")
+        return {'before': before, 'after': after, 'moved': moved}
+
+    def rebuild_customer_stats() -> int:
+        """Menghitung ulang agregat pembelian customer & customer_products dari semua penjualan (utama + arsip)."""
+        conn = connect_with_archive(isolation_level=None)
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.execute("UPDATE main.customers SET order_count = 0, purchase_count = 0, last_purchase_ts = NULL")
+            conn.execute("""UPDATE main.customers SET order_count = s.orders, purchase_count = s.purchases, last_purchase_ts = s.last_ts
+                            FROM (SELECT buyer_id, COUNT(*) AS orders, SUM(status = 'completed') AS purchases,
+                                         MAX(CASE WHEN status = 'completed' THEN completed_ts END) AS last_ts
+                                  FROM sales_all GROUP BY buyer_id) AS s
+                            WHERE customers.telegram_id = s.buyer_id""")
+            conn.execute("DELETE FROM main.customer_products")
+            conn.execute("""INSERT INTO main.customer_products (product_id, telegram_id, purchase_count, last_purchase_ts)
+                            SELECT COALESCE(product_id, ?), buyer_id, COUNT(*), MAX(completed_ts)
+                            FROM sales_all WHERE status = 'completed' GROUP BY 1, 2""", (DEFAULT_PRODUCT_ID,))
+            buyers = conn.execute("SELECT COUNT(*) FROM main.customers WHERE purchase_count > 0").fetchone()[0]
+            conn.commit()
+        except sqlite3.Error:
+            if conn.in_transaction: conn.rollback()
+            raise
+        finally:
+            conn.close()
+        logger.info(f"Agregat pembelian customer dihitung ulang: {buyers} pembeli.")
+        return buyers
+
+    # --- Pencarian Full-Text (FTS5) ---
+    def ensure_search_indexes(conn: sqlite3.Connection, schema: str = 'main') -> List[str]:
+        """Membuat index FTS5 beserta trigger sinkronisasinya; index yang baru dibuat langsung diisi (rebuild)."""
+        existing = {row[0] for row in conn.execute(f"SELECT name FROM {schema}.sqlite_master WHERE type = 'table'")}
+        created: List[str] = []
+        for fts_name, (table, columns, rowid_col) in SEARCH_INDEXES.items():
+            if table not in existing:
+                continue # Tabel arsip hanya berisi sales, sale_items, accounts
+            cols = ', '.join(columns)
+            new_cols = ', '.join(f"new.{col}" for col in columns)
+            old_cols = ', '.join(f"old.{col}" for col in columns)
+            changed = ' OR '.join(f"old.{col} IS NOT new.{col}" for col in columns)
+            if fts_name not in existing:
+                conn.execute(f"""CREATE VIRTUAL TABLE {schema}.{fts_name} USING fts5(
+                                 {cols}, content='{table}', content_rowid='{rowid_col}', prefix='2 3')""")
+                created.append(fts_name)
+            # Trigger update hanya untuk kolom yang diindex agar update status/tanggal tidak menyentuh FTS
+            conn.execute(f"""CREATE TRIGGER IF NOT EXISTS {schema}.{fts_name}_ai AFTER INSERT ON {table} BEGIN
+                                 INSERT INTO {fts_name}(rowid, {cols}) VALUES (new.{rowid_col}, {new_cols});
+                             END""")
+            conn.execute(f"""CREATE TRIGGER IF NOT EXISTS {schema}.{fts_name}_ad AFTER DELETE ON {table} BEGIN
+                                 INSERT INTO {fts_name}({fts_name}, rowid, {cols}) VALUES ('delete', old.{rowid_col}, {old_cols});
+                             END""")
+            # Flush aktivitas customer menulis ulang last_username tiap detik; tanpa WHEN nilai sama pun di-reindex
+            update_trigger = conn.execute(f"SELECT sql FROM {schema}.sqlite_master WHERE type = 'trigger' AND name = ?",
+                                          (f"{fts_name}_au",)).fetchone()
+            if update_trigger and ' WHEN ' not in update_trigger[0]:
+                conn.execute(f"DROP TRIGGER {schema}.{fts_name}_au")
+            conn.execute(f"""CREATE TRIGGER IF NOT EXISTS {schema}.{fts_name}_au AFTER UPDATE OF {cols} ON {table}
+                             WHEN {changed} BEGIN
+                                 INSERT INTO {fts_name}({fts_name}, rowid, {cols}) VALUES ('delete', old.{rowid_col}, {old_cols});
+                                 INSERT INTO {fts_name}(rowid, {cols}) VALUES (new.{rowid_col}, {new_cols});
+                             END""")
+        for fts_name in created:
+            conn.execute(f"INSERT INTO {schema}.{fts_name}({fts_name}) VALUES ('rebuild')")
+            logger.info(f"Index pencarian '{schema}.{fts_name}' dibuat dan diisi.")
+        return created
+
+    def rebuild_search_indexes() -> Dict[str, int]:
+        """Membangun ulang semua index FTS (utama & arsip), mengembalikan jumlah baris per index."""
+        counts: Dict[str, int] = {}
+        conn = connect_with_archive(isolation_level=None)
+        try:
+            for schema in ('main', 'archive'):
+                ensure_search_indexes(conn, schema)
+                for fts_name, (table, _columns, _rowid_col) in SEARCH_INDEXES.items():
+                    if not conn.execute(f"SELECT 1 FROM {schema}.sqlite_master WHERE name = ?", (fts_name,)).fetchone():
+                        continue
+                    conn.execute('BEGIN IMMEDIATE')
+                    conn.execute(f"INSERT INTO {schema}.{fts_name}({fts_name}) VALUES ('rebuild')")
+                    conn.execute(f"INSERT INTO {schema}.{fts_name}({fts_name}) VALUES ('optimize')")
+                    conn.commit()
+                    counts[f"{schema}.{fts_name}"] = conn.execute(f"SELECT COUNT(*) FROM {schema}.{table}").fetchone()[0]
+        except sqlite3.Error:
+            if conn.in_transaction: conn.rollback()
+            raise
+        finally:
+            conn.close()
+        return counts
+
+    def build_fts_query(text: str) -> str:
+        """Mengubah input bebas menjadi query FTS5 aman: setiap kata jadi frasa prefix, digabung AND."""
+        terms = [term.replace('"', '""') for term in text.split()]
+        return ' '.join(f'"{term}"*' for term in terms if term.strip('"'))
+
+    # (jenis, id, label, catatan, status, info, epoch, arsip)
+    SearchResult = Tuple[str, int, Optional[str], Optional[str], Optional[str], Optional[str], Optional[int], int]
+
+    def search_records(text: str, page: int = 0, page_size: int = SEARCH_PAGE_SIZE) -> Tuple[List[SearchResult], bool]:
+        """Mencari akun, sale dan customer (termasuk arsip), diurutkan bm25. Mengembalikan (hasil, ada_halaman_berikutnya)."""
+        fts_query = build_fts_query(text)
+        if not fts_query:
+            return [], False
+        arm_limit = (page + 1) * page_size + 1 # Cukup untuk halaman ini + deteksi halaman berikutnya
+        arms: List[str] = []
+        params: List[Any] = []
+        if text.strip().isdigit(): # ID persis (sale, akun, Telegram ID) ditampilkan paling atas
+            exact_id = int(text.strip())
+            arms += ["SELECT 'sale', id, buyer_username, admin_notes, status, amount, created_ts, 0, -1e9 FROM main.sales WHERE id = ?",
+                     "SELECT 'account', id, email, notes, sold, sold_to_username, added_ts, 0, -1e9 FROM main.accounts WHERE id = ?",
+                     "SELECT 'customer', telegram_id, username, last_username, is_blocked, NULL, last_seen_ts, 0, -1e9 FROM main.customers WHERE telegram_id = ?"]
+            params += [exact_id] * 3
+        for schema, archived in (('main', 0), ('archive', 1)):
+            arms.append(f"""SELECT * FROM (SELECT 'account', a.id, a.email, a.notes, a.sold, a.sold_to_username, a.added_ts, {archived}, bm25(accounts_fts) AS score
+                            FROM {schema}.accounts_fts JOIN {schema}.accounts a ON a.id = accounts_fts.rowid
+                            WHERE accounts_fts MATCH ? ORDER BY score LIMIT ?)""")
+            arms.append(f"""SELECT * FROM (SELECT 'sale', s.id, s.buyer_username, s.admin_notes, s.status, s.amount, s.created_ts, {archived}, bm25(sales_fts) AS score
+                            FROM {schema}.sales_fts JOIN {schema}.sales s ON s.id = sales_fts.rowid
+                            WHERE sales_fts MATCH ? ORDER BY score LIMIT ?)""")
+            params += [fts_query, arm_limit, fts_query, arm_limit]
+        arms.append("""SELECT * FROM (SELECT 'customer', c.telegram_id, c.username, c.last_username, c.is_blocked, NULL, c.last_seen_ts, 0, bm25(customers_fts) AS score
+                       FROM main.customers_fts JOIN main.customers c ON c.telegram_id = customers_fts.rowid
+                       WHERE customers_fts MATCH ? ORDER BY score LIMIT ?)""")
+        params += [fts_query, arm_limit]
+
+        with connect_with_archive() as conn:
+            rows = conn.execute(" UNION ALL ".join(arms) + " ORDER BY 9 LIMIT ? OFFSET ?",
+                                (*params, page_size + 1, page * page_size)).fetchall()
+        results = [row[:8] for row in rows]
+        return results[:page_size], len(results) > page_size
+
     def format_rupiah(amount_str: Any) -> str:
         """Memformat angka menjadi format Rupiah."""
         try:
+            if isinstance(amount_str, float): amount_str = round(amount_str) # Hasil SUM(... AS REAL): "123.0" jangan jadi 1230
             cleaned_amount = ''.join(filter(str.isdigit, str(amount_str)))
             if not cleaned_amount: return str(amount_str) # Jika kosong setelah dibersihkan
             amount = float(cleaned_amount)
@@ -202,9 +985,48 @@ try:
         except (ValueError, TypeError):
             return str(amount_str)
 
+    class AdminRoster:
+        """Peran admin aktif di memori (dibaca filter handler tiap pesan); dimuat ulang setelah roster berubah."""
+
+        def __init__(self):
+            self._roles: Dict[int, str] = {ADMIN_ID: 'admin'}
+            self._lock = threading.Lock()
+
+        def load(self) -> None:
+            try:
+                roles = repo.load_roster()
+            except sqlite3.Error as e:
+                logger.error(f"DB Error memuat roster admin: {e}")
+                return
+            roles[ADMIN_ID] = 'admin'
+            with self._lock:
+                self._roles = roles
+
+        def role(self, user_id: int) -> Optional[str]:
+            return self._roles.get(user_id)
+
+        def members(self) -> List[int]:
+            with self._lock:
+                return sorted(self._roles)
+
+    admin_roster = AdminRoster()
+
     def is_admin(user_id: int) -> bool:
-        """Memeriksa apakah user_id adalah admin."""
-        return user_id == ADMIN_ID
+        """Memeriksa apakah user_id adalah admin (akses penuh)."""
+        return admin_roster.role(user_id) == 'admin'
+
+    def is_staff(user_id: int) -> bool:
+        """Admin atau verifikator: boleh memverifikasi pembayaran."""
+        return admin_roster.role(user_id) is not None
+
+    def staff_sale_markup(sale_id: int) -> InlineKeyboardMarkup:
+        markup = InlineKeyboardMarkup(row_width=2)
+        markup.add(
+            InlineKeyboardButton("✅ Setujui", callback_data=f"{StaffCallbackData.APPROVE_PREFIX}{sale_id}"),
+            InlineKeyboardButton("❌ Tolak", callback_data=f"{StaffCallbackData.REJECT_PREFIX}{sale_id}"),
+        )
+        markup.add(InlineKeyboardButton("⏭ Berikutnya", callback_data=f"{StaffCallbackData.CLAIM_NEXT_PREFIX}{sale_id}"))
+        return markup
 
     def check_maintenance(func):
         """Decorator untuk memeriksa mode maintenance."""
@@ -231,16 +1053,23 @@ try:
             KeyboardButton("📦 Produk"), KeyboardButton("💰 Keuangan"),
             KeyboardButton("⚙️ Pengaturan"), KeyboardButton("📊 Statistik"),
             KeyboardButton("📢 Broadcast"), KeyboardButton("⏳ Pemb. Pending"),
-            KeyboardButton("🔄 Refresh")
+            KeyboardButton("⏭ Klaim Berikutnya"), KeyboardButton("🔄 Refresh")
         )
         return markup
 
+    def get_verifier_keyboard() -> ReplyKeyboardMarkup:
+        """Membuat keyboard verifikator pembayaran."""
+        markup = ReplyKeyboardMarkup(resize_keyboard=True, row_width=2)
+        markup.add(KeyboardButton("⏭ Klaim Berikutnya"), KeyboardButton("⏳ Pemb. Pending"))
+        return markup
+
     def get_user_keyboard() -> ReplyKeyboardMarkup:
         """Membuat keyboard user."""
         markup = ReplyKeyboardMarkup(resize_keyboard=True, row_width=2)
         markup.add(
             KeyboardButton("🛒 Beli Akun"), KeyboardButton("📦 Cek Stok"),
-            KeyboardButton("💰 Cek Harga"), KeyboardButton("❓ Bantuan")
+            KeyboardButton("💰 Cek Harga"), KeyboardButton("🧾 Riwayat Pembelian"),
+            KeyboardButton("❓ Bantuan")
         )
         return markup
 
@@ -250,17 +1079,7 @@ try:
         """Handler untuk perintah /start."""
         user_id = message.from_user.id
         username = message.from_user.username if message.from_user.username else f"user_{user_id}"
-        
-        try:
-            with sqlite3.connect(DB_NAME) as conn:
-                c = conn.cursor()
-                c.execute('''INSERT OR IGNORE INTO customers 
-                             (telegram_id, username, join_date)
-                             VALUES (?, ?, ?)''',
-                          (user_id, username, datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
-                conn.commit()
-        except sqlite3.Error as e:
-            logger.error(f"Error mendaftarkan customer {user_id}: {e}")
+        customer_buffer.record(user_id, username, register=True) # Ditulis batch oleh CustomerWriteBuffer
 
         markup: ReplyKeyboardMarkup
         msg_text: str
@@ -270,76 +1089,233 @@ try:
                 f"👑 *Selamat Datang, Admin Panel {STORE_NAME}!* (Enhanced)\n\n"
                 "Gunakan tombol di bawah untuk mengelola bot.\n"
                 "⏳ *Pemb. Pending*: Cek transaksi yang butuh approval.\n"
-                "📦 *Produk*: Kelola stok (tambah, lihat, hapus).\n"
+                "📦 *Produk*: Kelola katalog produk dan stok (tambah, lihat, hapus).\n"
                 "💰 *Keuangan*: Atur harga, metode bayar, laporan penjualan.\n"
                 "⚙️ *Pengaturan*: Atur mode maintenance, harga, dll.\n"
                 "📊 *Statistik*: Lihat statistik penjualan dan pengguna.\n"
-                "📢 *Broadcast*: Kirim pesan ke semua pengguna aktif.\n"
-                "🔄 *Refresh*: Muat ulang keyboard admin."
+                "📢 *Broadcast*: Kirim pesan ke semua pengguna atau segmen tertentu (pembeli, aktif N hari, per produk).\n"
+                "⏭ *Klaim Berikutnya*: Ambil pembayaran pending berikutnya untuk diverifikasi.\n"
+                "🔄 *Refresh*: Muat ulang keyboard admin.\n\n"
+                "🔎 `/cari <kata kunci>`: Cari akun, transaksi & pelanggan.\n"
+                "👥 `/admins`: Kelola admin & verifikator."
+            )
+        elif is_staff(user_id):
+            markup = get_verifier_keyboard()
+            msg_text = (
+                f"🧾 *Panel Verifikator {STORE_NAME}*\n\n"
+                "⏭ *Klaim Berikutnya*: Ambil pembayaran pending berikutnya. Selama diklaim, admin lain tidak bisa memprosesnya.\n"
+                "⏳ *Pemb. Pending*: Lihat semua pembayaran yang menunggu.\n\n"
+                "Perintah: `/next`, `/approve ID`, `/reject ID [ALASAN]`."
             )
         else:
             markup = get_user_keyboard()
+            try:
+                catalog_names = ', '.join(escape_md(product.name) for product in store_snapshot.get().catalog) or STORE_NAME
+            except sqlite3.Error as e:
+                logger.error(f"DB Error membaca katalog untuk /start: {e}")
+                catalog_names = STORE_NAME
             msg_text = (
                 f"🎉 *Selamat datang di {STORE_NAME}!* (Enhanced) 🎉\n\n"
-                f"Kami menyediakan akun Blackbox.ai premium.\n"
+                f"Kami menyediakan akun premium: {catalog_names}.\n"
                 "Silakan gunakan menu di bawah ini:\n"
                 "🛒 *Beli Akun*: Memulai proses pembelian otomatis.\n"
                 "📦 *Cek Stok*: Melihat ketersediaan akun saat ini.\n"
                 "💰 *Cek Harga*: Informasi harga per akun.\n"
+                "🧾 *Riwayat Pembelian*: Lihat pembelian & kirim ulang akun Anda.\n"
                 "❓ *Bantuan*: Informasi kontak dan bantuan."
             )
         bot.reply_to(message, msg_text, reply_markup=markup)
 
+    # --- Notifikasi Admin Tergabung ---
+    class PaymentNotice(NamedTuple):
+        sale_id: int
+        user_id: int
+        username: str
+        quantity: int
+        amount: str
+        file_id: str
+        is_photo: bool
+        chat_id: int # Untuk fallback forward jika album gagal
+        message_id: int
+        admin_id: int # Admin tujuan notifikasi (round-robin); sale belum diklaim siapa pun
+        product: str
+
+    def format_buyer(username: Optional[str], user_id: Optional[int]) -> str:
+        """Menampilkan @username (di-escape untuk Markdown, mis. `_`), atau User ID jika username hanya placeholder."""
+        return f"@{escape_markdown(username)}" if username and username != f"user_{user_id}" else f"User ID {user_id}"
+
+    class AdminNotifier:
+        """Menggabungkan notifikasi pembayaran baru: satu pesan antrean live yang diedit + bukti dalam album."""
+        SETTING_KEY = 'admin_queue_message_id'
+
+        def __init__(self, debounce_sec: float = ADMIN_NOTIFY_DEBOUNCE_SEC):
+            self.debounce_sec = debounce_sec
+            self._pending: List[PaymentNotice] = []
+            self._refresh_requested = False
+            self._timer: Optional[threading.Timer] = None
+            self._lock = threading.Lock()
+            self._flush_lock = threading.Lock() # Flush tidak boleh berjalan paralel (edit pesan yang sama)
+            self.flush_count = 0
+            self.notices_sent = 0
+
+        def pending_count(self) -> int:
+            with self._lock:
+                return len(self._pending)
+
+        def add(self, notice: PaymentNotice) -> None:
+            with self._lock:
+                self._pending.append(notice)
+                self._schedule_locked()
+
+        def request_refresh(self) -> None:
+            """Meminta pesan antrean diperbarui (mis. setelah approve/reject)."""
+            with self._lock:
+                self._refresh_requested = True
+                self._schedule_locked()
+
+        def _schedule_locked(self) -> None:
+            if self._timer is None:
+                self._timer = threading.Timer(self.debounce_sec, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+        def flush(self) -> None:
+            with self._flush_lock:
+                with self._lock:
+                    notices, self._pending = self._pending, []
+                    refresh, self._refresh_requested = self._refresh_requested, False
+                    if self._timer is not None:
+                        self._timer.cancel()
+                        self._timer = None
+                if not notices and not refresh:
+                    return
+                if notices:
+                    self._send_proof_albums(notices)
+                new_counts: Dict[int, int] = {}
+                for n in notices:
+                    new_counts[n.admin_id] = new_counts.get(n.admin_id, 0) + 1
+                self._update_queue_messages(new_counts)
+                self.flush_count += 1
+                self.notices_sent += len(notices)
+
+        def _send_proof_albums(self, notices: List[PaymentNotice]) -> None:
+            for admin_id in sorted({n.admin_id for n in notices}):
+                self._send_admin_albums(admin_id, [n for n in notices if n.admin_id == admin_id])
+
+        def _send_admin_albums(self, admin_id: int, notices: List[PaymentNotice]) -> None:
+            # Foto dan dokumen tidak bisa dicampur dalam satu album
+            for is_photo in (True, False):
+                group = [n for n in notices if n.is_photo == is_photo]
+                for start in range(0, len(group), MEDIA_GROUP_MAX):
+                    chunk = group[start:start + MEDIA_GROUP_MAX]
+                    media_cls = InputMediaPhoto if is_photo else InputMediaDocument
+                    media = [media_cls(n.file_id, caption=f"Sale ID {n.sale_id} • {format_buyer(n.username, n.user_id)} • {n.quantity} akun {escape_md(n.product)} • {format_rupiah(n.amount)}",
+                                       parse_mode='Markdown') # Sama dengan caption bukti tunggal (parse_mode bawaan bot)
+                             for n in chunk]
+                    try:
+                        if len(media) == 1: # Album minimal 2 item
+                            send = bot.send_photo if is_photo else bot.send_document
+                            send(admin_id, chunk[0].file_id, caption=media[0].caption)
+                        else:
+                            bot.send_media_group(admin_id, media)
+                    except Exception as e_album:
+                        logger.error(f"Gagal mengirim album bukti ({len(chunk)} item): {e_album}")
+                        for n in chunk:
+                            try:
+                                bot.forward_message(admin_id, n.chat_id, n.message_id)
+                            except Exception as e_forward:
+                                logger.error(f"Gagal forward bukti Sale ID {n.sale_id}: {e_forward}")
+
+        def _setting_key(self, admin_id: int) -> str:
+            return self.SETTING_KEY if admin_id == ADMIN_ID else f"{self.SETTING_KEY}_{admin_id}"
+
+        def _build_queue_text(self, queue: storage.PendingSummary, admin_id: int, new_count: int) -> str:
+            total_pending, total_amount, newest, claimed = queue
+            text = (
+                f"📋 *ANTREAN PEMBAYARAN PENDING*\n\n"
+                f"Total: *{total_pending}* pembayaran ({format_rupiah(int(total_amount))})\n"
+            )
+            if claimed.get(admin_id):
+                text += f"🔒 Diklaim Anda: {claimed[admin_id]}\n"
+            if new_count:
+                text += f"🔔 Baru masuk: {new_count} (bukti di album terbaru)\n"
+            if newest:
+                text += "\nTerbaru:\n" + "\n".join(
+                    f"• `{sale.id}` {format_buyer(sale.buyer_username, sale.buyer_id)} | {sale.quantity} akun | {format_rupiah(sale.amount)} | "
+                    f"{format_ts(sale.created_ts, '%H:%M')}"
+                    for sale in newest
+                )
+                text += "\n\n👉 ⏭ Klaim berikutnya, atau `/approve ID` / `/reject ID [ALASAN]`"
+            else:
+                text += "\n✅ Tidak ada pembayaran yang menunggu verifikasi."
+            text += f"\n\n_Diperbarui: {datetime.now().strftime('%H:%M:%S')}_"
+            return text
+
+        def _update_queue_messages(self, new_counts: Dict[int, int]) -> None:
+            """Memperbarui pesan antrean tiap admin; pesan baru hanya dibuat untuk admin yang menerima notifikasi."""
+            try:
+                queue = repo.pending_summary(ADMIN_QUEUE_PREVIEW_SIZE, int(time.time()))
+            except sqlite3.Error as e:
+                logger.error(f"DB Error menyusun pesan antrean admin: {e}")
+                return
+            markup = InlineKeyboardMarkup().add(InlineKeyboardButton("⏭ Klaim Berikutnya", callback_data=f"{StaffCallbackData.CLAIM_NEXT_PREFIX}0"))
+            for admin_id in admin_roster.members():
+                new_count = new_counts.get(admin_id, 0)
+                self._update_queue_message(admin_id, self._build_queue_text(queue, admin_id, new_count), markup, create=new_count > 0)
+
+        def _update_queue_message(self, admin_id: int, text: str, markup: InlineKeyboardMarkup, create: bool) -> None:
+            setting_key = self._setting_key(admin_id)
+            message_id = int(get_setting(setting_key) or 0)
+            if message_id:
+                try:
+                    bot.edit_message_text(text, admin_id, message_id, reply_markup=markup)
+                    return
+                except telebot.apihelper.ApiTelegramException as e_edit:
+                    if "message is not modified" in str(e_edit).lower():
+                        return
+                    logger.warning(f"Pesan antrean admin {admin_id}/{message_id} tidak bisa diedit, kirim ulang: {e_edit}")
+            if not create and not message_id:
+                return # Hanya refresh dan belum ada pesan antrean: tidak perlu membuat pesan baru
+            try:
+                sent = bot.send_message(admin_id, text, reply_markup=markup)
+                set_setting(setting_key, str(sent.message_id))
+                try:
+                    bot.pin_chat_message(admin_id, sent.message_id, disable_notification=True)
+                except telebot.apihelper.ApiTelegramException as e_pin:
+                    logger.warning(f"Gagal menyematkan pesan antrean admin {admin_id}: {e_pin}")
+            except Exception as e_send:
+                logger.error(f"Gagal mengirim pesan antrean admin {admin_id}: {e_send}")
+
+    admin_notifier = AdminNotifier()
+
     # --- USER COMMANDS (ENHANCED PURCHASE FLOW) ---
     @bot.message_handler(func=lambda message: message.text == "🛒 Beli Akun" and not is_admin(message.from_user.id))
     @check_maintenance
     def buy_account_user(message: Message) -> None:
-        """Handler untuk user yang ingin membeli akun."""
+        """Handler untuk user yang ingin membeli akun: katalog produk, atau langsung info pembelian jika hanya satu produk."""
         try:
-            with sqlite3.connect(DB_NAME) as conn:
-                c = conn.cursor()
-                c.execute('SELECT COUNT(*) FROM accounts WHERE sold = 0')
-                stock = c.fetchone()[0]
-
-                if stock == 0:
-                    bot.reply_to(message, "Mohon maaf, stok akun saat ini sedang habis. 😔 Silakan cek kembali nanti.")
-                    return
-
-                price_str = get_setting('price')
-                if not price_str: # Seharusnya tidak terjadi jika default ada
-                    bot.reply_to(message, f"⚠️ Harga belum diatur oleh admin. Hubungi @{ADMIN_USERNAME}.")
-                    return
-                price_formatted = format_rupiah(price_str)
-
-                c.execute('SELECT method, number, holder_name FROM payment_methods WHERE active = 1')
-                active_payments: List[Tuple[str, str, str]] = c.fetchall()
-            
-            payment_info = "💳 *Metode Pembayaran Tersedia*:\n"
-            if active_payments:
-                for method, number, holder_name in active_payments:
-                    payment_info += f"  • *{method}*: `{number}` (a/n *{holder_name}*)\n"
-            else:
-                payment_info += "  ⚠️ Saat ini admin belum mengatur metode pembayaran. Silakan hubungi admin.\n"
-                bot.reply_to(message, f"{payment_info}\nUntuk info lebih lanjut hubungi @{ADMIN_USERNAME}.")
+            snapshot = store_snapshot.get()
+            catalog = snapshot.catalog
+            min_qty, _max_qty = get_purchase_limits()
+            available = [product for product in catalog if product.stock >= min_qty]
+            if not available:
+                bot.reply_to(message, "Mohon maaf, stok akun saat ini sedang habis. 😔 Silakan cek kembali nanti.")
+                return
+            if len(catalog) == 1:
+                show_product_purchase(available[0], snapshot, lambda text, **kwargs: bot.reply_to(message, text, **kwargs))
                 return
 
             markup = InlineKeyboardMarkup(row_width=1)
-            markup.add(InlineKeyboardButton("✅ Saya Sudah Bayar & Kirim Bukti", callback_data="user_confirm_purchase_send_proof"))
+            catalog_text = f"🛍 *Katalog {STORE_NAME}*\n\nPilih produk yang ingin dibeli:\n"
+            for product in catalog:
+                in_stock = product.stock >= min_qty
+                catalog_text += f"\n• *{product.name}* - {format_rupiah(product.price)} ({f'stok {product.stock}' if in_stock else 'habis'})"
+                if product.description: catalog_text += f"\n   {product.description}"
+                if in_stock:
+                    markup.add(InlineKeyboardButton(f"🛒 {product.name} - {format_rupiah(product.price)}",
+                                                    callback_data=f"{UserCallbackData.BUY_PRODUCT_PREFIX}{product.id}"))
             markup.add(InlineKeyboardButton(f"❓ Tanya Admin (@{ADMIN_USERNAME})", url=f"https://t.me/{ADMIN_USERNAME}"))
-
-            buy_message = (
-                f"✨ *Pembelian Akun Premium {STORE_NAME}*\n\n"
-                f"Harga per akun: *{price_formatted}*\n"
-                f"Stok tersedia: *{stock} akun*\n\n"
-                f"{payment_info}\n"
-                f"➡️ *Langkah Pembelian*:\n"
-                f"1. Lakukan pembayaran sejumlah harga di atas ke salah satu metode yang tersedia.\n"
-                f"2. Klik tombol '*✅ Saya Sudah Bayar & Kirim Bukti*' di bawah ini.\n"
-                f"3. Kirimkan *BUKTI TRANSFER* Anda (berupa foto/screenshot).\n"
-                f"4. Admin akan memverifikasi dan akun akan dikirim otomatis jika disetujui.\n\n"
-                f"Terima kasih! 😊"
-            )
-            bot.reply_to(message, buy_message, reply_markup=markup)
+            bot.reply_to(message, catalog_text, reply_markup=markup)
 
         except sqlite3.Error as e:
             logger.error(f"DB Error di buy_account_user: {e}")
@@ -348,18 +1324,87 @@ try:
             logger.error(f"General Error di buy_account_user: {e}", exc_info=True)
             bot.reply_to(message, "❌ Ups! Ada kendala. Silakan hubungi admin.")
 
-    @bot.callback_query_handler(func=lambda call: call.data == "user_confirm_purchase_send_proof")
+    @bot.callback_query_handler(func=lambda call: call.data.startswith(UserCallbackData.BUY_PRODUCT_PREFIX))
+    @check_maintenance
+    def cb_user_selects_product(call: CallbackQuery) -> None:
+        """Callback tombol produk di katalog: menampilkan info pembelian produk tersebut."""
+        bot.answer_callback_query(call.id)
+        chat_id = call.message.chat.id
+        try:
+            snapshot = store_snapshot.get()
+            product = snapshot.product(int(call.data[len(UserCallbackData.BUY_PRODUCT_PREFIX):]))
+            if not product or not product.active or product.stock < get_purchase_limits()[0]:
+                bot.send_message(chat_id, "⚠️ Maaf, produk ini sedang tidak tersedia. Silakan pilih produk lain dari '🛒 Beli Akun'.")
+                return
+            show_product_purchase(product, snapshot, lambda text, **kwargs: bot.send_message(chat_id, text, **kwargs))
+        except ValueError:
+            logger.warning(f"Callback produk tidak valid: {call.data}")
+        except sqlite3.Error as e:
+            logger.error(f"DB Error di cb_user_selects_product: {e}")
+            bot.send_message(chat_id, "❌ Terjadi kesalahan database. Mohon coba lagi nanti.")
+
+    def show_product_purchase(product: ProductInfo, snapshot: StoreSnapshotData, reply: Callable[..., Any]) -> None:
+        """Mengirim harga, stok, metode pembayaran, dan langkah pembelian satu produk (bisa raise sqlite3.Error)."""
+        min_qty, max_qty = get_purchase_limits()
+        active_payments = snapshot.payment_methods
+        payment_info = "💳 *Metode Pembayaran Tersedia*:\n"
+        if active_payments:
+            for method, number, holder_name in active_payments:
+                payment_info += f"  • *{method}*: `{number}` (a/n *{holder_name}*)\n"
+        else:
+            payment_info += "  ⚠️ Saat ini admin belum mengatur metode pembayaran. Silakan hubungi admin.\n"
+            reply(f"{payment_info}\nUntuk info lebih lanjut hubungi @{ADMIN_USERNAME}.")
+            return
+
+        markup = InlineKeyboardMarkup(row_width=1)
+        if max_qty > 1: # Pesanan multi-akun: jumlah ditanyakan dulu sebelum transfer
+            markup.add(InlineKeyboardButton("🛒 Pesan Sekarang", callback_data=f"{UserCallbackData.CONFIRM_PURCHASE}::{product.id}"))
+            purchase_steps = (
+                f"1. Klik tombol '*🛒 Pesan Sekarang*' dan masukkan jumlah akun ({min_qty}–{max_qty} akun).\n"
+                f"2. Transfer *total harga* yang ditampilkan ke salah satu metode yang tersedia.\n"
+                f"3. Kirimkan *BUKTI TRANSFER* Anda (berupa foto/screenshot).\n"
+                f"4. Admin akan memverifikasi dan semua akun akan dikirim sekaligus jika disetujui.\n\n"
+            )
+        else:
+            # Pembelian 1 akun dibayar sebelum klik tombol, jadi kode unik ditentukan sekarang
+            unique_code = pick_unique_code(product.price)
+            markup.add(InlineKeyboardButton("✅ Saya Sudah Bayar & Kirim Bukti", callback_data=f"{UserCallbackData.CONFIRM_PURCHASE}:{unique_code}:{product.id}"))
+            purchase_steps = (
+                f"Total transfer: *{format_rupiah(product.price + unique_code)}* (harga + kode unik `{unique_code}`)\n"
+                f"1. Lakukan pembayaran *TEPAT* sejumlah total transfer di atas ke salah satu metode yang tersedia (agar terverifikasi otomatis).\n"
+                f"2. Klik tombol '*✅ Saya Sudah Bayar & Kirim Bukti*' di bawah ini.\n"
+                f"3. Kirimkan *BUKTI TRANSFER* Anda (berupa foto/screenshot).\n"
+                f"4. Admin akan memverifikasi dan akun akan dikirim otomatis jika disetujui.\n\n"
+            )
+        markup.add(InlineKeyboardButton(f"❓ Tanya Admin (@{ADMIN_USERNAME})", url=f"https://t.me/{ADMIN_USERNAME}"))
+
+        buy_message = (
+            f"✨ *Pembelian Akun {product.name} - {STORE_NAME}*\n\n"
+            + (f"{product.description}\n\n" if product.description else "")
+            + f"Harga per akun: *{format_rupiah(product.price)}*\n"
+            f"Stok tersedia: *{product.stock} akun*\n\n"
+            f"{payment_info}\n"
+            f"➡️ *Langkah Pembelian*:\n"
+            f"{purchase_steps}"
+            f"Terima kasih! 😊"
+        )
+        reply(buy_message, reply_markup=markup)
+
+    @bot.callback_query_handler(func=lambda call: call.data.split(':')[0] == UserCallbackData.CONFIRM_PURCHASE)
     @check_maintenance
     def cb_user_confirms_purchase(call: CallbackQuery) -> None:
         """Callback setelah user mengklik 'Saya Sudah Bayar & Kirim Bukti'."""
         bot.answer_callback_query(call.id)
+        # Data: PREFIX:KODE_UNIK:ID_PRODUK; tombol lama tanpa ID produk berlaku untuk produk pertama
+        _, code_str, product_str = (call.data.split(':') + ['', ''])[:3]
+        unique_code: Optional[int] = int(code_str) if code_str.isdigit() else None
+        product_id = int(product_str) if product_str.isdigit() else DEFAULT_PRODUCT_ID
         
         try:
-            with sqlite3.connect(DB_NAME) as conn:
-                c = conn.cursor()
-                c.execute('SELECT COUNT(*) FROM accounts WHERE sold = 0')
-                stock = c.fetchone()[0]
-            if stock == 0:
+            product = store_snapshot.get().product(product_id)
+            stock = product.stock if product and product.active else 0
+            min_qty, max_qty = get_purchase_limits()
+            if stock < min_qty:
                 bot.send_message(call.message.chat.id, "⚠️ Maaf, stok habis tepat sebelum Anda konfirmasi. Silakan cek lagi nanti.")
                 bot.edit_message_reply_markup(call.message.chat.id, call.message.message_id, reply_markup=None)
                 return
@@ -368,6 +1413,18 @@ try:
             bot.send_message(call.message.chat.id, "❌ Gagal memeriksa stok. Coba lagi dari menu.")
             return
 
+        if max_qty > 1:
+            msg_ask_qty = bot.send_message(
+                call.message.chat.id,
+                f"🔢 Berapa akun *{product.name}* yang ingin Anda beli?\nMasukkan angka *{min_qty}–{min(max_qty, stock)}*.\n\nKetik /cancel untuk batal.",
+            )
+            try:
+                bot.edit_message_reply_markup(call.message.chat.id, call.message.message_id, reply_markup=None)
+            except telebot.apihelper.ApiTelegramException as e_edit:
+                logger.warning(f"Gagal menghapus markup tombol lama: {e_edit}")
+            bot.register_next_step_handler(msg_ask_qty, process_purchase_quantity, product_id)
+            return
+
         msg_ask_proof = bot.send_message(
             call.message.chat.id,
             "Baik! 👍 Silakan kirim *satu pesan* berisi *foto atau screenshot bukti pembayaran* Anda.\n\nPastikan bukti transfer jelas dan terbaca ya.",
@@ -377,18 +1434,76 @@ try:
         except telebot.apihelper.ApiTelegramException as e_edit:
             logger.warning(f"Gagal menghapus markup tombol lama: {e_edit}")
 
-        bot.register_next_step_handler(msg_ask_proof, process_payment_proof_submission)
+        bot.register_next_step_handler(msg_ask_proof, process_payment_proof_submission, 1, unique_code, product_id)
+
+    def process_purchase_quantity(message: Message, product_id: int = DEFAULT_PRODUCT_ID) -> None:
+        """Memproses jumlah akun yang ingin dibeli user, lalu meminta bukti pembayaran."""
+        if message.text == '/cancel':
+            bot.reply_to(message, "Pembelian dibatalkan. Silakan gunakan menu lagi.")
+            return
+
+        min_qty, max_qty = get_purchase_limits()
+        try:
+            product = store_snapshot.get().product(product_id)
+            if not product or not product.active:
+                bot.reply_to(message, "⚠️ Produk ini sudah tidak tersedia. Silakan pilih lagi dari '🛒 Beli Akun'.")
+                return
+            stock = product.stock
+        except sqlite3.Error as e:
+            logger.error(f"DB error memeriksa stok di process_purchase_quantity: {e}")
+            bot.reply_to(message, "❌ Gagal memeriksa stok. Coba lagi dari menu.")
+            return
+
+        upper_qty = min(max_qty, stock)
+        try:
+            quantity = int((message.text or '').strip())
+            if not (min_qty <= quantity <= upper_qty): raise ValueError
+        except ValueError:
+            if upper_qty < min_qty:
+                bot.reply_to(message, "⚠️ Maaf, stok tidak mencukupi saat ini. Silakan cek lagi nanti.")
+                return
+            msg_retry = bot.reply_to(message, f"❌ Jumlah harus angka antara *{min_qty}* dan *{upper_qty}*. Coba lagi atau /cancel.")
+            bot.register_next_step_handler(msg_retry, process_purchase_quantity, product_id)
+            return
+
+        try:
+            unique_code = pick_unique_code(product.price * quantity) # Nominal bergantung jumlah akun, jadi dipilih setelah jumlah valid
+        except sqlite3.Error as e:
+            logger.error(f"DB error memilih kode unik di process_purchase_quantity: {e}")
+            bot.reply_to(message, "❌ Gagal menyiapkan pembayaran. Coba lagi dari menu.")
+            return
+        total_price = product.price * quantity + unique_code
+        msg_ask_proof = bot.reply_to(
+            message,
+            f"🧾 *Ringkasan Pesanan*\n"
+            f"Produk: *{product.name}*\n"
+            f"Jumlah: *{quantity} akun*\n"
+            f"Total bayar: *{format_rupiah(total_price)}* (termasuk kode unik `{unique_code}`)\n\n"
+            f"Silakan transfer *TEPAT* sejumlah total di atas ke salah satu metode pembayaran, lalu kirim *satu pesan* berisi *foto atau screenshot bukti pembayaran* Anda.",
+        )
+        bot.register_next_step_handler(msg_ask_proof, process_payment_proof_submission, quantity, unique_code, product_id)
+
+    def reply_duplicate_proof(message: Message, sale_id: int, status: str) -> None:
+        """Membalas kiriman bukti ganda dengan Sale ID yang sudah ada, tanpa notifikasi admin baru."""
+        logger.info(f"Bukti pembayaran ganda dari user {message.from_user.id}, memakai Sale ID {sale_id} yang sudah ada.")
+        bot.reply_to(
+            message,
+            f"ℹ️ Bukti pembayaran ini sudah kami terima sebelumnya (Sale ID: `{sale_id}`, status: *{status.upper()}*).\n"
+            f"Tidak perlu mengirim ulang. Cek status di menu '🧾 Riwayat Pembelian'.",
+        )
 
-    def process_payment_proof_submission(message: Message) -> None:
+    def process_payment_proof_submission(message: Message, quantity: int = 1, unique_code: Optional[int] = None,
+                                         product_id: int = DEFAULT_PRODUCT_ID) -> None:
         """Memproses bukti pembayaran yang dikirim user."""
         user_id = message.from_user.id
         username = message.from_user.username if message.from_user.username else f"user_{user_id}"
         file_id: Optional[str] = None
+        file_unique_id: Optional[str] = None # Stabil untuk file yang sama walau dikirim ulang
         
         if message.content_type == 'photo':
-            file_id = message.photo[-1].file_id
+            file_id, file_unique_id = message.photo[-1].file_id, message.photo[-1].file_unique_id
         elif message.content_type == 'document' and message.document.mime_type and message.document.mime_type.startswith('image/'):
-            file_id = message.document.file_id
+            file_id, file_unique_id = message.document.file_id, message.document.file_unique_id
         else:
             bot.reply_to(message, "⚠️ Format file tidak didukung atau bukan gambar. Harap kirim bukti pembayaran berupa *gambar/foto* atau *screenshot*.\nUlangi dari menu '🛒 Beli Akun'.")
             return
@@ -397,30 +1512,22 @@ try:
             bot.reply_to(message, "⚠️ Gagal mendapatkan file bukti pembayaran. Silakan coba lagi.\nUlangi dari menu '🛒 Beli Akun'.")
             return
 
-        price_str = get_setting('price')
-        if not price_str:
-            bot.reply_to(message, "Kesalahan: Harga produk tidak terset. Hubungi admin.")
-            logger.error("Harga produk tidak ditemukan saat proses submit bukti.")
-            return
-            
-        current_time_str = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        current_time_str, current_ts = now_stamp()
 
         try:
-            with sqlite3.connect(DB_NAME) as conn:
-                c = conn.cursor()
-                
-                c.execute('SELECT COUNT(*) FROM accounts WHERE sold = 0') # Cek stok terakhir
-                stock_final_check = c.fetchone()[0]
-                if stock_final_check == 0:
-                    bot.reply_to(message, "❌ Maaf, stok akun baru saja habis saat Anda mengirim bukti. Pembelian tidak dapat diproses. Silakan hubungi admin jika sudah transfer.")
-                    return
-
-                c.execute('''INSERT INTO sales 
-                             (buyer_id, buyer_username, amount, payment_proof, status, created_date, account_id) 
-                             VALUES (?, ?, ?, ?, 'pending', ?, NULL)''',
-                          (user_id, username, price_str, file_id, current_time_str))
-                sale_id = c.lastrowid
-                conn.commit()
+            result = repo.submit_sale(storage.NewSale(user_id, username, product_id, quantity, unique_code, file_id, file_unique_id,
+                                                      (current_time_str, current_ts)))
+            if result.status == 'duplicate':
+                reply_duplicate_proof(message, result.sale_id, result.sale_status)
+                return
+            if result.status == 'inactive':
+                bot.reply_to(message, "❌ Maaf, produk ini baru saja dinonaktifkan admin. Pembelian tidak dapat diproses. Silakan hubungi admin jika sudah transfer.")
+                return
+            if result.status == 'out_of_stock':
+                bot.reply_to(message, "❌ Maaf, stok akun baru saja habis saat Anda mengirim bukti. Pembelian tidak dapat diproses. Silakan hubungi admin jika sudah transfer.")
+                return
+            sale_id, product_name, total_amount_str = result.sale_id, result.product_name, result.amount
+            notify_admin_id = result.notify_admin_id or ADMIN_ID
 
             bot.reply_to(
                 message,
@@ -429,22 +1536,31 @@ try:
                 f"Harap tunggu dengan sabar. Terima kasih! 😊",
             )
 
+            if get_setting('admin_notify_mode') != 'individual':
+                admin_notifier.add(PaymentNotice(sale_id, user_id, username, quantity, total_amount_str, file_id,
+                                                 message.content_type == 'photo', message.chat.id, message.message_id,
+                                                 notify_admin_id, product_name))
+                return
+
+            code_info = f" (kode unik `{unique_code}`)" if unique_code else ""
             admin_message = (
                 f"🔔 *PEMBAYARAN BARU MENUNGGU VERIFIKASI!*\n\n"
                 f"Sale ID: `{sale_id}`\n"
-                f"Dari: @{username if username != f'user_{user_id}' else f'User ID {user_id}'}\n"
+                f"Dari: {format_buyer(username, user_id)}\n"
                 f"Waktu: {current_time_str}\n"
-                f"Jumlah: {format_rupiah(price_str)}\n\n"
+                f"Produk: {escape_md(product_name)}\n"
+                f"Jumlah Akun: {quantity}\n"
+                f"Jumlah: {format_rupiah(total_amount_str)}{code_info}\n\n"
                 f"Bukti pembayaran ada di pesan yang diteruskan.\n"
                 f"👉 Setujui: `/approve {sale_id}`\n"
                 f"👉 Tolak: `/reject {sale_id} [ALASAN]`"
             )
             try:
-                bot.forward_message(chat_id=ADMIN_ID, from_chat_id=message.chat.id, message_id=message.message_id)
-                bot.send_message(ADMIN_ID, admin_message)
+                bot.forward_message(chat_id=notify_admin_id, from_chat_id=message.chat.id, message_id=message.message_id)
+                bot.send_message(notify_admin_id, admin_message, reply_markup=staff_sale_markup(sale_id))
             except Exception as e_admin_notify:
                 logger.error(f"Gagal forward bukti atau notif admin untuk Sale ID {sale_id}: {e_admin_notify}")
-                bot.send_message(ADMIN_ID, f"🔔 Pembayaran baru (Sale ID: {sale_id}) dari @{username} (User ID: {user_id}) menunggu verifikasi. File ID Bukti: {file_id}. Gunakan `/approve {sale_id}` atau `/reject {sale_id} [ALASAN]`.")
+                bot.send_message(notify_admin_id, f"🔔 Pembayaran baru (Sale ID: {sale_id}) dari {format_buyer(username, user_id)} (User ID: {user_id}) menunggu verifikasi. File ID Bukti: {file_id}. Gunakan `/approve {sale_id}` atau `/reject {sale_id} [ALASAN]`.")
 
         except sqlite3.Error as e:
             logger.error(f"DB Error memproses bukti bayar untuk user {user_id}: {e}", exc_info=True)
@@ -453,19 +1569,38 @@ try:
             logger.error(f"General Error memproses bukti bayar untuk user {user_id}: {e}", exc_info=True)
             bot.reply_to(message, "❌ Terjadi kesalahan tak terduga. Mohon hubungi admin.")
 
+    def format_stock_text(catalog: List[ProductInfo]) -> str:
+        stock = sum(product.stock for product in catalog)
+        if stock <= 0:
+            return f"😔 Mohon maaf, stok akun {STORE_NAME} saat ini sedang *kosong*. Silakan cek kembali nanti ya!"
+        if len(catalog) == 1:
+            return f"📦 Stok akun {STORE_NAME} saat ini: *{stock} akun*.\nSegera lakukan pembelian sebelum kehabisan! 😉"
+        lines = [f"📦 *Stok {STORE_NAME} saat ini*\n"]
+        lines.extend(f"• *{product.name}*: {f'{product.stock} akun' if product.stock > 0 else 'habis'}" for product in catalog)
+        lines.append("\nSegera lakukan pembelian sebelum kehabisan! 😉")
+        return '\n'.join(lines)
+
+    def format_price_text(catalog: List[ProductInfo]) -> str:
+        if not catalog:
+            return f"⚠️ Informasi harga belum diatur. Silakan hubungi admin @{ADMIN_USERNAME}."
+        if len(catalog) == 1:
+            return f"💰 Harga satu akun premium {STORE_NAME} adalah: *{format_rupiah(catalog[0].price)}*."
+        lines = [f"💰 *Harga per akun di {STORE_NAME}*\n"]
+        lines.extend(f"• *{product.name}*: {format_rupiah(product.price)}" for product in catalog)
+        return '\n'.join(lines)
+
+    def format_payment_methods_text(methods: List[PaymentMethodInfo]) -> str:
+        if not methods:
+            return f"⚠️ Metode pembayaran belum tersedia. Silakan hubungi admin @{ADMIN_USERNAME}."
+        lines = [f"💳 *Metode Pembayaran {STORE_NAME}*\n"]
+        lines.extend(f"• *{method}*: `{number}` a/n {holder_name}" for method, number, holder_name in methods)
+        return '\n'.join(lines)
+
     @bot.message_handler(func=lambda message: message.text == "📦 Cek Stok" and not is_admin(message.from_user.id))
     @check_maintenance
     def check_stock_user(message: Message) -> None:
         try:
-            with sqlite3.connect(DB_NAME) as conn:
-                c = conn.cursor()
-                c.execute('SELECT COUNT(*) FROM accounts WHERE sold = 0')
-                stock = c.fetchone()[0]
-            
-            if stock > 0:
-                bot.reply_to(message, f"📦 Stok akun {STORE_NAME} saat ini: *{stock} akun*.\nSegera lakukan pembelian sebelum kehabisan! 😉")
-            else:
-                bot.reply_to(message, f"😔 Mohon maaf, stok akun {STORE_NAME} saat ini sedang *kosong*. Silakan cek kembali nanti ya!")
+            bot.reply_to(message, format_stock_text(store_snapshot.get().catalog))
         except sqlite3.Error as e:
             logger.error(f"DB Error di check_stock_user: {e}")
             bot.reply_to(message, "❌ Gagal mengambil info stok. Coba lagi nanti.")
@@ -473,12 +1608,67 @@ try:
     @bot.message_handler(func=lambda message: message.text == "💰 Cek Harga" and not is_admin(message.from_user.id))
     @check_maintenance
     def check_price_user(message: Message) -> None:
-        price_str = get_setting('price')
-        if price_str:
-            price_formatted = format_rupiah(price_str)
-            bot.reply_to(message, f"💰 Harga satu akun premium {STORE_NAME} adalah: *{price_formatted}*.")
-        else:
-            bot.reply_to(message, f"⚠️ Informasi harga belum diatur. Silakan hubungi admin @{ADMIN_USERNAME}.")
+        try:
+            bot.reply_to(message, format_price_text(store_snapshot.get().catalog))
+        except sqlite3.Error as e:
+            logger.error(f"DB Error di check_price_user: {e}")
+            bot.reply_to(message, "❌ Gagal mengambil info harga. Coba lagi nanti.")
+
+    # Kata kunci inline query (dicocokkan sebagai prefix) -> jenis jawaban
+    INLINE_TOPICS: Dict[str, Tuple[str, ...]] = {
+        'stok': ('stok', 'stock'),
+        'harga': ('harga', 'price'),
+        'bayar': ('bayar', 'pembayaran', 'payment', 'metode'),
+    }
+
+    def build_inline_results(snapshot: StoreSnapshotData, query_text: str) -> List[InlineQueryResultArticle]:
+        """Menyusun jawaban inline dari snapshot. Query kosong/tidak dikenal menampilkan semua topik."""
+        buy_markup = InlineKeyboardMarkup().add(InlineKeyboardButton(f"🛒 Beli di @{BOT_USERNAME}", url=f"https://t.me/{BOT_USERNAME}"))
+
+        def article(result_id: str, title: str, description: str, text: str) -> InlineQueryResultArticle:
+            return InlineQueryResultArticle(
+                id=result_id, title=title, description=description, reply_markup=buy_markup,
+                input_message_content=InputTextMessageContent(text, parse_mode='Markdown'),
+            )
+
+        if snapshot.maintenance:
+            return [article('maintenance', "🛠 Bot sedang maintenance", "Coba lagi beberapa saat lagi",
+                            f"🛠 *{STORE_NAME} SEDANG MAINTENANCE*\n\nMohon tunggu beberapa saat. Terima kasih!")]
+
+        words = query_text.strip().lower().split()
+        topics = [topic for topic, keywords in INLINE_TOPICS.items()
+                  if any(keyword.startswith(word) or word.startswith(keyword) for word in words for keyword in keywords)]
+        results = []
+        catalog = snapshot.catalog
+        if not topics or 'stok' in topics:
+            stock_desc = f"{snapshot.stock} akun tersedia" if snapshot.stock > 0 else "Stok kosong"
+            results.append(article('stok', f"📦 Stok {STORE_NAME}", stock_desc, format_stock_text(catalog)))
+        if not topics or 'harga' in topics:
+            prices = sorted(product.price for product in catalog)
+            if not prices:
+                price_desc = "Belum diatur"
+            elif len(catalog) == 1:
+                price_desc = format_rupiah(prices[0])
+            else:
+                price_desc = f"{len(catalog)} produk, mulai {format_rupiah(prices[0])}"
+            results.append(article('harga', "💰 Harga per akun", price_desc, format_price_text(catalog)))
+        if not topics or 'bayar' in topics:
+            methods_desc = ', '.join(method for method, _, _ in snapshot.payment_methods) or "Belum tersedia"
+            results.append(article('bayar', "💳 Metode pembayaran", methods_desc, format_payment_methods_text(snapshot.payment_methods)))
+        return results
+
+    @bot.inline_handler(func=lambda query: True)
+    def answer_inline_query(query: InlineQuery) -> None:
+        """Menjawab `@bot stok` dari snapshot; jawaban sama untuk semua user sehingga bisa di-cache Telegram."""
+        try:
+            results = build_inline_results(store_snapshot.get(), query.query or '')
+        except sqlite3.Error as e:
+            logger.error(f"DB Error membangun snapshot untuk inline query: {e}")
+            return
+        try:
+            bot.answer_inline_query(query.id, results, cache_time=INLINE_CACHE_TIME_SEC, is_personal=False)
+        except telebot.apihelper.ApiTelegramException as e_api: # Mis. query sudah kedaluwarsa
+            logger.warning(f"Gagal menjawab inline query {query.id}: {e_api}")
 
     @bot.message_handler(func=lambda message: message.text == "❓ Bantuan" and not is_admin(message.from_user.id))
     @check_maintenance
@@ -488,7 +1678,9 @@ try:
             "Berikut adalah perintah cepat:\n"
             "  🛒 *Beli Akun* - Mulai proses pembelian.\n"
             "  📦 *Cek Stok* - Lihat ketersediaan akun.\n"
-            "  💰 *Cek Harga* - Info harga per akun.\n\n"
+            "  💰 *Cek Harga* - Info harga per akun.\n"
+            "  🧾 *Riwayat Pembelian* - Lihat pembelian & kirim ulang akun yang hilang.\n\n"
+            f"Cek stok & harga dari chat mana pun: ketik `@{BOT_USERNAME} stok` atau `@{BOT_USERNAME} harga`.\n\n"
             f"Jika ada kendala atau pertanyaan, hubungi Admin @{ADMIN_USERNAME}.\n"
             f"Owner: @{OWNER_USERNAME}."
         )
@@ -498,6 +1690,83 @@ try:
              markup.add(InlineKeyboardButton(f"👑 Hubungi Owner (@{OWNER_USERNAME})", url=f"https://t.me/{OWNER_USERNAME}"))
         bot.reply_to(message, help_text, reply_markup=markup)
 
+    def display_purchase_history(chat_id: int, user_id: int, after_sale_id: Optional[int] = None, message_id_to_edit: Optional[int] = None) -> None:
+        """Menampilkan riwayat pembelian user, terbaru dulu, dengan keyset pagination (created_ts, id)."""
+        try:
+            history = repo.purchase_history(user_id, after_sale_id, HISTORY_PAGE_SIZE + 1)
+            has_more = len(history) > HISTORY_PAGE_SIZE
+            history = history[:HISTORY_PAGE_SIZE]
+            accounts_by_sale = repo.sale_accounts([entry.id for entry in history if entry.status == 'completed'])
+
+            status_labels = {'pending': "⏳ Menunggu verifikasi", 'completed': "✅ Selesai", 'cancelled': "❌ Dibatalkan", 'failed': "⚠️ Gagal"}
+            text = "🧾 *Riwayat Pembelian Anda*\n(Terbaru di atas)\n\n"
+            markup = InlineKeyboardMarkup(row_width=2)
+            if not history:
+                text += "Belum ada pembelian." if after_sale_id is None else "Tidak ada riwayat yang lebih lama."
+            for sale_id, amount, quantity, status, created_ts, _product_id in history:
+                text += (
+                    f"🆔 Sale ID: `{sale_id}`\n"
+                    f"🗓 {format_ts(created_ts)} | 📦 {quantity or 1} akun | 💰 {format_rupiah(amount)}\n"
+                    f"Status: {status_labels.get(status, status)}\n"
+                )
+                for _acc_id, email, _password, _notes in accounts_by_sale.get(sale_id, []):
+                    text += f"   📧 `{email}`\n"
+                text += "--------------------\n"
+                if sale_id in accounts_by_sale:
+                    markup.add(InlineKeyboardButton(f"📩 Kirim Ulang #{sale_id}", callback_data=f"{UserCallbackData.RESEND_ACCOUNT_PREFIX}{sale_id}"))
+            if has_more:
+                markup.add(InlineKeyboardButton("➡️ Lebih Lama", callback_data=f"{UserCallbackData.HISTORY_PAGE_PREFIX}{history[-1].id}"))
+
+            if len(text) > 4096:
+                text = text[:4000] + "\n\n⚠️ Daftar terlalu panjang, beberapa item mungkin terpotong..."
+            if message_id_to_edit:
+                bot.edit_message_text(text, chat_id, message_id_to_edit, reply_markup=markup)
+            else:
+                bot.send_message(chat_id, text, reply_markup=markup)
+        except sqlite3.Error as e:
+            logger.error(f"DB Error di display_purchase_history untuk user {user_id}: {e}", exc_info=True)
+            bot.send_message(chat_id, "❌ Gagal mengambil riwayat pembelian. Coba lagi nanti.")
+
+    @bot.message_handler(func=lambda message: message.text == "🧾 Riwayat Pembelian" and not is_admin(message.from_user.id))
+    @check_maintenance
+    def purchase_history_user(message: Message) -> None:
+        display_purchase_history(message.chat.id, message.from_user.id)
+
+    @bot.callback_query_handler(func=lambda call: call.data.startswith(UserCallbackData.HISTORY_PAGE_PREFIX))
+    @check_maintenance
+    def cb_purchase_history_page(call: CallbackQuery) -> None:
+        bot.answer_callback_query(call.id)
+        try:
+            after_sale_id = int(call.data[len(UserCallbackData.HISTORY_PAGE_PREFIX):])
+        except ValueError:
+            return
+        display_purchase_history(call.message.chat.id, call.from_user.id, after_sale_id=after_sale_id, message_id_to_edit=call.message.message_id)
+
+    @bot.callback_query_handler(func=lambda call: call.data.startswith(UserCallbackData.RESEND_ACCOUNT_PREFIX))
+    @check_maintenance
+    def cb_resend_account(call: CallbackQuery) -> None:
+        """Mengirim ulang detail akun dari sale milik user sendiri yang sudah selesai."""
+        try:
+            sale_id = int(call.data[len(UserCallbackData.RESEND_ACCOUNT_PREFIX):])
+        except ValueError:
+            bot.answer_callback_query(call.id)
+            return
+        try:
+            sale = repo.buyer_sale(call.from_user.id, sale_id)
+            if not sale or sale.status != 'completed':
+                bot.answer_callback_query(call.id, "Sale tidak ditemukan atau belum selesai.")
+                return
+            accounts = repo.sale_accounts([sale_id]).get(sale_id, [])
+            if not accounts:
+                bot.answer_callback_query(call.id, "Data akun tidak ditemukan. Hubungi admin.")
+                return
+            send_account_details(call.message.chat.id, sale_id, accounts, resend=True, product_name=product_label(sale.product_id))
+            bot.answer_callback_query(call.id, "Detail akun dikirim ulang.")
+            logger.info(f"User {call.from_user.id} meminta kirim ulang akun Sale ID {sale_id}.")
+        except sqlite3.Error as e:
+            logger.error(f"DB Error di cb_resend_account (Sale {sale_id}): {e}", exc_info=True)
+            bot.answer_callback_query(call.id, "Gagal mengambil data. Coba lagi nanti.")
+
     # --- ADMIN COMMANDS AND CALLBACKS ---
     @bot.message_handler(func=lambda message: message.text == "📦 Produk" and is_admin(message.from_user.id))
     def product_menu_admin(message: Message) -> None:
@@ -506,7 +1775,8 @@ try:
             InlineKeyboardButton("➕ Tambah Akun", callback_data=AdminCallbackData.ADD_ACCOUNT),
             InlineKeyboardButton("📋 List Semua Akun", callback_data=AdminCallbackData.LIST_ACCOUNTS),
             InlineKeyboardButton("📦 Stok Tersedia (Detail)", callback_data=AdminCallbackData.CHECK_STOCK_DETAIL),
-            InlineKeyboardButton("🗑 Hapus Akun", callback_data=AdminCallbackData.DELETE_ACCOUNT_PROMPT)
+            InlineKeyboardButton("🗑 Hapus Akun", callback_data=AdminCallbackData.DELETE_ACCOUNT_PROMPT),
+            InlineKeyboardButton("🗂 Katalog Produk", callback_data=AdminCallbackData.CATALOG)
         )
         bot.reply_to(message, "📦 *Menu Manajemen Produk*\n\nPilih tindakan:", reply_markup=markup)
 
@@ -517,7 +1787,8 @@ try:
             InlineKeyboardButton("💳 Metode Pembayaran", callback_data=AdminCallbackData.PAYMENT_METHODS),
             InlineKeyboardButton("💲 Atur Harga Akun", callback_data=AdminCallbackData.PRICE_SETTINGS),
             InlineKeyboardButton("📊 Laporan Penjualan", callback_data=AdminCallbackData.SALES_REPORT),
-            InlineKeyboardButton("⏳ Pembayaran Pending", callback_data=AdminCallbackData.PENDING_PAYMENTS_MENU)
+            InlineKeyboardButton("⏳ Pembayaran Pending", callback_data=AdminCallbackData.PENDING_PAYMENTS_MENU),
+            InlineKeyboardButton("🏦 Rekonsiliasi Mutasi", callback_data=AdminCallbackData.RECONCILE_STATEMENT)
         )
         bot.reply_to(message, "💰 *Menu Manajemen Keuangan*\n\nPilih tindakan:", reply_markup=markup)
     
@@ -525,30 +1796,26 @@ try:
     def display_pending_payments_admin(chat_id: int, message_id_to_edit: Optional[int] = None, from_reply_keyboard: bool = False) -> None:
         """Menampilkan daftar pembayaran pending untuk admin."""
         try:
-            with sqlite3.connect(DB_NAME) as conn:
-                c = conn.cursor()
-                c.execute("""
-                    SELECT s.id, s.buyer_username, s.buyer_id, s.amount, s.created_date, s.payment_method, s.payment_proof
-                    FROM sales s
-                    WHERE s.status = 'pending'
-                    ORDER BY s.created_date ASC 
-                """)
-                pending_tx: List[Tuple[int, str, int, str, str, Optional[str], Optional[str]]] = c.fetchall()
+            pending_tx = repo.pending_sales()
+            now_ts = int(time.time())
 
             response_text = "⏳ *Daftar Pembayaran Pending*\n(Urut berdasarkan terlama)\n\n"
             if not pending_tx:
                 response_text += "✅ Tidak ada pembayaran menunggu persetujuan."
             else:
-                for tx_id, username, buyer_id, amount, date_created, _, proof_file_id in pending_tx:
+                for tx_id, buyer_id, username, quantity, amount, proof_file_id, date_created, claimed_by, claimed_until, product_id in pending_tx:
                     buyer_name_display = username if username and username != f"user_{buyer_id}" else f"User ID {buyer_id}"
                     buyer_contact = f"@{username}" if username and username != f"user_{buyer_id}" else f"ID: {buyer_id}"
                     response_text += (
                         f"🆔 Sale ID: `{tx_id}`\n"
                         f"👤 Pembeli: {buyer_contact}\n"
+                        f"📦 Jumlah Akun: {quantity or 1} ({escape_md(product_label(product_id))})\n"
                         f"💰 Jumlah: {format_rupiah(amount)}\n"
                         f"🧾 Bukti File ID: `{proof_file_id if proof_file_id else 'TIDAK ADA'}`\n"
-                        f"🗓 Dibuat: {datetime.strptime(date_created, '%Y-%m-%d %H:%M:%S').strftime('%d %b %y, %H:%M')}\n"
-                        f"👉 Setujui: `/approve {tx_id}`\n"
+                        f"🗓 Dibuat: {format_ts(date_created)}\n"
+                        + (f"🔒 Diklaim: `{claimed_by}` s/d {format_ts(claimed_until, '%H:%M')}\n"
+                           if claimed_by and (claimed_until or 0) >= now_ts else "")
+                        + f"👉 Setujui: `/approve {tx_id}`\n"
                         f"👉 Tolak: `/reject {tx_id} [ALASAN]`\n"
                         f"--------------------\n"
                     )
@@ -577,142 +1844,370 @@ try:
             logger.error(f"Error saat generate daftar pembayaran pending: {e}", exc_info=True)
             bot.send_message(chat_id, "❌ Terjadi error internal saat menampilkan daftar pending. Cek log.")
 
-    @bot.message_handler(func=lambda message: message.text == "⏳ Pemb. Pending" and is_admin(message.from_user.id))
+    @bot.message_handler(func=lambda message: message.text == "⏳ Pemb. Pending" and is_staff(message.from_user.id))
     def pending_payments_menu_shortcut(message: Message) -> None:
         """Handler untuk tombol 'Pemb. Pending' dari ReplyKeyboard."""
         display_pending_payments_admin(message.chat.id, from_reply_keyboard=True)
 
     @bot.message_handler(func=lambda message: message.text == "⚙️ Pengaturan" and is_admin(message.from_user.id))
     def settings_menu_admin(message: Message) -> None:
+        settings_text, markup = build_settings_menu()
+        bot.reply_to(message, settings_text, reply_markup=markup)
+
+    def build_settings_menu() -> Tuple[str, InlineKeyboardMarkup]:
+        """Menyusun teks dan tombol menu pengaturan sesuai nilai setting saat ini."""
         markup = InlineKeyboardMarkup(row_width=1)
-        maintenance_status_val = get_setting('maintenance_mode')
-        maintenance_status = "ON 🟢" if maintenance_status_val == 'on' else "OFF 🔴"
+        maintenance_status = "ON 🟢" if get_setting('maintenance_mode') == 'on' else "OFF 🔴"
+        notify_mode = "Per Pembayaran 🔔" if get_setting('admin_notify_mode') == 'individual' else "Ringkas 📋"
         markup.add(
             InlineKeyboardButton(f"🛠 Mode Maintenance: {maintenance_status}", callback_data=AdminCallbackData.TOGGLE_MAINTENANCE),
+            InlineKeyboardButton(f"🔔 Notifikasi Pembayaran: {notify_mode}", callback_data=AdminCallbackData.TOGGLE_NOTIFY_MODE),
             InlineKeyboardButton("💲 Atur Harga Akun", callback_data=AdminCallbackData.PRICE_SETTINGS),
             InlineKeyboardButton("💳 Metode Pembayaran", callback_data=AdminCallbackData.PAYMENT_METHODS)
         )
-        current_price = format_rupiah(get_setting('price'))
+        try:
+            catalog = store_snapshot.get().catalog
+            current_price = ', '.join(f"{product.name} {format_rupiah(product.price)}" for product in catalog) or "-"
+        except sqlite3.Error as e:
+            logger.error(f"DB Error membaca katalog untuk menu pengaturan: {e}")
+            current_price = "?"
         settings_text = (
             f"⚙️ *Pengaturan Bot - {STORE_NAME}*\n\n"
             f"Harga Saat Ini: `{current_price}`\n"
-            f"Mode Maintenance: `{maintenance_status}`\n\n"
+            f"Mode Maintenance: `{maintenance_status}`\n"
+            f"Notifikasi Pembayaran: `{notify_mode}`\n\n"
             "Pilih pengaturan:"
         )
-        bot.reply_to(message, settings_text, reply_markup=markup)
+        return settings_text, markup
+
+    # --- Laporan Admin (di luar thread update) ---
+    # Builder menerima koneksi read-only (satu snapshot) dan job; job.check() dipanggil di loop format agar bisa dibatalkan
+    class ReportResult(NamedTuple):
+        text: str
+        document: Optional[Tuple[str, str, str]] = None # (nama file, isi, caption) jika teks terlalu panjang untuk pesan
+
+    class ReportSpec(NamedTuple):
+        title: str
+        timeout: float
+        build: Callable[[sqlite3.Connection, report_executor.ReportJob], ReportResult]
+        back_callback: Optional[str] # Tombol kembali setelah laporan selesai; None = tanpa tombol
+
+    def build_stats_report(conn: sqlite3.Connection, job: report_executor.ReportJob) -> ReportResult:
+        c = conn.cursor()
+        c.execute('SELECT COUNT(*) FROM accounts_all') # Statistik total mencakup data yang sudah diarsipkan
+        total_accounts = c.fetchone()[0]
+        c.execute('SELECT COUNT(*) FROM accounts WHERE sold = 0')
+        available_accounts = c.fetchone()[0]
+        sold_accounts = total_accounts - available_accounts
+
+        c.execute("SELECT COUNT(*), SUM(CAST(REPLACE(REPLACE(amount, '.', ''), ',', '') AS REAL)) FROM sales_all WHERE status = 'completed'")
+        completed_sales_data = c.fetchone()
+        total_completed_sales = completed_sales_data[0] or 0
+        total_revenue = completed_sales_data[1] or 0.0
+
+        today_start_ts, tomorrow_start_ts = day_range_ts(datetime.now())
+        c.execute("""
+            SELECT COUNT(*), SUM(CAST(REPLACE(REPLACE(amount, '.', ''), ',', '') AS REAL))
+            FROM sales 
+            WHERE status = 'completed' AND completed_ts >= ? AND completed_ts < ?
+        """, (today_start_ts, tomorrow_start_ts)) # Menggunakan waktu selesai untuk pendapatan harian
+        today_sales_data = c.fetchone()
+        today_sales_count = today_sales_data[0] or 0
+        today_revenue = today_sales_data[1] or 0.0
+
+        c.execute("SELECT COUNT(*) FROM customers WHERE is_blocked = 0")
+        total_users = c.fetchone()[0]
+        top_throttled = sorted(rate_limiter.throttled_by_key.items(), key=lambda item: item[1], reverse=True)[:3]
+        c.execute('SELECT name, stock FROM products ORDER BY sort_order, id') # Dari koneksi read-only worker, bukan snapshot
+        product_stock = c.fetchall()
+        per_product_stock = ''.join(f"     - {escape_md(name)}: {stock}\n" for name, stock in product_stock) if len(product_stock) > 1 else ""
+        stats_text = (
+            f"📊 *Statistik Bot - {STORE_NAME}*\n\n"
+            f"👤 Pengguna Aktif: {total_users}\n\n"
+            f"📦 Akun:\n"
+            f"  • Total di DB: {total_accounts}\n"
+            f"  • Tersedia: {available_accounts}\n"
+            f"{per_product_stock}"
+            f"  • Terjual: {sold_accounts}\n\n"
+            f"📈 Penjualan:\n"
+            f"  • Transaksi Sukses: {total_completed_sales}\n"
+            f"  • Total Pendapatan: {format_rupiah(total_revenue)}\n\n"
+            f"📅 Hari Ini ({datetime.now().strftime('%d %b %Y')}):\n"
+            f"  • Transaksi Sukses: {today_sales_count}\n"
+            f"  • Pendapatan Hari Ini: {format_rupiah(today_revenue)}\n\n"
+            f"🛡 Request Dibatasi (sejak start): {rate_limiter.throttled_count}"
+        )
+        if top_throttled:
+            stats_text += "\n" + "\n".join(f"  • `{key}`: {count}" for key, count in top_throttled)
+        return ReportResult(stats_text)
+
+    def build_account_list_report(conn: sqlite3.Connection, job: report_executor.ReportJob) -> ReportResult:
+        c = conn.cursor()
+        c.execute('SELECT id, email, password, notes, sold, sold_to_username, sold_ts, added_ts FROM accounts ORDER BY id DESC')
+        response_text = "📋 *Daftar Semua Akun*\n(Terbaru di atas)\n\n"
+        lines: List[str] = []
+        for i, (acc_id, email, acc_pass, notes, sold, sold_to, sold_ts, added_ts) in enumerate(c):
+            if i % 500 == 0: job.check()
+            status = "✅ Terjual" if sold else "☑️ Tersedia"
+            pass_display = f"{acc_pass[:3]}****{acc_pass[-1:]}" if acc_pass and len(acc_pass) > 4 else "****"
+            sold_info = f" kpd @{sold_to} ({format_ts(sold_ts, '%d %b %y')})" if sold else ""
+            notes_info = f"\n   📝 Catatan: {notes}" if notes else ""
+            added_info = f"\n   ➕ Ditambah: {format_ts(added_ts)}"
+            lines.append(
+                f"🆔 `{acc_id}`: `{email}` ({pass_display})\n"
+                f"Status: {status}{sold_info}{notes_info}{added_info}\n\n"
+            )
+        response_text += ''.join(lines) if lines else "Tidak ada akun di database."
+        if len(response_text) > 4096:
+            # Hapus markdown untuk file teks agar lebih bersih
+            clean_response = response_text.replace("`", "").replace("*", "").replace("✅", "-").replace("☑️", "-").replace("🆔", "ID:").replace("📝", "Catatan:").replace("➕", "Ditambah:")
+            return ReportResult("", ("daftar_akun_lengkap.txt", clean_response, "Daftar akun terlalu panjang, dikirim sebagai file."))
+        return ReportResult(response_text)
+
+    def build_stock_detail_report(conn: sqlite3.Connection, job: report_executor.ReportJob) -> ReportResult:
+        c = conn.cursor()
+        c.execute('''SELECT a.id, a.email, a.password, a.notes, a.added_ts, p.name
+                     FROM accounts a LEFT JOIN products p ON p.id = a.product_id
+                     WHERE a.sold = 0 ORDER BY a.product_id, a.added_ts ASC, a.id ASC''')
+        available_accounts: List[Tuple[int, str, str, Optional[str], int, Optional[str]]] = c.fetchall()
+        if not available_accounts:
+            return ReportResult("📦 *Stok Akun Tersedia Saat Ini*\n\n🎉 Semua akun telah terjual atau belum ada stok.")
+
+        stock_message = f"📦 *Stok Akun Tersedia ({len(available_accounts)} Akun)*:\n(Per produk, urut tanggal ditambah, terlama dulu - akan dijual duluan)\n\n"
+        current_product: Optional[str] = None
+        for acc_id, email, password, notes, added_ts, product_name in available_accounts:
+            if len(stock_message) > 4096: break # Sisanya akan terpotong juga
+            job.check()
+            if product_name != current_product:
+                current_product = product_name
+                stock_message += f"🏷 *{product_name or 'Tanpa produk'}*\n"
+            stock_message += f"🆔 `{acc_id}` | 📧 `{email}` | 🔑 `{password}`\n"
+            if notes: stock_message += f"   📝 {notes}\n"
+            stock_message += f"   ➕ Ditambah: {format_ts(added_ts)}\n---\n"
+        if len(stock_message) > 4096:
+            stock_message = stock_message[:4000] + "\n\n⚠️ Data terlalu panjang, beberapa item mungkin terpotong..."
+        return ReportResult(stock_message)
+
+    def build_sales_report(conn: sqlite3.Connection, job: report_executor.ReportJob) -> ReportResult:
+        c = conn.cursor()
+        thirty_days_ago_ts = int((datetime.now() - timedelta(days=30)).timestamp())
+        c.execute("""
+            SELECT s.id, s.buyer_username, s.buyer_id, s.amount, s.payment_method, s.status, s.completed_ts, a.email, s.admin_notes
+            FROM sales s
+            LEFT JOIN accounts a ON s.account_id = a.id
+            WHERE s.created_ts >= ? AND (s.status = 'completed' OR s.status = 'cancelled')
+            ORDER BY s.completed_ts DESC, s.created_ts DESC
+        """, (thirty_days_ago_ts,)) # Menampilkan completed dan cancelled
+        sales_data: List[Tuple[int, Optional[str], int, str, Optional[str], str, Optional[int], Optional[str], Optional[str]]] = c.fetchall()
+
+        report_text = f"📊 *Laporan Transaksi (30 Hari Terakhir)*\n\n"
+        if not sales_data:
+            return ReportResult(report_text + "Tidak ada transaksi dalam 30 hari terakhir.")
+        total_sales_amount = 0.0
+        entries: List[str] = []
+        entries_len = 0
+        for i, (sale_id, username, buyer_id, amount_str, payment, status, date_completed, acc_email, admin_notes_val) in enumerate(sales_data):
+            if i % 200 == 0: job.check()
+            entry = ""
+            try:
+                amount = float(str(amount_str).replace('.', '').replace(',', '')) if status == 'completed' else 0.0
+                if status == 'completed': total_sales_amount += amount
+            except ValueError:
+                amount = 0.0
+                entry += f"⚠️ Format jumlah salah untuk Sale ID {sale_id}\n"
+            if entries_len > 4096: continue # Total tetap dihitung, teks entri sisanya akan terpotong
+
+            buyer_contact = f"@{username}" if username and username != f"user_{buyer_id}" else f"ID: {buyer_id}"
+            entry += (
+                f"🆔 Transaksi: `{sale_id}`\n"
+                f"👤 Pembeli: {buyer_contact}\n"
+                f"状态 Status: *{status.upper()}*\n" # Menggunakan Bahasa Mandarin untuk 'Status' sebagai contoh variasi (bisa diganti)
+                f"📧 Akun: `{acc_email if acc_email else 'N/A (jika pending/cancelled tanpa akun)'}`\n"
+                f"💰 Jumlah: {format_rupiah(amount) if status == 'completed' else '-'}\n"
+                f"💳 Metode Bayar (User): {payment if payment else 'N/A'}\n" # Ini adalah metode yang mungkin dipilih user, bukan metode toko
+                f"🗓 Tgl Selesai/Batal: {format_ts(date_completed)}\n"
+            )
+            if status == 'cancelled' and admin_notes_val:
+                entry += f"📝 Catatan Admin: {admin_notes_val}\n"
+            entries.append(entry + "--------------------\n")
+            entries_len += len(entries[-1])
+        report_text += ''.join(entries) + f"\n*Total Pendapatan Sukses (30 Hari): {format_rupiah(total_sales_amount)}*"
+        if len(report_text) > 4096:
+            report_text = report_text[:4000] + "\n\n⚠️ Laporan terlalu panjang..."
+        return ReportResult(report_text)
+
+    REPORTS: Dict[str, ReportSpec] = {
+        'stats': ReportSpec("statistik", REPORT_TIMEOUT_SEC, build_stats_report, None),
+        'accounts': ReportSpec("daftar akun", REPORT_TIMEOUT_SEC * 2, build_account_list_report, AdminCallbackData.BACK_TO_PRODUCT),
+        'stock': ReportSpec("detail stok", REPORT_TIMEOUT_SEC, build_stock_detail_report, AdminCallbackData.BACK_TO_PRODUCT),
+        'sales': ReportSpec("laporan penjualan", REPORT_TIMEOUT_SEC, build_sales_report, AdminCallbackData.BACK_TO_FINANCE),
+    }
+    REPORT_BACK_LABELS: Dict[str, str] = {
+        AdminCallbackData.BACK_TO_PRODUCT: "🔙 Kembali ke Menu Produk",
+        AdminCallbackData.BACK_TO_FINANCE: "🔙 Kembali ke Menu Keuangan",
+    }
+
+    report_pool = report_executor.ReportExecutor(
+        lambda: report_executor.connect_readonly(DB_NAME, ARCHIVE_DB_NAME, ARCHIVED_TABLES),
+        REPORT_WORKERS, wrap_task=lambda task: lifecycle.track(task)) # Shutdown menunggu laporan yang sedang dibuat
+
+    def report_back_markup(name: str) -> Optional[InlineKeyboardMarkup]:
+        back_callback = REPORTS[name].back_callback
+        if not back_callback:
+            return None
+        return InlineKeyboardMarkup().add(InlineKeyboardButton(REPORT_BACK_LABELS[back_callback], callback_data=back_callback))
+
+    def start_report(chat_id: int, name: str, message_id_to_edit: Optional[int] = None) -> None:
+        """Menampilkan pesan tunggu (dengan tombol batal) lalu membuat laporan di report_pool; pesan diedit saat selesai."""
+        spec = REPORTS[name]
+        if report_pool.is_running((chat_id, name)):
+            bot.send_message(chat_id, f"⏳ {spec.title.capitalize()} masih diproses, tunggu sebentar.")
+            return
+        waiting_text = f"⏳ Menyiapkan {spec.title}..."
+        markup_cancel = InlineKeyboardMarkup().add(InlineKeyboardButton("❌ Batalkan", callback_data=f"{AdminCallbackData.REPORT_CANCEL_PREFIX}{name}"))
+        if message_id_to_edit:
+            bot.edit_message_text(waiting_text, chat_id, message_id_to_edit, reply_markup=markup_cancel)
+            message_id = message_id_to_edit
+        else:
+            message_id = bot.send_message(chat_id, waiting_text, reply_markup=markup_cancel).message_id
+
+        def on_done(job: report_executor.ReportJob, status: str, payload: Any) -> None:
+            markup_back = report_back_markup(name)
+            if status == 'done':
+                if payload.document:
+                    file_name, content, caption = payload.document
+                    bot.send_document(chat_id, io.BytesIO(content.encode('utf-8')), caption=caption,
+                                      visible_file_name=file_name, reply_markup=markup_back)
+                    bot.delete_message(chat_id, message_id)
+                else:
+                    bot.edit_message_text(payload.text, chat_id, message_id, reply_markup=markup_back)
+                return
+            if status == 'timeout':
+                logger.warning(f"Laporan '{name}' untuk chat {chat_id} melewati batas waktu {job.timeout:.0f} detik.")
+                text = f"⌛ Pembuatan {spec.title} melewati batas waktu {job.timeout:.0f} detik dan dihentikan. Coba lagi nanti."
+            elif status == 'cancelled':
+                text = f"🚫 Pembuatan {spec.title} dibatalkan."
+            elif isinstance(payload, sqlite3.Error):
+                logger.error(f"DB Error saat membuat laporan '{name}': {payload}", exc_info=payload)
+                text = f"❌ Error database saat membuat {spec.title}."
+            else:
+                logger.error(f"Error membuat laporan '{name}': {payload}", exc_info=payload)
+                text = f"❌ Error internal saat membuat {spec.title}."
+            bot.edit_message_text(text, chat_id, message_id, reply_markup=markup_back)
+
+        report_pool.submit((chat_id, name), name, spec.timeout, spec.build, on_done)
 
     @bot.message_handler(func=lambda message: message.text == "📊 Statistik" and is_admin(message.from_user.id))
     def stats_menu_admin(message: Message) -> None:
-        try:
-            with sqlite3.connect(DB_NAME) as conn:
-                c = conn.cursor()
-                c.execute('SELECT COUNT(*) FROM accounts')
-                total_accounts = c.fetchone()[0]
-                c.execute('SELECT COUNT(*) FROM accounts WHERE sold = 0')
-                available_accounts = c.fetchone()[0]
-                sold_accounts = total_accounts - available_accounts
-                
-                c.execute("SELECT COUNT(*), SUM(CAST(REPLACE(REPLACE(amount, '.', ''), ',', '') AS REAL)) FROM sales WHERE status = 'completed'")
-                completed_sales_data = c.fetchone()
-                total_completed_sales = completed_sales_data[0] or 0
-                total_revenue = completed_sales_data[1] or 0.0
-
-                today_str = datetime.now().strftime('%Y-%m-%d')
-                c.execute("""
-                    SELECT COUNT(*), SUM(CAST(REPLACE(REPLACE(amount, '.', ''), ',', '') AS REAL))
-                    FROM sales 
-                    WHERE status = 'completed' AND DATE(completed_date) = ? 
-                """, (today_str,)) # Menggunakan completed_date untuk pendapatan harian
-                today_sales_data = c.fetchone()
-                today_sales_count = today_sales_data[0] or 0
-                today_revenue = today_sales_data[1] or 0.0
-
-                c.execute("SELECT COUNT(*) FROM customers WHERE is_blocked = 0")
-                total_users = c.fetchone()[0]
-            stats_text = (
-                f"📊 *Statistik Bot - {STORE_NAME}*\n\n"
-                f"👤 Pengguna Aktif: {total_users}\n\n"
-                f"📦 Akun:\n"
-                f"  • Total di DB: {total_accounts}\n"
-                f"  • Tersedia: {available_accounts}\n"
-                f"  • Terjual: {sold_accounts}\n\n"
-                f"📈 Penjualan:\n"
-                f"  • Transaksi Sukses: {total_completed_sales}\n"
-                f"  • Total Pendapatan: {format_rupiah(total_revenue)}\n\n"
-                f"📅 Hari Ini ({datetime.now().strftime('%d %b %Y')}):\n"
-                f"  • Transaksi Sukses: {today_sales_count}\n"
-                f"  • Pendapatan Hari Ini: {format_rupiah(today_revenue)}"
-            )
-            bot.reply_to(message, stats_text)
-        except sqlite3.Error as e:
-            logger.error(f"Error di stats_menu_admin: {e}", exc_info=True)
-            bot.reply_to(message, "❌ Error database saat mengambil statistik.")
-        except Exception as e:
-            logger.error(f"Error tak terduga di stats_menu_admin: {e}", exc_info=True)
-            bot.reply_to(message, "❌ Error tak terduga. Hubungi developer.")
+        start_report(message.chat.id, 'stats')
+
+    BROADCAST_JOB_KEY = 'broadcast_job' # JSON progres broadcast di settings; kosong = tidak ada yang berjalan
+    BROADCAST_PROGRESS_EVERY = 50 # Progres disimpan tiap N penerima agar bisa dilanjutkan setelah restart
+    BROADCAST_PAGE_SIZE = 500 # Penerima dibaca per halaman keyset (telegram_id > terakhir), bukan sekaligus
+    BROADCAST_ACTIVE_DAYS = (7, 30) # Pilihan tombol segmen "aktif N hari"; hari lain lewat /broadcast aktif_N
+    BROADCAST_SEGMENT_LABELS: Dict[str, str] = {
+        'semua': "Semua pengguna",
+        'pembeli': "Sudah pernah membeli",
+        'bukan_pembeli': "Belum pernah membeli",
+        'belum_selesai': "Checkout tapi belum pernah selesai",
+    }
+
+    def resolve_broadcast_segment(key: str) -> Optional[Dict[str, Any]]:
+        """Segmen dari kunci: semua, pembeli, bukan_pembeli, belum_selesai, aktif_<hari>, produk_<id>."""
+        if key in BROADCAST_SEGMENT_LABELS:
+            return {'key': key}
+        name, _, arg = key.rpartition('_')
+        if name == 'aktif' and arg.isdigit() and 0 < int(arg) <= 3650: # Batas waktu dikunci saat segmen dipilih
+            return {'key': key, 'days': int(arg), 'since_ts': int(time.time()) - int(arg) * 86400}
+        if name == 'produk' and arg.isdigit():
+            return {'key': key, 'product_id': int(arg)}
+        return None
+
+    def broadcast_segment_label(segment: Dict[str, Any]) -> str:
+        if 'days' in segment:
+            return f"Aktif {segment['days']} hari terakhir"
+        if 'product_id' in segment:
+            return f"Pernah membeli {product_label(segment['product_id'])}"
+        return BROADCAST_SEGMENT_LABELS.get(segment.get('key', 'semua'), segment.get('key', '?'))
+
+    def build_broadcast_segment_menu() -> Tuple[str, InlineKeyboardMarkup]:
+        """Menu pilihan segmen beserta jumlah penerima saat ini."""
+        keys = list(BROADCAST_SEGMENT_LABELS) + [f"aktif_{days}" for days in BROADCAST_ACTIVE_DAYS]
+        keys += [f"produk_{product.id}" for product in store_snapshot.get().products]
+        markup = InlineKeyboardMarkup(row_width=1)
+        for key in keys:
+            segment = resolve_broadcast_segment(key)
+            count = repo.count_customers(segment)
+            markup.add(InlineKeyboardButton(f"{broadcast_segment_label(segment)} ({count})",
+                                            callback_data=f"{AdminCallbackData.BROADCAST_SEGMENT_PREFIX}{key}"))
+        markup.add(InlineKeyboardButton("❌ Batal", callback_data=AdminCallbackData.CANCEL_ACTION))
+        text = ("📢 *Broadcast*\nPilih target penerima (angka = jumlah penerima saat ini).\n"
+                "Segmen lain: `/broadcast aktif_<HARI>` atau `/broadcast produk_<ID>`.")
+        return text, markup
+
+    def prompt_broadcast_message(chat_id: int, segment: Dict[str, Any]) -> None:
+        """Menampilkan jumlah penerima segmen lalu meminta isi pesan broadcast."""
+        total_users = repo.count_customers(segment)
+        if not total_users:
+            bot.send_message(chat_id, f"ℹ️ Tidak ada penerima untuk segmen *{broadcast_segment_label(segment)}*.")
+            return
+        msg = bot.send_message(
+            chat_id,
+            f"📝 *Kirim Pesan Broadcast*\n🎯 Target: *{broadcast_segment_label(segment)}* ({total_users} penerima)\n\n"
+            "Masukkan pesan (Markdown didukung). Pesan akan memiliki prefix pemberitahuan otomatis.\nKetik /cancel_broadcast untuk batal.",
+        )
+        bot.register_next_step_handler(msg, process_broadcast_message, segment)
 
     @bot.message_handler(func=lambda message: message.text == "📢 Broadcast" and is_admin(message.from_user.id))
     def broadcast_command_admin(message: Message) -> None:
-        msg = bot.reply_to(
-            message,
-            "📝 *Kirim Pesan Broadcast*\nMasukkan pesan (Markdown didukung). Pesan akan memiliki prefix pemberitahuan otomatis.\nKetik /cancel_broadcast untuk batal.",
-        )
-        bot.register_next_step_handler(msg, process_broadcast_message)
-
-    def process_broadcast_message(message: Message) -> None:
-        if not is_admin(message.from_user.id): return # Extra check
-        if message.text == '/cancel_broadcast':
-            bot.reply_to(message, "Broadcast dibatalkan.")
+        try:
+            text, markup = build_broadcast_segment_menu()
+        except sqlite3.Error as e:
+            logger.error(f"Database error di broadcast_command_admin: {e}", exc_info=True)
+            bot.reply_to(message, "❌ Error database saat menghitung penerima broadcast.")
             return
+        bot.reply_to(message, text, reply_markup=markup)
 
-        broadcast_text = message.text
-        sent_count = 0
-        failed_count = 0
-        users_to_block: List[int] = []
-
+    @bot.message_handler(commands=['broadcast'])
+    def broadcast_segment_command(message: Message) -> None:
+        """Broadcast langsung ke segmen tertentu, mis. `/broadcast aktif_14`."""
+        if not is_admin(message.from_user.id):
+            bot.reply_to(message, "⛔ Anda tidak punya izin untuk perintah ini.")
+            return
+        args = message.text.split()
+        if len(args) < 2:
+            broadcast_command_admin(message)
+            return
+        segment = resolve_broadcast_segment(args[1].lower())
+        if not segment:
+            bot.reply_to(message, "⚠️ Format: `/broadcast <segmen>`\nSegmen: `semua`, `pembeli`, `bukan_pembeli`, `belum_selesai`, `aktif_<HARI>`, `produk_<ID>`\nContoh: `/broadcast aktif_14`")
+            return
+        try:
+            prompt_broadcast_message(message.chat.id, segment)
+        except sqlite3.Error as e:
+            logger.error(f"Database error di broadcast_segment_command: {e}", exc_info=True)
+            bot.reply_to(message, "❌ Error database saat menghitung penerima broadcast.")
+
+    def process_broadcast_message(message: Message, segment: Optional[Dict[str, Any]] = None) -> None:
+        if not is_admin(message.from_user.id): return # Extra check
+        if message.text == '/cancel_broadcast':
+            bot.reply_to(message, "Broadcast dibatalkan.")
+            return
+        if get_setting(BROADCAST_JOB_KEY):
+            bot.reply_to(message, "⚠️ Masih ada broadcast yang belum selesai. Tunggu hingga selesai lalu coba lagi.")
+            return
+
+        segment = segment or {'key': 'semua'}
+        job: Dict[str, Any] = {'text': message.text, 'chat_id': message.chat.id, 'segment': segment, 'last_id': 0, 'sent': 0, 'failed': 0}
         try:
-            with sqlite3.connect(DB_NAME) as conn_select:
-                c_select = conn_select.cursor()
-                c_select.execute('SELECT telegram_id FROM customers WHERE is_blocked = 0')
-                users: List[Tuple[int]] = c_select.fetchall()
+            total_users = repo.count_customers(segment)
 
-            if not users:
+            if not total_users:
                 bot.reply_to(message, "ℹ️ Tidak ada pengguna aktif untuk broadcast.")
                 return
 
-            bot.reply_to(message, f"⏳ Mengirim broadcast ke {len(users)} pengguna...")
-            
-            for (user_id,) in users:
-                try:
-                    bot.send_message(user_id, f"🔔 *Pesan dari Admin {STORE_NAME}* 🔔\n\n{broadcast_text}")
-                    sent_count += 1
-                except telebot.apihelper.ApiTelegramException as e_api:
-                    logger.warning(f"Gagal mengirim broadcast ke {user_id}: {e_api}")
-                    failed_count += 1
-                    err_msg = str(e_api).lower()
-                    if any(s in err_msg for s in ["bot was blocked by the user", "user is deactivated", "chat not found", "bot_blocked", "user_deleted", "forbidden: bot was kicket from the group chat"]): # Tambah variasi error
-                        users_to_block.append(user_id)
-                except Exception as e_general:
-                    logger.error(f"Error tak terduga saat mengirim broadcast ke {user_id}: {e_general}")
-                    failed_count +=1
-            
-            if users_to_block:
-                try:
-                    with sqlite3.connect(DB_NAME) as conn_update:
-                        c_update = conn_update.cursor()
-                        for user_id_block in users_to_block:
-                            c_update.execute("UPDATE customers SET is_blocked = 1 WHERE telegram_id = ?", (user_id_block,))
-                        conn_update.commit()
-                        logger.info(f"{len(users_to_block)} pengguna ditandai sebagai diblokir setelah broadcast.")
-                except sqlite3.Error as e_db_block:
-                     logger.error(f"Error DB saat update pengguna diblokir: {e_db_block}")
-            
-            bot.reply_to(
-                message,
-                f"✅ *Broadcast Selesai!*\n"
-                f"👍 Terkirim: {sent_count} pengguna.\n"
-                f"👎 Gagal: {failed_count} pengguna (termasuk yang memblokir bot)."
-            )
+            bot.reply_to(message, f"⏳ Mengirim broadcast ke {total_users} pengguna ({escape_md(broadcast_segment_label(segment))})...")
+            run_broadcast(job)
         except sqlite3.Error as e:
             logger.error(f"Database error di process_broadcast_message: {e}", exc_info=True)
             bot.reply_to(message, "❌ Error database saat broadcast.")
@@ -720,6 +2215,80 @@ try:
             logger.error(f"General error di process_broadcast_message: {e}", exc_info=True)
             bot.reply_to(message, "❌ Error umum saat broadcast.")
 
+    def run_broadcast(job: Dict[str, Any]) -> None:
+        """Mengirim broadcast ke customer segmen job dengan telegram_id > job['last_id']. Saat shutdown berhenti dan menyimpan progres."""
+        set_setting(BROADCAST_JOB_KEY, json.dumps(job))
+        segment = job.get('segment') or {} # Job lama tanpa segmen = semua pengguna
+
+        def recipients() -> Iterator[int]:
+            last_id = job['last_id']
+            while True: # Koneksi hanya dibuka per halaman, tidak ditahan selama pengiriman
+                page = repo.customer_ids(segment, last_id, BROADCAST_PAGE_SIZE)
+                yield from page
+                if len(page) < BROADCAST_PAGE_SIZE:
+                    return
+                last_id = page[-1]
+
+        users_to_block: List[int] = []
+        paused = False
+        for index, user_id in enumerate(recipients(), start=1):
+            if lifecycle.stopping.is_set():
+                paused = True
+                break
+            try:
+                bot.send_message(user_id, f"🔔 *Pesan dari Admin {STORE_NAME}* 🔔\n\n{job['text']}")
+                job['sent'] += 1
+            except telebot.apihelper.ApiTelegramException as e_api:
+                logger.warning(f"Gagal mengirim broadcast ke {user_id}: {e_api}")
+                job['failed'] += 1
+                err_msg = str(e_api).lower()
+                if any(s in err_msg for s in ["bot was blocked by the user", "user is deactivated", "chat not found", "bot_blocked", "user_deleted", "forbidden: bot was kicket from the group chat"]): # Tambah variasi error
+                    users_to_block.append(user_id)
+            except Exception as e_general:
+                logger.error(f"Error tak terduga saat mengirim broadcast ke {user_id}: {e_general}")
+                job['failed'] += 1
+            job['last_id'] = user_id
+            if index % BROADCAST_PROGRESS_EVERY == 0:
+                set_setting(BROADCAST_JOB_KEY, json.dumps(job))
+
+        if users_to_block:
+            try:
+                repo.block_customers(users_to_block)
+                logger.info(f"{len(users_to_block)} pengguna ditandai sebagai diblokir setelah broadcast.")
+            except sqlite3.Error as e_db_block:
+                 logger.error(f"Error DB saat update pengguna diblokir: {e_db_block}")
+
+        if paused:
+            set_setting(BROADCAST_JOB_KEY, json.dumps(job))
+            logger.warning(f"Broadcast dijeda karena shutdown: {job['sent']} terkirim, dilanjutkan dari telegram_id > {job['last_id']}.")
+            bot.send_message(job['chat_id'], f"⏸ Broadcast dijeda karena bot dimatikan ({job['sent']} terkirim). Akan dilanjutkan otomatis setelah bot aktif lagi.")
+            return
+        set_setting(BROADCAST_JOB_KEY, '')
+        bot.send_message(
+            job['chat_id'],
+            f"✅ *Broadcast Selesai!*\n"
+            f"👍 Terkirim: {job['sent']} pengguna.\n"
+            f"👎 Gagal: {job['failed']} pengguna (termasuk yang memblokir bot)."
+        )
+
+    def resume_broadcast_job() -> None:
+        """Melanjutkan broadcast yang dijeda shutdown sebelumnya (dipanggil saat startup)."""
+        raw_job = get_setting(BROADCAST_JOB_KEY)
+        if not raw_job:
+            return
+        try:
+            job = json.loads(raw_job)
+        except ValueError:
+            logger.error(f"Progres broadcast tersimpan tidak valid, diabaikan: {raw_job[:100]}")
+            set_setting(BROADCAST_JOB_KEY, '')
+            return
+        logger.info(f"Melanjutkan broadcast dari telegram_id > {job['last_id']} ({job['sent']} sudah terkirim).")
+        try:
+            bot.send_message(job['chat_id'], f"▶️ Melanjutkan broadcast yang terhenti ({job['sent']} sudah terkirim)...")
+        except telebot.apihelper.ApiTelegramException as e_api:
+            logger.warning(f"Gagal memberi tahu admin soal lanjutan broadcast: {e_api}")
+        threading.Thread(target=lifecycle.track(run_broadcast), args=(job,), name='broadcast-resume', daemon=True).start()
+
     @bot.message_handler(func=lambda message: message.text == "🔄 Refresh" and is_admin(message.from_user.id))
     def refresh_admin_keyboard(message: Message) -> None:
         bot.reply_to(message, "🔄 Keyboard admin dimuat ulang.", reply_markup=get_admin_keyboard())
@@ -742,76 +2311,71 @@ try:
         try:
             # --- Product Management Callbacks ---
             if data == AdminCallbackData.ADD_ACCOUNT:
-                msg_prompt = bot.send_message(
-                    chat_id,
-                    "➕ *Tambah Akun Baru*\nFormat: `email|password|catatan (opsional)`\nContoh: `user@ex.com|Pass123|Akun Premium`\n\nKetik /cancel untuk batal atau gunakan tombol di bawah.",
-                    reply_markup=InlineKeyboardMarkup().add(InlineKeyboardButton("❌ Batal & Kembali ke Produk", callback_data=AdminCallbackData.CANCEL_BACK_PRODUCT))
-                )
-                bot.register_next_step_handler(msg_prompt, process_add_account_admin)
+                products = store_snapshot.get().products
+                if len(products) == 1:
+                    prompt_add_account(chat_id, products[0])
+                else: # Stok selalu masuk ke satu produk; tanyakan produknya dulu
+                    markup_choose = InlineKeyboardMarkup(row_width=1)
+                    for product in products:
+                        markup_choose.add(InlineKeyboardButton(f"{product.name} (stok {product.stock})",
+                                                               callback_data=f"{AdminCallbackData.ADD_ACCOUNT_TO_PRODUCT_PREFIX}{product.id}"))
+                    markup_choose.add(InlineKeyboardButton("❌ Batal & Kembali ke Produk", callback_data=AdminCallbackData.CANCEL_BACK_PRODUCT))
+                    bot.edit_message_text("➕ *Tambah Akun Baru*\nPilih produk untuk akun yang akan ditambahkan:", chat_id, message_id, reply_markup=markup_choose)
+
+            elif data.startswith(AdminCallbackData.ADD_ACCOUNT_TO_PRODUCT_PREFIX):
+                product = store_snapshot.get().product(int(data.split('_')[-1]))
+                if product:
+                    prompt_add_account(chat_id, product)
+                else:
+                    bot.answer_callback_query(call.id, "Produk tidak ditemukan.")
 
-            elif data == AdminCallbackData.LIST_ACCOUNTS:
+            elif data.startswith(AdminCallbackData.BROADCAST_SEGMENT_PREFIX):
+                segment = resolve_broadcast_segment(data[len(AdminCallbackData.BROADCAST_SEGMENT_PREFIX):])
+                if segment:
+                    bot.edit_message_reply_markup(chat_id, message_id, reply_markup=None)
+                    prompt_broadcast_message(chat_id, segment)
+
+            elif data == AdminCallbackData.CATALOG:
+                catalog_text, markup_catalog = build_catalog_admin()
+                bot.edit_message_text(catalog_text, chat_id, message_id, reply_markup=markup_catalog)
+
+            elif data == AdminCallbackData.ADD_PRODUCT:
+                msg_prompt = bot.edit_message_text(
+                    "➕ *Tambah Produk Baru*\nFormat: `NAMA|HARGA|DESKRIPSI (opsional)`\nContoh: `ChatGPT Plus|75000|Akun sharing 1 bulan`\n\nKetik /cancel untuk batal.",
+                    chat_id, message_id,
+                    reply_markup=InlineKeyboardMarkup().add(InlineKeyboardButton("❌ Batal & Kembali ke Katalog", callback_data=AdminCallbackData.CATALOG)))
+                bot.register_next_step_handler(msg_prompt, process_add_product_admin)
+
+            elif data.startswith(AdminCallbackData.PRODUCT_PRICE_PREFIX):
+                product = store_snapshot.get().product(int(data.split('_')[-1]))
+                if product:
+                    prompt_product_price(chat_id, message_id, product, AdminCallbackData.CATALOG)
+                else:
+                    bot.answer_callback_query(call.id, "Produk tidak ditemukan.")
+
+            elif data.startswith(AdminCallbackData.TOGGLE_PRODUCT_PREFIX):
+                product_id = int(data.split('_')[-1])
                 try:
-                    with sqlite3.connect(DB_NAME) as conn:
-                        c = conn.cursor()
-                        c.execute('SELECT id, email, password, notes, sold, sold_to_username, sold_date, date_added FROM accounts ORDER BY id DESC')
-                        all_accounts: List[Tuple[int, str, str, Optional[str], int, Optional[str], Optional[str], str]] = c.fetchall()
-                    
-                    response_text = "📋 *Daftar Semua Akun*\n(Terbaru di atas)\n\n"
-                    if not all_accounts:
-                        response_text += "Tidak ada akun di database."
-                    else:
-                        for acc_id, email, acc_pass, notes, sold, sold_to, sold_dt, date_added in all_accounts:
-                            status = "✅ Terjual" if sold else "☑️ Tersedia"
-                            pass_display = f"{acc_pass[:3]}****{acc_pass[-1:]}" if acc_pass and len(acc_pass) > 4 else "****"
-                            sold_info = f" kpd @{sold_to} ({datetime.strptime(sold_dt, '%Y-%m-%d %H:%M:%S').strftime('%d %b %y') if sold_dt else 'N/A'})" if sold else ""
-                            notes_info = f"\n   📝 Catatan: {notes}" if notes else ""
-                            added_info = f"\n   ➕ Ditambah: {datetime.strptime(date_added, '%Y-%m-%d %H:%M:%S').strftime('%d %b %y, %H:%M')}"
-                            response_text += (
-                                f"🆔 `{acc_id}`: `{email}` ({pass_display})\n"
-                                f"Status: {status}{sold_info}{notes_info}{added_info}\n\n"
-                            )
-                    
-                    if len(response_text) > 4096:
-                        temp_fn = "daftar_akun_lengkap.txt"
-                        # Hapus markdown untuk file teks agar lebih bersih
-                        clean_response = response_text.replace("`", "").replace("*", "").replace("✅", "-").replace("☑️", "-").replace("🆔", "ID:").replace("📝", "Catatan:").replace("➕", "Ditambah:")
-                        with open(temp_fn, "w", encoding="utf-8") as f:
-                            f.write(clean_response)
-                        with open(temp_fn, "rb") as f:
-                            bot.send_document(chat_id, f, caption="Daftar akun terlalu panjang, dikirim sebagai file.",
-                                              reply_markup=InlineKeyboardMarkup().add(InlineKeyboardButton("🔙 Kembali ke Menu Produk", callback_data=AdminCallbackData.BACK_TO_PRODUCT)))
-                        os.remove(temp_fn)
-                        bot.delete_message(chat_id, message_id)
+                    toggled = repo.toggle_product(product_id)
+                    if toggled:
+                        event_bus.publish(events.ProductChanged(product_id, 'toggled'))
+                        catalog_text, markup_catalog = build_catalog_admin()
+                        bot.edit_message_text(catalog_text, chat_id, message_id, reply_markup=markup_catalog)
                     else:
-                        bot.edit_message_text(response_text, chat_id, message_id,
-                                              reply_markup=InlineKeyboardMarkup().add(InlineKeyboardButton("🔙 Kembali ke Menu Produk", callback_data=AdminCallbackData.BACK_TO_PRODUCT)))
+                        bot.answer_callback_query(call.id, "Produk tidak ditemukan.")
                 except sqlite3.Error as e_sql:
-                    logger.error(f"DB Error di AdminCallbackData.LIST_ACCOUNTS: {e_sql}", exc_info=True)
-                    bot.send_message(chat_id, "❌ Gagal mengambil daftar akun dari database.")
+                    logger.error(f"DB error toggle produk {product_id}: {e_sql}", exc_info=True)
+                    bot.send_message(chat_id, "❌ Error database saat mengubah status produk.")
+
+            elif data == AdminCallbackData.LIST_ACCOUNTS:
+                start_report(chat_id, 'accounts', message_id_to_edit=message_id)
 
             elif data == AdminCallbackData.CHECK_STOCK_DETAIL:
-                try:
-                    with sqlite3.connect(DB_NAME) as conn:
-                        c = conn.cursor()
-                        c.execute('SELECT id, email, password, notes, date_added FROM accounts WHERE sold = 0 ORDER BY date_added ASC, id ASC')
-                        available_accounts: List[Tuple[int, str, str, Optional[str], str]] = c.fetchall()
-                    
-                    if not available_accounts:
-                        stock_message = "📦 *Stok Akun Tersedia Saat Ini*\n\n🎉 Semua akun telah terjual atau belum ada stok."
-                    else:
-                        stock_message = f"📦 *Stok Akun Tersedia ({len(available_accounts)} Akun)*:\n(Urut berdasarkan tanggal ditambah, terlama dulu - akan dijual duluan)\n\n"
-                        for acc_id, email, password, notes, date_added in available_accounts:
-                            stock_message += f"🆔 `{acc_id}` | 📧 `{email}` | 🔑 `{password}`\n"
-                            if notes: stock_message += f"   📝 {notes}\n"
-                            stock_message += f"   ➕ Ditambah: {datetime.strptime(date_added, '%Y-%m-%d %H:%M:%S').strftime('%d %b %y, %H:%M')}\n---\n"
-                    
-                    if len(stock_message) > 4096:
-                         stock_message = stock_message[:4000] + "\n\n⚠️ Data terlalu panjang, beberapa item mungkin terpotong..."
-                    bot.edit_message_text(stock_message, chat_id, message_id,
-                                          reply_markup=InlineKeyboardMarkup().add(InlineKeyboardButton("🔙 Kembali ke Menu Produk", callback_data=AdminCallbackData.BACK_TO_PRODUCT)))
-                except sqlite3.Error as e_sql:
-                    logger.error(f"DB Error di AdminCallbackData.CHECK_STOCK_DETAIL: {e_sql}", exc_info=True)
-                    bot.send_message(chat_id, "❌ Gagal mengambil detail stok dari database.")
+                start_report(chat_id, 'stock', message_id_to_edit=message_id)
+
+            elif data.startswith(AdminCallbackData.REPORT_CANCEL_PREFIX):
+                if not report_pool.cancel((chat_id, data[len(AdminCallbackData.REPORT_CANCEL_PREFIX):])):
+                    bot.edit_message_reply_markup(chat_id, message_id, reply_markup=None) # Laporan sudah selesai atau tidak ada
 
             elif data == AdminCallbackData.DELETE_ACCOUNT_PROMPT:
                 msg_prompt = bot.edit_message_text("🗑 *Hapus Akun*\nMasukkan ID akun yang ingin dihapus (ketik /cancel untuk batal):",
@@ -825,10 +2389,7 @@ try:
             # --- Finance Management Callbacks ---
             elif data == AdminCallbackData.PAYMENT_METHODS:
                 try:
-                    with sqlite3.connect(DB_NAME) as conn:
-                        c = conn.cursor()
-                        c.execute("SELECT id, method, number, holder_name, active FROM payment_methods ORDER BY method")
-                        methods: List[Tuple[int, str, str, str, int]] = c.fetchall()
+                    methods = repo.list_payment_methods()
                     
                     text = "💳 *Pengaturan Metode Pembayaran*\n\n"
                     markup_pm = InlineKeyboardMarkup(row_width=1) # Tombol utama
@@ -862,18 +2423,15 @@ try:
             elif data.startswith(AdminCallbackData.TOGGLE_PAYMENT_METHOD_PREFIX):
                 pm_id = int(data.split('_')[-1])
                 try:
-                    with sqlite3.connect(DB_NAME) as conn:
-                        c = conn.cursor()
-                        c.execute("UPDATE payment_methods SET active = NOT active WHERE id = ?", (pm_id,))
-                        conn.commit()
-                        if c.rowcount > 0:
-                            bot.answer_callback_query(call.id, "Status metode pembayaran diubah.")
-                            # Refresh view
-                            new_call_obj = call
-                            new_call_obj.data = AdminCallbackData.PAYMENT_METHODS 
-                            handle_admin_callback(new_call_obj)
-                        else:
-                            bot.answer_callback_query(call.id, "Metode tidak ditemukan.")
+                    if repo.toggle_payment_method(pm_id):
+                        event_bus.publish(events.PaymentMethodChanged('toggled', method_id=pm_id))
+                        bot.answer_callback_query(call.id, "Status metode pembayaran diubah.")
+                        # Refresh view
+                        new_call_obj = call
+                        new_call_obj.data = AdminCallbackData.PAYMENT_METHODS 
+                        handle_admin_callback(new_call_obj)
+                    else:
+                        bot.answer_callback_query(call.id, "Metode tidak ditemukan.")
                 except sqlite3.Error as e_sql:
                     logger.error(f"DB error toggle payment method {pm_id}: {e_sql}", exc_info=True)
                     bot.answer_callback_query(call.id, "Error database.")
@@ -889,19 +2447,16 @@ try:
             elif data.startswith(AdminCallbackData.CONFIRM_DELETE_PAYMENT_METHOD_PREFIX):
                 pm_id_really_delete = int(data.split('_')[-1])
                 try:
-                    with sqlite3.connect(DB_NAME) as conn:
-                        c = conn.cursor()
-                        c.execute("DELETE FROM payment_methods WHERE id = ?", (pm_id_really_delete,))
-                        conn.commit()
-                        if c.rowcount > 0:
-                            bot.answer_callback_query(call.id, f"Metode pembayaran ID {pm_id_really_delete} dihapus.")
-                            new_call_obj = call
-                            new_call_obj.data = AdminCallbackData.PAYMENT_METHODS
-                            handle_admin_callback(new_call_obj)
-                        else:
-                            bot.answer_callback_query(call.id, "Metode tidak ditemukan/sudah dihapus.")
-                            bot.edit_message_text(f"Metode pembayaran ID {pm_id_really_delete} tidak ditemukan.", chat_id, message_id,
-                                                  reply_markup=InlineKeyboardMarkup().add(InlineKeyboardButton("🔙 Kembali", callback_data=AdminCallbackData.PAYMENT_METHODS)))
+                    if repo.delete_payment_method(pm_id_really_delete):
+                        event_bus.publish(events.PaymentMethodChanged('deleted', method_id=pm_id_really_delete))
+                        bot.answer_callback_query(call.id, f"Metode pembayaran ID {pm_id_really_delete} dihapus.")
+                        new_call_obj = call
+                        new_call_obj.data = AdminCallbackData.PAYMENT_METHODS
+                        handle_admin_callback(new_call_obj)
+                    else:
+                        bot.answer_callback_query(call.id, "Metode tidak ditemukan/sudah dihapus.")
+                        bot.edit_message_text(f"Metode pembayaran ID {pm_id_really_delete} tidak ditemukan.", chat_id, message_id,
+                                              reply_markup=InlineKeyboardMarkup().add(InlineKeyboardButton("🔙 Kembali", callback_data=AdminCallbackData.PAYMENT_METHODS)))
                 except sqlite3.Error as e_sql:
                     logger.error(f"DB error menghapus payment method {pm_id_really_delete}: {e_sql}", exc_info=True)
                     bot.answer_callback_query(call.id, "Error database saat menghapus.")
@@ -915,73 +2470,29 @@ try:
                 bot.register_next_step_handler(msg_prompt, process_add_payment_method_admin)
 
             elif data == AdminCallbackData.PRICE_SETTINGS:
-                current_price_raw = get_setting('price')
-                current_price_formatted = format_rupiah(current_price_raw)
-                msg_prompt = bot.edit_message_text(
-                    f"💲 *Pengaturan Harga Akun*\nHarga saat ini: *{current_price_formatted}*\n\nMasukkan harga baru (angka saja, misal `50000`):\n\nKetik /cancel untuk batal.",
-                    chat_id, message_id,
-                    reply_markup=InlineKeyboardMarkup().add(InlineKeyboardButton("❌ Batal & Kembali ke Keuangan", callback_data=AdminCallbackData.CANCEL_BACK_FINANCE)))
-                bot.register_next_step_handler(msg_prompt, process_price_settings_admin)
+                products = store_snapshot.get().products
+                if len(products) == 1:
+                    prompt_product_price(chat_id, message_id, products[0], AdminCallbackData.CANCEL_BACK_FINANCE)
+                else: # Harga diatur per produk dari katalog
+                    catalog_text, markup_catalog = build_catalog_admin()
+                    bot.edit_message_text(catalog_text, chat_id, message_id, reply_markup=markup_catalog)
 
             elif data == AdminCallbackData.SALES_REPORT:
-                try:
-                    with sqlite3.connect(DB_NAME) as conn:
-                        c = conn.cursor()
-                        thirty_days_ago = (datetime.now() - timedelta(days=30)).strftime('%Y-%m-%d %H:%M:%S')
-                        c.execute("""
-                            SELECT s.id, s.buyer_username, s.buyer_id, s.amount, s.payment_method, s.status, s.completed_date, a.email, s.admin_notes
-                            FROM sales s
-                            LEFT JOIN accounts a ON s.account_id = a.id
-                            WHERE (s.status = 'completed' OR s.status = 'cancelled') AND s.created_date >= ? 
-                            ORDER BY s.completed_date DESC, s.created_date DESC
-                        """, (thirty_days_ago,)) # Menampilkan completed dan cancelled
-                        sales_data: List[Tuple[int, Optional[str], int, str, Optional[str], str, Optional[str], Optional[str], Optional[str]]] = c.fetchall()
-
-                    report_text = f"📊 *Laporan Transaksi (30 Hari Terakhir)*\n\n"
-                    if not sales_data:
-                        report_text += "Tidak ada transaksi dalam 30 hari terakhir."
-                    else:
-                        total_sales_amount = 0.0
-                        for sale_id, username, buyer_id, amount_str, payment, status, date_completed, acc_email, admin_notes_val in sales_data:
-                            try:
-                                amount = float(str(amount_str).replace('.', '').replace(',', '')) if status == 'completed' else 0.0
-                                if status == 'completed': total_sales_amount += amount
-                            except ValueError:
-                                amount = 0.0
-                                report_text += f"⚠️ Format jumlah salah untuk Sale ID {sale_id}\n"
-
-                            buyer_name_display = username if username and username != f"user_{buyer_id}" else f"User ID {buyer_id}"
-                            buyer_contact = f"@{username}" if username and username != f"user_{buyer_id}" else f"ID: {buyer_id}"
-                            
-                            report_text += (
-                                f"🆔 Transaksi: `{sale_id}`\n"
-                                f"👤 Pembeli: {buyer_contact}\n"
-                                f"状态 Status: *{status.upper()}*\n" # Menggunakan Bahasa Mandarin untuk 'Status' sebagai contoh variasi (bisa diganti)
-                                f"📧 Akun: `{acc_email if acc_email else 'N/A (jika pending/cancelled tanpa akun)'}`\n"
-                                f"💰 Jumlah: {format_rupiah(amount) if status == 'completed' else '-'}\n"
-                                f"💳 Metode Bayar (User): {payment if payment else 'N/A'}\n" # Ini adalah metode yang mungkin dipilih user, bukan metode toko
-                                f"🗓 Tgl Selesai/Batal: {datetime.strptime(date_completed, '%Y-%m-%d %H:%M:%S').strftime('%d %b %y, %H:%M') if date_completed else 'N/A'}\n"
-                            )
-                            if status == 'cancelled' and admin_notes_val:
-                                report_text += f"📝 Catatan Admin: {admin_notes_val}\n"
-                            report_text += "--------------------\n"
-                        report_text += f"\n*Total Pendapatan Sukses (30 Hari): {format_rupiah(total_sales_amount)}*"
-                    
-                    if len(report_text) > 4096:
-                        report_text = report_text[:4000] + "\n\n⚠️ Laporan terlalu panjang..."
-                    
-                    bot.edit_message_text(report_text, chat_id, message_id,
-                                          reply_markup=InlineKeyboardMarkup().add(InlineKeyboardButton("🔙 Kembali ke Menu Keuangan", callback_data=AdminCallbackData.BACK_TO_FINANCE)))
-                except sqlite3.Error as e_sql:
-                    logger.error(f"DB Error di AdminCallbackData.SALES_REPORT: {e_sql}", exc_info=True)
-                    bot.send_message(chat_id, "❌ Gagal mengambil laporan penjualan dari database.")
-                except Exception as e_gen:
-                    logger.error(f"Error membuat laporan penjualan: {e_gen}", exc_info=True)
-                    bot.send_message(chat_id, "❌ Error internal saat membuat laporan penjualan.")
+                start_report(chat_id, 'sales', message_id_to_edit=message_id)
 
             elif data == AdminCallbackData.PENDING_PAYMENTS_MENU:
                 display_pending_payments_admin(chat_id, message_id_to_edit=message_id)
 
+            elif data == AdminCallbackData.RECONCILE_STATEMENT:
+                msg_prompt = bot.edit_message_text(
+                    "🏦 *Rekonsiliasi Mutasi Otomatis*\n"
+                    "Kirim file *CSV mutasi* dari bank/e-wallet (kolom minimal: tanggal & nominal).\n"
+                    "Tulis nama metode pembayaran di caption file (mis. `BCA`) agar tercatat di transaksi.\n\n"
+                    "Pembayaran pending dengan nominal unik yang cocok akan disetujui otomatis.\n\nKetik /cancel untuk batal.",
+                    chat_id, message_id,
+                    reply_markup=InlineKeyboardMarkup().add(InlineKeyboardButton("❌ Batal & Kembali ke Keuangan", callback_data=AdminCallbackData.CANCEL_BACK_FINANCE)))
+                bot.register_next_step_handler(msg_prompt, process_statement_upload_admin)
+
             # --- Settings Callbacks ---
             elif data == AdminCallbackData.TOGGLE_MAINTENANCE:
                 current_mode = get_setting('maintenance_mode')
@@ -991,25 +2502,35 @@ try:
                     bot.answer_callback_query(call.id, f"Mode Maintenance: {status_text.split(' ')[0]}")
                     
                     # Update original settings message
-                    updated_markup = InlineKeyboardMarkup(row_width=1)
-                    updated_markup.add(
-                        InlineKeyboardButton(f"🛠 Mode Maintenance: {status_text}", callback_data=AdminCallbackData.TOGGLE_MAINTENANCE),
-                        InlineKeyboardButton("💲 Atur Harga Akun", callback_data=AdminCallbackData.PRICE_SETTINGS),
-                        InlineKeyboardButton("💳 Metode Pembayaran", callback_data=AdminCallbackData.PAYMENT_METHODS)
-                    )
-                    current_price = format_rupiah(get_setting('price'))
-                    settings_text_updated = (
-                        f"⚙️ *Pengaturan Bot - {STORE_NAME}*\n\n"
-                        f"Harga Saat Ini: `{current_price}`\n"
-                        f"Mode Maintenance: `{status_text}`\n\nPilih pengaturan:"
-                    )
+                    settings_text_updated, updated_markup = build_settings_menu()
                     try:
                         bot.edit_message_text(settings_text_updated, chat_id, message_id, reply_markup=updated_markup)
                     except telebot.apihelper.ApiTelegramException as e_edit:
                          if "message is not modified" not in str(e_edit).lower(): logger.error(f"Error edit pesan pengaturan: {e_edit}")
                 else:
                     bot.answer_callback_query(call.id, "❌ Gagal ubah mode maintenance.")
+
+            elif data == AdminCallbackData.TOGGLE_NOTIFY_MODE:
+                new_mode = 'batch' if get_setting('admin_notify_mode') == 'individual' else 'individual'
+                if set_setting('admin_notify_mode', new_mode):
+                    if new_mode == 'individual': admin_notifier.flush() # Kirim sisa antrean agar tidak tertahan
+                    bot.answer_callback_query(call.id, "Notifikasi: per pembayaran" if new_mode == 'individual' else "Notifikasi: ringkas")
+                    settings_text_updated, updated_markup = build_settings_menu()
+                    try:
+                        bot.edit_message_text(settings_text_updated, chat_id, message_id, reply_markup=updated_markup)
+                    except telebot.apihelper.ApiTelegramException as e_edit:
+                         if "message is not modified" not in str(e_edit).lower(): logger.error(f"Error edit pesan pengaturan: {e_edit}")
+                else:
+                    bot.answer_callback_query(call.id, "❌ Gagal ubah mode notifikasi.")
             
+            # --- Search Callbacks ---
+            elif data.startswith(AdminCallbackData.SEARCH_PAGE_PREFIX):
+                query = admin_search_queries.get(chat_id)
+                if not query:
+                    bot.edit_message_text("ℹ️ Sesi pencarian sudah kedaluwarsa. Ulangi dengan `/cari <kata kunci>`.", chat_id, message_id)
+                else:
+                    display_search_results(chat_id, query, int(data[len(AdminCallbackData.SEARCH_PAGE_PREFIX):]), message_id)
+
             # --- Cancellation & Navigation Callbacks ---
             elif data == AdminCallbackData.CANCEL_ACTION:
                 try:
@@ -1038,7 +2559,8 @@ try:
                     InlineKeyboardButton("➕ Tambah Akun", callback_data=AdminCallbackData.ADD_ACCOUNT),
                     InlineKeyboardButton("📋 List Semua Akun", callback_data=AdminCallbackData.LIST_ACCOUNTS),
                     InlineKeyboardButton("📦 Stok Tersedia (Detail)", callback_data=AdminCallbackData.CHECK_STOCK_DETAIL),
-                    InlineKeyboardButton("🗑 Hapus Akun", callback_data=AdminCallbackData.DELETE_ACCOUNT_PROMPT)
+                    InlineKeyboardButton("🗑 Hapus Akun", callback_data=AdminCallbackData.DELETE_ACCOUNT_PROMPT),
+                    InlineKeyboardButton("🗂 Katalog Produk", callback_data=AdminCallbackData.CATALOG)
                 )
                 bot.edit_message_text("📦 *Menu Manajemen Produk*\n\nPilih tindakan:", chat_id, message_id, reply_markup=markup_prod)
 
@@ -1048,7 +2570,8 @@ try:
                     InlineKeyboardButton("💳 Metode Pembayaran", callback_data=AdminCallbackData.PAYMENT_METHODS),
                     InlineKeyboardButton("💲 Atur Harga Akun", callback_data=AdminCallbackData.PRICE_SETTINGS),
                     InlineKeyboardButton("📊 Laporan Penjualan", callback_data=AdminCallbackData.SALES_REPORT),
-                    InlineKeyboardButton("⏳ Pembayaran Pending", callback_data=AdminCallbackData.PENDING_PAYMENTS_MENU)
+                    InlineKeyboardButton("⏳ Pembayaran Pending", callback_data=AdminCallbackData.PENDING_PAYMENTS_MENU),
+                    InlineKeyboardButton("🏦 Rekonsiliasi Mutasi", callback_data=AdminCallbackData.RECONCILE_STATEMENT)
                 )
                 bot.edit_message_text("💰 *Menu Manajemen Keuangan*\n\nPilih tindakan:", chat_id, message_id, reply_markup=markup_fin)
 
@@ -1065,9 +2588,74 @@ try:
             logger.error(f"Error di handle_admin_callback (data: {data}): {e}", exc_info=True)
             bot.send_message(chat_id, "❌ Terjadi kesalahan internal. Silakan coba lagi dari menu utama atau hubungi developer jika berlanjut.")
 
+    def build_catalog_admin() -> Tuple[str, InlineKeyboardMarkup]:
+        """Teks dan tombol menu katalog admin dari snapshot (bisa raise sqlite3.Error)."""
+        text = "🗂 *Katalog Produk*\n\n"
+        markup = InlineKeyboardMarkup(row_width=2)
+        for product in store_snapshot.get().products:
+            status = "🟢 Aktif" if product.active else "🔴 Nonaktif"
+            text += f"`{product.id}` *{product.name}* - {format_rupiah(product.price)} | stok {product.stock} | {status}\n"
+            if product.description: text += f"   📝 {product.description}\n"
+            markup.add(
+                InlineKeyboardButton(f"💲 {product.name}", callback_data=f"{AdminCallbackData.PRODUCT_PRICE_PREFIX}{product.id}"),
+                InlineKeyboardButton(f"{'Nonaktifkan' if product.active else 'Aktifkan'} {product.name}",
+                                     callback_data=f"{AdminCallbackData.TOGGLE_PRODUCT_PREFIX}{product.id}"),
+            )
+        text += "\nProduk nonaktif tidak tampil di menu pembeli; stoknya tetap tersimpan."
+        markup.add(InlineKeyboardButton("➕ Produk Baru", callback_data=AdminCallbackData.ADD_PRODUCT))
+        markup.add(InlineKeyboardButton("🔙 Kembali ke Menu Produk", callback_data=AdminCallbackData.BACK_TO_PRODUCT))
+        return text, markup
+
+    def prompt_add_account(chat_id: int, product: ProductInfo) -> None:
+        msg_prompt = bot.send_message(
+            chat_id,
+            f"➕ *Tambah Akun Baru - {product.name}*\nFormat: `email|password|catatan (opsional)`\nContoh: `user@ex.com|Pass123|Akun Premium`\n\nKetik /cancel untuk batal atau gunakan tombol di bawah.",
+            reply_markup=InlineKeyboardMarkup().add(InlineKeyboardButton("❌ Batal & Kembali ke Produk", callback_data=AdminCallbackData.CANCEL_BACK_PRODUCT))
+        )
+        bot.register_next_step_handler(msg_prompt, process_add_account_admin, product.id)
+
+    def prompt_product_price(chat_id: int, message_id: int, product: ProductInfo, cancel_callback: str) -> None:
+        msg_prompt = bot.edit_message_text(
+            f"💲 *Pengaturan Harga - {product.name}*\nHarga saat ini: *{format_rupiah(product.price)}*\n\nMasukkan harga baru (angka saja, misal `50000`):\n\nKetik /cancel untuk batal.",
+            chat_id, message_id,
+            reply_markup=InlineKeyboardMarkup().add(InlineKeyboardButton("❌ Batal & Kembali", callback_data=cancel_callback)))
+        bot.register_next_step_handler(msg_prompt, process_price_settings_admin, product.id)
+
     # --- Process Functions for Admin (called by next_step_handler) ---
-    def process_add_account_admin(message: Message) -> None:
-        """Memproses input untuk menambah akun baru."""
+    def process_add_product_admin(message: Message) -> None:
+        """Memproses input untuk menambah produk baru ke katalog."""
+        if not is_admin(message.from_user.id): return
+        if message.text == '/cancel':
+            bot.reply_to(message, "Penambahan produk dibatalkan. Silakan gunakan menu lagi.")
+            return
+
+        parts = [part.strip() for part in (message.text or '').split('|')]
+        price_input = parts[1].replace('.', '').replace(',', '') if len(parts) > 1 else ''
+        if not (2 <= len(parts) <= 3) or not parts[0] or not price_input.isdigit() or int(price_input) <= 0:
+            msg_retry = bot.reply_to(message, "❌ Format salah! `NAMA|HARGA` atau `NAMA|HARGA|DESKRIPSI`, harga angka positif.\nKetik /cancel atau coba lagi.")
+            bot.register_next_step_handler(msg_retry, process_add_product_admin)
+            return
+        name, price, description = parts[0], int(price_input), (parts[2] if len(parts) == 3 else None) or None
+        if any(char in name for char in MARKDOWN_SPECIAL_CHARS): # Nama produk ditampilkan tebal (*...*) di banyak pesan
+            msg_retry = bot.reply_to(message, "❌ Nama produk tidak boleh mengandung karakter \\_ \\* \\` \\[. Coba lagi atau /cancel.")
+            bot.register_next_step_handler(msg_retry, process_add_product_admin)
+            return
+
+        try:
+            new_id = repo.add_product(name, price, description, now_stamp())
+            if new_id is None:
+                msg_retry = bot.reply_to(message, "❌ Nama produk sudah ada. Gunakan nama lain atau /cancel.")
+                bot.register_next_step_handler(msg_retry, process_add_product_admin)
+                return
+            event_bus.publish(events.ProductChanged(new_id, 'added'))
+            bot.reply_to(message, f"✅ Produk *{name}* (ID `{new_id}`) ditambahkan dengan harga {format_rupiah(price)}.\n"
+                                  f"Tambahkan stoknya lewat 📦 Produk > ➕ Tambah Akun.")
+        except sqlite3.Error as e_sql:
+            logger.error(f"DB error menambah produk: {e_sql}", exc_info=True)
+            bot.reply_to(message, "❌ Error database saat menambah produk.")
+
+    def process_add_account_admin(message: Message, product_id: int = DEFAULT_PRODUCT_ID) -> None:
+        """Memproses input untuk menambah akun baru ke sebuah produk."""
         if not is_admin(message.from_user.id): return
         if message.text == '/cancel':
             bot.reply_to(message, "Penambahan akun dibatalkan. Silakan gunakan menu lagi.")
@@ -1076,41 +2664,31 @@ try:
         parts = message.text.split('|')
         if not (2 <= len(parts) <= 3):
             msg_retry = bot.reply_to(message, "❌ Format salah! `email|password` atau `email|password|catatan`\nKetik /cancel atau coba lagi.")
-            bot.register_next_step_handler(msg_retry, process_add_account_admin)
+            bot.register_next_step_handler(msg_retry, process_add_account_admin, product_id)
             return
         
         email, password = parts[0].strip(), parts[1].strip()
         notes = parts[2].strip() if len(parts) == 3 else ""
 
-        if '@' not in email or '.' not in email.split('@')[-1] or not password: # Validasi email sederhana
+        if not stock_spool.is_valid_account(email, password):
             msg_retry = bot.reply_to(message, "❌ Email atau Password tidak valid. Coba lagi atau /cancel.")
-            bot.register_next_step_handler(msg_retry, process_add_account_admin)
+            bot.register_next_step_handler(msg_retry, process_add_account_admin, product_id)
             return
 
         try:
-            with sqlite3.connect(DB_NAME) as conn:
-                c = conn.cursor()
-                c.execute('SELECT id FROM accounts WHERE email = ?', (email,))
-                if c.fetchone():
-                    msg_retry = bot.reply_to(message, "❌ Email sudah ada di database. Gunakan email lain atau /cancel.")
-                    bot.register_next_step_handler(msg_retry, process_add_account_admin)
-                    return
-                
-                date_added_str = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                c.execute('INSERT INTO accounts (email, password, notes, date_added) VALUES (?, ?, ?, ?)',
-                          (email, password, notes, date_added_str))
-                new_id = c.lastrowid
-                conn.commit()
-                c.execute('SELECT COUNT(*) FROM accounts WHERE sold = 0')
-                stock = c.fetchone()[0]
-            bot.reply_to(message, f"✅ Akun ID `{new_id}` (Email: `{email}`) berhasil ditambahkan.\nStok tersedia saat ini: {stock} akun.")
-        except sqlite3.IntegrityError: # Email unique constraint failed (double check, seharusnya sudah ditangani di atas)
-            msg_retry = bot.reply_to(message, "❌ Email sudah ada (Integrity Error). Coba lagi atau /cancel.")
-            bot.register_next_step_handler(msg_retry, process_add_account_admin)
+            new_id = repo.add_account(product_id, email, password, notes, now_stamp())
+            if new_id is None:
+                msg_retry = bot.reply_to(message, "❌ Email sudah ada di database. Gunakan email lain atau /cancel.")
+                bot.register_next_step_handler(msg_retry, process_add_account_admin, product_id)
+                return
+            event_bus.publish(events.StockAdded(product_id, (new_id,)))
+            product = store_snapshot.get().product(product_id)
+            stock_info = f"Stok {escape_md(product.name)} saat ini: {product.stock} akun." if product else ""
+            bot.reply_to(message, f"✅ Akun ID `{new_id}` (Email: `{email}`) berhasil ditambahkan.\n{stock_info}")
         except sqlite3.Error as e_sql:
             logger.error(f"DB error menambah akun: {e_sql}", exc_info=True)
             msg_retry = bot.reply_to(message, "❌ Error database saat menambah akun. Coba lagi atau /cancel.")
-            bot.register_next_step_handler(msg_retry, process_add_account_admin)
+            bot.register_next_step_handler(msg_retry, process_add_account_admin, product_id)
 
     def process_delete_account_admin(message: Message) -> None:
         """Memproses input ID akun yang akan dihapus."""
@@ -1120,17 +2698,14 @@ try:
             return
         try:
             acc_id_del = int(message.text.strip())
-            with sqlite3.connect(DB_NAME) as conn:
-                c = conn.cursor()
-                c.execute("SELECT email, sold FROM accounts WHERE id = ?", (acc_id_del,))
-                account_data = c.fetchone()
+            account_data = repo.get_account(acc_id_del)
             if not account_data:
                 msg_retry = bot.reply_to(message, f"❌ Akun ID `{acc_id_del}` tidak ditemukan. /cancel atau masukkan ID lain.")
                 bot.register_next_step_handler(msg_retry, process_delete_account_admin)
                 return
             
             email_to_delete, sold_status = account_data
-            status_info = "(SUDAH TERJUAL)" if sold_status == 1 else "(TERSEDIA)"
+            status_info = "(SUDAH TERJUAL)" if sold_status else "(TERSEDIA)"
             # Menggunakan AdminCallbackData.CONFIRM_DELETE_ACCOUNT_PREFIX
             markup = InlineKeyboardMarkup(row_width=1).add(
                 InlineKeyboardButton(f"✅ Ya, Hapus ID {acc_id_del}", callback_data=f"{AdminCallbackData.CONFIRM_DELETE_ACCOUNT_PREFIX}{acc_id_del}"),
@@ -1154,26 +2729,16 @@ try:
         message_id = call.message.message_id
 
         try:
-            with sqlite3.connect(DB_NAME) as conn:
-                c = conn.cursor()
-                c.execute("SELECT email FROM accounts WHERE id = ?", (account_id_to_delete,))
-                email_deleted_tuple = c.fetchone()
-                if not email_deleted_tuple:
-                    bot.edit_message_text(f"⚠️ Akun ID `{account_id_to_delete}` sudah tidak ada atau salah ID.", chat_id, message_id)
-                    bot.answer_callback_query(call.id, "Akun tidak ditemukan.")
-                    return
-
-                # PRAGMA foreign_keys = ON sudah diatur di init_db dan koneksi, ON DELETE SET NULL akan bekerja
-                c.execute("DELETE FROM accounts WHERE id = ?", (account_id_to_delete,))
-                conn.commit()
-
-                if c.rowcount > 0:
-                    bot.edit_message_text(f"✅ Akun ID `{account_id_to_delete}` (Email: `{email_deleted_tuple[0]}`) berhasil dihapus.", chat_id, message_id,
-                                          reply_markup=InlineKeyboardMarkup().add(InlineKeyboardButton("🔙 Kembali ke Menu Produk", callback_data=AdminCallbackData.BACK_TO_PRODUCT)))
-                    bot.answer_callback_query(call.id, "Akun berhasil dihapus.")
-                else: # Seharusnya sudah ditangani oleh cek email_deleted_tuple
-                    bot.edit_message_text(f"⚠️ Akun ID `{account_id_to_delete}` tidak ditemukan saat mencoba menghapus.", chat_id, message_id)
-                    bot.answer_callback_query(call.id, "Akun tidak ditemukan.")
+            # PRAGMA foreign_keys = ON sudah diatur di init_db dan koneksi, ON DELETE SET NULL akan bekerja
+            email_deleted = repo.delete_account(account_id_to_delete)
+            if email_deleted is None:
+                bot.edit_message_text(f"⚠️ Akun ID `{account_id_to_delete}` sudah tidak ada atau salah ID.", chat_id, message_id)
+                bot.answer_callback_query(call.id, "Akun tidak ditemukan.")
+                return
+            event_bus.publish(events.StockRemoved(account_id_to_delete))
+            bot.edit_message_text(f"✅ Akun ID `{account_id_to_delete}` (Email: `{email_deleted}`) berhasil dihapus.", chat_id, message_id,
+                                  reply_markup=InlineKeyboardMarkup().add(InlineKeyboardButton("🔙 Kembali ke Menu Produk", callback_data=AdminCallbackData.BACK_TO_PRODUCT)))
+            bot.answer_callback_query(call.id, "Akun berhasil dihapus.")
         except sqlite3.IntegrityError as e_int: # Jika ON DELETE RESTRICT/NO ACTION (seharusnya tidak dengan SET NULL)
             logger.error(f"DB IntegrityError saat hapus akun {account_id_to_delete}: {e_int}", exc_info=True)
             bot.edit_message_text(f"❌ Gagal hapus ID `{account_id_to_delete}`. Akun ini mungkin masih terkait dengan data penjualan yang tidak bisa di-NULL-kan.", chat_id, message_id,
@@ -1208,12 +2773,8 @@ try:
             return
         
         try:
-            with sqlite3.connect(DB_NAME) as conn:
-                c = conn.cursor()
-                # INSERT OR REPLACE akan update jika method sudah ada, atau insert baru
-                c.execute('''INSERT OR REPLACE INTO payment_methods (method, number, holder_name, active)
-                             VALUES (?, ?, ?, 1)''', (method_name, acc_number, holder_name))
-                conn.commit()
+            repo.save_payment_method(method_name, acc_number, holder_name)
+            event_bus.publish(events.PaymentMethodChanged('saved', method=method_name))
             bot.reply_to(message, f"✅ Metode pembayaran '{method_name}' berhasil ditambahkan/diperbarui dan diaktifkan.")
             # Bisa tambahkan tombol untuk kembali ke menu keuangan
         except sqlite3.Error as e_sql:
@@ -1221,8 +2782,8 @@ try:
             msg_retry = bot.reply_to(message, "❌ Error database. /cancel atau coba lagi.")
             bot.register_next_step_handler(msg_retry, process_add_payment_method_admin)
 
-    def process_price_settings_admin(message: Message) -> None:
-        """Memproses input untuk mengubah harga akun."""
+    def process_price_settings_admin(message: Message, product_id: int = DEFAULT_PRODUCT_ID) -> None:
+        """Memproses input untuk mengubah harga satu produk."""
         if not is_admin(message.from_user.id): return
         if message.text == '/cancel':
             bot.reply_to(message, "Pengaturan harga dibatalkan. Silakan gunakan menu lagi.")
@@ -1233,24 +2794,148 @@ try:
             if not new_price_input.isdigit(): raise ValueError("Harga harus berupa angka.")
             price_value = int(new_price_input)
             if price_value <= 0: raise ValueError("Harga harus lebih dari 0.")
-            
-            if set_setting('price', str(price_value)):
-                bot.reply_to(message, f"✅ Harga akun berhasil diubah menjadi: *{format_rupiah(str(price_value))}*")
+
+            updated = repo.set_product_price(product_id, price_value)
+            if updated:
+                event_bus.publish(events.ProductChanged(product_id, 'price'))
             else:
-                raise Exception("Gagal menyimpan harga ke database.") # Akan ditangkap oleh blok except umum
+                bot.reply_to(message, "❌ Produk tidak ditemukan. Silakan buka lagi dari menu Katalog.")
+                return
+            bot.reply_to(message, f"✅ Harga {escape_md(product_label(product_id))} berhasil diubah menjadi: *{format_rupiah(str(price_value))}*")
         except ValueError as ve:
             msg_retry = bot.reply_to(message, f"❌ Format harga salah: {ve}\nMasukkan angka positif saja (misal `50000`). /cancel atau coba lagi.")
-            bot.register_next_step_handler(msg_retry, process_price_settings_admin)
+            bot.register_next_step_handler(msg_retry, process_price_settings_admin, product_id)
         except Exception as e:
-            logger.error(f"Error saat mengatur harga: {e}", exc_info=True)
+            logger.error(f"Error saat mengatur harga produk {product_id}: {e}", exc_info=True)
             msg_retry = bot.reply_to(message, "❌ Gagal menyimpan harga. /cancel atau coba lagi.")
-            bot.register_next_step_handler(msg_retry, process_price_settings_admin)
+            bot.register_next_step_handler(msg_retry, process_price_settings_admin, product_id)
 
     # --- ADMIN /approve DAN /reject COMMANDS ---
+    AccountDetail = storage.AccountDetail
+
+    def send_account_details(chat_id: int, sale_id: int, accounts: List[AccountDetail], resend: bool = False,
+                             product_name: str = "premium") -> None:
+        """Mengirim detail semua akun sebuah sale ke pembeli dalam satu pesan (atau satu file jika terlalu panjang)."""
+        if resend:
+            header = f"📩 *Pengiriman Ulang Akun (Sale ID: `{sale_id}`) - {STORE_NAME}*\n\n"
+        else:
+            header = f"🎉 *Pembayaran Anda (Sale ID: `{sale_id}`) Telah Disetujui! ({STORE_NAME})*\n\n"
+
+        if len(accounts) == 1:
+            _acc_id, acc_email, acc_pass, acc_notes = accounts[0]
+            details = (
+                f"Berikut detail akun {escape_md(product_name)} Anda:\n"
+                f"📧 Email: `{acc_email}`\n"
+                f"🔑 Password: `{acc_pass}`"
+            )
+            if acc_notes: details += f"\n📝 Catatan: {acc_notes}"
+        else:
+            details = f"Berikut detail {len(accounts)} akun {escape_md(product_name)} Anda:\n"
+            for i, (_acc_id, acc_email, acc_pass, acc_notes) in enumerate(accounts, start=1):
+                details += f"\n{i}. 📧 `{acc_email}` | 🔑 `{acc_pass}`"
+                if acc_notes: details += f"\n   📝 {acc_notes}"
+        footer = (
+            f"\n\n*⚠️ PENTING:*\n"
+            f"  • Segera amankan akun (ganti password jika disarankan).\n"
+            f"  • Simpan detail ini baik-baik.\n"
+            f"  • Jika ada kendala login awal, hubungi Admin @{ADMIN_USERNAME} (sertakan screenshot).\n\n"
+            f"Terima kasih telah bertransaksi di {STORE_NAME}! 😊"
+        )
+        account_details_text = header + details + footer
+
+        if len(account_details_text) <= 4096:
+            bot.send_message(chat_id, account_details_text)
+            return
+        # Terlalu panjang untuk satu pesan: kirim semua akun sebagai satu file teks
+        file_lines = [f"{STORE_NAME} - Sale ID {sale_id} ({len(accounts)} akun)", ""]
+        for i, (_acc_id, acc_email, acc_pass, acc_notes) in enumerate(accounts, start=1):
+            file_lines.append(f"{i}. {acc_email} | {acc_pass}" + (f" | {acc_notes}" if acc_notes else ""))
+        bot.send_document(chat_id, io.BytesIO("\n".join(file_lines).encode('utf-8')),
+                          visible_file_name=f"akun_sale_{sale_id}.txt",
+                          caption=header + f"Detail {len(accounts)} akun terlampir dalam file." + footer)
+
+    def claim_blocked(sale_id: int, claimed_by: Optional[int], claimed_until: Optional[int], admin_id: int,
+                      reply: Callable[[str], Any]) -> bool:
+        """True (dan memberi tahu) jika sale sedang diklaim admin lain yang lease-nya belum habis."""
+        if claimed_by is None or claimed_by == admin_id or (claimed_until or 0) < int(time.time()):
+            return False
+        reply(f"🔒 Sale ID `{sale_id}` sedang diklaim admin `{claimed_by}` sampai {format_ts(claimed_until, '%H:%M')}. "
+              f"Gunakan ⏭ Klaim Berikutnya untuk mengambil pembayaran lain.")
+        return True
+
+    def approve_sale(sale_id: int, admin_id: int, reply: Callable[[str], Any]) -> bool:
+        """Menyetujui pembayaran dan mengirim akun; hasil dan error dilaporkan lewat `reply`."""
+        try:
+            result = repo.approve_sale(sale_id, admin_id, now_stamp())
+            sale = result.sale
+            if result.status == 'not_found':
+                reply(f"❌ Sale ID `{sale_id}` tidak ditemukan.")
+                return False
+            if result.status == 'not_pending':
+                reply(f"❌ Sale ID `{sale_id}` statusnya `{sale.status.upper()}`, bukan 'pending'. Tidak bisa diproses.")
+                return False
+            if result.status == 'claimed':
+                claim_blocked(sale_id, sale.claimed_by, sale.claimed_until, admin_id, reply)
+                return False
+            if result.status == 'out_of_stock': # Sale tetap pending
+                reply(f"⚠️ *STOK TIDAK CUKUP!* Sale ID `{sale_id}` butuh {sale.quantity} akun {escape_md(product_label(sale.product_id))}, tersedia {result.available}. Pembayaran belum bisa disetujui.\nSegera tambah stok!")
+                return False
+            if result.status == 'account_missing': # Akun lama yang ter-assign sudah terhapus; sale ditandai failed
+                reply(f"❌ Error: Akun ID `{sale.account_id}` (terhubung ke Sale ID `{sale_id}`) tidak ditemukan di database. Mungkin terhapus.")
+                return False
+            if result.status == 'account_sold':
+                reply(f"⚠️ *PERINGATAN:* Akun ID `{sale.account_id}` (Email: `{result.accounts[0][1]}`) untuk Sale ID `{sale_id}` SUDAH TERJUAL sebelumnya. Harap periksa manual untuk hindari duplikasi penjualan!\nApproval dibatalkan. Periksa dan `/approve` lagi jika aman.")
+                return False
+            if result.status == 'conflict':
+                reply(f"❌ *GAGAL UPDATE AKUN!* Sebagian akun untuk Sale ID `{sale_id}` tidak bisa ditandai terjual (mungkin sudah terjual oleh proses lain). Approval dibatalkan. Periksa dan coba lagi.")
+                logger.error(f"Kondisi kritis atau race condition saat menandai akun terjual untuk sale {sale_id}.")
+                return False
+
+            event_bus.publish(events.SaleCompleted(sale_id, sale.buyer_id, sale.product_id,
+                                                   tuple(account[0] for account in result.accounts), 'admin'))
+            accounts, buyer_tg_id, buyer_username = result.accounts, sale.buyer_id, sale.buyer_username
+            product_id = sale.product_id
+            
+            buyer_notified_successfully = False
+            if buyer_tg_id:
+                try:
+                    send_account_details(buyer_tg_id, sale_id, accounts, product_name=product_label(product_id))
+                    buyer_notified_successfully = True
+                except Exception as e_send:
+                    logger.error(f"Gagal kirim detail akun ke buyer {buyer_tg_id} (Sale {sale_id}): {e_send}")
+            else:
+                logger.warning(f"Tidak ada buyer_tg_id untuk Sale ID {sale_id}, tidak bisa kirim detail otomatis.")
+
+            account_summary = ', '.join(f"`{acc_id}`" for acc_id, *_ in accounts[:10]) + (" ..." if len(accounts) > 10 else "")
+            admin_feedback = (
+                f"✅ *Pembayaran Berhasil Disetujui & Akun Terkirim!*\n\n"
+                f"Sale ID: `{sale_id}`\n"
+                f"Pembeli: @{buyer_username if buyer_username and buyer_username != f'user_{buyer_tg_id}' else f'ID {buyer_tg_id}'}\n"
+            )
+            if len(accounts) == 1:
+                admin_feedback += f"Akun ID: `{accounts[0][0]}` (Email: `{accounts[0][1]}`)\n"
+            else:
+                admin_feedback += f"Jumlah Akun: {len(accounts)} (ID: {account_summary})\n"
+            if buyer_notified_successfully:
+                admin_feedback += "Detail akun telah dikirim ke pembeli."
+            else:
+                admin_feedback += f"⚠️ *PENTING*: Detail akun GAGAL dikirim otomatis ke pembeli. Mohon KIRIM MANUAL ke @{buyer_username if buyer_username and buyer_username != f'user_{buyer_tg_id}' else (f'ID {buyer_tg_id}' if buyer_tg_id else 'ID TIDAK DIKETAHUI')}."
+            reply(admin_feedback)
+            admin_notifier.request_refresh()
+            return True
+
+        except sqlite3.Error as e_sql:
+            logger.error(f"Kesalahan database pada approve_payment untuk Sale ID {sale_id}: {e_sql}", exc_info=True)
+            reply("❌ Terjadi kesalahan database. Perubahan telah dibatalkan (rollback).")
+        except Exception as e_main:
+            logger.error(f"Kesalahan tak terduga pada approve_payment untuk Sale ID {sale_id}: {e_main}", exc_info=True)
+            reply("❌ Terjadi kesalahan tak terduga. Perubahan mungkin telah dibatalkan (rollback).")
+        return False
+
     @bot.message_handler(commands=['approve'])
     def approve_payment_command(message: Message) -> None:
         """Menyetujui pembayaran dan mengirim akun."""
-        if not is_admin(message.from_user.id):
+        if not is_staff(message.from_user.id):
             bot.reply_to(message, "⛔ Anda tidak punya izin untuk perintah ini.")
             return
             
@@ -1264,124 +2949,62 @@ try:
         except ValueError:
             bot.reply_to(message, "⚠️ ID Sale harus berupa angka.")
             return
+        approve_sale(sale_id_to_approve, message.from_user.id, lambda text: bot.reply_to(message, text))
 
-        conn: Optional[sqlite3.Connection] = None
+    def reject_sale(sale_id: int, admin_id: int, reason: str, reply: Callable[[str], Any]) -> bool:
+        """Membatalkan pembayaran yang pending; hasil dan error dilaporkan lewat `reply`."""
         try:
-            conn = sqlite3.connect(DB_NAME)
-            conn.execute('PRAGMA foreign_keys = ON;')
-            c = conn.cursor()
-            
-            # --- Mulai Transaksi (implisit oleh SQLite, diakhiri dengan commit/rollback) ---
-            c.execute("SELECT id, account_id, buyer_id, buyer_username, status, amount FROM sales WHERE id = ?", (sale_id_to_approve,))
-            sale_record = c.fetchone()
-
-            if not sale_record:
-                bot.reply_to(message, f"❌ Sale ID `{sale_id_to_approve}` tidak ditemukan.")
-                return # Tidak ada DML, jadi tidak perlu rollback eksplisit
-            
-            _sale_id, current_account_id, buyer_tg_id, buyer_username, sale_status, sale_amount = sale_record
-
-            if sale_status != 'pending':
-                bot.reply_to(message, f"❌ Sale ID `{sale_id_to_approve}` statusnya `{sale_status.upper()}`, bukan 'pending'. Tidak bisa diproses.")
-                return
+            result = repo.reject_sale(sale_id, admin_id, reason, now_stamp())
+            sale = result.sale
+            if result.status == 'not_found':
+                reply(f"❌ Sale ID `{sale_id}` tidak ditemukan.")
+                return False
+            if result.status == 'not_pending':
+                reply(f"❌ Sale ID `{sale_id}` statusnya `{sale.status.upper()}`, bukan 'pending'. Tidak dapat dibatalkan.")
+                return False
+            if result.status == 'claimed':
+                claim_blocked(sale_id, sale.claimed_by, sale.claimed_until, admin_id, reply)
+                return False
+            if result.status == 'conflict': # Diproses admin lain di antara pemeriksaan dan update
+                reply(f"❌ Sale ID `{sale_id}` sudah diproses admin lain.")
+                return False
+            event_bus.publish(events.SaleRejected(sale_id, sale.buyer_id, admin_id))
+            buyer_tg_id, buyer_username = sale.buyer_id, sale.buyer_username
 
-            assigned_account_id = current_account_id
-            acc_email, acc_pass, acc_notes = None, None, None
-
-            if assigned_account_id is None: # Akun belum ter-assign, cari yang tersedia
-                c.execute("SELECT id, email, password, notes FROM accounts WHERE sold = 0 ORDER BY date_added ASC, id ASC LIMIT 1")
-                available_account = c.fetchone()
-                if not available_account:
-                    bot.reply_to(message, f"⚠️ *STOK HABIS!* Tidak ada akun tersedia untuk Sale ID `{sale_id_to_approve}`. Pembayaran belum bisa disetujui.\nSegera tambah stok!")
-                    return # Sale tetap pending, tidak ada rollback diperlukan
-                assigned_account_id, acc_email, acc_pass, acc_notes = available_account
-                c.execute("UPDATE sales SET account_id = ? WHERE id = ?", (assigned_account_id, sale_id_to_approve)) # DML 1
-            else: # Akun sudah ter-assign, fetch detailnya
-                c.execute("SELECT email, password, notes, sold FROM accounts WHERE id = ?", (assigned_account_id,))
-                account_data = c.fetchone()
-                if not account_data:
-                    bot.reply_to(message, f"❌ Error: Akun ID `{assigned_account_id}` (terhubung ke Sale ID `{sale_id_to_approve}`) tidak ditemukan di database. Mungkin terhapus.")
-                    c.execute("UPDATE sales SET status = 'failed', admin_notes = ? WHERE id = ?", 
-                              (f"Gagal approve: Akun ID {assigned_account_id} tidak ditemukan saat approval.", sale_id_to_approve))
-                    conn.commit() # Commit status 'failed' ini
-                    return
-                acc_email, acc_pass, acc_notes, acc_already_sold = account_data
-                if acc_already_sold == 1:
-                    bot.reply_to(message, f"⚠️ *PERINGATAN:* Akun ID `{assigned_account_id}` (Email: `{acc_email}`) untuk Sale ID `{sale_id_to_approve}` SUDAH TERJUAL sebelumnya. Harap periksa manual untuk hindari duplikasi penjualan!\nApproval dibatalkan. Periksa dan `/approve` lagi jika aman.")
-                    return
-
-            now_str = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-            
-            c.execute('''UPDATE accounts 
-                         SET sold = 1, sold_to_username = ?, sold_to_id = ?, sold_date = ?
-                         WHERE id = ? AND sold = 0''', # Kunci: AND sold = 0
-                      (buyer_username, buyer_tg_id, now_str, assigned_account_id)) # DML 2
-            
-            if c.rowcount == 0: # Jika akun gagal diupdate (misal, sudah terjual oleh proses lain)
-                bot.reply_to(message, f"❌ *GAGAL UPDATE AKUN!* Akun ID `{assigned_account_id}` tidak bisa ditandai terjual (mungkin sudah terjual oleh proses lain atau tidak valid). Approval dibatalkan. Periksa dan coba lagi.")
-                logger.error(f"Kondisi kritis atau race condition saat menandai akun {assigned_account_id} terjual untuk sale {sale_id_to_approve}. Rowcount 0 pada update akun.")
-                conn.rollback() # Rollback semua perubahan (termasuk update sales.account_id jika terjadi)
-                return 
-
-            c.execute("UPDATE sales SET status = 'completed', completed_date = ? WHERE id = ?", (now_str, sale_id_to_approve)) # DML 3
-            
-            conn.commit() # --- COMMIT TRANSAKSI ---
-            
-            # Kirim detail akun ke pembeli
-            account_details_text = (
-                f"🎉 *Pembayaran Anda (Sale ID: `{sale_id_to_approve}`) Telah Disetujui! ({STORE_NAME})*\n\n"
-                f"Berikut detail akun Blackbox.ai Anda:\n"
-                f"📧 Email: `{acc_email}`\n"
-                f"🔑 Password: `{acc_pass}`"
-            )
-            if acc_notes: account_details_text += f"\n📝 Catatan: {acc_notes}"
-            account_details_text += (
-                f"\n\n*⚠️ PENTING:*\n"
-                f"  • Segera amankan akun (ganti password jika disarankan).\n"
-                f"  • Simpan detail ini baik-baik.\n"
-                f"  • Jika ada kendala login awal, hubungi Admin @{ADMIN_USERNAME} (sertakan screenshot).\n\n"
-                f"Terima kasih telah bertransaksi di {STORE_NAME}! 😊"
+            user_rejection_message = (
+                f"ℹ️ Pembelian Anda (Sale ID: `{sale_id}`) di {STORE_NAME} telah *DIBATALKAN* oleh admin.\n\n"
+                f"Alasan: {reason}\n\n"
+                f"Jika ada pertanyaan lebih lanjut, silakan hubungi @{ADMIN_USERNAME}."
             )
-            
-            buyer_notified_successfully = False
+            notif_ke_user_gagal = False
             if buyer_tg_id:
                 try:
-                    bot.send_message(buyer_tg_id, account_details_text)
-                    buyer_notified_successfully = True
-                except Exception as e_send:
-                    logger.error(f"Gagal kirim detail akun ke buyer {buyer_tg_id} (Sale {sale_id_to_approve}): {e_send}")
-            else:
-                logger.warning(f"Tidak ada buyer_tg_id untuk Sale ID {sale_id_to_approve}, tidak bisa kirim detail otomatis.")
-
-            admin_feedback = (
-                f"✅ *Pembayaran Berhasil Disetujui & Akun Terkirim!*\n\n"
-                f"Sale ID: `{sale_id_to_approve}`\n"
-                f"Pembeli: @{buyer_username if buyer_username and buyer_username != f'user_{buyer_tg_id}' else f'ID {buyer_tg_id}'}\n"
-                f"Akun ID: `{assigned_account_id}` (Email: `{acc_email}`)\n"
-            )
-            if buyer_notified_successfully:
-                admin_feedback += "Detail akun telah dikirim ke pembeli."
+                    bot.send_message(buyer_tg_id, user_rejection_message)
+                except Exception as e_send_user:
+                    logger.error(f"Gagal mengirim notifikasi pembatalan ke user {buyer_tg_id} (Sale ID {sale_id}): {e_send_user}")
+                    notif_ke_user_gagal = True
+            
+            admin_feedback = f"✅ Sale ID `{sale_id}` telah berhasil dibatalkan (status: cancelled).\nAlasan: {reason}\n"
+            if notif_ke_user_gagal:
+                admin_feedback += f"Peringatan: Gagal memberitahu user @{buyer_username if buyer_username and buyer_username != f'user_{buyer_tg_id}' else f'ID {buyer_tg_id}'} tentang pembatalan."
             else:
-                admin_feedback += f"⚠️ *PENTING*: Detail akun GAGAL dikirim otomatis ke pembeli. Mohon KIRIM MANUAL ke @{buyer_username if buyer_username and buyer_username != f'user_{buyer_tg_id}' else (f'ID {buyer_tg_id}' if buyer_tg_id else 'ID TIDAK DIKETAHUI')}."
-            bot.reply_to(message, admin_feedback)
+                admin_feedback += "Pengguna telah (atau akan dicoba) diberitahu."
+            reply(admin_feedback)
+            admin_notifier.request_refresh()
+            return True
 
         except sqlite3.Error as e_sql:
-            logger.error(f"Kesalahan database pada approve_payment untuk Sale ID {args[1] if len(args)>1 else 'N/A'}: {e_sql}", exc_info=True)
-            bot.reply_to(message, "❌ Terjadi kesalahan database. Perubahan telah dibatalkan (rollback).")
-            if conn: conn.rollback()
+            logger.error(f"Kesalahan database pada reject_payment untuk Sale ID {sale_id}: {e_sql}", exc_info=True)
+            reply("❌ Terjadi kesalahan database saat membatalkan. Perubahan mungkin telah dibatalkan (rollback).")
         except Exception as e_main:
-            logger.error(f"Kesalahan tak terduga pada approve_payment untuk Sale ID {args[1] if len(args)>1 else 'N/A'}: {e_main}", exc_info=True)
-            bot.reply_to(message, "❌ Terjadi kesalahan tak terduga. Perubahan mungkin telah dibatalkan (rollback).")
-            if conn:
-                try: conn.rollback()
-                except Exception: pass # Abaikan jika rollback juga gagal
-        finally:
-            if conn: conn.close()
+            logger.error(f"Kesalahan tak terduga pada reject_payment untuk Sale ID {sale_id}: {e_main}", exc_info=True)
+            reply("❌ Terjadi kesalahan tak terduga saat membatalkan. Perubahan mungkin telah dibatalkan (rollback).")
+        return False
 
     @bot.message_handler(commands=['reject'])
     def reject_payment_command(message: Message) -> None:
         """Membatalkan pembayaran yang pending."""
-        if not is_admin(message.from_user.id):
+        if not is_staff(message.from_user.id):
             bot.reply_to(message, "⛔ Anda tidak punya izin untuk perintah ini.")
             return
 
@@ -1392,70 +3015,438 @@ try:
 
         try:
             sale_id_to_reject = int(args[1])
-            rejection_reason = args[2].strip() if len(args) > 2 else "Tidak ada alasan spesifik dari admin."
         except ValueError:
             bot.reply_to(message, "⚠️ ID Sale harus berupa angka.")
             return
-        
-        if not rejection_reason: rejection_reason = "Tidak ada alasan spesifik dari admin."
+        rejection_reason = (args[2].strip() if len(args) > 2 else "") or "Tidak ada alasan spesifik dari admin."
+        reject_sale(sale_id_to_reject, message.from_user.id, rejection_reason, lambda text: bot.reply_to(message, text))
+
+    # --- Klaim Verifikasi (Multi-Admin) ---
+    def show_claimed_sale(chat_id: int, sale: storage.QueuedSale) -> None:
+        """Mengirim bukti pembayaran sale yang diklaim beserta tombol Setujui / Tolak / Berikutnya."""
+        sale_id, buyer_id, buyer_username, quantity, amount, proof_file_id, created_ts, _, claimed_until, product_id = sale
+        caption = (
+            f"🔒 *Diklaim untuk Anda* (sampai {format_ts(claimed_until, '%H:%M')})\n\n"
+            f"Sale ID: `{sale_id}`\n"
+            f"Dari: {format_buyer(buyer_username, buyer_id)}\n"
+            f"Produk: {escape_md(product_label(product_id))}\n"
+            f"Jumlah Akun: {quantity or 1}\n"
+            f"Jumlah: {format_rupiah(amount)}\n"
+            f"Masuk: {format_ts(created_ts)}"
+        )
+        markup = staff_sale_markup(sale_id)
+        for send in (bot.send_photo, bot.send_document): # Bukti bisa berupa foto atau dokumen gambar
+            try:
+                send(chat_id, proof_file_id, caption=caption, reply_markup=markup)
+                return
+            except telebot.apihelper.ApiTelegramException as e_send:
+                logger.warning(f"Gagal mengirim bukti Sale ID {sale_id} dengan {send.__name__}: {e_send}")
+        bot.send_message(chat_id, caption + "\n\n⚠️ Bukti pembayaran gagal ditampilkan.", reply_markup=markup)
+
+    def claim_and_show_next(chat_id: int, admin_id: int, after_id: int = 0) -> None:
+        try:
+            sale = repo.claim_next_sale(admin_id, after_id, int(time.time()), ADMIN_CLAIM_LEASE_SEC)
+        except sqlite3.Error as e:
+            logger.error(f"DB Error mengklaim sale pending untuk admin {admin_id}: {e}")
+            bot.send_message(chat_id, "❌ Gagal mengambil pembayaran pending. Silakan coba lagi.")
+            return
+        if not sale:
+            bot.send_message(chat_id, "✅ Tidak ada pembayaran pending yang bisa diklaim. Semua sudah diproses atau sedang diklaim admin lain.")
+            return
+        show_claimed_sale(chat_id, sale)
+        admin_notifier.request_refresh()
+
+    @bot.message_handler(commands=['next'])
+    @bot.message_handler(func=lambda message: message.text == "⏭ Klaim Berikutnya" and is_staff(message.from_user.id))
+    def claim_next_command(message: Message) -> None:
+        """Mengklaim pembayaran pending berikutnya untuk diverifikasi."""
+        if not is_staff(message.from_user.id):
+            bot.reply_to(message, "⛔ Anda tidak punya izin untuk perintah ini.")
+            return
+        claim_and_show_next(message.chat.id, message.from_user.id)
 
+    @bot.callback_query_handler(func=lambda call: call.data.startswith('staff_'))
+    def handle_staff_callback(call: CallbackQuery) -> None:
+        admin_id = call.from_user.id
+        if not is_staff(admin_id):
+            bot.answer_callback_query(call.id, "⚠️ Akses ditolak!")
+            return
+        bot.answer_callback_query(call.id)
+        chat_id, message_id, data = call.message.chat.id, call.message.message_id, call.data
 
-        conn: Optional[sqlite3.Connection] = None
         try:
-            conn = sqlite3.connect(DB_NAME)
-            conn.execute('PRAGMA foreign_keys = ON;')
-            c = conn.cursor()
+            if data.startswith(StaffCallbackData.CLAIM_NEXT_PREFIX):
+                claim_and_show_next(chat_id, admin_id, int(data[len(StaffCallbackData.CLAIM_NEXT_PREFIX):]))
+            elif data.startswith(StaffCallbackData.APPROVE_PREFIX):
+                sale_id = int(data[len(StaffCallbackData.APPROVE_PREFIX):])
+                if approve_sale(sale_id, admin_id, lambda text: bot.send_message(chat_id, text)):
+                    clear_staff_buttons(chat_id, message_id)
+                    claim_and_show_next(chat_id, admin_id, sale_id)
+            elif data.startswith(StaffCallbackData.REJECT_PREFIX):
+                sale_id = int(data[len(StaffCallbackData.REJECT_PREFIX):])
+                # Klaim dulu agar admin lain tidak memproses sale ini selama alasan diketik
+                claim = repo.claim_sale(sale_id, admin_id, int(time.time()), ADMIN_CLAIM_LEASE_SEC)
+                if claim.status == 'not_found':
+                    bot.send_message(chat_id, f"❌ Sale ID `{sale_id}` tidak ditemukan.")
+                    return
+                if claim.status == 'not_pending':
+                    bot.send_message(chat_id, f"ℹ️ Sale ID `{sale_id}` sudah diproses (status `{claim.sale.status.upper()}`).")
+                    clear_staff_buttons(chat_id, message_id)
+                    return
+                if claim.status == 'taken':
+                    claim_blocked(sale_id, claim.sale.claimed_by, claim.sale.claimed_until, admin_id, lambda text: bot.send_message(chat_id, text))
+                    return
+                admin_notifier.request_refresh()
+                msg_prompt = bot.send_message(chat_id, f"✍️ Kirim alasan penolakan untuk Sale ID `{sale_id}`.\n"
+                                                       f"Ketik `-` untuk tanpa alasan, atau /cancel untuk batal.")
+                bot.register_next_step_handler(msg_prompt, process_staff_reject_reason, sale_id, message_id)
+        except ValueError:
+            logger.warning(f"Callback staff tidak valid: {data}")
+        except Exception as e:
+            logger.error(f"Error di handle_staff_callback untuk data '{data}': {e}", exc_info=True)
+            bot.send_message(chat_id, "❌ Terjadi kesalahan saat memproses aksi verifikasi.")
 
-            c.execute("SELECT buyer_id, buyer_username, status, account_id FROM sales WHERE id = ?", (sale_id_to_reject,))
-            sale_record = c.fetchone()
+    def clear_staff_buttons(chat_id: int, message_id: int) -> None:
+        try:
+            bot.edit_message_reply_markup(chat_id, message_id, reply_markup=None)
+        except telebot.apihelper.ApiTelegramException:
+            pass # Pesan terlalu lama atau sudah diedit; tombol yang tertinggal ditolak saat diproses
 
-            if not sale_record:
-                bot.reply_to(message, f"❌ Sale ID `{sale_id_to_reject}` tidak ditemukan.")
-                return
+    def process_staff_reject_reason(message: Message, sale_id: int, proof_message_id: int) -> None:
+        if not is_staff(message.from_user.id): return
+        if message.text == '/cancel':
+            bot.reply_to(message, f"Penolakan Sale ID `{sale_id}` dibatalkan. Sale masih diklaim atas nama Anda.")
+            return
+        if message.content_type != 'text':
+            msg_retry = bot.reply_to(message, "❌ Alasan harus berupa teks. Coba lagi atau /cancel.")
+            bot.register_next_step_handler(msg_retry, process_staff_reject_reason, sale_id, proof_message_id)
+            return
+        reason = message.text.strip()
+        if reason in ('', '-'): reason = "Tidak ada alasan spesifik dari admin."
+        if reject_sale(sale_id, message.from_user.id, reason, lambda text: bot.reply_to(message, text)):
+            clear_staff_buttons(message.chat.id, proof_message_id)
+            claim_and_show_next(message.chat.id, message.from_user.id, sale_id)
+
+    # --- Roster Admin ---
+    @bot.message_handler(commands=['admins'])
+    def list_admins_command(message: Message) -> None:
+        """Menampilkan admin & verifikator aktif beserta beban klaimnya."""
+        if not is_admin(message.from_user.id): return
+        try:
+            rows = repo.list_admins(int(time.time()))
+        except sqlite3.Error as e:
+            logger.error(f"DB Error membaca roster admin: {e}")
+            bot.reply_to(message, "❌ Gagal membaca daftar admin.")
+            return
+        lines = [f"👥 *Roster Admin* ({len(rows)} aktif)\n"]
+        for telegram_id, role, assigned_count, claimed in rows:
+            owner = " (pemilik)" if telegram_id == ADMIN_ID else ""
+            lines.append(f"• `{telegram_id}` {role}{owner} | notifikasi: {assigned_count} | klaim aktif: {claimed}")
+        lines.append("\n`/addadmin ID [admin|verifier]` | `/deladmin ID`")
+        bot.reply_to(message, "\n".join(lines))
+
+    @bot.message_handler(commands=['addadmin'])
+    def add_admin_command(message: Message) -> None:
+        """Menambah (atau mengubah peran) admin/verifikator."""
+        if not is_admin(message.from_user.id): return
+        args = message.text.split()
+        role = args[2].lower() if len(args) > 2 else 'verifier'
+        if len(args) < 2 or not args[1].isdigit() or role not in ADMIN_ROLES:
+            bot.reply_to(message, "⚠️ Format: `/addadmin <TELEGRAM_ID> [admin|verifier]`\nContoh: `/addadmin 123456789 verifier`")
+            return
+        new_admin_id = int(args[1])
+        if new_admin_id == ADMIN_ID:
+            bot.reply_to(message, "ℹ️ Pemilik bot selalu berperan admin.")
+            return
+        try:
+            repo.add_admin(new_admin_id, role, now_stamp())
+        except sqlite3.Error as e:
+            logger.error(f"DB Error menambah admin {new_admin_id}: {e}")
+            bot.reply_to(message, "❌ Gagal menyimpan admin baru.")
+            return
+        admin_roster.load()
+        bot.reply_to(message, f"✅ `{new_admin_id}` sekarang *{role}*. Notifikasi pembayaran baru akan dibagi bergiliran.")
+        try:
+            keyboard = get_admin_keyboard() if role == 'admin' else get_verifier_keyboard()
+            bot.send_message(new_admin_id, f"👋 Anda ditambahkan sebagai *{role}* di {STORE_NAME}. Kirim /start untuk melihat menu.",
+                             reply_markup=keyboard)
+        except Exception as e_notify:
+            logger.warning(f"Gagal memberi tahu admin baru {new_admin_id}: {e_notify}")
+
+    @bot.message_handler(commands=['deladmin'])
+    def remove_admin_command(message: Message) -> None:
+        """Menonaktifkan admin/verifikator dan melepas klaimnya."""
+        if not is_admin(message.from_user.id): return
+        args = message.text.split()
+        if len(args) < 2 or not args[1].isdigit():
+            bot.reply_to(message, "⚠️ Format: `/deladmin <TELEGRAM_ID>`")
+            return
+        old_admin_id = int(args[1])
+        if old_admin_id == ADMIN_ID:
+            bot.reply_to(message, "⛔ Pemilik bot tidak bisa dihapus dari roster.")
+            return
+        try:
+            released = repo.remove_admin(old_admin_id)
+        except sqlite3.Error as e:
+            logger.error(f"DB Error menghapus admin {old_admin_id}: {e}")
+            bot.reply_to(message, "❌ Gagal menghapus admin.")
+            return
+        if released is None:
+            bot.reply_to(message, f"ℹ️ `{old_admin_id}` tidak ada di roster aktif.")
+            return
+        admin_roster.load()
+        admin_notifier.request_refresh()
+        bot.reply_to(message, f"✅ `{old_admin_id}` dihapus dari roster. {released} klaim pending dilepas untuk admin lain.")
+
+    # --- Rekonsiliasi Mutasi ---
+    def run_reconciliation(lines: List[reconcile.StatementLine], payment_method: Optional[str], window: timedelta
+                           ) -> Tuple[reconcile.ReconcileResult, List[storage.ReconcileApproval], List[int]]:
+        """Mencocokkan mutasi dengan sale pending dan menyetujui semua yang cocok dalam satu transaksi."""
+        result, approved, short_stock = repo.reconcile_statement(lines, window, payment_method, now_stamp())
+        for sale_id, buyer_id, accounts, product_id in approved:
+            event_bus.publish(events.SaleCompleted(sale_id, buyer_id, product_id,
+                                                   tuple(account[0] for account in accounts), 'reconcile'))
+        return result, approved, short_stock
+
+    def process_statement_upload_admin(message: Message) -> None:
+        """Memproses file CSV mutasi yang diunggah admin untuk rekonsiliasi otomatis."""
+        if not is_admin(message.from_user.id): return
+        if message.text == '/cancel':
+            bot.reply_to(message, "Rekonsiliasi dibatalkan. Silakan gunakan menu lagi.")
+            return
+        if message.content_type != 'document':
+            msg_retry = bot.reply_to(message, "❌ Kirim mutasi sebagai *file CSV* (dokumen). Coba lagi atau /cancel.")
+            bot.register_next_step_handler(msg_retry, process_statement_upload_admin)
+            return
 
-            buyer_tg_id, buyer_username, sale_status, _ = sale_record # account_id tidak penting untuk reject
+        payment_method = (message.caption or '').strip().upper() or None
+        try:
+            window = timedelta(hours=float(get_setting('reconcile_window_hours') or '24'))
+            file_info = bot.get_file(message.document.file_id)
+            statement_text = bot.download_file(file_info.file_path).decode('utf-8-sig', errors='replace')
+            lines, skipped_rows = reconcile.parse_statement(statement_text)
+            result, approved, short_stock = run_reconciliation(lines, payment_method, window)
+        except ValueError as ve:
+            msg_retry = bot.reply_to(message, f"❌ File mutasi tidak bisa dibaca: {ve}\nCoba lagi atau /cancel.")
+            bot.register_next_step_handler(msg_retry, process_statement_upload_admin)
+            return
+        except sqlite3.Error as e_sql:
+            logger.error(f"DB error saat rekonsiliasi mutasi: {e_sql}", exc_info=True)
+            bot.reply_to(message, "❌ Error database saat rekonsiliasi. Semua perubahan dibatalkan (rollback).")
+            return
 
-            if sale_status != 'pending':
-                bot.reply_to(message, f"❌ Sale ID `{sale_id_to_reject}` statusnya `{sale_status.upper()}`, bukan 'pending'. Tidak dapat dibatalkan.")
-                return
+        delivery_failed: List[int] = []
+        for sale_id, buyer_id, accounts, product_id in approved:
+            try:
+                send_account_details(buyer_id, sale_id, accounts, product_name=product_label(product_id))
+            except Exception as e_send:
+                logger.error(f"Gagal kirim detail akun ke buyer {buyer_id} (Sale {sale_id}, auto-rekonsiliasi): {e_send}")
+                delivery_failed.append(sale_id)
+        if approved: admin_notifier.request_refresh()
+        logger.info(f"Rekonsiliasi {payment_method or '-'}: {len(approved)} disetujui, {len(result.unmatched)} tidak cocok, "
+                    f"{len(result.ambiguous)} ambigu, {len(short_stock)} stok kurang.")
+
+        report = (
+            f"🏦 *Hasil Rekonsiliasi{f' ({payment_method})' if payment_method else ''}*\n\n"
+            f"Baris uang masuk: {len(lines)} (dilewati: {len(skipped_rows)})\n"
+            f"✅ Disetujui otomatis: {len(approved)}\n"
+        )
+        if approved:
+            report += "   Sale ID: " + ', '.join(f"`{sale_id}`" for sale_id, *_ in approved[:30]) + (" ..." if len(approved) > 30 else "") + "\n"
+        if short_stock:
+            report += "⚠️ Cocok tapi stok kurang (tetap pending): " + ', '.join(f"`{sale_id}`" for sale_id in short_stock) + "\n"
+        if delivery_failed:
+            report += "⚠️ Akun GAGAL terkirim ke pembeli, kirim manual: " + ', '.join(f"`{sale_id}`" for sale_id in delivery_failed) + "\n"
+        if result.ambiguous:
+            report += f"\n❓ *Ambigu ({len(result.ambiguous)})* - cek manual:\n"
+            for line, candidates in result.ambiguous[:15]:
+                report += f"  • Baris {line.line_no}: {format_rupiah(line.amount)} → Sale ID {', '.join(str(sale.sale_id) for sale in candidates)}\n"
+        if result.unmatched:
+            report += f"\n🔍 *Tidak cocok ({len(result.unmatched)})*:\n"
+            for line in result.unmatched[:30]:
+                report += f"  • Baris {line.line_no}: {format_rupiah(line.amount)} ({line.date:%d %b %y %H:%M}) {line.description[:40]}\n"
+        if len(report) > 4096:
+            report = report[:4000] + "\n\n⚠️ Laporan terlalu panjang..."
+        bot.reply_to(message, report)
+
+    @bot.message_handler(commands=['archive'])
+    def archive_command(message: Message) -> None:
+        """Memindahkan transaksi & akun terjual yang sudah lama ke database arsip."""
+        if not is_admin(message.from_user.id):
+            bot.reply_to(message, "⛔ Anda tidak punya izin untuk perintah ini.")
+            return
 
-            now_str = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-            c.execute("UPDATE sales SET status = 'cancelled', completed_date = ?, admin_notes = ? WHERE id = ?",
-                      (now_str, rejection_reason, sale_id_to_reject))
-            conn.commit() # Commit perubahan status
+        args = message.text.split()
+        try:
+            max_age_days = int(args[1]) if len(args) > 1 else int(get_setting('archive_after_days') or '90')
+        except ValueError:
+            bot.reply_to(message, "⚠️ Format: `/archive [UMUR_HARI]`\nContoh: `/archive 90`")
+            return
+        if max_age_days < ARCHIVE_MIN_AGE_DAYS:
+            bot.reply_to(message, f"⚠️ Umur minimal arsip adalah {ARCHIVE_MIN_AGE_DAYS} hari (laporan penjualan membaca {ARCHIVE_MIN_AGE_DAYS} hari terakhir).")
+            return
 
-            user_rejection_message = (
-                f"ℹ️ Pembelian Anda (Sale ID: `{sale_id_to_reject}`) di {STORE_NAME} telah *DIBATALKAN* oleh admin.\n\n"
-                f"Alasan: {rejection_reason}\n\n"
-                f"Jika ada pertanyaan lebih lanjut, silakan hubungi @{ADMIN_USERNAME}."
-            )
-            notif_ke_user_gagal = False
-            if buyer_tg_id:
-                try:
-                    bot.send_message(buyer_tg_id, user_rejection_message)
-                except Exception as e_send_user:
-                    logger.error(f"Gagal mengirim notifikasi pembatalan ke user {buyer_tg_id} (Sale ID {sale_id_to_reject}): {e_send_user}")
-                    notif_ke_user_gagal = True
-            
-            admin_feedback = f"✅ Sale ID `{sale_id_to_reject}` telah berhasil dibatalkan (status: cancelled).\nAlasan: {rejection_reason}\n"
-            if notif_ke_user_gagal:
-                admin_feedback += f"Peringatan: Gagal memberitahu user @{buyer_username if buyer_username and buyer_username != f'user_{buyer_tg_id}' else f'ID {buyer_tg_id}'} tentang pembatalan."
+        try:
+            result = archive_old_records(max_age_days)
+        except sqlite3.Error as e_sql:
+            logger.error(f"DB error saat arsip data: {e_sql}", exc_info=True)
+            bot.reply_to(message, "❌ Error database saat mengarsipkan data. Batch yang belum selesai telah di-rollback.")
+            return
+
+        before, after, moved = result['before'], result['after'], result['moved']
+        bot.reply_to(
+            message,
+            f"🗄 *Arsip Selesai* (lebih tua dari {max_age_days} hari)\n\n"
+            f"Penjualan dipindah: {moved['sales']}\n"
+            f"Akun terjual dipindah: {moved['accounts']}\n\n"
+            f"Ukuran tabel utama:\n"
+            f"  • sales: {before['sales']} → {after['sales']}\n"
+            f"  • sale_items: {before['sale_items']} → {after['sale_items']}\n"
+            f"  • accounts: {before['accounts']} → {after['accounts']}"
+        )
+
+    # --- Pencarian Admin ---
+    admin_search_queries: Dict[int, str] = {} # chat_id -> query terakhir, dipakai tombol halaman
+
+    def code_text(value: Any, max_len: int = 40) -> str:
+        """Teks bebas aman untuk Markdown: dibungkus backtick, backtick di dalamnya dibuang."""
+        text = str(value).replace('`', "'").replace('\n', ' ')
+        return f"`{text[:max_len]}{'…' if len(text) > max_len else ''}`"
+
+    def display_search_results(chat_id: int, query: str, page: int = 0, message_id_to_edit: Optional[int] = None) -> None:
+        """Menampilkan satu halaman hasil /cari."""
+        try:
+            start = time.perf_counter()
+            results, has_more = search_records(query, page)
+            elapsed_ms = (time.perf_counter() - start) * 1000
+        except sqlite3.Error as e:
+            logger.error(f"DB Error saat mencari '{query}': {e}", exc_info=True)
+            bot.send_message(chat_id, "❌ Error database saat mencari. Coba `/reindex` jika index rusak.")
+            return
+
+        text = f"🔎 *Hasil Pencarian* {code_text(query)} (hal. {page + 1}, {elapsed_ms:.0f} ms)\n\n"
+        if not results:
+            text += "Tidak ada hasil." if page == 0 else "Tidak ada hasil lagi."
+        for kind, ref_id, label, notes, status, info, ts, archived in results:
+            archive_tag = " 🗄 arsip" if archived else ""
+            if kind == 'account':
+                state = f"✅ Terjual ke {code_text('@' + info) if info else '-'}" if status else "☑️ Tersedia"
+                text += f"📧 Akun `{ref_id}` {code_text(label)}{archive_tag}\n   {state} | ➕ {format_ts(ts, '%d %b %y')}\n"
+            elif kind == 'sale':
+                text += (f"🧾 Sale `{ref_id}` {code_text('@' + (label or '-'))}{archive_tag}\n"
+                         f"   {str(status).upper()} | {format_rupiah(info)} | 🗓 {format_ts(ts)}\n")
             else:
-                admin_feedback += "Pengguna telah (atau akan dicoba) diberitahu."
-            bot.reply_to(message, admin_feedback)
+                blocked = " | 🚫 Diblokir" if status else ""
+                text += f"👤 Customer {code_text('@' + (label or '-'))} (ID `{ref_id}`)\n   Aktif terakhir: {format_ts(ts)}{blocked}\n"
+            if notes and kind != 'customer':
+                text += f"   📝 {code_text(notes, 60)}\n"
+
+        markup = InlineKeyboardMarkup(row_width=2)
+        nav_buttons = []
+        if page > 0:
+            nav_buttons.append(InlineKeyboardButton("⬅️ Sebelumnya", callback_data=f"{AdminCallbackData.SEARCH_PAGE_PREFIX}{page - 1}"))
+        if has_more:
+            nav_buttons.append(InlineKeyboardButton("Berikutnya ➡️", callback_data=f"{AdminCallbackData.SEARCH_PAGE_PREFIX}{page + 1}"))
+        if nav_buttons:
+            markup.add(*nav_buttons)
+
+        if message_id_to_edit:
+            try:
+                bot.edit_message_text(text, chat_id, message_id_to_edit, reply_markup=markup)
+                return
+            except telebot.apihelper.ApiTelegramException as e_edit:
+                if "message is not modified" in str(e_edit).lower():
+                    return
+                logger.warning(f"Gagal edit hasil pencarian, kirim pesan baru: {e_edit}")
+        bot.send_message(chat_id, text, reply_markup=markup)
 
+    @bot.message_handler(commands=['cari'])
+    def search_command(message: Message) -> None:
+        """Pencarian full-text akun (email/catatan), sale (username/catatan admin) dan customer."""
+        if not is_admin(message.from_user.id):
+            bot.reply_to(message, "⛔ Anda tidak punya izin untuk perintah ini.")
+            return
+        args = message.text.split(maxsplit=1)
+        if len(args) < 2 or not build_fts_query(args[1]):
+            bot.reply_to(message, "⚠️ Format: `/cari <kata kunci>`\nContoh: `/cari budi`, `/cari gmail refund`, `/cari 123` (ID sale/akun/Telegram)")
+            return
+        admin_search_queries[message.chat.id] = args[1].strip()
+        display_search_results(message.chat.id, args[1].strip())
+
+    @bot.message_handler(commands=['reindex'])
+    def reindex_command(message: Message) -> None:
+        """Membangun ulang index pencarian full-text dan agregat segmen broadcast."""
+        if not is_admin(message.from_user.id):
+            bot.reply_to(message, "⛔ Anda tidak punya izin untuk perintah ini.")
+            return
+        try:
+            start = time.perf_counter()
+            counts = rebuild_search_indexes()
+            counts['customers (agregat pembeli)'] = rebuild_customer_stats()
+            elapsed = time.perf_counter() - start
         except sqlite3.Error as e_sql:
-            logger.error(f"Kesalahan database pada reject_payment untuk Sale ID {sale_id_to_reject}: {e_sql}", exc_info=True)
-            bot.reply_to(message, "❌ Terjadi kesalahan database saat membatalkan. Perubahan mungkin telah dibatalkan (rollback).")
-            if conn: conn.rollback()
-        except Exception as e_main:
-            logger.error(f"Kesalahan tak terduga pada reject_payment untuk Sale ID {sale_id_to_reject}: {e_main}", exc_info=True)
-            bot.reply_to(message, "❌ Terjadi kesalahan tak terduga saat membatalkan. Perubahan mungkin telah dibatalkan (rollback).")
-            if conn:
-                try: conn.rollback()
-                except Exception: pass
-        finally:
-            if conn: conn.close()
+            logger.error(f"DB error saat rebuild index pencarian: {e_sql}", exc_info=True)
+            bot.reply_to(message, "❌ Error database saat membangun ulang index pencarian.")
+            return
+        logger.info(f"Index pencarian dibangun ulang dalam {elapsed:.1f} detik: {counts}")
+        bot.reply_to(message, f"🔎 *Index Pencarian Dibangun Ulang* ({elapsed:.1f} detik)\n\n" +
+                     "\n".join(f"  • `{name}`: {count} baris" for name, count in counts.items()))
+
+    # --- Profiler Update ---
+    profiler = update_profiler.UpdateProfiler(PROFILE_SAMPLE_RATE, PROFILE_THRESHOLD_MS, PROFILE_MAX_CAPTURES)
+
+    @bot.message_handler(commands=['profile'])
+    def profile_command(message: Message) -> None:
+        """Mengatur profiler update dan mengunduh tangkapan update yang lambat."""
+        if not is_admin(message.from_user.id):
+            bot.reply_to(message, "⛔ Anda tidak punya izin untuk perintah ini.")
+            return
+
+        args = message.text.split()
+        action = args[1].lower() if len(args) > 1 else 'status'
+        try:
+            if action == 'on':
+                sample_rate = float(args[2]) if len(args) > 2 else (profiler.sample_rate or 1.0)
+                threshold_ms = float(args[3]) if len(args) > 3 else None
+                profiler.enable(sample_rate, threshold_ms)
+                logger.info(f"Profiler diaktifkan: sampel {profiler.sample_rate:.0%}, ambang {profiler.threshold_ms:.0f} ms")
+            elif action == 'off':
+                profiler.disable()
+                logger.info("Profiler dinonaktifkan.")
+            elif action in ('dump', 'lihat'):
+                index = int(args[2]) if len(args) > 2 else None
+                captures = list(profiler.captures) if index is None else [profiler.get_capture(index)]
+                if not captures or captures[0] is None:
+                    bot.reply_to(message, "ℹ️ Belum ada tangkapan update lambat (atau nomor tidak valid).")
+                    return
+                stamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+                if action == 'dump':
+                    document = io.BytesIO(profiler.dump_pstats(captures))
+                    caption = f"🐢 {len(captures)} tangkapan. Buka dengan `python -m pstats FILE`."
+                    bot.send_document(message.chat.id, document, visible_file_name=f"profile_{stamp}.pstats", caption=caption)
+                else:
+                    report = "\n\n".join(profiler.format_report(capture) for capture in captures)
+                    bot.send_document(message.chat.id, io.BytesIO(report.encode('utf-8')), visible_file_name=f"profile_{stamp}.txt")
+                return
+            elif action != 'status':
+                raise ValueError(action)
+        except ValueError:
+            bot.reply_to(message, "⚠️ Format:\n`/profile` - status\n`/profile on [SAMPEL 0-1] [AMBANG_MS]`\n`/profile off`\n"
+                                  "`/profile dump [NO]` - unduh .pstats\n`/profile lihat [NO]` - laporan teks + SQL")
+            return
+
+        status_text = (
+            f"🐢 *Profiler Update*: {'ON 🟢' if profiler.enabled else 'OFF 🔴'}\n"
+            f"Sampel: {profiler.sample_rate:.0%} | Ambang: {profiler.threshold_ms:.0f} ms\n"
+            f"Update diprofil: {profiler.profiled_count} (gagal aktif: {profiler.skipped_count}) | Tangkapan: {len(profiler.captures)}/{profiler.captures.maxlen}\n"
+        )
+        captures = list(profiler.captures)
+        if captures:
+            status_text += "\nTerbaru (NO untuk dump/lihat):\n" + "\n".join(
+                f"{i}. `{capture.handler}` {capture.duration_ms:.0f} ms, {len(capture.sql)} SQL ({capture.captured_at:%H:%M:%S})"
+                for i, capture in enumerate(reversed(captures[-10:]), start=1)
+            )
+        bot.reply_to(message, status_text)
 
     # Fallback untuk pesan teks yang tidak dikenali (opsional, bisa di-uncomment)
     # @bot.message_handler(func=lambda message: True)
@@ -1466,13 +3457,426 @@ try:
     #     else:
     #         bot.reply_to(message, f"Maaf, perintah '{message.text}' tidak saya mengerti. Silakan gunakan tombol menu atau ketik /start.")
 
+    # --- Write-Behind Customer ---
+    class CustomerWriteBuffer:
+        """Mengumpulkan registrasi dan aktivitas customer di memori, lalu menulisnya dalam satu transaksi."""
+
+        def __init__(self, interval_ms: int = CUSTOMER_FLUSH_INTERVAL_MS, max_rows: int = CUSTOMER_FLUSH_MAX_ROWS):
+            self.interval = interval_ms / 1000
+            self.max_rows = max_rows
+            self._pending: Dict[int, List[Any]] = {} # user_id -> [username, (last_seen, last_seen_ts), register]; user berulang digabung
+            self._lock = threading.Lock()
+            self._wakeup = threading.Event()
+            self._stopped = threading.Event()
+            self._thread: Optional[threading.Thread] = None
+            self.flushed_rows = 0
+
+        def pending_count(self) -> int:
+            with self._lock:
+                return len(self._pending)
+
+        def record(self, user_id: int, username: Optional[str], register: bool = False) -> None:
+            seen = now_stamp()
+            with self._lock:
+                entry = self._pending.get(user_id)
+                if entry:
+                    entry[0], entry[1] = username, seen
+                    entry[2] = entry[2] or register
+                else:
+                    self._pending[user_id] = [username, seen, register]
+                if len(self._pending) >= self.max_rows:
+                    self._wakeup.set()
+
+        def flush(self) -> int:
+            """Menulis semua entri tertunda dalam satu transaksi executemany."""
+            with self._lock:
+                batch, self._pending = self._pending, {}
+            if not batch:
+                return 0
+            try:
+                repo.record_customers([storage.CustomerActivity(user_id, username, seen, register)
+                                       for user_id, (username, seen, register) in batch.items()])
+            except sqlite3.Error as e:
+                logger.error(f"Error flush {len(batch)} data customer: {e}")
+                with self._lock: # Kembalikan entri agar dicoba lagi, data yang lebih baru tetap menang
+                    for user_id, entry in batch.items():
+                        newer = self._pending.get(user_id)
+                        if newer: newer[2] = newer[2] or entry[2]
+                        else: self._pending[user_id] = entry
+                return 0
+            self.flushed_rows += len(batch)
+            return len(batch)
+
+        def _run(self) -> None:
+            while not self._stopped.is_set():
+                self._wakeup.wait(self.interval)
+                self._wakeup.clear()
+                self.flush()
+
+        def start(self) -> None:
+            self._thread = threading.Thread(target=self._run, name='customer-write-buffer', daemon=True)
+            self._thread.start()
+
+        def stop(self) -> None:
+            """Menghentikan thread flush dan menulis sisa buffer (dipanggil saat shutdown)."""
+            self._stopped.set()
+            self._wakeup.set()
+            if self._thread: self._thread.join(timeout=5)
+            self.flush()
+
+    customer_buffer = CustomerWriteBuffer()
+
+    def get_update_user(update: telebot.types.Update) -> Optional[telebot.types.User]:
+        """Mengambil pengirim dari update (pesan atau callback)."""
+        source = update.message or update.edited_message or update.callback_query
+        return source.from_user if source else None
+
+    # --- Rate Limit Per User ---
+    # Biaya token per handler; handler yang membaca DB lebih mahal. Kunci: teks tombol atau prefix callback.
+    RATE_LIMIT_COSTS: Dict[str, float] = {
+        "🛒 Beli Akun": 2, "📦 Cek Stok": 1, "💰 Cek Harga": 1, "🧾 Riwayat Pembelian": 2,
+        UserCallbackData.CONFIRM_PURCHASE: 2, UserCallbackData.BUY_PRODUCT_PREFIX: 2, UserCallbackData.HISTORY_PAGE_PREFIX: 2, UserCallbackData.RESEND_ACCOUNT_PREFIX: 3,
+    }
+    RATE_LIMIT_DEFAULT_COST = 1.0
+    RATE_LIMIT_NOTICE_INTERVAL = 10.0 # Detik; balasan "terlalu cepat" maksimal sekali per interval per user
+
+    class UserRateLimiter:
+        """Token bucket per user_id di memori. Bucket yang lama tidak aktif (sudah penuh lagi) dibuang."""
+
+        def __init__(self, burst: float = RATE_LIMIT_BURST, refill_per_sec: float = RATE_LIMIT_REFILL_PER_SEC):
+            self.burst = burst
+            self.refill_per_sec = refill_per_sec
+            self._buckets: Dict[int, List[float]] = {} # user_id -> [token, waktu update terakhir, waktu notice terakhir]
+            self._lock = threading.Lock()
+            self._calls = 0
+            self.throttled_count = 0
+            self.throttled_by_key: Dict[str, int] = {}
+
+        def allow(self, user_id: int, key: str, cost: float) -> Tuple[bool, bool]:
+            """Mengambil token. Mengembalikan (diizinkan, perlu_kirim_notice)."""
+            now = time.monotonic()
+            with self._lock:
+                self._calls += 1
+                if self._calls % 1000 == 0:
+                    self._expire(now)
+                bucket = self._buckets.get(user_id)
+                if bucket is None:
+                    bucket = self._buckets[user_id] = [self.burst, now, 0.0]
+                else:
+                    bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.refill_per_sec)
+                    bucket[1] = now
+                if bucket[0] >= cost:
+                    bucket[0] -= cost
+                    return True, False
+                self.throttled_count += 1
+                self.throttled_by_key[key] = self.throttled_by_key.get(key, 0) + 1
+                send_notice = now - bucket[2] >= RATE_LIMIT_NOTICE_INTERVAL
+                if send_notice: bucket[2] = now
+                return False, send_notice
+
+        def _expire(self, now: float) -> None:
+            idle_limit = max(self.burst / self.refill_per_sec, RATE_LIMIT_NOTICE_INTERVAL) if self.refill_per_sec > 0 else 3600
+            stale = [user_id for user_id, bucket in self._buckets.items() if now - bucket[1] > idle_limit]
+            for user_id in stale:
+                del self._buckets[user_id]
+
+    rate_limiter = UserRateLimiter()
+
+    def get_rate_limit_key(update: telebot.types.Update) -> str:
+        """Menentukan kunci biaya rate limit dari isi update."""
+        if update.callback_query:
+            data = update.callback_query.data or ''
+            for key in RATE_LIMIT_COSTS:
+                if data.startswith(key): return key
+            return 'callback'
+        message = update.message or update.edited_message
+        if message and message.text in RATE_LIMIT_COSTS:
+            return message.text
+        return 'message'
+
+    def apply_rate_limit(update: telebot.types.Update) -> bool:
+        """True jika update boleh diproses. Update yang dibatasi dibalas murah (tanpa DB) atau diabaikan."""
+        user = get_update_user(update)
+        if not user or is_staff(user.id):
+            return True
+        key = get_rate_limit_key(update)
+        allowed, send_notice = rate_limiter.allow(user.id, key, RATE_LIMIT_COSTS.get(key, RATE_LIMIT_DEFAULT_COST))
+        if allowed:
+            return True
+        logger.debug(f"Update dari user {user.id} dibatasi ({key}).")
+        try:
+            if update.callback_query:
+                bot.answer_callback_query(update.callback_query.id, "⏳ Terlalu cepat, tunggu sebentar.")
+            elif send_notice and update.message:
+                bot.send_message(update.message.chat.id, "⏳ Anda mengirim permintaan terlalu cepat. Mohon tunggu beberapa detik lalu coba lagi.")
+        except telebot.apihelper.ApiTelegramException as e_api:
+            logger.warning(f"Gagal mengirim notice rate limit ke {user.id}: {e_api}")
+        return False
+
+    # --- Idempotensi Update ---
+    class ProcessedUpdateStore:
+        """Penyimpan update_id yang sudah diproses: ring terbatas di memori + high-water mark di tabel settings."""
+
+        SETTING_KEY = 'last_update_id'
+
+        def __init__(self, maxlen: int = PROCESSED_UPDATES_MAXLEN):
+            self._ring: deque = deque(maxlen=maxlen)
+            self._seen: set = set()
+            self._lock = threading.Lock()
+            self.high_water_mark = 0
+            self._persisted_mark = 0
+            self._floor = 0 # update_id <= floor dianggap sudah diproses (mark saat startup / entri yang tergeser)
+            self.skipped_count = 0
+
+        def load(self) -> int:
+            """Memuat high-water mark tersimpan (dipanggil saat startup)."""
+            try:
+                self.high_water_mark = self._persisted_mark = self._floor = int(get_setting(self.SETTING_KEY) or 0)
+            except ValueError:
+                logger.warning(f"Nilai pengaturan {self.SETTING_KEY} tidak valid, mulai dari 0.")
+            return self.high_water_mark
+
+        def mark(self, update_id: int) -> bool:
+            """Menandai update sebagai diproses. False jika update ini duplikat/sudah lewat."""
+            with self._lock:
+                if update_id in self._seen or update_id <= self._floor:
+                    self.skipped_count += 1
+                    return False
+                if len(self._ring) == self._ring.maxlen:
+                    evicted = self._ring[0] # Entri terlama akan tergeser
+                    self._seen.discard(evicted)
+                    self._floor = max(self._floor, evicted)
+                self._ring.append(update_id)
+                self._seen.add(update_id)
+                self.high_water_mark = max(self.high_water_mark, update_id)
+                return True
+
+        def persist(self) -> None:
+            """Menyimpan high-water mark jika bertambah (satu tulis per batch getUpdates)."""
+            with self._lock:
+                mark = self.high_water_mark
+                if mark <= self._persisted_mark:
+                    return
+                self._persisted_mark = mark
+            set_setting(self.SETTING_KEY, str(mark))
+
+    processed_updates = ProcessedUpdateStore()
+    _process_new_updates_unfiltered = bot.process_new_updates
+
+    def process_new_updates_once(updates: List[telebot.types.Update]) -> None:
+        """Menyaring update yang dikirim ulang Telegram sebelum diteruskan ke handler."""
+        health_state.mark_poll(len(updates))
+        if lifecycle.stopping.is_set():
+            # Tidak ditandai diproses: high-water mark tidak maju sehingga Telegram mengirim ulang ke proses berikutnya
+            if updates: logger.info(f"Shutdown berjalan, {len(updates)} update ditunda ke proses berikutnya.")
+            return
+        if updates: # Offset getUpdates harus maju juga untuk update yang disaring (duplikat/dibatasi), bukan hanya yang diproses
+            bot.last_update_id = max(bot.last_update_id, max(update.update_id for update in updates))
+        fresh_updates = [update for update in updates if processed_updates.mark(update.update_id)]
+        if len(fresh_updates) < len(updates):
+            logger.info(f"{len(updates) - len(fresh_updates)} update duplikat dilewati.")
+        for update in fresh_updates:
+            user = get_update_user(update)
+            if user: customer_buffer.record(user.id, user.username or f"user_{user.id}")
+            message = update.message or update.edited_message
+            if message: health_state.record_lag(message.edit_date or message.date)
+        fresh_updates = [update for update in fresh_updates if apply_rate_limit(update)]
+        _process_new_updates_unfiltered(fresh_updates)
+        processed_updates.persist()
+
+    bot.process_new_updates = process_new_updates_once
+
+    # --- Rekaman Trafik (opsional) ---
+    traffic_writer: Optional[traffic_capture.CaptureWriter] = None
+
+    def traffic_capture_meta() -> Dict[str, Any]:
+        """Metadata tiap file rekaman: ID admin (pseudonim) agar replay.py mengenali admin yang sama."""
+        anonymizer = traffic_writer.anonymizer
+        return {
+            'store': STORE_NAME, 'schema_version': SCHEMA_VERSION,
+            'admin_id': anonymizer.user_id(ADMIN_ID),
+            'roster': {str(anonymizer.user_id(member)): admin_roster.role(member) for member in admin_roster.members()},
+        }
+
+    def get_updates_captured(offset: Optional[int] = None, limit: Optional[int] = None, timeout: int = 20,
+                             allowed_updates: Optional[List[str]] = None, long_polling_timeout: int = 20) -> List[telebot.types.Update]:
+        """Sama dengan TeleBot.get_updates, tetapi JSON mentah ditulis ke rekaman sebelum diubah jadi objek Update."""
+        json_updates = telebot.apihelper.get_updates(bot.token, offset, limit, timeout, allowed_updates, long_polling_timeout)
+        try:
+            traffic_writer.write(json_updates)
+        except (OSError, ValueError) as e: # Rekaman tidak boleh menghentikan polling
+            logger.error(f"Gagal menulis rekaman {len(json_updates)} update: {e}")
+        return [telebot.types.Update.de_json(json_update) for json_update in json_updates]
+
+    if TRAFFIC_CAPTURE_DIR:
+        if not TRAFFIC_CAPTURE_SALT:
+            logger.warning("TRAFFIC_CAPTURE_SALT kosong: pseudonim user acak per proses dan tidak cocok dengan database untuk replay.")
+        traffic_writer = traffic_capture.CaptureWriter(
+            TRAFFIC_CAPTURE_DIR, traffic_capture.Anonymizer(TRAFFIC_CAPTURE_SALT or os.urandom(16).hex()), traffic_capture_meta,
+            int(TRAFFIC_CAPTURE_MAX_MB * 1024 * 1024), TRAFFIC_CAPTURE_KEEP_FILES, is_staff)
+        bot.get_updates = get_updates_captured
+        logger.info(f"Rekaman trafik aktif di {TRAFFIC_CAPTURE_DIR}.")
+
+    # --- Lifecycle (Graceful Shutdown) ---
+    class Lifecycle:
+        """SIGTERM/SIGINT: berhenti polling, tunggu handler selesai, flush buffer, checkpoint WAL, log sisa pekerjaan."""
+
+        def __init__(self, drain_timeout: float = SHUTDOWN_DRAIN_SEC):
+            self.drain_timeout = drain_timeout
+            self.stopping = threading.Event()
+            self._inflight = 0
+            self._idle = threading.Condition()
+            self._shutdown_lock = threading.Lock()
+            self._shutdown_done = False
+
+        def track(self, task):
+            """Membungkus task agar dihitung sebagai pekerjaan berjalan sampai selesai."""
+            with self._idle:
+                self._inflight += 1
+
+            @wraps(task)
+            def tracked_task(*args, **kwargs):
+                try:
+                    return task(*args, **kwargs)
+                finally:
+                    with self._idle:
+                        self._inflight -= 1
+                        if self._inflight == 0: self._idle.notify_all()
+            return tracked_task
+
+        def request_stop(self, signum: Optional[int] = None, frame: Any = None) -> None:
+            """Signal handler: hanya menandai berhenti dan menghentikan polling; pembersihan di shutdown()."""
+            if self.stopping.is_set():
+                return
+            logger.info(f"Sinyal {signal.Signals(signum).name if signum else '-'} diterima, menghentikan polling...")
+            self.stopping.set()
+            bot.stop_polling()
+            # Thread polling bisa masih menunggu long poll getUpdates; pembersihan langsung dimulai di thread terpisah
+            threading.Thread(target=self.shutdown, name='shutdown').start()
+
+        def drain(self) -> int:
+            """Menunggu task berjalan selesai sampai batas waktu. Mengembalikan jumlah yang belum selesai."""
+            deadline = time.monotonic() + self.drain_timeout
+            with self._idle:
+                while self._inflight > 0:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0: break
+                    self._idle.wait(remaining)
+                return self._inflight
+
+        def shutdown(self) -> None:
+            """Idempoten; pemanggil kedua menunggu sampai shutdown pertama selesai."""
+            with self._shutdown_lock:
+                if self._shutdown_done: return
+                self._shutdown_done = True
+                self._run_shutdown()
+
+        def _run_shutdown(self) -> None:
+            self.stopping.set()
+            started = time.monotonic()
+            unfinished: List[str] = []
+
+            cancelled_reports = report_pool.cancel_all() # Laporan dibuat ulang dengan mudah; jangan tahan shutdown
+            if cancelled_reports:
+                logger.info(f"{cancelled_reports} laporan admin yang sedang dibuat dibatalkan.")
+            still_running = self.drain()
+            report_pool.shutdown(wait=False)
+            if still_running:
+                unfinished.append(f"{still_running} handler masih berjalan setelah {self.drain_timeout:.0f} detik")
+            pending_flows = list(getattr(bot.next_step_backend, 'handlers', {}))
+            if pending_flows:
+                preview = ', '.join(str(chat_id) for chat_id in pending_flows[:20])
+                unfinished.append(f"{len(pending_flows)} chat masih di tengah alur input (chat: {preview})")
+
+            if stock_ingestor:
+                stock_ingestor.stop()
+            customer_buffer.stop()
+            if customer_buffer.pending_count():
+                unfinished.append(f"{customer_buffer.pending_count()} data customer gagal ditulis")
+            admin_notifier.flush()
+            if admin_notifier.pending_count():
+                unfinished.append(f"{admin_notifier.pending_count()} notifikasi pembayaran gagal dikirim ke admin")
+            processed_updates.persist()
+            if traffic_writer:
+                traffic_writer.close()
+            event_bus.close()
+            if event_bus.pending_count():
+                unfinished.append(f"{event_bus.pending_count()} event async belum diproses")
+            if http_sender:
+                http_sender.close()
+            if get_setting(BROADCAST_JOB_KEY):
+                unfinished.append("broadcast belum selesai (dilanjutkan saat startup)")
+            try:
+                with sqlite3.connect(DB_NAME) as conn:
+                    busy, _, _ = conn.execute('PRAGMA wal_checkpoint(TRUNCATE)').fetchone()
+                if busy: unfinished.append("checkpoint WAL tidak tuntas (database sedang dipakai)")
+            except sqlite3.Error as e:
+                logger.error(f"Gagal checkpoint WAL saat shutdown: {e}")
+
+            for item in unfinished:
+                logger.warning(f"Belum selesai saat shutdown: {item}")
+            logger.info(f"Shutdown selesai dalam {time.monotonic() - started:.1f} detik.")
+
+    lifecycle = Lifecycle()
+
+    def collect_health_metrics() -> Dict[str, float]:
+        """Kedalaman antrean dan counter lain untuk /metrics (tanpa akses DB)."""
+        worker_pool = getattr(bot, 'worker_pool', None)
+        return {
+            'worker_queue_depth': worker_pool.tasks.qsize() if worker_pool else 0,
+            'customer_buffer_pending': customer_buffer.pending_count(),
+            'admin_notify_pending': admin_notifier.pending_count(),
+            'duplicate_updates_total': processed_updates.skipped_count,
+            'rate_limited_total': rate_limiter.throttled_count,
+            'report_jobs_running': report_pool.running_count(),
+            'captured_updates_total': traffic_writer.captured_count if traffic_writer else 0,
+            'report_timeouts_total': report_pool.counts['timeout'],
+            'stock_spool_files_processed_total': stock_ingestor.counts['processed'] if stock_ingestor else 0,
+            'stock_spool_files_failed_total': stock_ingestor.counts['failed'] if stock_ingestor else 0,
+            'low_stock_alerts_total': low_stock_monitor.alert_count,
+            **({'http_requests_total': http_sender.counts['requests'],
+                'http_retries_total': http_sender.counts['retries'],
+                'http_connection_errors_total': http_sender.counts['connection_errors'],
+                **{f"http_{name}_total": count for name, count in http_sender.connection_stats().items()}} if http_sender else {}),
+            'event_subscriber_errors_total': event_bus.errors,
+            'events_dropped_total': event_bus.dropped,
+            **{f"events_{name}_total": count for name, count in event_bus.counts().items()},
+        }
+
+    # Profiler: nama handler dicatat lewat pembungkus, eksekusi diprofil di worker (_exec_task) dan dihitung untuk drain shutdown
+    for handler_list in (bot.message_handlers, bot.callback_query_handlers, bot.inline_handlers):
+        for handler in handler_list:
+            handler['function'] = profiler.wrap_handler(handler['function'])
+    _exec_task_unprofiled = bot._exec_task
+    bot._exec_task = lambda task, *args, **kwargs: _exec_task_unprofiled(lifecycle.track(profiler.wrap_task(task)), *args, **kwargs)
+    if PROFILE_SAMPLE_RATE > 0:
+        profiler.enable()
+
     # Jalankan bot
     logger.info(f"Bot {STORE_NAME} (Enhanced) mulai polling...")
     init_db() # Pastikan DB diinisialisasi sebelum polling
+    admin_roster.load()
+    bot.last_update_id = processed_updates.load() # Lanjutkan offset getUpdates dari high-water mark
+    customer_buffer.start()
+    low_stock_monitor.load()
+    low_stock_monitor.check() # Stok yang sudah rendah sebelum bot jalan (sekali, tercatat di settings)
+    if stock_ingestor:
+        stock_ingestor.start()
+        logger.info(f"Impor stok dari direktori spool {STOCK_SPOOL_DIR} aktif (cek tiap {STOCK_SPOOL_POLL_SEC:.0f} detik).")
+    atexit.register(lifecycle.shutdown) # Sisa buffer customer & notifikasi admin tetap tertulis saat proses berhenti
+    if HEALTH_PORT > 0:
+        health = health_server.HealthServer(health_state, DB_NAME, SCHEMA_VERSION, collect_health_metrics, port=HEALTH_PORT)
+        health.start()
+        logger.info(f"Health server berjalan di port {HEALTH_PORT} (/healthz, /readyz, /metrics, /status).")
     logger.info(f"Admin ID adalah: {ADMIN_ID} (tipe: {type(ADMIN_ID)})")
     
-    polling_logger_level = logging.DEBUG if os.getenv('BOT_DEBUG_POLLING', 'false').lower() == 'true' else logging.INFO
-    bot.infinity_polling(logger_level=polling_logger_level, timeout=60, long_polling_timeout=30)
+    if __name__ == '__main__': # Saat dimuat oleh skrip lain (mis. stress_test.py) handler dipanggil langsung tanpa polling
+        polling_logger_level = logging.DEBUG if os.getenv('BOT_DEBUG_POLLING', 'false').lower() == 'true' else logging.INFO
+        signal.signal(signal.SIGTERM, lifecycle.request_stop)
+        signal.signal(signal.SIGINT, lifecycle.request_stop)
+        resume_broadcast_job()
+        bot.infinity_polling(logger_level=polling_logger_level, timeout=60, long_polling_timeout=30)
+        lifecycle.shutdown()
 
 except ValueError as ve_config: # Untuk error konfigurasi
     logger.critical(f"Kesalahan konfigurasi: {ve_config}", exc_info=True)
@@ -0,0 +1,196 @@
+"""Rekaman update Telegram mentah untuk direplay (lihat replay.py).
+
+Jika TRAFFIC_CAPTURE_DIR diisi, setiap hasil getUpdates ditulis apa adanya ke file
+JSONL ter-gzip yang dirotasi per ukuran. ID user dan chat diganti pseudonim
+HMAC (kunci TRAFFIC_CAPTURE_SALT), dan username, nama, serta nomor telepon
+diganti/dihapus. Pseudonim sama untuk user yang sama selama kuncinya sama,
+sehingga urutan interaksi per user tetap utuh. Isi teks pesan dan caption
+pembeli tidak diubah; untuk update dari staf (admin/verifikator) teks dan caption
+disensor karena bisa berisi kredensial (mis. input tambah akun
+`email|password|catatan`), hanya nama perintah bot (/approve, /next, ...) yang
+disisakan. Alur admin di replay.py karenanya hanya terulang sebagian.
+
+Baris pertama tiap file adalah metadata ({"meta": {...}}) berisi ID admin versi
+pseudonim; baris berikutnya {"t": epoch saat diterima, "update": {...}}. Data
+ditulis dengan Z_SYNC_FLUSH per batch sehingga file yang terputus (proses mati)
+tetap bisa dibaca sampai batch terakhir.
+"""
+import glob
+import gzip
+import hashlib
+import hmac
+import json
+import os
+import threading
+import time
+import zlib
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+PSEUDONYM_BASE = 10 ** 13 # Di atas rentang ID user Telegram saat ini agar tidak bentrok dengan ID asli
+PSEUDONYM_SPAN = 10 ** 13
+USER_KEYS = ('from', 'chat', 'user', 'sender_chat', 'forward_from', 'forward_from_chat', 'new_chat_member',
+             'old_chat_member', 'contact', 'via_bot', 'left_chat_member', 'sender_user')
+# Field identitas lain: diganti placeholder (wajib ada di objek telebot) atau dihapus (None)
+NAME_FIELDS: Dict[str, Optional[str]] = {'first_name': 'x', 'phone_number': '0', 'last_name': None, 'title': None, 'vcard': None}
+# Nama pengirim forward yang menyembunyikan akunnya: string di objek message / forward_origin, bukan objek user
+SENDER_NAME_FIELDS: Dict[str, str] = {'forward_sender_name': 'x', 'sender_user_name': 'x'}
+# Teks yang disensor untuk update staf; entities ikut dibuang karena offset-nya tidak lagi cocok
+TEXT_FIELDS = ('text', 'caption')
+ENTITY_FIELDS = ('entities', 'caption_entities')
+REDACTED_TEXT = '[disensor]'
+FILE_PREFIX = 'updates-'
+FILE_SUFFIX = '.jsonl.gz'
+
+
+class Anonymizer:
+    """Pseudonim deterministik untuk ID Telegram (HMAC-SHA256 dengan kunci rahasia)."""
+
+    def __init__(self, salt: str):
+        self._key = salt.encode('utf-8')
+
+    def user_id(self, value: Optional[int]) -> Optional[int]:
+        if value is None:
+            return None
+        digest = hmac.new(self._key, str(abs(int(value))).encode(), hashlib.sha256).digest()
+        pseudonym = PSEUDONYM_BASE + int.from_bytes(digest[:8], 'big') % PSEUDONYM_SPAN
+        return -pseudonym if int(value) < 0 else pseudonym # Tanda ID grup/channel dipertahankan
+
+    def username(self, user_id: Optional[int]) -> Optional[str]:
+        return None if user_id is None else f"u{abs(self.user_id(user_id))}"
+
+    def _entity(self, entity: Dict[str, Any]) -> Dict[str, Any]:
+        entity = dict(entity)
+        original_id = entity.get('id', entity.get('user_id'))
+        if 'id' in entity: entity['id'] = self.user_id(entity['id'])
+        if 'user_id' in entity: entity['user_id'] = self.user_id(entity['user_id'])
+        if entity.get('username'): entity['username'] = self.username(original_id)
+        for name, placeholder in NAME_FIELDS.items():
+            if name in entity:
+                entity[name] = placeholder
+        return {key: value for key, value in entity.items() if value is not None}
+
+    def update(self, value: Any) -> Any:
+        """Salinan update dengan semua objek user/chat (di kedalaman mana pun) dipseudonimkan."""
+        if isinstance(value, list):
+            return [self.update(item) for item in value]
+        if not isinstance(value, dict):
+            return value
+        result: Dict[str, Any] = {}
+        for key, item in value.items():
+            if key in USER_KEYS and isinstance(item, dict):
+                item = self._entity(item)
+            elif key in SENDER_NAME_FIELDS and isinstance(item, str):
+                item = SENDER_NAME_FIELDS[key]
+            result[key] = self.update(item)
+        return result
+
+
+def sender_id(update: Dict[str, Any]) -> Optional[int]:
+    """ID user pengirim update (message, callback_query, dst.), None jika tidak ada."""
+    for item in update.values():
+        if isinstance(item, dict) and isinstance(item.get('from'), dict):
+            return item['from'].get('id')
+    return None
+
+
+def redact_text(value: Any) -> Any:
+    """Salinan dengan semua text/caption (di kedalaman mana pun) disensor; perintah bot disisakan namanya saja."""
+    if isinstance(value, list):
+        return [redact_text(item) for item in value]
+    if not isinstance(value, dict):
+        return value
+    result: Dict[str, Any] = {}
+    for key, item in value.items():
+        if key in ENTITY_FIELDS:
+            continue
+        if key in TEXT_FIELDS and isinstance(item, str):
+            result[key] = item.split(maxsplit=1)[0] if item.startswith('/') else REDACTED_TEXT
+        else:
+            result[key] = redact_text(item)
+    return result
+
+
+class CaptureWriter:
+    """Menulis batch update ke file gzip berotasi: file baru saat `max_bytes` (sebelum kompresi) terlampaui,
+    hanya `keep_files` file terbaru yang disimpan (0 = semua). `meta` dipanggil tiap file baru dibuat.
+    Teks update dari user yang `is_staff` disensor (lihat redact_text)."""
+
+    def __init__(self, directory: str, anonymizer: Anonymizer, meta: Callable[[], Dict[str, Any]],
+                 max_bytes: int = 50 * 1024 * 1024, keep_files: int = 20,
+                 is_staff: Callable[[int], bool] = lambda user_id: False):
+        self.directory = directory
+        self.anonymizer = anonymizer
+        self.meta = meta
+        self.is_staff = is_staff
+        self.max_bytes = max_bytes
+        self.keep_files = keep_files
+        self.captured_count = 0
+        self._file: Optional[gzip.GzipFile] = None
+        self._written = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def write(self, updates: List[Dict[str, Any]]) -> None:
+        if not updates:
+            return
+        received_at = time.time()
+        lines = ''.join(json.dumps({'t': received_at, 'update': self.anonymizer.update(self._redact_staff(update))},
+                                   ensure_ascii=False, separators=(',', ':')) + '\n' for update in updates)
+        data = lines.encode('utf-8')
+        with self._lock:
+            if self._file is None or self._written >= self.max_bytes:
+                self._rotate()
+            self._file.write(data)
+            self._file.flush(zlib.Z_SYNC_FLUSH)
+            self._written += len(data)
+            self.captured_count += len(updates)
+
+    def _redact_staff(self, update: Dict[str, Any]) -> Dict[str, Any]:
+        user_id = sender_id(update)
+        return redact_text(update) if user_id is not None and self.is_staff(user_id) else update
+
+    def _rotate(self) -> None:
+        if self._file:
+            self._file.close()
+        name = f"{FILE_PREFIX}{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}{FILE_SUFFIX}"
+        self._file = gzip.open(os.path.join(self.directory, name), 'wb')
+        header = json.dumps({'meta': dict(self.meta(), started_at=time.time())}, ensure_ascii=False) + '\n'
+        self._file.write(header.encode('utf-8'))
+        self._written = 0
+        for old_path in (capture_files(self.directory)[:-self.keep_files] if self.keep_files else []):
+            try:
+                os.remove(old_path)
+            except OSError:
+                pass
+
+    def close(self) -> None:
+        with self._lock:
+            if self._file:
+                self._file.close()
+                self._file = None
+
+
+def capture_files(path: str) -> List[str]:
+    """File rekaman di direktori (urut waktu dibuat), atau path itu sendiri jika berupa file."""
+    if os.path.isfile(path):
+        return [path]
+    return sorted(glob.glob(os.path.join(path, f"{FILE_PREFIX}*{FILE_SUFFIX}")))
+
+
+def read_capture(paths: List[str]) -> Iterator[Tuple[Dict[str, Any], float, Dict[str, Any]]]:
+    """Menghasilkan (meta file, waktu diterima, update) berurutan; bagian akhir file yang terpotong dilewati."""
+    for path in paths:
+        meta: Dict[str, Any] = {}
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            try:
+                for line in f:
+                    if not line.endswith('\n'):
+                        break # Baris terakhir belum selesai ditulis
+                    record = json.loads(line)
+                    if 'meta' in record:
+                        meta = record['meta']
+                    else:
+                        yield meta, record['t'], record['update']
+            except (EOFError, zlib.error): # Proses perekam berhenti sebelum file ditutup
+                pass
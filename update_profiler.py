@@ -0,0 +1,167 @@
+"""Profiler opsional per update untuk bot Telegram.
+
+Sebagian update (sesuai `sample_rate`) dijalankan di bawah cProfile. Update yang
+lebih lambat dari `threshold_ms` disimpan bersama nama handler dan statement SQL
+yang dieksekusi ke ring buffer berisi `max_captures` tangkapan terakhir. Tangkapan
+bisa diekspor ke format `.pstats` dan dibuka dengan `python -m pstats FILE` atau
+snakeviz.
+
+Statement SQL direkam lewat `set_trace_callback` pada setiap koneksi yang dibuka
+dengan `sqlite3.connect` selama profiler aktif; di luar update yang sedang
+diprofil callback tersebut tidak melakukan apa-apa.
+"""
+import cProfile
+import io
+import marshal
+import pstats
+import random
+import sqlite3
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from datetime import datetime
+from functools import wraps
+from typing import Any, Callable, Deque, List, Optional
+
+MAX_SQL_PER_CAPTURE = 200
+MAX_SQL_LENGTH = 500
+
+
+@dataclass
+class Capture:
+    captured_at: datetime
+    label: str
+    handler: str
+    duration_ms: float
+    profile: cProfile.Profile
+    sql: List[str] = field(default_factory=list)
+
+
+def describe_update(args: tuple) -> str:
+    """Ringkasan singkat argumen handler (Message/CallbackQuery/InlineQuery) untuk label tangkapan."""
+    if not args:
+        return '-'
+    obj = args[0]
+    if isinstance(obj, list): # Listener menerima list pesan
+        return f"list[{len(obj)}]"
+    data = getattr(obj, 'data', None)
+    if isinstance(data, str):
+        return f"callback:{data[:40]}"
+    query = getattr(obj, 'query', None)
+    if isinstance(query, str):
+        return f"inline:{query[:40]}"
+    text = getattr(obj, 'text', None)
+    if text:
+        return f"message:{text[:40]}"
+    return f"message:{getattr(obj, 'content_type', type(obj).__name__)}"
+
+
+class UpdateProfiler:
+    def __init__(self, sample_rate: float = 0.0, threshold_ms: float = 500.0, max_captures: int = 20):
+        self.sample_rate = sample_rate
+        self.threshold_ms = threshold_ms
+        self.captures: Deque[Capture] = deque(maxlen=max_captures)
+        self.enabled = False
+        self.profiled_count = 0
+        self.skipped_count = 0 # Tersampel tapi profiler tidak bisa diaktifkan
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._original_connect: Optional[Callable[..., sqlite3.Connection]] = None
+
+    def enable(self, sample_rate: Optional[float] = None, threshold_ms: Optional[float] = None) -> None:
+        if sample_rate is not None:
+            self.sample_rate = min(max(sample_rate, 0.0), 1.0)
+        if threshold_ms is not None:
+            self.threshold_ms = max(threshold_ms, 0.0)
+        with self._lock:
+            if self._original_connect is None:
+                self._original_connect = sqlite3.connect
+                sqlite3.connect = self._traced_connect
+            self.enabled = True
+
+    def disable(self) -> None:
+        with self._lock:
+            self.enabled = False
+            if self._original_connect is not None:
+                sqlite3.connect = self._original_connect
+                self._original_connect = None
+
+    def _traced_connect(self, *args: Any, **kwargs: Any) -> sqlite3.Connection:
+        conn = self._original_connect(*args, **kwargs)
+        conn.set_trace_callback(self._trace_sql)
+        return conn
+
+    def _trace_sql(self, statement: str) -> None:
+        sql = getattr(self._local, 'sql', None)
+        if sql is not None and len(sql) < MAX_SQL_PER_CAPTURE:
+            sql.append(' '.join(statement.split())[:MAX_SQL_LENGTH])
+
+    def wrap_task(self, task: Callable) -> Callable:
+        """Membungkus task worker agar bisa diprofil; tanpa biaya tambahan saat profiler mati."""
+        if not self.enabled:
+            return task
+
+        @wraps(task)
+        def profiled_task(*args: Any, **kwargs: Any) -> Any:
+            return self.run(task, *args, **kwargs)
+        return profiled_task
+
+    def wrap_handler(self, func: Callable) -> Callable:
+        """Membungkus fungsi handler agar namanya tercatat di tangkapan yang sedang berjalan."""
+        @wraps(func)
+        def named_handler(*args: Any, **kwargs: Any) -> Any:
+            if getattr(self._local, 'sql', None) is not None:
+                self._local.handler = func.__name__
+            return func(*args, **kwargs)
+        return named_handler
+
+    def run(self, task: Callable, *args: Any, **kwargs: Any) -> Any:
+        if not self.enabled or random.random() >= self.sample_rate or getattr(self._local, 'sql', None) is not None:
+            return task(*args, **kwargs)
+
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError: # Python 3.12+: profiler lain (sys.monitoring) sudah aktif; task tetap jalan tanpa profil
+            self.skipped_count += 1
+            return task(*args, **kwargs)
+        self._local.sql = []
+        self._local.handler = getattr(task, '__name__', repr(task))
+        start = time.perf_counter()
+        try:
+            return task(*args, **kwargs)
+        finally:
+            profile.disable()
+            duration_ms = (time.perf_counter() - start) * 1000
+            sql, handler = self._local.sql, self._local.handler
+            self._local.sql = None
+            self.profiled_count += 1
+            if duration_ms >= self.threshold_ms:
+                self.captures.append(Capture(datetime.now(), describe_update(args), handler, duration_ms, profile, sql))
+
+    def get_capture(self, index: int) -> Optional[Capture]:
+        """Index 1 = tangkapan terbaru."""
+        captures = list(self.captures)
+        return captures[-index] if 1 <= index <= len(captures) else None
+
+    def dump_pstats(self, captures: List[Capture]) -> bytes:
+        """Menggabungkan profil tangkapan ke format file .pstats (marshal, sama seperti Stats.dump_stats)."""
+        stats = pstats.Stats(captures[0].profile)
+        for capture in captures[1:]:
+            stats.add(capture.profile)
+        return marshal.dumps(stats.stats)
+
+    def format_report(self, capture: Capture, limit: int = 30) -> str:
+        """Laporan teks: ringkasan, fungsi dengan waktu kumulatif terbesar, dan statement SQL."""
+        out = io.StringIO()
+        out.write(f"Waktu    : {capture.captured_at:%Y-%m-%d %H:%M:%S}\n"
+                  f"Update   : {capture.label}\n"
+                  f"Handler  : {capture.handler}\n"
+                  f"Durasi   : {capture.duration_ms:.1f} ms\n"
+                  f"SQL      : {len(capture.sql)} statement\n\n")
+        pstats.Stats(capture.profile, stream=out).sort_stats('cumulative').print_stats(limit)
+        out.write("\n--- SQL ---\n")
+        for i, statement in enumerate(capture.sql, start=1):
+            out.write(f"{i}. {statement}\n")
+        return out.getvalue()